@@ -115,6 +115,12 @@ def start_embedded_sync_worker():
         SYNC_INTERVAL = 30
         MAX_FAILURES = 10
         
+        # Only one sync loop runs across all gunicorn workers and sync_worker.py
+        from modules.google_sync import GoogleSheetSync
+        from modules.sync_leader import SyncLeader
+        leader = SyncLeader(GoogleSheetSync().get_db_connection, 'embedded')
+        was_leader = False
+        
         def log_to_db(conn, level, message):
             """Helper to log to worker_logs table"""
             try:
@@ -132,16 +138,28 @@ def start_embedded_sync_worker():
             conn = None
             try:
                 from modules.google_sync import GoogleSheetSync
-                from modules.mlm_core import calculate_new_commissions_fast
+                from modules.mlm_core import enqueue_commission_job, process_commission_jobs, refresh_ctv_daily_rollup
+                from modules.dashboard_cache import check_ctv_tree_watermark
+                from modules.sheets_client import get_spreadsheet
                 
                 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '12YrAEGiOKLoqzj4tE-VLZNQNIda7S5hdMaQJO5UEsnQ')
                 
                 syncer = GoogleSheetSync()
                 
-                # Step 1: Connect to Google
+                # Step 0: Leader election - standby workers skip the cycle
+                is_leader = leader.ensure()
+                if is_leader != was_leader:
+                    logger.info(f"{leader.worker_id}: {'sync leader' if is_leader else 'standby'}")
+                    was_leader = is_leader
+                if not is_leader:
+                    cycle -= 1
+                    time.sleep(SYNC_INTERVAL)
+                    continue
+                
+                # Step 1: Connect to Google (client is reused across cycles)
                 try:
-                    client = syncer.get_google_client()
-                    spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+                    client = syncer.get_shared_google_client()
+                    spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID, client)
                 except Exception as ge:
                     # Log to console only if no DB yet
                     logger.error(f"Cycle #{cycle} Google error: {ge}")
@@ -165,50 +183,65 @@ def start_embedded_sync_worker():
                     cur.execute("SELECT COUNT(*) FROM khach_hang WHERE source = 'tham_my'")
                     db_count = cur.fetchone()[0]
                     cur.close()
-                    
-                    # Get sheet count
-                    tm_sheet = spreadsheet.worksheet('Khach hang Tham my')
-                    sheet_count = len(tm_sheet.get_all_values()) - 1  # Minus header
-                    
-                    log_to_db(conn, 'INFO', f'📊 TM: Sheet={sheet_count}, DB={db_count}, Diff={sheet_count - db_count}')
                 except Exception as ce:
+                    db_count = None
                     log_to_db(conn, 'WARNING', f'⚠️ Count check failed: {str(ce)[:40]}')
                 
-                # Step 4: Sync each tab with detailed logging
+                # Step 4: Sync all tabs at once (one batched sheet read, one connection per tab)
                 tab_names = {'tham_my': 'Thẩm Mỹ', 'nha_khoa': 'Nha Khoa', 'gioi_thieu': 'Giới Thiệu'}
                 total_new = 0
                 
-                for tab in ['tham_my', 'nha_khoa', 'gioi_thieu']:
-                    tab_display = tab_names.get(tab, tab)
-                    try:
-                        log_to_db(conn, 'INFO', f'🔍 Checking {tab_display}...')
-                        
-                        p, e = syncer.sync_tab_by_phone_matching(spreadsheet, conn, tab)
-                        
-                        if p > 0:
+                try:
+                    cycle_start = time.time()
+                    tab_stats = syncer.sync_tabs_concurrently(spreadsheet)
+                    
+                    tm_rows = tab_stats['tham_my']['rows']
+                    if tm_rows is not None and db_count is not None:
+                        sheet_count = tm_rows - 1  # Minus header
+                        log_to_db(conn, 'INFO', f'📊 TM: Sheet={sheet_count}, DB={db_count}, Diff={sheet_count - db_count}')
+                    
+                    for tab, result in tab_stats.items():
+                        tab_display = tab_names.get(tab, tab)
+                        p, e = result['processed'], result['errors']
+                        if result['rows'] is None:
+                            log_to_db(conn, 'INFO', f'⏭️ {tab_display}: unchanged since last sync')
+                        elif p > 0:
                             total_new += p
-                            log_to_db(conn, 'INFO', f'✅ {tab_display}: +{p} new, {e} errors')
+                            log_to_db(conn, 'INFO', f'✅ {tab_display}: +{p} new, {e} errors ({result["duration"]:.1f}s)')
                         else:
-                            # Get why it was skipped
-                            log_to_db(conn, 'INFO', f'⏭️ {tab_display}: 0 new (all exist in DB)')
-                            
-                    except Exception as tab_e:
-                        log_to_db(conn, 'ERROR', f'❌ {tab_display}: {str(tab_e)[:50]}')
-                        logger.error(f"Tab {tab} error: {tab_e}")
+                            log_to_db(conn, 'INFO', f'⏭️ {tab_display}: 0 new (all exist in DB) ({result["duration"]:.1f}s)')
+                    log_to_db(conn, 'INFO', f'⏱️ Tabs synced in {time.time() - cycle_start:.1f}s')
+                        
+                except Exception as tab_e:
+                    log_to_db(conn, 'ERROR', f'❌ Tab sync: {str(tab_e)[:50]}')
+                    logger.error(f"Tab sync error: {tab_e}")
                 
-                # Step 5: Calculate commissions if new records
-                if total_new > 0:
-                    try:
-                        calculate_new_commissions_fast(connection=conn)
-                        log_to_db(conn, 'INFO', f'💰 Commissions updated for {total_new} records')
-                    except Exception as ce:
-                        log_to_db(conn, 'WARNING', f'⚠️ Commission: {str(ce)[:30]}')
+                # Step 5: Queue commissions for new records, then run queued jobs
+                try:
+                    if total_new > 0:
+                        enqueue_commission_job('incremental', requested_by='sync_worker', connection=conn)
+                    for job in process_commission_jobs(connection=conn):
+                        log_to_db(conn, 'INFO', f'💰 Commission job #{job["id"]} ({job["job_type"]}): {job["status"]}')
+                    refresh_ctv_daily_rollup(connection=conn)
+                    check_ctv_tree_watermark(conn)
+                except Exception as ce:
+                    log_to_db(conn, 'WARNING', f'⚠️ Commission: {str(ce)[:30]}')
+                
+                # Step 5.2: Booking rows still waiting in the Sheets outbox
+                try:
+                    from modules.sheets_outbox import dispatch_sheets_outbox
+                    outbox = dispatch_sheets_outbox(connection=conn)
+                    if outbox['sent'] or outbox['retry'] or outbox['failed']:
+                        log_to_db(conn, 'INFO', f'📤 Sheets outbox: {outbox["sent"]} sent, '
+                                                f'{outbox["retry"]} retrying, {outbox["failed"]} failed')
+                except Exception as oe:
+                    log_to_db(conn, 'WARNING', f'⚠️ Sheets outbox: {str(oe)[:50]}')
                 
                 # Step 5.5: Sync Pricing Data from Google Sheet (uses fresh client)
                 try:
                     from modules.pricing_sync import sync_pricing_sheet
                     PRICING_SHEET_ID = '19YZB-SgpqvI3-hu93xOk0OCDWtUPxrAAfR6CiFpU4GY'
-                    pricing_client = syncer.get_google_client()
+                    pricing_client = syncer.get_shared_google_client()
                     result = sync_pricing_sheet(pricing_client, PRICING_SHEET_ID)
                     if result > 0:
                         log_to_db(conn, 'INFO', f'📋 Pricing data synced ({result} categories)')
@@ -270,8 +303,9 @@ def _start_sync_worker_once():
         app._sync_first_request_done = True
         start_embedded_sync_worker()
 
-# Database connection pool
-from modules.db_pool import get_db_connection, return_db_connection
+# Database connection pool (one shared connection per request, released on teardown)
+from modules.db_pool import get_db_connection, return_db_connection, setup_request_connection
+setup_request_connection(app)
 
 # ══════════════════════════════════════════════════════════════════════════════
 # LANDING PAGES
@@ -382,7 +416,7 @@ def check_duplicate():
     # Extract last 8 digits for fuzzy matching (handles leading zero variations)
     phone_suffix = phone[-8:]
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -503,7 +537,7 @@ def api_admin_remove_duplicates():
             if conn: conn.rollback()
             yield f"data: {json.dumps({'message': f'Error: {str(e)}', 'type': 'error'})}\n\n"
         finally:
-            if conn: conn.close()
+            if conn: return_db_connection(conn)
             
     return Response(stream_with_context(generate_logs()), mimetype='text/event-stream')
 
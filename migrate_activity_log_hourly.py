@@ -0,0 +1,116 @@
+"""
+Migration script to add the activity_log_hourly table.
+
+get_activity_stats() ran half a dozen aggregates over activity_logs every time
+the admin logs page opened, and get_suspicious_ips() regrouped 7 days of raw
+rows. The log writer now adds every batch to per-hour counters in
+activity_log_hourly (and in Redis), and those endpoints read the counters.
+
+The table is created and backfilled from the existing rows in one
+transaction; the writer starts counting as soon as it sees the table, so rows
+logged afterwards are not counted twice.
+
+Usage:
+    python migrate_activity_log_hourly.py
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS activity_log_hourly (
+        hour TIMESTAMP NOT NULL,
+        dimension VARCHAR(20) NOT NULL,
+        key VARCHAR(255) NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        last_seen TIMESTAMP,
+        PRIMARY KEY (hour, dimension, key)
+    )
+"""
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_activity_log_hourly_dimension ON activity_log_hourly(dimension, hour)",
+]
+
+# dimension -> (key expression, extra filter); mirrors activity_logger._aggregate_entries
+IGNORED_IPS = "('', 'unknown', 'system', '127.0.0.1')"
+DIMENSIONS = {
+    'event': ("event_type", "TRUE"),
+    'user_type': ("COALESCE(user_type, '')", "TRUE"),
+    'status': ("(status_code / 100)::text || 'xx'", "status_code IS NOT NULL AND status_code != 0"),
+    'endpoint': ("LEFT(endpoint, 255)", "endpoint IS NOT NULL"),
+    'ip': ("ip_address", "COALESCE(ip_address, '') != ''"),
+    'failed_ip': ("ip_address", f"event_type = 'login_failed' AND ip_address IS NOT NULL AND ip_address NOT IN {IGNORED_IPS}"),
+    'ip_user': ("LEFT(ip_address || '|' || COALESCE(user_type, '') || '|' || user_id, 255)",
+                f"event_type IN ('login_success', 'api_call') AND user_id IS NOT NULL AND user_id != '' "
+                f"AND ip_address IS NOT NULL AND ip_address NOT IN {IGNORED_IPS}"),
+}
+
+
+def migrate():
+    """Create activity_log_hourly and backfill it from activity_logs"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        cursor.execute("SELECT to_regclass('activity_log_hourly') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            print("activity_log_hourly already exists, nothing to do")
+            connection.rollback()
+            return_db_connection(connection)
+            return True
+
+        print("[1/3] Creating activity_log_hourly table...")
+        cursor.execute(CREATE_TABLE)
+
+        print("[2/3] Creating indexes...")
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
+            print(f"   {index_sql.split(' ON ')[0].split()[-1]}")
+
+        # Writers that started before this transaction commits do not see the
+        # table yet, so rows up to now are counted here only
+        print("[3/3] Backfilling from activity_logs...")
+        for dimension, (key_expr, condition) in DIMENSIONS.items():
+            cursor.execute(f"""
+                INSERT INTO activity_log_hourly (hour, dimension, key, count, last_seen)
+                SELECT date_trunc('hour', timestamp), %s, {key_expr}, COUNT(*), MAX(timestamp)
+                FROM activity_logs
+                WHERE timestamp IS NOT NULL AND {condition}
+                GROUP BY 1, 3
+            """, (dimension,))
+            print(f"   {dimension}: {cursor.rowcount} hourly rows")
+
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Activity Log Hourly Counters Migration")
+    print("=" * 60)
+
+    if migrate():
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -0,0 +1,190 @@
+"""
+Migration script to convert activity_logs into a monthly range-partitioned table.
+
+cleanup_old_logs() and mask_old_ips() ran DELETE/UPDATE statements over the
+whole table, and every stats query scanned all of it. Partitioned by month on
+timestamp, date-filtered queries only read the matching partitions and
+retention becomes DETACH + DROP of whole months.
+
+Steps:
+1. One short transaction renames the old table to activity_logs_legacy and
+   creates the partitioned activity_logs (new log rows go there right away).
+2. Monthly partitions are created from the oldest legacy row to 3 months ahead.
+3. Legacy rows are moved in batches (DELETE ... RETURNING into the new table),
+   one commit per batch, so no lock is held for long.
+4. activity_logs_legacy is dropped once empty.
+
+The script is resumable: rerunning it continues moving rows from
+activity_logs_legacy if a previous run stopped half way.
+
+Usage:
+    python migrate_activity_log_partitions.py [--batch-size 5000]
+"""
+
+import os
+import sys
+import time
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+from modules.activity_logger import is_log_table_partitioned, ensure_log_partitions
+
+DEFAULT_BATCH_SIZE = 5000
+
+COLUMNS = "id, event_type, user_type, user_id, ip_address, user_agent, endpoint, method, status_code, details, timestamp"
+
+CREATE_TABLE = """
+    CREATE TABLE activity_logs (
+        id BIGSERIAL,
+        event_type VARCHAR(50) NOT NULL,
+        user_type VARCHAR(10),
+        user_id VARCHAR(50),
+        ip_address VARCHAR(45),
+        user_agent TEXT,
+        endpoint VARCHAR(255),
+        method VARCHAR(10),
+        status_code INTEGER,
+        details JSONB,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+"""
+
+CREATE_DEFAULT_PARTITION = "CREATE TABLE activity_logs_default PARTITION OF activity_logs DEFAULT"
+
+INDEXES = [
+    "CREATE INDEX idx_activity_logs_timestamp ON activity_logs(timestamp)",
+    "CREATE INDEX idx_activity_logs_event ON activity_logs(event_type)",
+    "CREATE INDEX idx_activity_logs_user ON activity_logs(user_type, user_id)",
+    "CREATE INDEX idx_activity_logs_ip ON activity_logs(ip_address)",
+    "CREATE INDEX idx_activity_logs_logins ON activity_logs(timestamp, user_id) WHERE event_type IN ('login_success', 'login_failed')",
+]
+
+
+def swap_tables(cursor):
+    """Rename the plain table (and its indexes/sequence) out of the way and create the partitioned one"""
+    cursor.execute("SET LOCAL lock_timeout = '5s'")
+    cursor.execute("ALTER TABLE activity_logs RENAME TO activity_logs_legacy")
+
+    # Index and sequence names are schema-wide; free them for the new table
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'activity_logs_legacy'
+    """)
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"')
+    cursor.execute("SELECT pg_get_serial_sequence('activity_logs_legacy', 'id')")
+    sequence = cursor.fetchone()[0]
+    if sequence:
+        cursor.execute(f"ALTER SEQUENCE {sequence} RENAME TO activity_logs_legacy_id_seq")
+
+    cursor.execute(CREATE_TABLE)
+    cursor.execute(CREATE_DEFAULT_PARTITION)
+    for index_sql in INDEXES:
+        cursor.execute(index_sql)
+
+    # New ids continue after the legacy ones
+    cursor.execute("SELECT MAX(id) FROM activity_logs_legacy")
+    max_id = cursor.fetchone()[0]
+    if max_id:
+        cursor.execute("SELECT setval(pg_get_serial_sequence('activity_logs', 'id'), %s)", (max_id,))
+
+
+def move_rows(connection, batch_size):
+    """Move legacy rows into the partitioned table, one committed batch at a time"""
+    cursor = connection.cursor()
+    total = 0
+    while True:
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM activity_logs_legacy
+                WHERE id IN (SELECT id FROM activity_logs_legacy ORDER BY id LIMIT %s)
+                RETURNING {COLUMNS}
+            )
+            INSERT INTO activity_logs ({COLUMNS})
+            SELECT id, event_type, user_type, user_id, ip_address, user_agent, endpoint,
+                   method, status_code, details, COALESCE(timestamp, CURRENT_TIMESTAMP)
+            FROM moved
+        """, (batch_size,))
+        moved = cursor.rowcount
+        connection.commit()
+        if moved == 0:
+            break
+        total += moved
+        print(f"   moved {total} rows")
+        time.sleep(0.05)  # let the app's own writes through between batches
+    cursor.close()
+    return total
+
+
+def migrate(batch_size=DEFAULT_BATCH_SIZE):
+    """Partition activity_logs and move the existing rows"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/4] Creating partitioned activity_logs...")
+        if is_log_table_partitioned(cursor):
+            print("   already partitioned")
+        else:
+            swap_tables(cursor)
+        connection.commit()
+
+        cursor.execute("SELECT to_regclass('activity_logs_legacy') IS NOT NULL")
+        has_legacy = cursor.fetchone()[0]
+        oldest = None
+        if has_legacy:
+            cursor.execute("SELECT MIN(timestamp) FROM activity_logs_legacy")
+            oldest = cursor.fetchone()[0]
+        connection.commit()
+
+        print("[2/4] Creating monthly partitions...")
+        for name in ensure_log_partitions(connection=connection, since=oldest) or []:
+            print(f"   {name}")
+
+        print("[3/4] Moving existing rows...")
+        if has_legacy:
+            moved = move_rows(connection, batch_size)
+            print(f"   {moved} rows moved")
+
+            print("[4/4] Dropping activity_logs_legacy...")
+            cursor.execute("DROP TABLE activity_logs_legacy")
+            connection.commit()
+        else:
+            print("   nothing to move")
+
+        cursor.execute("ANALYZE activity_logs")
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Activity Logs Partitioning Migration")
+    print("=" * 60)
+
+    batch_size = DEFAULT_BATCH_SIZE
+    if '--batch-size' in sys.argv:
+        batch_size = int(sys.argv[sys.argv.index('--batch-size') + 1])
+
+    if migrate(batch_size):
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -0,0 +1,271 @@
+"""
+Migration script to add the client_summary table.
+
+client_summary is the admin clients list as a table: one row per client card
+(sdt, ten_khach) with the aggregates the list shows and filters on. The list
+used to GROUP BY all of khach_hang on every request, page with OFFSET and
+re-run the aggregation to count. It now reads a page straight off the
+(last_visit_date, sdt, ten_khach) index, and name / phone search is served by
+pg_trgm indexes.
+
+The table is kept current by statement-level triggers on khach_hang, inside
+the same transaction as the write: every phone a statement touches has its
+rows recomputed.
+
+Usage:
+    python migrate_client_summary.py            # Full migration (table, triggers, build)
+    python migrate_client_summary.py --rebuild  # Recompute every row
+    python migrate_client_summary.py --check    # Report missing / extra rows
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+from modules.client_summary import rebuild_client_summary, check_client_summary
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS client_summary (
+        sdt VARCHAR(15) NOT NULL,
+        ten_khach VARCHAR(100) NOT NULL DEFAULT '',
+        sdt_norm VARCHAR(50),
+        co_so VARCHAR(100),
+        first_visit_date DATE,
+        last_visit_date DATE NOT NULL,
+        nguoi_chot VARCHAR(50),
+        closers TEXT[] NOT NULL DEFAULT '{}',
+        service_count INTEGER NOT NULL DEFAULT 0,
+        deposit_count INTEGER NOT NULL DEFAULT 0,
+        last_done_visit DATE,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (sdt, ten_khach)
+    )
+"""
+
+INDEXES = [
+    ('idx_client_summary_recent', 'client_summary', '(last_visit_date, sdt, ten_khach)'),
+    ('idx_client_summary_sdt_norm', 'client_summary', '(sdt_norm)'),
+    ('idx_client_summary_closers', 'client_summary', ' USING GIN (closers)'),
+]
+
+# Need pg_trgm; the list still works without them, search just scans the table
+TRGM_INDEXES = [
+    ('idx_client_summary_name_trgm', 'client_summary', ' USING GIN (ten_khach gin_trgm_ops)'),
+    ('idx_client_summary_sdt_trgm', 'client_summary', ' USING GIN (sdt gin_trgm_ops)'),
+]
+
+FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION client_summary_rows(phones TEXT[])
+    RETURNS TABLE(
+        sdt VARCHAR(15), ten_khach VARCHAR(100), sdt_norm VARCHAR(50), co_so VARCHAR(100),
+        first_visit_date DATE, last_visit_date DATE, nguoi_chot VARCHAR(50), closers TEXT[],
+        service_count INTEGER, deposit_count INTEGER, last_done_visit DATE
+    ) AS $$
+        SELECT
+            kh.sdt,
+            COALESCE(kh.ten_khach, '')::VARCHAR(100),
+            MIN(kh.sdt_norm),
+            MIN(kh.co_so),
+            MIN(kh.ngay_nhap_don),
+            COALESCE(MAX(kh.ngay_nhap_don), DATE '1900-01-01'),
+            MIN(kh.nguoi_chot),
+            ARRAY_REMOVE(ARRAY_AGG(DISTINCT kh.nguoi_chot::TEXT), NULL),
+            COUNT(*)::INTEGER,
+            (COUNT(*) FILTER (WHERE kh.tien_coc > 0))::INTEGER,
+            MAX(kh.ngay_hen_lam) FILTER (WHERE kh.trang_thai IN ('Đã đến làm', 'Da den lam'))
+        FROM khach_hang kh
+        WHERE kh.sdt = ANY(phones) AND kh.sdt <> ''
+        GROUP BY kh.sdt, COALESCE(kh.ten_khach, '')
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION refresh_client_summary(phones TEXT[])
+    RETURNS VOID AS $$
+    BEGIN
+        IF phones IS NULL OR cardinality(phones) = 0 THEN
+            RETURN;
+        END IF;
+
+        -- Transactions writing the same phones take turns, so each recount
+        -- sees the rows the other one committed
+        PERFORM pg_advisory_xact_lock(hashtext('client_summary'), bucket)
+        FROM (
+            SELECT DISTINCT hashtext(p) & 255 AS bucket FROM unnest(phones) AS p ORDER BY 1
+        ) buckets;
+
+        DELETE FROM client_summary cs
+        WHERE cs.sdt = ANY(phones)
+        AND NOT EXISTS (
+            SELECT 1 FROM khach_hang kh
+            WHERE kh.sdt = cs.sdt AND COALESCE(kh.ten_khach, '') = cs.ten_khach
+        );
+
+        INSERT INTO client_summary (
+            sdt, ten_khach, sdt_norm, co_so, first_visit_date, last_visit_date,
+            nguoi_chot, closers, service_count, deposit_count, last_done_visit
+        )
+        SELECT * FROM client_summary_rows(phones)
+        ON CONFLICT (sdt, ten_khach) DO UPDATE SET
+            sdt_norm = EXCLUDED.sdt_norm,
+            co_so = EXCLUDED.co_so,
+            first_visit_date = EXCLUDED.first_visit_date,
+            last_visit_date = EXCLUDED.last_visit_date,
+            nguoi_chot = EXCLUDED.nguoi_chot,
+            closers = EXCLUDED.closers,
+            service_count = EXCLUDED.service_count,
+            deposit_count = EXCLUDED.deposit_count,
+            last_done_visit = EXCLUDED.last_done_visit,
+            updated_at = CURRENT_TIMESTAMP;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION sync_client_summary()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM refresh_client_summary(ARRAY(SELECT DISTINCT sdt::TEXT FROM new_rows WHERE sdt <> ''));
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM refresh_client_summary(ARRAY(SELECT DISTINCT sdt::TEXT FROM old_rows WHERE sdt <> ''));
+        ELSIF TG_OP = 'UPDATE' THEN
+            -- Sync re-writes many rows unchanged; only summarized columns matter
+            PERFORM refresh_client_summary(ARRAY(
+                SELECT DISTINCT p FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL unnest(ARRAY[o.sdt::TEXT, n.sdt::TEXT]) AS p
+                WHERE p <> ''
+                AND (o.sdt, o.ten_khach, o.co_so, o.ngay_nhap_don, o.nguoi_chot, o.tien_coc, o.ngay_hen_lam, o.trang_thai)
+                    IS DISTINCT FROM
+                    (n.sdt, n.ten_khach, n.co_so, n.ngay_nhap_don, n.nguoi_chot, n.tien_coc, n.ngay_hen_lam, n.trang_thai)
+            ));
+        ELSE
+            DELETE FROM client_summary;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+]
+
+# (trigger name, definition after "CREATE TRIGGER <name>")
+TRIGGERS = [
+    ('khach_hang_client_summary_insert', """
+        AFTER INSERT ON khach_hang
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary()
+    """),
+    ('khach_hang_client_summary_update', """
+        AFTER UPDATE ON khach_hang
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary()
+    """),
+    ('khach_hang_client_summary_delete', """
+        AFTER DELETE ON khach_hang
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary()
+    """),
+    ('khach_hang_client_summary_truncate', """
+        AFTER TRUNCATE ON khach_hang
+        FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary()
+    """),
+]
+
+
+def migrate():
+    """Create the client_summary table, indexes and triggers, then build it"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/5] Enabling pg_trgm...")
+        cursor.execute("SAVEPOINT trgm")
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute("RELEASE SAVEPOINT trgm")
+            has_trgm = True
+        except Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT trgm")
+            print(f"   WARNING: pg_trgm unavailable, search will not be indexed: {e}")
+            has_trgm = False
+
+        print("[2/5] Creating client_summary table and indexes...")
+        cursor.execute(CREATE_TABLE)
+        for name, table, columns in INDEXES + (TRGM_INDEXES if has_trgm else []):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}{columns}")
+            print(f"   {name} ON {table}{columns}")
+
+        print("[3/5] Creating summary functions and triggers...")
+        for function_sql in FUNCTIONS:
+            cursor.execute(function_sql)
+        for name, definition in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON khach_hang")
+            cursor.execute(f"CREATE TRIGGER {name} {definition}")
+            print(f"   {name}")
+        connection.commit()
+
+        print("[4/5] Building summary rows...")
+        rows = rebuild_client_summary(connection)
+        if rows is None:
+            raise Error("rebuild failed")
+        print(f"   client_summary: {rows} rows")
+
+        print("[5/5] Verifying...")
+        cursor.execute("ANALYZE client_summary")
+        connection.commit()
+        if not report_check(connection):
+            raise Error("client_summary is inconsistent after rebuild")
+
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+def report_check(connection=None):
+    """Print the consistency check result, True when consistent"""
+    result = check_client_summary(connection)
+    if result is None:
+        print("   Check failed (is the migration applied?)")
+        return False
+    print(f"   rows={result['rows']} missing={result['missing']} extra={result['extra']}")
+    return result['consistent']
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Client Summary Migration")
+    print("=" * 60)
+
+    if '--check' in sys.argv:
+        success = report_check()
+        print("\nSummary is consistent." if success else "\nSummary is INCONSISTENT - run with --rebuild")
+        sys.exit(0 if success else 1)
+
+    if '--rebuild' in sys.argv:
+        rows = rebuild_client_summary()
+        success = rows is not None
+        if success:
+            print(f"   client_summary: {rows} rows")
+    else:
+        success = migrate()
+
+    if success:
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
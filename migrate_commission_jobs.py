@@ -0,0 +1,86 @@
+"""
+Migration script to add the commission_jobs table.
+
+Admin pages used to run calculate_new_commissions_fast() inside the request,
+so a dashboard load after a large sync waited on the whole backfill. They now
+queue a job in commission_jobs and report how stale the numbers are; the sync
+worker claims jobs with FOR UPDATE SKIP LOCKED and runs them one at a time.
+
+The partial unique index keeps at most one pending job per type, so repeated
+page loads collapse into a single queued run.
+
+Usage:
+    python migrate_commission_jobs.py
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS commission_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        job_type VARCHAR(30) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        requested_by VARCHAR(50),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result JSONB,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+"""
+
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_commission_jobs_one_pending ON commission_jobs(job_type) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_commission_jobs_status ON commission_jobs(status, id)",
+]
+
+
+def migrate():
+    """Create the commission_jobs table and its indexes"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/2] Creating commission_jobs table...")
+        cursor.execute(CREATE_TABLE)
+
+        print("[2/2] Creating indexes...")
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
+            print(f"   {index_sql.split(' ON ')[0].split()[-1]}")
+
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Commission Jobs Migration")
+    print("=" * 60)
+
+    if migrate():
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -0,0 +1,180 @@
+"""
+Migration script to add the ctv_closure table.
+
+ctv_closure stores one row per (ancestor, descendant) pair of the referral
+tree with the distance between them (depth 0 = the CTV itself). Downline
+queries that used to walk the tree with WITH RECURSIVE on every request become
+a single indexed lookup, e.g. revenue per level is one GROUP BY depth.
+
+The table is kept current by an AFTER INSERT / UPDATE OF nguoi_gioi_thieu
+trigger on ctv, inside the same transaction as the write. Deleting a CTV
+cascades its closure rows, and the ON DELETE SET NULL on its children fires
+the trigger for each child.
+
+Usage:
+    python migrate_ctv_closure.py            # Full migration (table, trigger, build)
+    python migrate_ctv_closure.py --rebuild  # Recompute every row
+    python migrate_ctv_closure.py --check    # Report missing / extra rows
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+from modules.mlm.closure import rebuild_ctv_closure, check_ctv_closure
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS ctv_closure (
+        ancestor VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+        descendant VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor, descendant)
+    )
+"""
+
+INDEXES = [
+    ('idx_ctv_closure_ancestor_depth', 'ctv_closure', '(ancestor, depth)'),
+    ('idx_ctv_closure_descendant_depth', 'ctv_closure', '(descendant, depth)'),
+]
+
+FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION ctv_closure_paths(codes TEXT[])
+    RETURNS TABLE(ancestor VARCHAR(20), descendant VARCHAR(20), depth INTEGER) AS $$
+        WITH RECURSIVE chain AS (
+            SELECT c.ma_ctv AS start_code, c.ma_ctv AS code, c.nguoi_gioi_thieu AS next_code,
+                   0 AS lvl, ARRAY[c.ma_ctv::TEXT] AS path
+            FROM ctv c
+            WHERE c.ma_ctv = ANY(codes)
+
+            UNION ALL
+
+            SELECT chain.start_code, p.ma_ctv, p.nguoi_gioi_thieu, chain.lvl + 1, chain.path || p.ma_ctv::TEXT
+            FROM chain
+            INNER JOIN ctv p ON p.ma_ctv = chain.next_code
+            WHERE NOT p.ma_ctv = ANY(chain.path)
+        )
+        SELECT code, start_code, lvl FROM chain
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION refresh_ctv_closure(codes TEXT[])
+    RETURNS VOID AS $$
+    BEGIN
+        DELETE FROM ctv_closure WHERE descendant = ANY(codes);
+        INSERT INTO ctv_closure (ancestor, descendant, depth)
+        SELECT * FROM ctv_closure_paths(codes);
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION sync_ctv_closure()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        affected TEXT[];
+    BEGIN
+        IF TG_OP = 'UPDATE' AND NEW.nguoi_gioi_thieu IS NOT DISTINCT FROM OLD.nguoi_gioi_thieu THEN
+            RETURN NULL;
+        END IF;
+
+        affected := ARRAY(SELECT descendant::TEXT FROM ctv_closure WHERE ancestor = NEW.ma_ctv);
+        IF NOT NEW.ma_ctv = ANY(affected) THEN
+            affected := affected || NEW.ma_ctv::TEXT;
+        END IF;
+
+        PERFORM refresh_ctv_closure(affected);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+]
+
+
+def migrate():
+    """Create table, functions and trigger, then build the closure"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/4] Creating ctv_closure table and indexes...")
+        cursor.execute(CREATE_TABLE)
+        for name, table, columns in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}{columns}")
+            print(f"   {name} ON {table}{columns}")
+
+        print("[2/4] Creating closure functions and trigger...")
+        for function_sql in FUNCTIONS:
+            cursor.execute(function_sql)
+        cursor.execute("DROP TRIGGER IF EXISTS ctv_closure_sync ON ctv")
+        cursor.execute("""
+            CREATE TRIGGER ctv_closure_sync
+            AFTER INSERT OR UPDATE OF nguoi_gioi_thieu ON ctv
+            FOR EACH ROW EXECUTE FUNCTION sync_ctv_closure()
+        """)
+        connection.commit()
+
+        print("[3/4] Building closure rows...")
+        rows = rebuild_ctv_closure(connection)
+        if rows is None:
+            raise Error("rebuild failed")
+        print(f"   ctv_closure: {rows} rows")
+
+        print("[4/4] Verifying...")
+        cursor.execute("ANALYZE ctv_closure")
+        connection.commit()
+        if not report_check(connection):
+            raise Error("closure is inconsistent after rebuild")
+
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+def report_check(connection=None):
+    """Print the consistency check result, True when consistent"""
+    result = check_ctv_closure(connection)
+    if result is None:
+        print("   Check failed (is the migration applied?)")
+        return False
+    print(f"   rows={result['rows']} missing={result['missing']} extra={result['extra']}")
+    return result['consistent']
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("CTV Closure Table Migration")
+    print("=" * 60)
+
+    if '--check' in sys.argv:
+        success = report_check()
+        print("\nClosure is consistent." if success else "\nClosure is INCONSISTENT - run with --rebuild")
+        sys.exit(0 if success else 1)
+
+    if '--rebuild' in sys.argv:
+        rows = rebuild_ctv_closure()
+        success = rows is not None
+        if success:
+            print(f"   ctv_closure: {rows} rows")
+    else:
+        success = migrate()
+
+    if success:
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
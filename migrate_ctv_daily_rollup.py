@@ -0,0 +1,253 @@
+"""
+Migration script to add the ctv_daily_rollup table.
+
+ctv_daily_rollup keeps one row per (ctv_code, day, level) with revenue,
+transaction count and commission, so the admin dashboard, the commission
+summary and the CTV lifetime / commission endpoints add up O(days) rows
+instead of scanning khach_hang, services and commissions on every request.
+
+Triggers on khach_hang, services, commissions and ctv append the affected days
+to ctv_daily_rollup_dirty. The sync worker drains that queue after every cycle
+(refresh_ctv_daily_rollup), so the rollup trails the source tables by at most
+one sync cycle.
+
+Usage:
+    python migrate_ctv_daily_rollup.py            # Full migration (tables, triggers, build)
+    python migrate_ctv_daily_rollup.py --rebuild  # Recompute every row
+    python migrate_ctv_daily_rollup.py --refresh  # Only refresh the queued days
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+from modules.mlm.rollup import rebuild_ctv_daily_rollup, refresh_ctv_daily_rollup
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS ctv_daily_rollup (
+        ctv_code VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+        day DATE NOT NULL,
+        level INTEGER NOT NULL,
+        revenue DECIMAL(15,2) NOT NULL DEFAULT 0,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        commission DECIMAL(15,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (ctv_code, day, level)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ctv_daily_rollup_dirty (
+        id BIGSERIAL PRIMARY KEY,
+        day DATE NOT NULL,
+        marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+]
+
+INDEXES = [
+    ('idx_ctv_daily_rollup_day', 'ctv_daily_rollup', '(day)'),
+]
+
+FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION mark_rollup_days(days DATE[])
+    RETURNS VOID AS $$
+        INSERT INTO ctv_daily_rollup_dirty (day)
+        SELECT DISTINCT COALESCE(d, DATE '1900-01-01') FROM unnest(days) AS d
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION mark_khach_hang_rollup_day()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM mark_rollup_days(ARRAY[NEW.ngay_hen_lam]);
+        ELSIF TG_OP = 'UPDATE' THEN
+            PERFORM mark_rollup_days(ARRAY[OLD.ngay_hen_lam, NEW.ngay_hen_lam]);
+        ELSE
+            PERFORM mark_rollup_days(ARRAY[OLD.ngay_hen_lam]);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION mark_services_rollup_day()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM mark_rollup_days(ARRAY[NEW.date_entered]);
+        ELSIF TG_OP = 'UPDATE' THEN
+            PERFORM mark_rollup_days(ARRAY[OLD.date_entered, NEW.date_entered]);
+        ELSE
+            PERFORM mark_rollup_days(ARRAY[OLD.date_entered]);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION mark_commissions_rollup_days()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM mark_rollup_days(ARRAY(
+                SELECT kh.ngay_hen_lam FROM old_rows r JOIN khach_hang kh ON r.transaction_id = -kh.id
+                UNION
+                SELECT s.date_entered FROM old_rows r JOIN services s ON r.transaction_id = s.id
+            ));
+        ELSE
+            PERFORM mark_rollup_days(ARRAY(
+                SELECT kh.ngay_hen_lam FROM new_rows r JOIN khach_hang kh ON r.transaction_id = -kh.id
+                UNION
+                SELECT s.date_entered FROM new_rows r JOIN services s ON r.transaction_id = s.id
+            ));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION mark_ctv_rollup_days()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        keys TEXT[];
+    BEGIN
+        keys := ARRAY[NEW.ma_ctv_norm];
+        IF TG_OP = 'UPDATE' THEN
+            IF NEW.ma_ctv_norm IS NOT DISTINCT FROM OLD.ma_ctv_norm THEN
+                RETURN NULL;
+            END IF;
+            keys := keys || OLD.ma_ctv_norm;
+        END IF;
+
+        PERFORM mark_rollup_days(ARRAY(
+            SELECT ngay_hen_lam FROM khach_hang WHERE nguoi_chot_norm = ANY(keys)
+            UNION
+            SELECT date_entered FROM services WHERE nguoi_chot_norm = ANY(keys)
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+]
+
+# (trigger name, table, definition after "CREATE TRIGGER <name>")
+TRIGGERS = [
+    ('khach_hang_rollup_day', 'khach_hang', """
+        AFTER INSERT OR DELETE ON khach_hang
+        FOR EACH ROW EXECUTE FUNCTION mark_khach_hang_rollup_day()
+    """),
+    ('khach_hang_rollup_day_update', 'khach_hang', """
+        AFTER UPDATE ON khach_hang
+        FOR EACH ROW
+        WHEN ((OLD.ngay_hen_lam, OLD.trang_thai, OLD.tong_tien, OLD.nguoi_chot_norm)
+              IS DISTINCT FROM (NEW.ngay_hen_lam, NEW.trang_thai, NEW.tong_tien, NEW.nguoi_chot_norm))
+        EXECUTE FUNCTION mark_khach_hang_rollup_day()
+    """),
+    ('services_rollup_day', 'services', """
+        AFTER INSERT OR DELETE ON services
+        FOR EACH ROW EXECUTE FUNCTION mark_services_rollup_day()
+    """),
+    ('services_rollup_day_update', 'services', """
+        AFTER UPDATE ON services
+        FOR EACH ROW
+        WHEN ((OLD.date_entered, OLD.tong_tien, OLD.nguoi_chot_norm)
+              IS DISTINCT FROM (NEW.date_entered, NEW.tong_tien, NEW.nguoi_chot_norm))
+        EXECUTE FUNCTION mark_services_rollup_day()
+    """),
+    ('commissions_rollup_days_insert', 'commissions', """
+        AFTER INSERT ON commissions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days()
+    """),
+    ('commissions_rollup_days_update', 'commissions', """
+        AFTER UPDATE ON commissions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days()
+    """),
+    ('commissions_rollup_days_delete', 'commissions', """
+        AFTER DELETE ON commissions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days()
+    """),
+    ('ctv_rollup_days', 'ctv', """
+        AFTER INSERT OR UPDATE OF ma_ctv ON ctv
+        FOR EACH ROW EXECUTE FUNCTION mark_ctv_rollup_days()
+    """),
+]
+
+
+def migrate():
+    """Create tables, functions and triggers, then build the rollup"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/3] Creating ctv_daily_rollup tables and indexes...")
+        for table_sql in CREATE_TABLES:
+            cursor.execute(table_sql)
+        for name, table, columns in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}{columns}")
+            print(f"   {name} ON {table}{columns}")
+
+        print("[2/3] Creating dirty-day functions and triggers...")
+        for function_sql in FUNCTIONS:
+            cursor.execute(function_sql)
+        for name, table, definition in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            cursor.execute(f"CREATE TRIGGER {name} {definition}")
+            print(f"   {name} ON {table}")
+        connection.commit()
+
+        print("[3/3] Building rollup rows...")
+        rows = rebuild_ctv_daily_rollup(connection)
+        if rows is None:
+            raise Error("rebuild failed")
+        cursor.execute("ANALYZE ctv_daily_rollup")
+        connection.commit()
+        print(f"   ctv_daily_rollup: {rows} rows")
+
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("CTV Daily Rollup Migration")
+    print("=" * 60)
+
+    if '--refresh' in sys.argv:
+        days = refresh_ctv_daily_rollup()
+        success = days is not None
+        if success:
+            print(f"   Refreshed {days} day(s)")
+    elif '--rebuild' in sys.argv:
+        rows = rebuild_ctv_daily_rollup()
+        success = rows is not None
+        if success:
+            print(f"   ctv_daily_rollup: {rows} rows")
+    else:
+        success = migrate()
+
+    if success:
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
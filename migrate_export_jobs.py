@@ -0,0 +1,150 @@
+"""
+Migration script to add the export_jobs table and the export data versions.
+
+Large admin exports (commissions, clients, activity logs) used to run inside
+the request and hold a gunicorn thread for minutes. They can now be submitted
+as jobs: a thread pool in the web process writes the file to local disk, the
+admin page polls the job for progress and downloads the finished file.
+
+Finished files are reused for identical requests as long as the data has not
+changed. Statement triggers advance one sequence per source table
+(export_version_<table>), which is part of every job's cache key. nextval()
+takes no lock writers wait for, unlike the counter rows in
+export_data_versions that an earlier version of this migration updated (they
+serialized every write to these tables); that table is dropped here.
+
+Usage:
+    python migrate_export_jobs.py
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS export_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        export_type VARCHAR(30) NOT NULL,
+        export_format VARCHAR(10) NOT NULL DEFAULT 'xlsx',
+        params JSONB,
+        cache_key CHAR(64) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        rows_total BIGINT,
+        file_path TEXT,
+        file_name VARCHAR(255),
+        file_size BIGINT,
+        error TEXT,
+        requested_by VARCHAR(50),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        expires_at TIMESTAMP
+    )
+    """,
+]
+
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_export_jobs_one_live ON export_jobs(cache_key) WHERE status IN ('pending', 'running')",
+    "CREATE INDEX IF NOT EXISTS idx_export_jobs_cache ON export_jobs(cache_key, status)",
+    "CREATE INDEX IF NOT EXISTS idx_export_jobs_created ON export_jobs(created_at)",
+]
+
+CREATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION advance_export_data_version()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        -- Statement triggers also fire for statements that touched no rows
+        IF TG_OP <> 'TRUNCATE' AND NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+            RETURN NULL;
+        END IF;
+        PERFORM nextval(TG_ARGV[0]::regclass);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+# Tables exports read -> events that advance their version sequence.
+# activity_logs inserts are covered by MAX(id) in the export version.
+VERSIONED_TABLES = [
+    ('commissions', ('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE')),
+    ('ctv', ('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE')),
+    ('khach_hang', ('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE')),
+    ('activity_logs', ('UPDATE', 'DELETE', 'TRUNCATE')),
+]
+
+# Transition tables allow a single event per trigger
+TRANSITION = {
+    'INSERT': 'REFERENCING NEW TABLE AS changed_rows',
+    'UPDATE': 'REFERENCING NEW TABLE AS changed_rows',
+    'DELETE': 'REFERENCING OLD TABLE AS changed_rows',
+    'TRUNCATE': '',
+}
+
+
+def migrate():
+    """Create the export_jobs table, indexes and version triggers"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/3] Creating export_jobs table...")
+        for table_sql in CREATE_TABLES:
+            cursor.execute(table_sql)
+
+        print("[2/3] Creating indexes...")
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
+            print(f"   {index_sql.split(' ON ')[0].split()[-1]}")
+
+        print("[3/3] Creating data version sequences and triggers...")
+        cursor.execute(CREATE_FUNCTION)
+        for table, events in VERSIONED_TABLES:
+            sequence = f"export_version_{table}"
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence}")
+            for event in events:
+                name = f"{table}_export_version_{event.lower()}"
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+                cursor.execute(f"""
+                    CREATE TRIGGER {name} AFTER {event} ON {table} {TRANSITION[event]}
+                    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('{sequence}')
+                """)
+                print(f"   {name}")
+        # Counter rows of the earlier version
+        cursor.execute("DROP FUNCTION IF EXISTS bump_export_data_version()")
+        cursor.execute("DROP TABLE IF EXISTS export_data_versions")
+
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Export Jobs Migration")
+    print("=" * 60)
+
+    if migrate():
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
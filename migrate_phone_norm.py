@@ -0,0 +1,189 @@
+"""
+Migration script to add normalized phone key columns.
+
+Closer/phone matching used to run RIGHT(REGEXP_REPLACE(col, '[^0-9]', '', 'g'), 9)
+on every row, which cannot use an index. This migration persists that key:
+- khach_hang.nguoi_chot_norm  - key of nguoi_chot
+- khach_hang.sdt_norm         - key of sdt (customer phone)
+- services.nguoi_chot_norm    - key of COALESCE(nguoi_chot, ctv_code)
+- ctv.ma_ctv_norm             - key of ma_ctv
+
+The key is computed by the phone_key() SQL function (last 9 digits, or the
+lowercased value for codes without digits). BEFORE INSERT/UPDATE triggers keep
+the columns current for the sync worker, the import scripts and admin edits.
+
+Usage:
+    python migrate_phone_norm.py              # Full migration
+    python migrate_phone_norm.py --backfill   # Only re-run the batched backfill
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+# Rows updated per backfill statement (keeps row locks short)
+BACKFILL_BATCH_SIZE = 5000
+
+PHONE_KEY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION phone_key(value TEXT)
+    RETURNS TEXT AS $$
+        SELECT CASE
+            WHEN REGEXP_REPLACE(COALESCE(value, ''), '[^0-9]', '', 'g') <> ''
+                THEN RIGHT(REGEXP_REPLACE(value, '[^0-9]', '', 'g'), 9)
+            ELSE NULLIF(LOWER(TRIM(value)), '')
+        END
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+"""
+
+TRIGGER_FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION set_khach_hang_phone_norm()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.nguoi_chot_norm = phone_key(NEW.nguoi_chot);
+        NEW.sdt_norm = phone_key(NEW.sdt);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION set_services_phone_norm()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.nguoi_chot_norm = phone_key(COALESCE(NEW.nguoi_chot, NEW.ctv_code));
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION set_ctv_phone_norm()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.ma_ctv_norm = phone_key(NEW.ma_ctv);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+]
+
+# (table, column, trigger name, trigger function, watched columns)
+NORM_COLUMNS = [
+    ('khach_hang', 'nguoi_chot_norm', 'khach_hang_phone_norm', 'set_khach_hang_phone_norm', 'nguoi_chot, sdt'),
+    ('khach_hang', 'sdt_norm', None, None, None),
+    ('services', 'nguoi_chot_norm', 'services_phone_norm', 'set_services_phone_norm', 'nguoi_chot, ctv_code'),
+    ('ctv', 'ma_ctv_norm', 'ctv_phone_norm', 'set_ctv_phone_norm', 'ma_ctv'),
+]
+
+# (table, key column, SET clause) for the batched backfill
+BACKFILLS = [
+    ('khach_hang', 'id', "nguoi_chot_norm = phone_key(nguoi_chot), sdt_norm = phone_key(sdt)"),
+    ('services', 'id', "nguoi_chot_norm = phone_key(COALESCE(nguoi_chot, ctv_code))"),
+]
+
+INDEXES = [
+    ('idx_khach_hang_chot_norm_date', 'khach_hang', '(nguoi_chot_norm, ngay_hen_lam)'),
+    ('idx_khach_hang_sdt_norm_date', 'khach_hang', '(sdt_norm, ngay_hen_lam)'),
+    ('idx_services_chot_norm_date', 'services', '(nguoi_chot_norm, date_entered)'),
+    ('idx_ctv_ma_ctv_norm', 'ctv', '(ma_ctv_norm)'),
+]
+
+
+def backfill(connection):
+    """Populate the key columns in id-range batches so no statement holds long locks"""
+    cursor = connection.cursor()
+
+    for table, key_column, set_clause in BACKFILLS:
+        cursor.execute(f"SELECT COALESCE(MIN({key_column}), 0), COALESCE(MAX({key_column}), 0) FROM {table}")
+        min_id, max_id = cursor.fetchone()
+
+        updated = 0
+        start = min_id
+        while start <= max_id:
+            end = start + BACKFILL_BATCH_SIZE
+            cursor.execute(
+                f"UPDATE {table} SET {set_clause} WHERE {key_column} >= %s AND {key_column} < %s",
+                (start, end)
+            )
+            updated += cursor.rowcount
+            connection.commit()
+            start = end
+        print(f"   {table}: {updated} rows backfilled")
+
+    # ctv is small and keyed by ma_ctv; one statement is enough
+    cursor.execute("UPDATE ctv SET ma_ctv_norm = phone_key(ma_ctv)")
+    print(f"   ctv: {cursor.rowcount} rows backfilled")
+    connection.commit()
+    cursor.close()
+
+
+def migrate(backfill_only=False):
+    """Add key columns, triggers, backfill and indexes"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        if not backfill_only:
+            print("[1/4] Creating phone_key() and trigger functions...")
+            cursor.execute(PHONE_KEY_FUNCTION)
+            for function_sql in TRIGGER_FUNCTIONS:
+                cursor.execute(function_sql)
+
+            print("[2/4] Adding columns and triggers...")
+            for table, column, trigger, function, watched in NORM_COLUMNS:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} VARCHAR(50)")
+                if trigger:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+                    cursor.execute(f"""
+                        CREATE TRIGGER {trigger}
+                        BEFORE INSERT OR UPDATE OF {watched} ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION {function}()
+                    """)
+            connection.commit()
+
+        print("[3/4] Backfilling existing rows...")
+        backfill(connection)
+
+        if not backfill_only:
+            print("[4/4] Creating indexes...")
+            for name, table, columns in INDEXES:
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}{columns}")
+                print(f"   {name} ON {table}{columns}")
+            connection.commit()
+
+            for table in ('khach_hang', 'services', 'ctv'):
+                cursor.execute(f"ANALYZE {table}")
+            connection.commit()
+
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Normalized Phone Key Migration")
+    print("=" * 60)
+
+    success = migrate(backfill_only='--backfill' in sys.argv)
+
+    if success:
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -0,0 +1,88 @@
+"""
+Migration script to add the Google Sheets delta-sync state tables.
+
+The sync loop used to download every tab and run one duplicate-check SELECT
+per sheet row every 30 seconds. With these tables it first compares the
+spreadsheet's Drive modifiedTime with the one seen last cycle (no download at
+all when nothing was edited), and otherwise only matches rows whose content
+hash is not in sheet_row_state against the DB.
+
+Usage:
+    python migrate_sheet_row_state.py          # Create the tables
+    python migrate_sheet_row_state.py --reset  # Forget all state (next sync is a full pass)
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS sheet_row_state (
+        tab_type VARCHAR(20) NOT NULL,
+        row_number INTEGER NOT NULL,
+        row_hash CHAR(32) NOT NULL,
+        fingerprint CHAR(32),
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (tab_type, row_number)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sheet_tab_state (
+        tab_type VARCHAR(20) PRIMARY KEY,
+        modified_time VARCHAR(40),
+        row_count INTEGER,
+        full_synced_at TIMESTAMP,
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+]
+
+
+def migrate(reset=False):
+    """Create the state tables (and optionally empty them)"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/1] Creating sheet_row_state and sheet_tab_state tables...")
+        for table_sql in CREATE_TABLES:
+            cursor.execute(table_sql)
+
+        if reset:
+            cursor.execute("DELETE FROM sheet_row_state")
+            cursor.execute("DELETE FROM sheet_tab_state")
+            print("   State cleared")
+
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Sheet Row State Migration")
+    print("=" * 60)
+
+    if migrate(reset='--reset' in sys.argv):
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -0,0 +1,87 @@
+"""
+Migration script to add the sheets_outbox table.
+
+Bookings (CTV portal and public booking page) used to append their row to the
+'Khách giới thiệu' sheet inside the request, so Sheets latency and quota
+errors reached the user. The booking now writes its khach_hang row and an
+outbox row in one transaction; a background dispatcher pushes pending rows to
+Sheets in batches and retries failures with backoff.
+
+Usage:
+    python migrate_sheets_outbox.py
+"""
+
+import os
+import sys
+from psycopg2 import Error
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.db_pool import get_db_connection, return_db_connection
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS sheets_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        idempotency_key VARCHAR(100) NOT NULL UNIQUE,
+        spreadsheet_id VARCHAR(100) NOT NULL,
+        tab_type VARCHAR(30) NOT NULL,
+        row_values JSONB NOT NULL,
+        match_key VARCHAR(100),
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    )
+"""
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_sheets_outbox_due ON sheets_outbox(next_attempt_at, id) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_sheets_outbox_created ON sheets_outbox(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sheets_outbox_match ON sheets_outbox(tab_type, match_key) WHERE status = 'sent'",
+]
+
+
+def migrate():
+    """Create the sheets_outbox table and its indexes"""
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Could not connect to database")
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        print("[1/2] Creating sheets_outbox table...")
+        cursor.execute(CREATE_TABLE)
+
+        print("[2/2] Creating indexes...")
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
+            print(f"   {index_sql.split(' ON ')[0].split()[-1]}")
+
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        return True
+
+    except Error as e:
+        print(f"ERROR: Migration failed: {e}")
+        if connection:
+            connection.rollback()
+            return_db_connection(connection)
+        return False
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Sheets Outbox Migration")
+    print("=" * 60)
+
+    if migrate():
+        print("\nMigration completed successfully!")
+    else:
+        print("\nMigration failed!")
+        sys.exit(1)
@@ -11,8 +11,14 @@ Updated for PostgreSQL.
 #
 # Core Logging:
 # - log_activity(event_type, user_type, user_id, details, ...)
-#     DOES: Insert activity record into database
-#     OUTPUTS: Log ID or None on failure
+#     DOES: Queue activity record for the batching writer
+#     OUTPUTS: True if queued, False if dropped (backpressure)
+#
+# - flush_activity_logs(timeout)
+#     DOES: Write everything still queued (runs at exit)
+#
+# - get_log_writer_stats()
+#     DOES: queued / dropped / flushed counters of the writer
 #
 # - get_client_ip(request)
 #     DOES: Extract real client IP (handles proxies/load balancers)
@@ -28,14 +34,32 @@ Updated for PostgreSQL.
 # - setup_request_logging(app)
 #     DOES: Register before_request and after_request hooks
 #
-# Maintenance:
+# Maintenance (activity_logs is partitioned by month on timestamp):
+# - ensure_log_partitions(months_ahead=3)
+#     DOES: Pre-create monthly partitions
+# - drop_old_log_partitions(days)
+#     DOES: Retention by detaching and dropping whole old partitions
+# - maintain_log_partitions()
+#     DOES: Both of the above; run by the writer thread every 6 hours
 # - cleanup_old_logs(days=90)
-#     DOES: Remove logs older than specified days
+#     DOES: Remove logs older than specified days (partition drop once migrated)
+#
+# Statistics (from the hourly counters kept by the writer):
+# - get_activity_stats()
+#     DOES: Today's logins/IPs, 7-day breakdowns by event, IP, endpoint, status
+#           (aggregated from activity_logs until the hourly table is migrated)
+# - get_suspicious_ips()
+#     DOES: IPs used by more than one account in the last 7 days
+# - get_current_hour_counters(connection=None)
+#     DOES: This hour's event counts (Redis, falls back to activity_log_hourly)
 #
 # Retrieval:
 # - get_activity_logs(filters, page, per_page)
 #     DOES: Query logs with filtering and pagination
 #
+# - build_activity_log_filters(filters) -> (where_sql, params)
+#     DOES: WHERE clause shared by get_activity_logs and the streaming exports
+#
 # ══════════════════════════════════════════════════════════════════════════════
 
 Created: December 29, 2025
@@ -108,27 +132,247 @@ def get_user_agent(req=None):
 # ASYNC LOGGING WITH QUEUE
 # ══════════════════════════════════════════════════════════════════════════════
 
+import atexit
+import random
 import threading
 import queue
+import time
+from psycopg2.extras import execute_values
 
-_log_queue = queue.Queue()
+# Writer tuning (entries are written in batches by one background thread)
+LOG_QUEUE_MAX = int(os.getenv('ACTIVITY_LOG_QUEUE_MAX', 10000))
+LOG_BATCH_SIZE = int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', 200))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv('ACTIVITY_LOG_FLUSH_MS', 500))
+
+# Backpressure: once the queue is this full, only LOG_SAMPLE_RATE of the
+# routine request events is kept; when it is completely full they are dropped.
+# Security/audit events are never sampled and are written directly instead.
+LOG_SAMPLE_THRESHOLD = 0.75
+LOG_SAMPLE_RATE = 0.1
+SAMPLED_EVENTS = ('api_call', 'page_view')
+
+LOG_COLUMNS = ('event_type', 'user_type', 'user_id', 'ip_address', 'user_agent',
+               'endpoint', 'method', 'status_code', 'details')
+
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
 _log_thread = None
-_log_thread_stop = False
+_log_thread_stop = threading.Event()
+_log_counters = {'queued': 0, 'dropped': 0, 'flushed': 0, 'failed': 0, 'batches': 0}
+_log_counters_lock = threading.Lock()
+
+
+def _count(name, n=1):
+    with _log_counters_lock:
+        _log_counters[name] += n
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# HOURLY AGGREGATES (activity_log_hourly + Redis)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Dimensions counted per hour; the stats and suspicious-IP readers use these
+# instead of scanning activity_logs.
+#   event      event_type            user_type  user_type ('' = anonymous)
+#   status     '2xx', '4xx', ...     endpoint   request path
+#   ip         client IP             failed_ip  client IP of login_failed
+#   ip_user    'ip|user_type|user_id' for login_success / api_call by a known user
+HOURLY_TTL = 8 * 24 * 3600  # Redis copies cover the 7-day windows
+IGNORED_IPS = ('', 'unknown', 'system', '127.0.0.1')
+
+_hourly_ready = False
+
+
+def _aggregate_entries(entries):
+    """Count entries per (dimension, key) for one hour bucket"""
+    counts = {}
+    
+    def add(dimension, key):
+        if key is None:
+            return
+        key = str(key)[:255]
+        counts[(dimension, key)] = counts.get((dimension, key), 0) + 1
+    
+    for entry in entries:
+        event_type = entry.get('event_type')
+        ip = entry.get('ip_address')
+        status_code = entry.get('status_code')
+        add('event', event_type)
+        add('user_type', entry.get('user_type') or '')
+        if status_code:
+            add('status', f"{int(status_code) // 100}xx")
+        add('endpoint', entry.get('endpoint'))
+        if ip:
+            add('ip', ip)
+        if ip not in (None,) + IGNORED_IPS:
+            if event_type == 'login_failed':
+                add('failed_ip', ip)
+            if event_type in ('login_success', 'api_call') and entry.get('user_id'):
+                add('ip_user', f"{ip}|{entry.get('user_type') or ''}|{entry['user_id']}")
+    return counts
+
+
+def _record_hourly(cursor, entries):
+    """
+    Add entries to activity_log_hourly inside the caller's transaction.
+    The hour bucket is the transaction's CURRENT_TIMESTAMP, the same value the
+    inserted rows get as their timestamp. Returns (hour, counts) for Redis.
+    """
+    global _hourly_ready
+    if not _hourly_ready:
+        cursor.execute("SELECT to_regclass('activity_log_hourly') IS NOT NULL")
+        _hourly_ready = cursor.fetchone()[0]
+        if not _hourly_ready:
+            return None, {}
+    
+    counts = _aggregate_entries(entries)
+    if not counts:
+        return None, {}
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [(dimension, key, count) for (dimension, key), count in sorted(counts.items())]
+    hours = execute_values(cursor, """
+        INSERT INTO activity_log_hourly (hour, dimension, key, count, last_seen)
+        VALUES %s
+        ON CONFLICT (hour, dimension, key) DO UPDATE SET
+            count = activity_log_hourly.count + EXCLUDED.count,
+            last_seen = EXCLUDED.last_seen
+        RETURNING hour
+    """, rows, template="(date_trunc('hour', CURRENT_TIMESTAMP), %s, %s, %s, CURRENT_TIMESTAMP)",
+        page_size=len(rows), fetch=True)
+    return hours[0][0], counts
+
+
+def _mirror_hourly_to_redis(hour, counts):
+    """HINCRBY the hour's counters into activity_hourly:{YYYYmmddHH}"""
+    if not counts:
+        return
+    try:
+        from .redis_cache import get_redis_client
+        client = get_redis_client()
+        if not client:
+            return
+        key = f"activity_hourly:{hour.strftime('%Y%m%d%H')}"
+        pipe = client.pipeline()
+        for (dimension, field), count in counts.items():
+            pipe.hincrby(key, f"{dimension}:{field}", count)
+        pipe.expire(key, HOURLY_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"Activity hourly Redis error: {e}")
+
+
+def get_current_hour_counters(connection=None):
+    """
+    DOES: Event counts for the current hour, from Redis when available
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Dict event_type -> count
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+    
+    if not connection:
+        return {}
+    
+    try:
+        cursor = connection.cursor()
+        # The writer buckets by the database's CURRENT_TIMESTAMP (see _record_hourly),
+        # so the hour comes from the same clock, not from this process
+        cursor.execute("SELECT date_trunc('hour', CURRENT_TIMESTAMP)::timestamp")
+        hour = cursor.fetchone()[0]
+        
+        counters = None
+        try:
+            from .redis_cache import get_redis_client
+            client = get_redis_client()
+            if client:
+                fields = client.hgetall(f"activity_hourly:{hour.strftime('%Y%m%d%H')}")
+                counters = {field[len('event:'):]: int(value) for field, value in fields.items()
+                            if field.startswith('event:')}
+        except Exception as e:
+            print(f"Activity hourly Redis error: {e}")
+        
+        if counters is None:
+            cursor.execute("""
+                SELECT key, count FROM activity_log_hourly
+                WHERE hour = %s AND dimension = 'event'
+            """, (hour,))
+            counters = {key: count for key, count in cursor.fetchall()}
+        cursor.close()
+        
+        if should_close:
+            return_db_connection(connection)
+        return counters
+    except Error as e:
+        print(f"Error reading hourly activity counters: {e}")
+        connection.rollback()
+        if should_close:
+            return_db_connection(connection)
+        return {}
+
+
+def _flush_batch(batch):
+    """Write a batch of queued entries with one multi-row INSERT"""
+    if not batch:
+        return
+    connection = get_db_connection()
+    if not connection:
+        _count('failed', len(batch))
+        return
+    
+    try:
+        cursor = connection.cursor()
+        execute_values(cursor, f"""
+            INSERT INTO activity_logs ({', '.join(LOG_COLUMNS)}) VALUES %s
+        """, [
+            tuple(Json(entry[col]) if col == 'details' and entry[col] else entry[col]
+                  for col in LOG_COLUMNS)
+            for entry in batch
+        ], page_size=LOG_BATCH_SIZE)
+        hour, counts = _record_hourly(cursor, batch)
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+        _mirror_hourly_to_redis(hour, counts)
+        _count('flushed', len(batch))
+        _count('batches')
+    except Exception as e:
+        print(f"Error flushing activity logs: {e}")
+        connection.rollback()
+        return_db_connection(connection)
+        _count('failed', len(batch))
+
+
+def _drain(batch, deadline=None):
+    """Move queued entries into batch until it is full (or the deadline passes)"""
+    while len(batch) < LOG_BATCH_SIZE:
+        try:
+            if deadline is None:
+                entry = _log_queue.get_nowait()
+            else:
+                entry = _log_queue.get(timeout=max(deadline - time.time(), 0.001))
+        except queue.Empty:
+            break
+        batch.append(entry)
+        if deadline is not None and time.time() >= deadline:
+            break
 
 
 def _log_worker():
-    """Background worker that processes log entries from the queue"""
-    global _log_thread_stop
-    while not _log_thread_stop:
+    """Background worker: flush every LOG_BATCH_SIZE entries or LOG_FLUSH_INTERVAL_MS"""
+    last_maintenance = 0
+    while not _log_thread_stop.is_set():
         try:
-            log_entry = _log_queue.get(timeout=1.0)
-            if log_entry is None:
-                break
+            if time.time() - last_maintenance > PARTITION_MAINTENANCE_INTERVAL:
+                last_maintenance = time.time()
+                maintain_log_partitions()
             
-            _sync_log_activity(**log_entry)
-            _log_queue.task_done()
-        except queue.Empty:
-            continue
+            try:
+                batch = [_log_queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            _drain(batch, deadline=time.time() + LOG_FLUSH_INTERVAL_MS / 1000.0)
+            _flush_batch(batch)
         except Exception as e:
             print(f"Activity logger worker error: {e}")
 
@@ -137,10 +381,40 @@ def _start_log_thread():
     """Start the background logging thread if not already running"""
     global _log_thread
     if _log_thread is None or not _log_thread.is_alive():
+        _log_thread_stop.clear()
         _log_thread = threading.Thread(target=_log_worker, daemon=True)
         _log_thread.start()
 
 
+def flush_activity_logs(timeout=5.0):
+    """
+    DOES: Stop the writer thread and write everything still queued (registered with atexit)
+    INPUTS: timeout - seconds to wait for the writer's in-flight batch
+    """
+    _log_thread_stop.set()
+    if _log_thread is not None and _log_thread.is_alive():
+        _log_thread.join(timeout)
+    while not _log_queue.empty():
+        batch = []
+        _drain(batch)
+        _flush_batch(batch)
+
+
+atexit.register(flush_activity_logs)
+
+
+def get_log_writer_stats():
+    """
+    DOES: Counters of the batching writer (since process start)
+    OUTPUTS: Dict with queued, dropped, flushed, failed, batches, queue_depth, queue_max
+    """
+    with _log_counters_lock:
+        stats = dict(_log_counters)
+    stats['queue_depth'] = _log_queue.qsize()
+    stats['queue_max'] = LOG_QUEUE_MAX
+    return stats
+
+
 def _sync_log_activity(
     event_type,
     user_type=None,
@@ -173,9 +447,14 @@ def _sync_log_activity(
         
         result = cursor.fetchone()
         log_id = result[0] if result else None
+        hour, counts = _record_hourly(cursor, [{
+            'event_type': event_type, 'user_type': user_type, 'user_id': user_id,
+            'endpoint': endpoint, 'status_code': status_code, 'ip_address': ip_address
+        }])
         connection.commit()
         cursor.close()
         return_db_connection(connection)
+        _mirror_hourly_to_redis(hour, counts)
         return log_id
     except Exception as e:
         print(f"Error logging activity: {e}")
@@ -200,7 +479,11 @@ def log_activity(
     ip_address=None,
     user_agent=None
 ):
-    """Queue an activity log record for async insertion"""
+    """
+    Queue an activity log record for batched insertion.
+    Routine request events may be sampled or dropped when the queue is backed up
+    (returns False); other events fall back to a direct insert when it is full.
+    """
     _start_log_thread()
     
     try:
@@ -214,6 +497,12 @@ def log_activity(
         if user_agent is None:
             user_agent = 'system'
     
+    routine = event_type in SAMPLED_EVENTS
+    if routine and _log_queue.qsize() >= LOG_QUEUE_MAX * LOG_SAMPLE_THRESHOLD \
+            and random.random() >= LOG_SAMPLE_RATE:
+        _count('dropped')
+        return False
+    
     try:
         _log_queue.put_nowait({
             'event_type': event_type,
@@ -226,8 +515,12 @@ def log_activity(
             'ip_address': ip_address,
             'user_agent': user_agent
         })
+        _count('queued')
         return True
     except queue.Full:
+        if routine:
+            _count('dropped')
+            return False
         return _sync_log_activity(
             event_type, user_type, user_id, endpoint, method,
             status_code, details, ip_address, user_agent
@@ -447,6 +740,56 @@ def setup_request_logging(app):
 # LOG RETRIEVAL
 # ══════════════════════════════════════════════════════════════════════════════
 
+def build_activity_log_filters(
+    event_type=None,
+    user_type=None,
+    user_id=None,
+    ip_address=None,
+    date_from=None,
+    date_to=None,
+    search=None
+):
+    """
+    DOES: Build the WHERE clause shared by log listing and log exports
+    OUTPUTS: (where_sql, params) - where_sql starts with "WHERE 1=1"
+    """
+    where = "WHERE 1=1"
+    params = []
+    
+    if event_type:
+        where += " AND event_type = %s"
+        params.append(event_type)
+    
+    if user_type:
+        where += " AND user_type = %s"
+        params.append(user_type)
+    
+    if user_id:
+        where += " AND user_id = %s"
+        params.append(user_id)
+    
+    if ip_address:
+        where += " AND ip_address = %s"
+        params.append(ip_address)
+    
+    if date_from:
+        where += " AND timestamp >= %s"
+        params.append(date_from)
+    
+    if date_to:
+        where += " AND timestamp <= %s"
+        if isinstance(date_to, str) and len(date_to) == 10:
+            date_to = date_to + ' 23:59:59'
+        params.append(date_to)
+    
+    if search:
+        where += " AND (user_id ILIKE %s OR endpoint ILIKE %s OR ip_address ILIKE %s)"
+        search_term = f"%{search}%"
+        params.extend([search_term, search_term, search_term])
+    
+    return where, params
+
+
 def get_activity_logs(
     event_type=None,
     user_type=None,
@@ -459,54 +802,18 @@ def get_activity_logs(
     per_page=50
 ):
     """Query activity logs with filtering and pagination"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return {'logs': [], 'total': 0, 'page': page, 'per_page': per_page}
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        query = "SELECT * FROM activity_logs WHERE 1=1"
-        count_query = "SELECT COUNT(*) as total FROM activity_logs WHERE 1=1"
-        params = []
-        
-        if event_type:
-            query += " AND event_type = %s"
-            count_query += " AND event_type = %s"
-            params.append(event_type)
-        
-        if user_type:
-            query += " AND user_type = %s"
-            count_query += " AND user_type = %s"
-            params.append(user_type)
-        
-        if user_id:
-            query += " AND user_id = %s"
-            count_query += " AND user_id = %s"
-            params.append(user_id)
-        
-        if ip_address:
-            query += " AND ip_address = %s"
-            count_query += " AND ip_address = %s"
-            params.append(ip_address)
-        
-        if date_from:
-            query += " AND timestamp >= %s"
-            count_query += " AND timestamp >= %s"
-            params.append(date_from)
-        
-        if date_to:
-            query += " AND timestamp <= %s"
-            count_query += " AND timestamp <= %s"
-            if isinstance(date_to, str) and len(date_to) == 10:
-                date_to = date_to + ' 23:59:59'
-            params.append(date_to)
-        
-        if search:
-            query += " AND (user_id ILIKE %s OR endpoint ILIKE %s OR ip_address ILIKE %s)"
-            count_query += " AND (user_id ILIKE %s OR endpoint ILIKE %s OR ip_address ILIKE %s)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term])
+        where, params = build_activity_log_filters(
+            event_type, user_type, user_id, ip_address, date_from, date_to, search
+        )
+        query = f"SELECT * FROM activity_logs {where}"
+        count_query = f"SELECT COUNT(*) as total FROM activity_logs {where}"
         
         # Get total count
         cursor.execute(count_query, params)
@@ -544,8 +851,99 @@ def get_activity_logs(
         return {'logs': [], 'total': 0, 'page': page, 'per_page': per_page}
 
 
+def _activity_stats_from_hourly(cursor):
+    """Summary counts from activity_log_hourly"""
+    cursor.execute("""
+        SELECT
+            COALESCE(SUM(count) FILTER (WHERE dimension = 'event' AND key = 'login_success' AND hour >= date_trunc('day', CURRENT_TIMESTAMP)), 0) as logins_today,
+            COALESCE(SUM(count) FILTER (WHERE dimension = 'event' AND key = 'login_failed' AND hour >= date_trunc('day', CURRENT_TIMESTAMP)), 0) as failed_logins_today,
+            COUNT(DISTINCT key) FILTER (WHERE dimension = 'ip' AND hour >= date_trunc('day', CURRENT_TIMESTAMP)) as unique_ips_today,
+            COALESCE(SUM(count) FILTER (WHERE dimension = 'event'), 0) as total_logs
+        FROM activity_log_hourly
+    """)
+    totals = cursor.fetchone()
+    
+    def top(dimension, limit=None):
+        cursor.execute(f"""
+            SELECT key, SUM(count) as count
+            FROM activity_log_hourly
+            WHERE dimension = %s AND hour >= CURRENT_TIMESTAMP - INTERVAL '7 days' AND key != ''
+            GROUP BY key
+            ORDER BY count DESC
+            {'LIMIT %s' if limit else ''}
+        """, (dimension, limit) if limit else (dimension,))
+        return [{'key': row['key'], 'count': int(row['count'])} for row in cursor.fetchall()]
+    
+    return {
+        'logins_today': int(totals['logins_today']),
+        'failed_logins_today': int(totals['failed_logins_today']),
+        'unique_ips_today': totals['unique_ips_today'],
+        'total_logs': int(totals['total_logs']),
+        'events_by_type': [{'event_type': r['key'], 'count': r['count']} for r in top('event')],
+        'top_ips': [{'ip_address': r['key'], 'count': r['count']} for r in top('ip', 10)],
+        'top_failed_ips': [{'ip_address': r['key'], 'count': r['count']} for r in top('failed_ip', 10)],
+        'top_endpoints': [{'endpoint': r['key'], 'count': r['count']} for r in top('endpoint', 10)],
+        'status_classes': {r['key']: r['count'] for r in top('status')},
+    }
+
+
+def _activity_stats_from_logs(cursor):
+    """Same summary aggregated over activity_logs (before migrate_activity_log_hourly.py has run)"""
+    cursor.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE event_type = 'login_success' AND timestamp >= date_trunc('day', CURRENT_TIMESTAMP)) as logins_today,
+            COUNT(*) FILTER (WHERE event_type = 'login_failed' AND timestamp >= date_trunc('day', CURRENT_TIMESTAMP)) as failed_logins_today,
+            COUNT(DISTINCT ip_address) FILTER (WHERE timestamp >= date_trunc('day', CURRENT_TIMESTAMP)) as unique_ips_today,
+            COUNT(*) as total_logs
+        FROM activity_logs
+    """)
+    totals = cursor.fetchone()
+    
+    def top(key_expr, condition='TRUE', limit=None):
+        cursor.execute(f"""
+            SELECT {key_expr} as key, COUNT(*) as count
+            FROM activity_logs
+            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days' AND {condition}
+            GROUP BY 1
+            ORDER BY count DESC
+            {'LIMIT %s' if limit else ''}
+        """, (limit,) if limit else None)
+        return [{'key': row['key'], 'count': row['count']} for row in cursor.fetchall()]
+    
+    cursor.execute("""
+        SELECT event_type, COUNT(*) as count
+        FROM activity_logs
+        WHERE timestamp >= date_trunc('hour', CURRENT_TIMESTAMP) AND event_type IS NOT NULL
+        GROUP BY event_type
+    """)
+    current_hour = {row['event_type']: row['count'] for row in cursor.fetchall()}
+    
+    ignored_ips = ', '.join(f"'{ip}'" for ip in IGNORED_IPS)
+    return {
+        'logins_today': totals['logins_today'],
+        'failed_logins_today': totals['failed_logins_today'],
+        'unique_ips_today': totals['unique_ips_today'],
+        'total_logs': totals['total_logs'],
+        'events_by_type': [{'event_type': r['key'], 'count': r['count']}
+                           for r in top('event_type', "event_type IS NOT NULL")],
+        'top_ips': [{'ip_address': r['key'], 'count': r['count']}
+                    for r in top('ip_address', "COALESCE(ip_address, '') != ''", 10)],
+        'top_failed_ips': [{'ip_address': r['key'], 'count': r['count']}
+                           for r in top('ip_address', f"event_type = 'login_failed' AND ip_address NOT IN ({ignored_ips})", 10)],
+        'top_endpoints': [{'endpoint': r['key'], 'count': r['count']}
+                          for r in top('endpoint', "COALESCE(endpoint, '') != ''", 10)],
+        'status_classes': {r['key']: r['count']
+                           for r in top("(status_code / 100)::text || 'xx'", "COALESCE(status_code, 0) != 0")},
+        'current_hour': current_hour,
+    }
+
+
 def get_activity_stats():
-    """Get summary statistics for activity logs"""
+    """
+    Get summary statistics for activity logs.
+    Counts come from activity_log_hourly, so the cost does not grow with activity_logs;
+    until that table is migrated they are aggregated from activity_logs as before.
+    """
     connection = get_db_connection()
     if not connection:
         return {}
@@ -553,51 +951,14 @@ def get_activity_stats():
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM activity_logs 
-            WHERE event_type = 'login_success' 
-            AND DATE(timestamp) = %s
-        """, (today,))
-        logins_today = cursor.fetchone()['count']
-        
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM activity_logs 
-            WHERE event_type = 'login_failed' 
-            AND DATE(timestamp) = %s
-        """, (today,))
-        failed_logins_today = cursor.fetchone()['count']
-        
-        cursor.execute("""
-            SELECT COUNT(DISTINCT ip_address) as count FROM activity_logs 
-            WHERE DATE(timestamp) = %s
-        """, (today,))
-        unique_ips_today = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM activity_logs")
-        total_logs = cursor.fetchone()['count']
-        
-        cursor.execute("""
-            SELECT event_type, COUNT(*) as count 
-            FROM activity_logs 
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-            GROUP BY event_type
-            ORDER BY count DESC
-        """)
-        events_by_type = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT ip_address, COUNT(*) as count 
-            FROM activity_logs 
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-            AND ip_address IS NOT NULL AND ip_address != ''
-            GROUP BY ip_address
-            ORDER BY count DESC
-            LIMIT 10
-        """)
-        top_ips = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("SELECT to_regclass('activity_log_hourly') IS NOT NULL as ready")
+        if cursor.fetchone()['ready']:
+            stats = _activity_stats_from_hourly(cursor)
+            stats['current_hour'] = get_current_hour_counters(connection)
+        else:
+            stats = _activity_stats_from_logs(cursor)
         
+        # Latest raw rows; served by the partial login index
         cursor.execute("""
             SELECT user_id, ip_address, timestamp 
             FROM activity_logs 
@@ -609,23 +970,16 @@ def get_activity_stats():
         for log in recent_failed:
             if log.get('timestamp'):
                 log['timestamp'] = log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+        stats['recent_failed_logins'] = recent_failed
         
         cursor.close()
         return_db_connection(connection)
-        
-        return {
-            'logins_today': logins_today,
-            'failed_logins_today': failed_logins_today,
-            'unique_ips_today': unique_ips_today,
-            'total_logs': total_logs,
-            'events_by_type': events_by_type,
-            'top_ips': top_ips,
-            'recent_failed_logins': recent_failed
-        }
+        return stats
         
     except Error as e:
         print(f"Error getting activity stats: {e}")
         if connection:
+            connection.rollback()
             return_db_connection(connection)
         return {}
 
@@ -634,6 +988,187 @@ def get_activity_stats():
 # MAINTENANCE
 # ══════════════════════════════════════════════════════════════════════════════
 
+# activity_logs is range-partitioned by month on timestamp (activity_logs_YYYY_MM
+# plus activity_logs_default for anything outside the created ranges)
+PARTITION_MONTHS_AHEAD = 3
+LOG_RETENTION_DAYS = int(os.getenv('ACTIVITY_LOG_RETENTION_DAYS', 365))
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600  # seconds between writer-thread runs
+
+
+def _month_start(value, months=0):
+    """First day of value's month shifted by months"""
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def log_partition_name(month):
+    """activity_logs_YYYY_MM for the month containing month"""
+    return f"activity_logs_{month.year:04d}_{month.month:02d}"
+
+
+def is_log_table_partitioned(cursor):
+    """True once migrate_activity_log_partitions.py has run"""
+    cursor.execute("""
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('activity_logs')
+    """)
+    return cursor.fetchone() is not None
+
+
+def ensure_log_partitions(months_ahead=PARTITION_MONTHS_AHEAD, connection=None, since=None):
+    """
+    DOES: Create monthly partitions from the current month (or since's month) to months_ahead
+    INPUTS: months_ahead, optional connection (borrows one from the pool if not provided),
+            since - optional datetime of the oldest row to cover (migration)
+    OUTPUTS: List of partitions created, None if activity_logs is not partitioned yet
+    
+    Rows already sitting in activity_logs_default for a new month are moved
+    into the new partition so it can be attached.
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+    if not connection:
+        return []
+    
+    created = []
+    try:
+        cursor = connection.cursor()
+        if not is_log_table_partitioned(cursor):
+            cursor.close()
+            connection.rollback()
+            if should_close:
+                return_db_connection(connection)
+            return None
+        
+        first = _month_start(min(since, datetime.now()) if since else datetime.now())
+        last = _month_start(datetime.now(), months_ahead)
+        start = first
+        while start <= last:
+            name = log_partition_name(start)
+            end = _month_start(start, 1)
+            
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+            if cursor.fetchone()[0]:
+                start = end
+                continue
+            
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM activity_logs_default WHERE timestamp >= %s AND timestamp < %s)",
+                (start, end)
+            )
+            if cursor.fetchone()[0]:
+                cursor.execute(f"CREATE TABLE {name} (LIKE activity_logs INCLUDING DEFAULTS)")
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM activity_logs_default
+                        WHERE timestamp >= %s AND timestamp < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """, (start, end))
+                cursor.execute(
+                    f"ALTER TABLE activity_logs ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                    (start, end)
+                )
+            else:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF activity_logs FOR VALUES FROM (%s) TO (%s)",
+                    (start, end)
+                )
+            connection.commit()
+            created.append(name)
+            start = end
+        
+        cursor.close()
+        if should_close:
+            return_db_connection(connection)
+        return created
+        
+    except Error as e:
+        print(f"Error creating activity log partitions: {e}")
+        connection.rollback()
+        if should_close:
+            return_db_connection(connection)
+        return created
+
+
+def drop_old_log_partitions(days, connection=None):
+    """
+    DOES: Retention by partition: detach and drop every monthly partition that
+          ends before the cutoff, and delete old rows from the default partition
+    INPUTS: days to keep, optional connection
+    OUTPUTS: Number of log rows removed
+    
+    The month containing the cutoff is kept whole, so up to one extra month
+    survives compared with a row-level DELETE.
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+    if not connection:
+        return 0
+    
+    removed = 0
+    dropped_until = None
+    try:
+        cursor = connection.cursor()
+        cutoff = datetime.now() - timedelta(days=days)
+        
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'activity_logs'::regclass
+            AND c.relname ~ '^activity_logs_[0-9]{4}_[0-9]{2}$'
+            ORDER BY c.relname
+        """)
+        for (name,) in cursor.fetchall():
+            month = datetime.strptime(name[len('activity_logs_'):], '%Y_%m')
+            if _month_start(month, 1) > cutoff:
+                continue
+            cursor.execute(f"SELECT COUNT(*) FROM {name}")
+            count = cursor.fetchone()[0]
+            cursor.execute(f"ALTER TABLE activity_logs DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            connection.commit()
+            removed += count
+            dropped_until = _month_start(month, 1)
+            print(f"Dropped activity log partition {name} ({count} rows)")
+        
+        cursor.execute("DELETE FROM activity_logs_default WHERE timestamp < %s", (cutoff,))
+        removed += cursor.rowcount
+        # Keep the hourly counters in line with the rows that are left
+        cursor.execute("SELECT to_regclass('activity_log_hourly') IS NOT NULL")
+        if dropped_until and cursor.fetchone()[0]:
+            cursor.execute("DELETE FROM activity_log_hourly WHERE hour < %s", (dropped_until,))
+        connection.commit()
+        
+        cursor.close()
+        if should_close:
+            return_db_connection(connection)
+        return removed
+        
+    except Error as e:
+        print(f"Error dropping activity log partitions: {e}")
+        connection.rollback()
+        if should_close:
+            return_db_connection(connection)
+        return removed
+
+
+def maintain_log_partitions():
+    """DOES: Pre-create future partitions and apply LOG_RETENTION_DAYS (0 disables retention)"""
+    connection = get_db_connection()
+    if not connection:
+        return
+    if ensure_log_partitions(connection=connection) is not None and LOG_RETENTION_DAYS > 0:
+        drop_old_log_partitions(LOG_RETENTION_DAYS, connection=connection)
+    return_db_connection(connection)
+
+
 def cleanup_old_logs(days=90):
     """Remove activity logs older than specified number of days"""
     connection = get_db_connection()
@@ -643,9 +1178,18 @@ def cleanup_old_logs(days=90):
     try:
         cursor = connection.cursor()
         
+        if is_log_table_partitioned(cursor):
+            cursor.close()
+            connection.rollback()
+            deleted_count = drop_old_log_partitions(days, connection=connection)
+            return_db_connection(connection)
+            print(f"Cleaned up {deleted_count} activity logs older than {days} days")
+            return deleted_count
+        
+        # Not migrated yet: row-level delete
         cursor.execute("""
             DELETE FROM activity_logs 
-            WHERE timestamp < CURRENT_TIMESTAMP - INTERVAL '%s days'
+            WHERE timestamp < CURRENT_TIMESTAMP - INTERVAL '1 day' * %s
         """, (days,))
         
         deleted_count = cursor.rowcount
@@ -660,12 +1204,16 @@ def cleanup_old_logs(days=90):
     except Error as e:
         print(f"Error cleaning up logs: {e}")
         if connection:
+            connection.rollback()
             return_db_connection(connection)
         return 0
 
 
 def get_suspicious_ips():
-    """Find IPs that are logged into multiple different accounts"""
+    """
+    Find IPs that are logged into multiple different accounts (last 7 days).
+    Reads the hourly 'ip_user' counters instead of raw activity_logs rows.
+    """
     connection = get_db_connection()
     if not connection:
         return {}
@@ -674,35 +1222,33 @@ def get_suspicious_ips():
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
         cursor.execute("""
-            SELECT ip_address, user_id, user_type, MAX(timestamp) as last_login
-            FROM activity_logs 
-            WHERE event_type IN ('login_success', 'api_call')
-            AND timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-            AND ip_address IS NOT NULL 
-            AND ip_address != '' 
-            AND ip_address != 'unknown'
-            AND ip_address != 'system'
-            AND ip_address != '127.0.0.1'
-            AND user_id IS NOT NULL
-            GROUP BY ip_address, user_id, user_type
+            WITH pairs AS (
+                SELECT split_part(key, '|', 1) as ip_address,
+                       split_part(key, '|', 2) as user_type,
+                       substr(key, length(split_part(key, '|', 1)) + length(split_part(key, '|', 2)) + 3) as user_id,
+                       MAX(last_seen) as last_login
+                FROM activity_log_hourly
+                WHERE dimension = 'ip_user' AND hour >= %s
+                GROUP BY key
+            )
+            SELECT ip_address, user_id, NULLIF(user_type, '') as user_type, last_login
+            FROM pairs
+            WHERE ip_address IN (
+                SELECT ip_address FROM pairs GROUP BY ip_address HAVING COUNT(*) > 1
+            )
             ORDER BY ip_address, last_login DESC
-        """)
+        """, (datetime.now() - timedelta(days=7),))
         
         results = cursor.fetchall()
         
-        ip_users = {}
+        suspicious = {}
         for row in results:
-            ip = row['ip_address']
-            if ip not in ip_users:
-                ip_users[ip] = []
-            ip_users[ip].append({
+            suspicious.setdefault(row['ip_address'], []).append({
                 'user_id': row['user_id'],
                 'user_type': row['user_type'],
                 'last_login': row['last_login'].strftime('%Y-%m-%d %H:%M:%S') if row['last_login'] else None
             })
         
-        suspicious = {ip: users for ip, users in ip_users.items() if len(users) > 1}
-        
         cursor.close()
         return_db_connection(connection)
         
@@ -711,6 +1257,7 @@ def get_suspicious_ips():
     except Error as e:
         print(f"Error getting suspicious IPs: {e}")
         if connection:
+            connection.rollback()
             return_db_connection(connection)
         return {}
 
@@ -727,7 +1274,7 @@ def get_activity_logs_grouped(
     per_page=50
 ):
     """Query activity logs grouped by user+IP combination"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return {'groups': [], 'suspicious_ips': {}, 'total': 0, 'page': page, 'per_page': per_page}
     
@@ -844,10 +1391,10 @@ def mask_old_ips(days=90):
                 (STRING_TO_ARRAY(ip_address, '.'))[2], '.',
                 (STRING_TO_ARRAY(ip_address, '.'))[3], '.xxx'
             )
-            WHERE timestamp < CURRENT_TIMESTAMP - INTERVAL '%s days'
+            WHERE timestamp < %s
             AND ip_address LIKE '%%.%%.%%.%%'
             AND ip_address NOT LIKE '%%.xxx'
-        """, (days,))
+        """, (datetime.now() - timedelta(days=days),))
         
         masked_count = cursor.rowcount
         
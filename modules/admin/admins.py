@@ -9,7 +9,7 @@ from ..db_pool import get_db_connection, return_db_connection
 @require_admin
 def list_admins():
     """List all admin accounts"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -51,7 +51,7 @@ def create_admin():
         if not data.get(field):
             return jsonify({'status': 'error', 'message': f'Missing required field: {field}'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
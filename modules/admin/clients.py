@@ -4,88 +4,102 @@ from psycopg2 import Error
 from .blueprint import admin_bp
 from ..auth import require_admin
 from ..db_pool import get_db_connection, return_db_connection
+from ..client_summary import encode_client_cursor, decode_client_cursor, count_client_summary
 
 @admin_bp.route('/api/admin/clients-with-services', methods=['GET'])
 @require_admin
 def get_clients_with_services():
-    """Get all clients with their services grouped - OPTIMIZED VERSION"""
-    connection = get_db_connection()
+    """Get all clients with their services grouped - OPTIMIZED VERSION
+    
+    Pages are read from client_summary newest last visit first. Pass the
+    previous response's pagination.next_cursor as ?cursor= for the next page
+    (page is then only the page number shown); without a cursor, page falls
+    back to OFFSET.
+    """
+    search = request.args.get('search', '').strip()
+    nguoi_chot = request.args.get('nguoi_chot', '').strip()
+    status_filter = request.args.get('status', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', 50, type=int)
+    cursor_value = request.args.get('cursor', '').strip()
+    
+    per_page = min(max(per_page, 1), 100)
+    
+    after = None
+    if cursor_value:
+        try:
+            after = decode_client_cursor(cursor_value)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        search = request.args.get('search', '').strip()
-        nguoi_chot = request.args.get('nguoi_chot', '').strip()
-        status_filter = request.args.get('status', '').strip()
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
-        
-        per_page = min(per_page, 100)
-        offset = (page - 1) * per_page
-        
-        base_where = "WHERE sdt IS NOT NULL AND sdt != ''"
+        conditions = []
         params = []
         
         if search:
-            base_where += " AND (ten_khach ILIKE %s OR sdt ILIKE %s)"
+            # Trigram indexes serve the ILIKEs; the phone key also finds +84 / 0-less forms
+            conditions.append("(ten_khach ILIKE %s OR sdt ILIKE %s OR sdt_norm = phone_key(%s))")
             search_term = f"%{search}%"
-            params.extend([search_term, search_term])
+            params.extend([search_term, search_term, search])
         
         if nguoi_chot:
-            base_where += " AND nguoi_chot = %s"
+            conditions.append("closers @> ARRAY[%s]::TEXT[]")
             params.append(nguoi_chot)
             
         if status_filter == 'deposited':
-            base_where += " AND tien_coc > 0"
+            conditions.append("deposit_count > 0")
         elif status_filter == 'not_deposited':
-            base_where += " AND (tien_coc = 0 OR tien_coc IS NULL)"
+            conditions.append("deposit_count < service_count")
         elif status_filter == 'cskh_potential':
             # CSKH Potential: Customers whose last visit was 360+ days ago
             # These are lapsed customers who could be contacted for follow-up
-            base_where += """ AND sdt IN (
-                SELECT sdt FROM khach_hang
-                WHERE sdt IS NOT NULL AND sdt != ''
-                AND trang_thai IN ('Đã đến làm', 'Da den lam')
+            conditions.append("""sdt IN (
+                SELECT sdt FROM client_summary
                 GROUP BY sdt
-                HAVING MAX(ngay_hen_lam) < CURRENT_DATE - INTERVAL '360 days'
-            )"""
+                HAVING MAX(last_done_visit) < CURRENT_DATE - INTERVAL '360 days'
+            )""")
+        
+        base_where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
         
-        # Query with regular sorting by date
-        client_query = f"""
+        page_conditions = list(conditions)
+        page_params = list(params)
+        offset = 0
+        if after:
+            page_conditions.append("(last_visit_date, sdt, ten_khach) < (%s, %s, %s)")
+            page_params.extend(after)
+        else:
+            offset = (page - 1) * per_page
+        page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+        
+        # Walks idx_client_summary_recent backwards; one extra row tells if there is a next page
+        cursor.execute(f"""
             SELECT 
                 sdt,
                 ten_khach,
-                MIN(co_so) as co_so,
-                MIN(ngay_nhap_don) as first_visit_date,
-                MAX(ngay_nhap_don) as last_visit_date,
-                MIN(nguoi_chot) as nguoi_chot,
-                COUNT(*) as service_count
-            FROM khach_hang
-            {base_where}
-            GROUP BY sdt, ten_khach
-            ORDER BY 
-                MAX(ngay_nhap_don) DESC
+                co_so,
+                first_visit_date,
+                last_visit_date,
+                nguoi_chot,
+                service_count
+            FROM client_summary
+            {page_where}
+            ORDER BY last_visit_date DESC, sdt DESC, ten_khach DESC
             LIMIT %s OFFSET %s
-        """
-        
-        cursor.execute(client_query, params + [per_page, offset])
+        """, page_params + [per_page + 1, offset])
         clients_raw = [dict(row) for row in cursor.fetchall()]
         
-        if not clients_raw:
-            cursor.close()
-            return_db_connection(connection)
-            return jsonify({
-                'status': 'success',
-                'clients': [],
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': 0,
-                    'total_pages': 0
-                }
-            })
+        has_more = len(clients_raw) > per_page
+        clients_raw = clients_raw[:per_page]
+        next_cursor = None
+        if has_more:
+            last = clients_raw[-1]
+            next_cursor = encode_client_cursor(last['last_visit_date'], last['sdt'], last['ten_khach'])
         
         clients_dict = {}
         client_keys = []
@@ -113,7 +127,7 @@ def get_clients_with_services():
             or_conditions = []
             flat_keys = []
             for sdt, ten_khach in client_keys:
-                or_conditions.append('(sdt = %s AND ten_khach = %s)')
+                or_conditions.append("(sdt = %s AND COALESCE(ten_khach, '') = %s)")
                 flat_keys.extend([sdt, ten_khach])
             
             services_query = f"""
@@ -121,7 +135,7 @@ def get_clients_with_services():
                     SELECT 
                         id,
                         sdt,
-                        ten_khach,
+                        COALESCE(ten_khach, '') as ten_khach,
                         dich_vu,
                         tong_tien,
                         tien_coc,
@@ -132,9 +146,9 @@ def get_clients_with_services():
                         nguoi_chot,
                         source,
                         ROW_NUMBER() OVER (
-                            PARTITION BY sdt, ten_khach 
+                            PARTITION BY sdt, COALESCE(ten_khach, '') 
                             ORDER BY 
-                                ngay_nhap_don DESC
+                                ngay_nhap_don DESC, id DESC
                         ) as rn
                     FROM khach_hang
                     WHERE {' OR '.join(or_conditions)}
@@ -176,20 +190,15 @@ def get_clients_with_services():
                     clients_dict[key]['overall_status'] = svc['trang_thai'] or ''
                     clients_dict[key]['overall_deposit'] = deposit_status
         
-        if len(clients_raw) < per_page:
-            total = offset + len(clients_raw)
-            total_pages = page
+        if not has_more:
+            # Last page: everything before it was full
+            total = (page - 1) * per_page + len(clients_raw)
+            total_is_estimate = after is not None
         else:
-            count_query = f"""
-                SELECT COUNT(*) as total FROM (
-                    SELECT 1 FROM khach_hang
-                    {base_where}
-                    GROUP BY sdt, ten_khach
-                ) as grouped_clients
-            """
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()['total']
-            total_pages = (total + per_page - 1) // per_page
+            total, total_is_estimate = count_client_summary(cursor, base_where, params)
+            # Statistics can lag behind the pages actually seen
+            total = max(total, page * per_page + 1)
+        total_pages = (total + per_page - 1) // per_page
         
         clients = sorted(clients_dict.values(), key=lambda x: x.pop('_order'))
         
@@ -203,7 +212,10 @@ def get_clients_with_services():
                 'page': page,
                 'per_page': per_page,
                 'total': total,
-                'total_pages': total_pages
+                'total_pages': total_pages,
+                'total_is_estimate': total_is_estimate,
+                'has_more': has_more,
+                'next_cursor': next_cursor
             }
         })
         
@@ -221,7 +233,7 @@ def get_clients_with_services():
 @require_admin
 def get_client_commission_report():
     """Get commission breakdown for a specific client"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -1,3 +1,4 @@
+import datetime
 from flask import jsonify, request, g
 from psycopg2.extras import RealDictCursor
 from psycopg2 import Error
@@ -8,16 +9,19 @@ from ..mlm_core import (
     recalculate_all_commissions,
     calculate_new_commissions_fast,
     get_commission_cache_status,
-    remove_commissions_for_levels
+    remove_commissions_for_levels,
+    month_date_range,
+    build_rollup_date_condition
 )
 from ..redis_cache import invalidate_commission_cache, invalidate_all_hierarchies
+from ..dashboard_cache import invalidate_all_dashboards
 from ..activity_logger import log_commission_adjusted
 
 @admin_bp.route('/api/admin/commission-settings', methods=['GET'])
 @require_admin
 def get_settings():
     """Get all commission rate settings"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -65,7 +69,7 @@ def update_settings():
     if not data or 'settings' not in data:
         return jsonify({'status': 'error', 'message': 'Settings array required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -138,6 +142,7 @@ def update_settings():
         # Invalidate caches to ensure new rates and active levels are used
         invalidate_commission_cache()
         invalidate_all_hierarchies()  # Hierarchy trees depend on active levels
+        invalidate_all_dashboards()   # CTV dashboards read rates and active levels
         
         # Step 3: Execute the appropriate action based on what changed
         result_message = 'Commission settings updated'
@@ -179,7 +184,7 @@ def update_settings():
 @require_admin
 def list_commissions():
     """Get all commission records with filtering"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -280,7 +285,7 @@ def list_commissions():
 @require_admin
 def list_commissions_summary():
     """Get commission summary grouped by CTV, including services even if no commissions"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -291,164 +296,51 @@ def list_commissions_summary():
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
         
-        # Build date conditions and parameters for different tables
-        comm_params = []
-        kh_params = []
-        svc_params = []
-        
-        if month:
-            comm_where = """(
-                (c.transaction_id < 0 AND TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = %s)
-                OR
-                (c.transaction_id > 0 AND TO_CHAR(s.date_entered, 'YYYY-MM') = %s)
-            )"""
-            comm_params.extend([month, month])
-            kh_where = "TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = %s"
-            kh_params.append(month)
-            svc_where = "TO_CHAR(s.date_entered, 'YYYY-MM') = %s"
-            svc_params.append(month)
-        elif date_from and date_to:
-            comm_where = """(
-                (c.transaction_id < 0 AND DATE(kh.ngay_hen_lam) >= %s AND DATE(kh.ngay_hen_lam) <= %s)
-                OR
-                (c.transaction_id > 0 AND DATE(s.date_entered) >= %s AND DATE(s.date_entered) <= %s)
-            )"""
-            comm_params.extend([date_from, date_to, date_from, date_to])
-            kh_where = "DATE(kh.ngay_hen_lam) >= %s AND DATE(kh.ngay_hen_lam) <= %s"
-            kh_params.extend([date_from, date_to])
-            svc_where = "DATE(s.date_entered) >= %s AND DATE(s.date_entered) <= %s"
-            svc_params.extend([date_from, date_to])
-        elif date_from:
-            comm_where = """(
-                (c.transaction_id < 0 AND DATE(kh.ngay_hen_lam) >= %s)
-                OR
-                (c.transaction_id > 0 AND DATE(s.date_entered) >= %s)
-            )"""
-            comm_params.extend([date_from, date_from])
-            kh_where = "DATE(kh.ngay_hen_lam) >= %s"
-            kh_params.append(date_from)
-            svc_where = "DATE(s.date_entered) >= %s"
-            svc_params.append(date_from)
-        elif date_to:
-            comm_where = """(
-                (c.transaction_id < 0 AND DATE(kh.ngay_hen_lam) <= %s)
-                OR
-                (c.transaction_id > 0 AND DATE(s.date_entered) <= %s)
-            )"""
-            comm_params.extend([date_to, date_to])
-            kh_where = "DATE(kh.ngay_hen_lam) <= %s"
-            kh_params.append(date_to)
-            svc_where = "DATE(s.date_entered) <= %s"
-            svc_params.append(date_to)
-        else:
-            comm_where = """(
-                (c.transaction_id < 0 AND TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM'))
-                OR
-                (c.transaction_id > 0 AND TO_CHAR(s.date_entered, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM'))
-            )"""
-            kh_where = "TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-            svc_where = "TO_CHAR(s.date_entered, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
+        # Resolve the filter to a day range on the rollup (default: current month)
+        try:
+            if month:
+                date_from, date_to = month_date_range(month)
+            elif not date_from and not date_to:
+                date_from, date_to = month_date_range(datetime.date.today().strftime('%Y-%m'))
+        except ValueError:
+            cursor.close()
+            return_db_connection(connection)
+            return jsonify({'status': 'error', 'message': 'Invalid month format'}), 400
         
-        # Get commissions data
-        comm_query = """
-            SELECT
-                c.ctv_code,
-                SUM(c.transaction_amount) as total_service_price,
-                SUM(c.commission_amount) as total_commission,
-                COUNT(*) as commission_count
-            FROM commissions c
-            LEFT JOIN khach_hang kh ON c.transaction_id = -ABS(kh.id)
-            LEFT JOIN services s ON c.transaction_id = s.id AND c.transaction_id > 0
-            WHERE """ + comm_where + """
-            GROUP BY c.ctv_code
-        """
-        cursor.execute(comm_query, comm_params)
-        commissions_data = {row['ctv_code']: row for row in cursor.fetchall()}
+        params = []
+        day_condition = build_rollup_date_condition('r.day', date_from, date_to, params)
         
-        # Get services from khach_hang table
-        # Use phone normalization to handle leading zero variations (972020881 vs 0972020881)
-        kh_query = """
+        # Commissions (all levels) and personal sales (level 0) per CTV, from the daily rollup.
+        # Personal sales are matched on normalized keys (972020881 vs 0972020881)
+        cursor.execute("""
             SELECT
-                c.ma_ctv as ctv_code,
-                COUNT(*) as service_count,
-                SUM(kh.tong_tien) as total_revenue
-            FROM khach_hang kh
-            JOIN ctv c ON (
-                LOWER(kh.nguoi_chot) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
-            WHERE kh.nguoi_chot IS NOT NULL
-            AND kh.nguoi_chot != ''
-            AND (kh.trang_thai = 'Đã đến làm' OR kh.trang_thai = 'Da den lam')
-            AND """ + kh_where + """
-            GROUP BY c.ma_ctv
-        """
-        cursor.execute(kh_query, kh_params)
-        kh_services = {row['ctv_code']: row for row in cursor.fetchall()}
-        
-        # Get services from services table
-        # Use phone normalization to handle leading zero variations (972020881 vs 0972020881)
-        svc_query = """
-            SELECT 
-                c.ma_ctv as ctv_code,
-                COUNT(*) as service_count,
-                SUM(s.tong_tien) as total_revenue
-            FROM services s
-            JOIN ctv c ON (
-                LOWER(COALESCE(s.nguoi_chot, s.ctv_code)) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
-            WHERE COALESCE(s.nguoi_chot, s.ctv_code) IS NOT NULL 
-            AND COALESCE(s.nguoi_chot, s.ctv_code) != ''
-            AND """ + svc_where + """
-            GROUP BY c.ma_ctv
-        """
-        cursor.execute(svc_query, svc_params)
-        svc_services = {row['ctv_code']: row for row in cursor.fetchall()}
-        
-        # FAST: Calculate only new commissions using cached max IDs
-        # fast_stats = calculate_new_commissions_fast(connection=connection)
-        
-        # if fast_stats.get('total', 0) > 0:
-        #     cursor.execute(comm_query, comm_params)
-        #     commissions_data = {row['ctv_code']: row for row in cursor.fetchall()}
-        
-        all_ctv_codes = set()
-        all_ctv_codes.update(commissions_data.keys())
-        all_ctv_codes.update(kh_services.keys())
-        all_ctv_codes.update(svc_services.keys())
+                r.ctv_code,
+                ctv.ten,
+                ctv.sdt,
+                COALESCE(SUM(r.commission), 0) as total_commission,
+                COALESCE(SUM(CASE WHEN r.level = 0 THEN r.tx_count ELSE 0 END), 0) as service_count,
+                COALESCE(SUM(CASE WHEN r.level = 0 THEN r.revenue ELSE 0 END), 0) as total_revenue
+            FROM ctv_daily_rollup r
+            JOIN ctv ON ctv.ma_ctv = r.ctv_code
+            WHERE """ + day_condition + """
+            GROUP BY r.ctv_code, ctv.ten, ctv.sdt
+        """, params)
         
         summary = []
         total_service_count = 0
         total_service_revenue = 0
         
-        for ctv_code in all_ctv_codes:
-            cursor.execute("SELECT ma_ctv, ten, sdt FROM ctv WHERE ma_ctv = %s", (ctv_code,))
-            ctv_info = cursor.fetchone()
-            if not ctv_info:
-                continue
-            
-            comm_data = commissions_data.get(ctv_code, {})
-            comm_total = float(comm_data.get('total_commission', 0) or 0)
-            comm_service_price = float(comm_data.get('total_service_price', 0) or 0)
-            
-            kh_data = kh_services.get(ctv_code, {})
-            kh_count = int(kh_data.get('service_count', 0) or 0)
-            kh_revenue = float(kh_data.get('total_revenue', 0) or 0)
-            
-            svc_data = svc_services.get(ctv_code, {})
-            svc_count = int(svc_data.get('service_count', 0) or 0)
-            svc_revenue = float(svc_data.get('total_revenue', 0) or 0)
-            
-            total_services = kh_count + svc_count
-            total_revenue = kh_revenue + svc_revenue
+        for row in cursor.fetchall():
+            comm_total = float(row['total_commission'] or 0)
+            total_services = int(row['service_count'] or 0)
+            total_revenue = float(row['total_revenue'] or 0)
             
             service_price = total_revenue  # Use personal sales only (Doanh số cá nhân)
             
             summary.append({
-                'ctv_code': ctv_code,
-                'ctv_name': ctv_info['ten'],
-                'ctv_phone': ctv_info['sdt'],
+                'ctv_code': row['ctv_code'],
+                'ctv_name': row['ten'],
+                'ctv_phone': row['sdt'],
                 'total_service_price': service_price,
                 'total_commission': comm_total,
                 'service_count': total_services,
@@ -507,7 +399,7 @@ def adjust_commission(commission_id):
     if not data or 'commission_amount' not in data:
         return jsonify({'status': 'error', 'message': 'commission_amount required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
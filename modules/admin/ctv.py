@@ -1,17 +1,27 @@
+from datetime import datetime
 from flask import jsonify, request, g
 from psycopg2.extras import RealDictCursor
 from psycopg2 import Error
 from .blueprint import admin_bp
 from ..auth import require_admin, hash_password
+from ..session_cache import invalidate_user
 from ..db_pool import get_db_connection, return_db_connection
-from ..mlm_core import get_total_downline, build_hierarchy_tree
+from ..mlm_core import get_downline_counts, build_hierarchy_tree, graph_set_parent, graph_remove_ctv
 from ..activity_logger import log_ctv_created, log_ctv_updated, log_ctv_deleted
 
+# Sort keys accepted by list_ctv (?sort=...)
+CTV_SORT_KEYS = {
+    'created_at': lambda ctv: ctv['created_at'] or datetime.min,
+    'downline': lambda ctv: ctv['total_downline'],
+    'ma_ctv': lambda ctv: (ctv['ma_ctv'] or '').lower(),
+    'ten': lambda ctv: (ctv['ten'] or '').lower(),
+}
+
 @admin_bp.route('/api/admin/ctv/levels', methods=['GET'])
 @require_admin
 def get_ctv_levels():
     """Get all distinct CTV levels"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -48,8 +58,13 @@ def get_ctv_levels():
 @admin_bp.route('/api/admin/ctv', methods=['GET'])
 @require_admin
 def list_ctv():
-    """List all CTVs with hierarchy info"""
-    connection = get_db_connection()
+    """
+    List CTVs with hierarchy info
+
+    Query params: search, active_only, sort (created_at | downline | ma_ctv | ten),
+    order (asc | desc), page, per_page. Without page the whole list is returned.
+    """
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -58,6 +73,13 @@ def list_ctv():
         
         search = request.args.get('search', '').strip()
         active_only = request.args.get('active_only', 'false').lower() == 'true'
+        sort = request.args.get('sort', 'created_at')
+        descending = request.args.get('order', 'desc').lower() != 'asc'
+        page = request.args.get('page', type=int)
+        per_page = request.args.get('per_page', 50, type=int)
+        
+        if sort not in CTV_SORT_KEYS:
+            sort = 'created_at'
         
         query = """
             SELECT 
@@ -90,21 +112,42 @@ def list_ctv():
         cursor.execute(query, params)
         ctv_list = [dict(row) for row in cursor.fetchall()]
         
-        # Add total downline count for each CTV
+        # Downline counts of every CTV in one pass over the referral forest
+        downline_counts = get_downline_counts(connection)
+        for ctv in ctv_list:
+            ctv['total_downline'] = downline_counts.get(ctv['ma_ctv'], 0)
+        
+        # Stable sort: ties keep the newest-first order from the query
+        if sort != 'created_at' or not descending:
+            ctv_list.sort(key=CTV_SORT_KEYS[sort], reverse=descending)
+        
+        total = len(ctv_list)
+        if page is not None:
+            page = max(page, 1)
+            per_page = min(max(per_page, 1), 500)
+            offset = (page - 1) * per_page
+            ctv_list = ctv_list[offset:offset + per_page]
+        
         for ctv in ctv_list:
             if ctv.get('created_at'):
                 ctv['created_at'] = ctv['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-            # Calculate total downline below this CTV
-            ctv['total_downline'] = get_total_downline(ctv['ma_ctv'], connection)
         
         cursor.close()
         return_db_connection(connection)
         
-        return jsonify({
+        response = {
             'status': 'success',
             'data': ctv_list,
-            'total': len(ctv_list)
-        })
+            'total': total
+        }
+        if page is not None:
+            response['pagination'] = {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'total_pages': (total + per_page - 1) // per_page
+            }
+        return jsonify(response)
         
     except Error as e:
         if connection:
@@ -126,7 +169,7 @@ def create_ctv():
         if not data.get(field):
             return jsonify({'status': 'error', 'message': f'Missing required field: {field}'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -166,6 +209,8 @@ def create_ctv():
         cursor.close()
         return_db_connection(connection)
         
+        graph_set_parent(data['ma_ctv'], nguoi_gioi_thieu)
+        
         admin_username = g.current_user.get('username', 'admin')
         log_ctv_created(admin_username, data['ma_ctv'], data['ten'])
         
@@ -187,7 +232,7 @@ def create_ctv():
 @require_admin
 def generate_ctv_code():
     """Generate a unique CTV code"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -234,7 +279,7 @@ def update_ctv(ctv_code):
     if not data:
         return jsonify({'status': 'error', 'message': 'Request body required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -275,6 +320,10 @@ def update_ctv(ctv_code):
         cursor.close()
         return_db_connection(connection)
         
+        if 'nguoi_gioi_thieu' in data:
+            graph_set_parent(ctv_code, data['nguoi_gioi_thieu'])
+        invalidate_user('ctv', ctv_code)
+        
         admin_username = g.current_user.get('username', 'admin')
         changes = {field: data[field] for field in allowed_fields if field in data}
         if data.get('password'):
@@ -297,7 +346,7 @@ def update_ctv(ctv_code):
 @require_admin
 def deactivate_ctv(ctv_code):
     """Deactivate CTV (soft delete)"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -315,6 +364,8 @@ def deactivate_ctv(ctv_code):
         cursor.close()
         return_db_connection(connection)
         
+        invalidate_user('ctv', ctv_code)
+        
         admin_username = g.current_user.get('username', 'admin')
         log_ctv_deleted(admin_username, ctv_code)
         
@@ -334,7 +385,7 @@ def deactivate_ctv(ctv_code):
 @require_admin
 def hard_delete_ctv(ctv_code):
     """Permanently delete a CTV from the database"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -354,8 +405,10 @@ def hard_delete_ctv(ctv_code):
         cursor.execute("""
             UPDATE ctv SET nguoi_gioi_thieu = NULL 
             WHERE nguoi_gioi_thieu = %s
+            RETURNING ma_ctv
         """, (ctv_code,))
-        updated_referrals = cursor.rowcount
+        referred_codes = [row['ma_ctv'] for row in cursor.fetchall()]
+        updated_referrals = len(referred_codes)
         
         # Delete related commissions
         cursor.execute("DELETE FROM commissions WHERE ctv_code = %s", (ctv_code,))
@@ -368,6 +421,10 @@ def hard_delete_ctv(ctv_code):
         cursor.close()
         return_db_connection(connection)
         
+        graph_remove_ctv(ctv_code)
+        for code in [ctv_code] + referred_codes:
+            invalidate_user('ctv', code)
+        
         admin_username = g.current_user.get('username', 'admin')
         log_ctv_deleted(admin_username, ctv_code)
         
@@ -389,7 +446,7 @@ def hard_delete_ctv(ctv_code):
 @require_admin
 def delete_non_numeric_ctv():
     """Delete all CTVs with non-numeric codes"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -419,7 +476,9 @@ def delete_non_numeric_ctv():
         cursor.execute("""
             UPDATE ctv SET nguoi_gioi_thieu = NULL 
             WHERE nguoi_gioi_thieu = ANY(%s)
+            RETURNING ma_ctv
         """, (codes_to_delete,))
+        referred_codes = [row['ma_ctv'] for row in cursor.fetchall()]
         
         # Delete related commissions
         cursor.execute("""
@@ -436,6 +495,11 @@ def delete_non_numeric_ctv():
         cursor.close()
         return_db_connection(connection)
         
+        for code in codes_to_delete:
+            graph_remove_ctv(code)
+        for code in codes_to_delete + referred_codes:
+            invalidate_user('ctv', code)
+        
         admin_username = g.current_user.get('username', 'admin')
         for ctv in non_numeric_ctvs:
             log_ctv_deleted(admin_username, ctv['ma_ctv'])
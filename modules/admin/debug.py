@@ -20,7 +20,7 @@ def debug_commission_page():
 # @require_admin  # TEMPORARY: Removed for debugging
 def get_full_hierarchy():
     """Get complete CTV hierarchy tree with all data"""
-    conn = get_db_connection()
+    conn = get_db_connection(shared=True)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
@@ -123,7 +123,7 @@ def get_ctv_detail(ctv_code):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    conn = get_db_connection()
+    conn = get_db_connection(shared=True)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
@@ -140,18 +140,11 @@ def get_ctv_detail(ctv_code):
         
         # Get the entire downline hierarchy (including the selected CTV at level 0)
         cursor.execute("""
-            WITH RECURSIVE network AS (
-                SELECT ma_ctv, ten, nguoi_gioi_thieu, 0 as level
-                FROM ctv WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, c.ten, c.nguoi_gioi_thieu, n.level + 1
-                FROM ctv c
-                JOIN network n ON c.nguoi_gioi_thieu = n.ma_ctv
-                WHERE n.level < 4
-            )
-            SELECT * FROM network ORDER BY level, ma_ctv
+            SELECT c.ma_ctv, c.ten, c.nguoi_gioi_thieu, cl.depth as level
+            FROM ctv_closure cl
+            JOIN ctv c ON c.ma_ctv = cl.descendant
+            WHERE cl.ancestor = %s AND cl.depth <= 4
+            ORDER BY level, ma_ctv
         """, (ctv_code,))
         network_ctvs = cursor.fetchall()
         
@@ -205,20 +198,12 @@ def get_ctv_detail(ctv_code):
                     'tham_my' as source_type
                 FROM khach_hang kh
                 JOIN (
-                    WITH RECURSIVE net AS (
-                        SELECT ma_ctv, 0 as level FROM ctv WHERE ma_ctv = %s
-                        UNION ALL
-                        SELECT c.ma_ctv, n.level + 1 FROM ctv c JOIN net n ON c.nguoi_gioi_thieu = n.ma_ctv WHERE n.level < 4
-                    )
-                    SELECT * FROM net
-                ) network ON (
-                    kh.nguoi_chot = network.ma_ctv
-                    OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(network.ma_ctv, '[^0-9]', '', 'g'), 9)
-                )
-                LEFT JOIN ctv ON (
-                    ctv.ma_ctv = kh.nguoi_chot
-                    OR RIGHT(REGEXP_REPLACE(ctv.ma_ctv, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9)
-                )
+                    SELECT d.ma_ctv_norm, cl.depth as level
+                    FROM ctv_closure cl
+                    JOIN ctv d ON d.ma_ctv = cl.descendant
+                    WHERE cl.ancestor = %s AND cl.depth <= 4
+                ) network ON kh.nguoi_chot_norm = network.ma_ctv_norm
+                LEFT JOIN ctv ON ctv.ma_ctv_norm = kh.nguoi_chot_norm
                 WHERE (kh.trang_thai = 'Đã đến làm' OR kh.trang_thai = 'Da den lam')
                 {date_filter_kh}
                 
@@ -238,27 +223,19 @@ def get_ctv_detail(ctv_code):
                 FROM services s
                 LEFT JOIN customers c ON s.customer_id = c.id
                 JOIN (
-                    WITH RECURSIVE net AS (
-                        SELECT ma_ctv, 0 as level FROM ctv WHERE ma_ctv = %s
-                        UNION ALL
-                        SELECT c.ma_ctv, n.level + 1 FROM ctv c JOIN net n ON c.nguoi_gioi_thieu = n.ma_ctv WHERE n.level < 4
-                    )
-                    SELECT * FROM net
-                ) network ON (
-                    COALESCE(s.nguoi_chot, s.ctv_code) = network.ma_ctv
-                    OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(network.ma_ctv, '[^0-9]', '', 'g'), 9)
-                )
-                LEFT JOIN ctv ON (
-                    ctv.ma_ctv = COALESCE(s.nguoi_chot, s.ctv_code)
-                    OR RIGHT(REGEXP_REPLACE(ctv.ma_ctv, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9)
-                )
+                    SELECT d.ma_ctv_norm, cl.depth as level
+                    FROM ctv_closure cl
+                    JOIN ctv d ON d.ma_ctv = cl.descendant
+                    WHERE cl.ancestor = %s AND cl.depth <= 4
+                ) network ON s.nguoi_chot_norm = network.ma_ctv_norm
+                LEFT JOIN ctv ON ctv.ma_ctv_norm = s.nguoi_chot_norm
                 WHERE 1=1
                 {date_filter_svc}
             ) AS all_transactions
             ORDER BY closer_level, nguoi_chot, transaction_date DESC
         """
         
-        # Build params: ctv_code for first CTE, date params, ctv_code for second CTE, date params
+        # Build params: ctv_code for first network join, date params, ctv_code for second, date params
         query_params = [ctv_code] + date_params + [ctv_code] + date_params
         
         cursor.execute(query, tuple(query_params))
@@ -391,7 +368,7 @@ def get_ctv_detail(ctv_code):
 # @require_admin  # TEMPORARY: Removed for debugging
 def get_raw_data():
     """Get raw database dump grouped by CTV for easy comparison"""
-    conn = get_db_connection()
+    conn = get_db_connection(shared=True)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
@@ -410,10 +387,7 @@ def get_raw_data():
                 kh.nguoi_chot,
                 ctv.ten as ctv_name
             FROM khach_hang kh
-            LEFT JOIN ctv ON (
-                ctv.ma_ctv = kh.nguoi_chot
-                OR RIGHT(REGEXP_REPLACE(ctv.ma_ctv, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9)
-            )
+            LEFT JOIN ctv ON ctv.ma_ctv_norm = kh.nguoi_chot_norm
             ORDER BY kh.nguoi_chot, kh.ten_khach, kh.id
         """)
         clients = cursor.fetchall()
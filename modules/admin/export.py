@@ -1,12 +1,20 @@
-from flask import jsonify, request, g
-from psycopg2.extras import RealDictCursor
+from datetime import datetime
+from flask import jsonify, request, g, send_file
 from psycopg2 import Error
 from .blueprint import admin_bp
 from ..auth import require_admin
 from ..db_pool import get_db_connection, return_db_connection
-from ..activity_logger import get_activity_logs, log_data_export
+from ..activity_logger import build_activity_log_filters, log_data_export
+from ..export_jobs import (
+    register_export_type,
+    submit_export_job,
+    get_export_job,
+    list_export_jobs,
+    get_export_file
+)
 from ..export_excel import (
-    create_xlsx_response,
+    iter_query_rows,
+    create_export_response,
     CTV_EXPORT_COLUMNS,
     COMMISSION_EXPORT_COLUMNS,
     COMMISSION_SUMMARY_COLUMNS,
@@ -15,17 +23,220 @@ from ..export_excel import (
     COMMISSION_SETTINGS_COLUMNS
 )
 
+
+def _export_format():
+    """'csv' when ?format=csv is given, otherwise 'xlsx'"""
+    return 'csv' if request.args.get('format', '').lower() == 'csv' else 'xlsx'
+
+
+def _stream_export(connection, export, export_type):
+    """
+    DOES: Stream a query result as XLSX/CSV and log the export once it finished
+    INPUTS: connection (released when the stream ends), export dict
+            {'query', 'params', 'columns', 'filename', 'sheet_name', 'transform'},
+            export type for the activity log
+    OUTPUTS: Flask Response (raises psycopg2.Error if the query fails)
+    """
+    rows = iter_query_rows(connection, export['query'], export['params'],
+                           transform=export.get('transform'), release_connection=True)
+    admin_username = g.current_user.get('username', 'admin')
+
+    return create_export_response(
+        rows,
+        export['columns'],
+        export['filename'],
+        sheet_name=export['sheet_name'],
+        export_format=_export_format(),
+        on_complete=lambda count: log_data_export('admin', admin_username, export_type, count)
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# EXPORT QUERIES (shared by the download endpoints and the export jobs)
+# ══════════════════════════════════════════════════════════════════════════════
+
+COMMISSION_EXPORT_PARAMS = ('ctv_code', 'month', 'level')
+CLIENT_EXPORT_PARAMS = ('search', 'nguoi_chot')
+ACTIVITY_LOG_EXPORT_PARAMS = ('event_type', 'user_type', 'user_id', 'ip_address', 'date_from', 'date_to', 'search')
+
+
+def build_commission_export(args):
+    """
+    DOES: Commission records export, filtered by ctv_code, month (YYYY-MM), level
+    INPUTS: args - request.args or a dict of the same parameters
+    OUTPUTS: Export dict for _stream_export / export jobs
+    """
+    ctv_code = args.get('ctv_code')
+    month = args.get('month')
+    level = args.get('level')
+
+    query = """
+        SELECT
+            c.id,
+            c.transaction_id,
+            c.ctv_code,
+            ctv.ten as ctv_name,
+            c.level,
+            c.commission_rate,
+            c.transaction_amount,
+            c.commission_amount,
+            TO_CHAR(c.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
+        FROM commissions c
+        JOIN ctv ON c.ctv_code = ctv.ma_ctv
+        WHERE 1=1
+    """
+    params = []
+
+    if ctv_code:
+        query += " AND c.ctv_code = %s"
+        params.append(ctv_code)
+
+    if month:
+        query += " AND TO_CHAR(c.created_at, 'YYYY-MM') = %s"
+        params.append(month)
+
+    if level is not None:
+        query += " AND c.level = %s"
+        params.append(int(level))
+
+    query += " ORDER BY c.created_at DESC"
+
+    return {
+        'query': query,
+        'params': params,
+        'columns': COMMISSION_EXPORT_COLUMNS,
+        'filename': 'commissions_export',
+        'sheet_name': 'Commissions'
+    }
+
+
+def build_client_export(args):
+    """
+    DOES: Clients export (one row per phone + name), filtered by search, nguoi_chot
+    INPUTS: args - request.args or a dict of the same parameters
+    OUTPUTS: Export dict for _stream_export / export jobs
+    """
+    search = (args.get('search') or '').strip()
+    nguoi_chot = (args.get('nguoi_chot') or '').strip()
+
+    base_where = "WHERE sdt IS NOT NULL AND sdt != ''"
+    params = []
+
+    if search:
+        base_where += " AND (ten_khach ILIKE %s OR sdt ILIKE %s)"
+        search_term = f"%{search}%"
+        params.extend([search_term, search_term])
+
+    if nguoi_chot:
+        base_where += " AND nguoi_chot = %s"
+        params.append(nguoi_chot)
+
+    query = f"""
+        SELECT
+            sdt,
+            ten_khach,
+            MIN(co_so) as co_so,
+            MIN(nguoi_chot) as nguoi_chot,
+            COUNT(*) as service_count,
+            TO_CHAR(MIN(ngay_nhap_don), 'DD/MM/YYYY') as first_visit_date,
+            MAX(trang_thai) as overall_status,
+            CASE WHEN MAX(tien_coc) > 0 THEN 'Da coc' ELSE 'Chua coc' END as overall_deposit
+        FROM khach_hang
+        {base_where}
+        GROUP BY sdt, ten_khach
+        ORDER BY MAX(ngay_nhap_don) DESC
+    """
+
+    return {
+        'query': query,
+        'params': params,
+        'columns': CLIENTS_EXPORT_COLUMNS,
+        'filename': 'clients_export',
+        'sheet_name': 'Clients'
+    }
+
+
+def format_activity_log_row(log):
+    """Details as text, the way the log exports have always shown them"""
+    if log.get('details'):
+        log['details'] = str(log['details'])
+    return log
+
+
+def build_activity_log_export(args):
+    """
+    DOES: Activity logs export, filtered like the activity log list
+    INPUTS: args - request.args or a dict of the same parameters
+    OUTPUTS: Export dict for _stream_export / export jobs
+    """
+    search = (args.get('search') or '').strip()
+    where, params = build_activity_log_filters(
+        event_type=args.get('event_type'),
+        user_type=args.get('user_type'),
+        user_id=args.get('user_id'),
+        ip_address=args.get('ip_address'),
+        date_from=args.get('date_from'),
+        date_to=args.get('date_to'),
+        search=search if search else None
+    )
+    query = f"""
+        SELECT
+            l.id,
+            TO_CHAR(l.timestamp, 'YYYY-MM-DD HH24:MI:SS') as timestamp,
+            l.event_type,
+            l.user_type,
+            l.user_id,
+            l.ip_address,
+            l.endpoint,
+            l.method,
+            l.status_code,
+            l.details
+        FROM activity_logs l
+        {where}
+        ORDER BY l.timestamp DESC
+    """
+
+    return {
+        'query': query,
+        'params': params,
+        'columns': ACTIVITY_LOG_COLUMNS,
+        'filename': 'activity_logs_export',
+        'sheet_name': 'Activity Logs',
+        'transform': format_activity_log_row
+    }
+
+
+def activity_log_data_version(cursor, params):
+    """
+    DOES: Version part for log inserts, which the table counters leave out
+          (count_inserts=False): the id range. The newest id is left out when
+          date_to is a past day, as new rows cannot fall in that range.
+    """
+    cursor.execute("SELECT MIN(id) as min_id, MAX(id) as max_id FROM activity_logs")
+    row = cursor.fetchone()
+    date_to = params.get('date_to')
+    if date_to and date_to[:10] < datetime.now().strftime('%Y-%m-%d'):
+        return f"{row['min_id']}"
+    return f"{row['min_id']}:{row['max_id']}"
+
+
+register_export_type('commissions', build_commission_export, COMMISSION_EXPORT_PARAMS,
+                     tables=('commissions', 'ctv'))
+register_export_type('clients', build_client_export, CLIENT_EXPORT_PARAMS,
+                     tables=('khach_hang',))
+register_export_type('activity_logs', build_activity_log_export, ACTIVITY_LOG_EXPORT_PARAMS,
+                     tables=('activity_logs',), version=activity_log_data_version, count_inserts=False)
+
+
 @admin_bp.route('/api/admin/ctv/export', methods=['GET'])
 @require_admin
 def export_ctv_excel():
     """Export all CTVs to Excel file"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
         search = request.args.get('search', '').strip()
         active_only = request.args.get('active_only', 'false').lower() == 'true'
         
@@ -39,7 +250,7 @@ def export_ctv_excel():
                 c.nguoi_gioi_thieu as nguoi_gioi_thieu_code,
                 c.cap_bac,
                 CASE WHEN c.is_active = TRUE OR c.is_active IS NULL THEN 'Active' ELSE 'Inactive' END as is_active,
-                c.created_at
+                TO_CHAR(c.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
             FROM ctv c
             LEFT JOIN ctv p ON c.nguoi_gioi_thieu = p.ma_ctv
             WHERE 1=1
@@ -56,25 +267,13 @@ def export_ctv_excel():
         
         query += " ORDER BY c.created_at DESC"
         
-        cursor.execute(query, params)
-        ctv_list = [dict(row) for row in cursor.fetchall()]
-        
-        for ctv in ctv_list:
-            if ctv.get('created_at'):
-                ctv['created_at'] = ctv['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        cursor.close()
-        return_db_connection(connection)
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'ctv_list', len(ctv_list))
-        
-        return create_xlsx_response(
-            data=ctv_list,
-            columns=CTV_EXPORT_COLUMNS,
-            filename='ctv_export',
-            sheet_name='CTV List'
-        )
+        return _stream_export(connection, {
+            'query': query,
+            'params': params,
+            'columns': CTV_EXPORT_COLUMNS,
+            'filename': 'ctv_export',
+            'sheet_name': 'CTV List'
+        }, 'ctv_list')
         
     except Error as e:
         if connection:
@@ -86,70 +285,12 @@ def export_ctv_excel():
 @require_admin
 def export_commissions_excel():
     """Export commission records to Excel file"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        ctv_code = request.args.get('ctv_code')
-        month = request.args.get('month')
-        level = request.args.get('level')
-        
-        query = """
-            SELECT 
-                c.id,
-                c.transaction_id,
-                c.ctv_code,
-                ctv.ten as ctv_name,
-                c.level,
-                c.commission_rate,
-                c.transaction_amount,
-                c.commission_amount,
-                c.created_at
-            FROM commissions c
-            JOIN ctv ON c.ctv_code = ctv.ma_ctv
-            WHERE 1=1
-        """
-        params = []
-        
-        if ctv_code:
-            query += " AND c.ctv_code = %s"
-            params.append(ctv_code)
-        
-        if month:
-            query += " AND TO_CHAR(c.created_at, 'YYYY-MM') = %s"
-            params.append(month)
-        
-        if level is not None:
-            query += " AND c.level = %s"
-            params.append(int(level))
-        
-        query += " ORDER BY c.created_at DESC LIMIT 10000"
-        
-        cursor.execute(query, params)
-        commissions = [dict(row) for row in cursor.fetchall()]
-        
-        for c in commissions:
-            c['commission_rate'] = float(c['commission_rate'])
-            c['transaction_amount'] = float(c['transaction_amount'])
-            c['commission_amount'] = float(c['commission_amount'])
-            if c.get('created_at'):
-                c['created_at'] = c['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        cursor.close()
-        return_db_connection(connection)
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'commissions', len(commissions))
-        
-        return create_xlsx_response(
-            data=commissions,
-            columns=COMMISSION_EXPORT_COLUMNS,
-            filename='commissions_export',
-            sheet_name='Commissions'
-        )
+        return _stream_export(connection, build_commission_export(request.args), 'commissions')
         
     except Error as e:
         if connection:
@@ -161,13 +302,11 @@ def export_commissions_excel():
 @require_admin
 def export_commissions_summary_excel():
     """Export commission summary by CTV to Excel file"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
         month = request.args.get('month')
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
@@ -177,8 +316,8 @@ def export_commissions_summary_excel():
                 c.ctv_code,
                 ctv.ten as ctv_name,
                 ctv.sdt as ctv_phone,
-                SUM(c.transaction_amount) as total_service_price,
-                SUM(c.commission_amount) as total_commission
+                COALESCE(SUM(c.transaction_amount), 0) as total_service_price,
+                COALESCE(SUM(c.commission_amount), 0) as total_commission
             FROM commissions c
             JOIN ctv ON c.ctv_code = ctv.ma_ctv
             WHERE 1=1
@@ -203,25 +342,13 @@ def export_commissions_summary_excel():
             ORDER BY total_commission DESC
         """
         
-        cursor.execute(query, params)
-        summary = [dict(row) for row in cursor.fetchall()]
-        
-        for s in summary:
-            s['total_service_price'] = float(s['total_service_price'] or 0)
-            s['total_commission'] = float(s['total_commission'] or 0)
-        
-        cursor.close()
-        return_db_connection(connection)
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'commission_summary', len(summary))
-        
-        return create_xlsx_response(
-            data=summary,
-            columns=COMMISSION_SUMMARY_COLUMNS,
-            filename='commission_summary_export',
-            sheet_name='Commission Summary'
-        )
+        return _stream_export(connection, {
+            'query': query,
+            'params': params,
+            'columns': COMMISSION_SUMMARY_COLUMNS,
+            'filename': 'commission_summary_export',
+            'sheet_name': 'Commission Summary'
+        }, 'commission_summary')
         
     except Error as e:
         if connection:
@@ -233,64 +360,12 @@ def export_commissions_summary_excel():
 @require_admin
 def export_clients_excel():
     """Export clients with services to Excel file"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        search = request.args.get('search', '').strip()
-        nguoi_chot = request.args.get('nguoi_chot', '').strip()
-        
-        base_where = "WHERE sdt IS NOT NULL AND sdt != ''"
-        params = []
-        
-        if search:
-            base_where += " AND (ten_khach ILIKE %s OR sdt ILIKE %s)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term])
-        
-        if nguoi_chot:
-            base_where += " AND nguoi_chot = %s"
-            params.append(nguoi_chot)
-        
-        query = f"""
-            SELECT 
-                sdt,
-                ten_khach,
-                MIN(co_so) as co_so,
-                MIN(nguoi_chot) as nguoi_chot,
-                COUNT(*) as service_count,
-                MIN(ngay_nhap_don) as first_visit_date,
-                MAX(trang_thai) as overall_status,
-                CASE WHEN MAX(tien_coc) > 0 THEN 'Da coc' ELSE 'Chua coc' END as overall_deposit
-            FROM khach_hang
-            {base_where}
-            GROUP BY sdt, ten_khach
-            ORDER BY MAX(ngay_nhap_don) DESC
-            LIMIT 10000
-        """
-        
-        cursor.execute(query, params)
-        clients = [dict(row) for row in cursor.fetchall()]
-        
-        for client in clients:
-            if client.get('first_visit_date'):
-                client['first_visit_date'] = client['first_visit_date'].strftime('%d/%m/%Y')
-        
-        cursor.close()
-        return_db_connection(connection)
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'clients', len(clients))
-        
-        return create_xlsx_response(
-            data=clients,
-            columns=CLIENTS_EXPORT_COLUMNS,
-            filename='clients_export',
-            sheet_name='Clients'
-        )
+        return _stream_export(connection, build_client_export(request.args), 'clients')
         
     except Error as e:
         if connection:
@@ -302,47 +377,16 @@ def export_clients_excel():
 @require_admin
 def export_activity_logs_excel():
     """Export activity logs to Excel file"""
+    connection = get_db_connection(shared=True)
+    if not connection:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    
     try:
-        event_type = request.args.get('event_type')
-        user_type = request.args.get('user_type')
-        user_id = request.args.get('user_id')
-        ip_address = request.args.get('ip_address')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        search = request.args.get('search', '').strip()
-        
-        result = get_activity_logs(
-            event_type=event_type,
-            user_type=user_type,
-            user_id=user_id,
-            ip_address=ip_address,
-            date_from=date_from,
-            date_to=date_to,
-            search=search if search else None,
-            page=1,
-            per_page=10000
-        )
-        
-        logs = result['logs']
-        
-        for log in logs:
-            if log.get('details'):
-                if isinstance(log['details'], dict):
-                    log['details'] = str(log['details'])
-                else:
-                    log['details'] = str(log['details'])
+        return _stream_export(connection, build_activity_log_export(request.args), 'activity_logs')
         
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'activity_logs', len(logs))
-        
-        return create_xlsx_response(
-            data=logs,
-            columns=ACTIVITY_LOG_COLUMNS,
-            filename='activity_logs_export',
-            sheet_name='Activity Logs'
-        )
-        
-    except Exception as e:
+    except Error as e:
+        if connection:
+            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
@@ -350,39 +394,88 @@ def export_activity_logs_excel():
 @require_admin
 def export_commission_settings_excel():
     """Export commission settings to Excel file"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT level, rate, description, updated_at, updated_by
+        query = """
+            SELECT level, rate, description,
+                   TO_CHAR(updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at, updated_by
             FROM commission_settings ORDER BY level
-        """)
-        settings = [dict(row) for row in cursor.fetchall()]
-        
-        for s in settings:
-            s['rate'] = float(s['rate'])
-            if s.get('updated_at'):
-                s['updated_at'] = s['updated_at'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        cursor.close()
-        return_db_connection(connection)
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'commission_settings', len(settings))
+        """
         
-        return create_xlsx_response(
-            data=settings,
-            columns=COMMISSION_SETTINGS_COLUMNS,
-            filename='commission_settings_export',
-            sheet_name='Commission Settings'
-        )
+        return _stream_export(connection, {
+            'query': query,
+            'params': None,
+            'columns': COMMISSION_SETTINGS_COLUMNS,
+            'filename': 'commission_settings_export',
+            'sheet_name': 'Commission Settings'
+        }, 'commission_settings')
         
     except Error as e:
         if connection:
             return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BACKGROUND EXPORT JOBS
+# ══════════════════════════════════════════════════════════════════════════════
+
+@admin_bp.route('/api/admin/export-jobs', methods=['POST'])
+@require_admin
+def create_export_job():
+    """
+    Start a background export (commissions, clients, activity_logs)
+    Body: {"export_type": "commissions", "format": "xlsx", "params": {"month": "2026-01"}}
+    Returns the job right away; an identical export of unchanged data is reused.
+    """
+    data = request.get_json() or {}
+
+    try:
+        job = submit_export_job(
+            data.get('export_type'),
+            params=data.get('params') or {},
+            export_format=(data.get('format') or 'xlsx').lower(),
+            requested_by=g.current_user.get('username', 'admin')
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Error as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    return jsonify({'status': 'success', 'job': job}), 200 if job['status'] == 'done' else 202
+
+
+@admin_bp.route('/api/admin/export-jobs', methods=['GET'])
+@require_admin
+def list_export_jobs_endpoint():
+    """Most recent export jobs"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({'status': 'success', 'jobs': list_export_jobs(limit)})
+
+
+@admin_bp.route('/api/admin/export-jobs/<int:job_id>', methods=['GET'])
+@require_admin
+def get_export_job_endpoint(job_id):
+    """Status and progress of an export job"""
+    job = get_export_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Export job not found'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+
+@admin_bp.route('/api/admin/export-jobs/<int:job_id>/download', methods=['GET'])
+@require_admin
+def download_export_job(job_id):
+    """Download the file of a finished export job"""
+    found = get_export_file(job_id)
+    if not found:
+        return jsonify({
+            'status': 'error',
+            'message': 'Export file not available (not finished, expired or on another server)'
+        }), 410
+
+    path, file_name = found
+    return send_file(path, as_attachment=True, download_name=file_name)
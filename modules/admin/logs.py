@@ -7,8 +7,25 @@ from ..activity_logger import (
     get_activity_logs_grouped,
     get_suspicious_ips,
     cleanup_old_logs,
-    log_data_export
+    log_data_export,
+    get_log_writer_stats
 )
+from ..db_pool import get_db_connection, return_db_connection
+from ..export_excel import iter_query_rows, create_export_response
+from .export import build_activity_log_export
+
+ACTIVITY_LOG_CSV_COLUMNS = [
+    {'key': 'id', 'header': 'ID'},
+    {'key': 'timestamp', 'header': 'Timestamp'},
+    {'key': 'event_type', 'header': 'Event Type'},
+    {'key': 'user_type', 'header': 'User Type'},
+    {'key': 'user_id', 'header': 'User ID'},
+    {'key': 'ip_address', 'header': 'IP Address'},
+    {'key': 'endpoint', 'header': 'Endpoint'},
+    {'key': 'method', 'header': 'Method'},
+    {'key': 'status_code', 'header': 'Status Code'},
+    {'key': 'details', 'header': 'Details'},
+]
 
 @admin_bp.route('/api/admin/activity-logs', methods=['GET'])
 @require_admin
@@ -62,7 +79,8 @@ def get_logs_stats():
         stats = get_activity_stats()
         return jsonify({
             'status': 'success',
-            'stats': stats
+            'stats': stats,
+            'writer': get_log_writer_stats()
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -72,76 +90,29 @@ def get_logs_stats():
 @require_admin
 def export_activity_logs():
     """Export activity logs as CSV"""
-    import csv
-    import io
+    connection = get_db_connection(shared=True)
+    if not connection:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        event_type = request.args.get('event_type')
-        user_type = request.args.get('user_type')
-        user_id = request.args.get('user_id')
-        ip_address = request.args.get('ip_address')
+        export = build_activity_log_export(request.args)
+        rows = iter_query_rows(connection, export['query'], export['params'],
+                               transform=export['transform'], release_connection=True)
+        admin_username = g.current_user.get('username', 'admin')
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
-        search = request.args.get('search', '').strip()
         
-        result = get_activity_logs(
-            event_type=event_type,
-            user_type=user_type,
-            user_id=user_id,
-            ip_address=ip_address,
-            date_from=date_from,
-            date_to=date_to,
-            search=search if search else None,
-            page=1,
-            per_page=10000
-        )
-        
-        logs = result['logs']
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        writer.writerow([
-            'ID', 'Timestamp', 'Event Type', 'User Type', 'User ID',
-            'IP Address', 'Endpoint', 'Method', 'Status Code', 'Details'
-        ])
-        
-        for log in logs:
-            details_str = ''
-            if log.get('details'):
-                if isinstance(log['details'], dict):
-                    details_str = str(log['details'])
-                else:
-                    details_str = str(log['details'])
-            
-            writer.writerow([
-                log.get('id', ''),
-                log.get('timestamp', ''),
-                log.get('event_type', ''),
-                log.get('user_type', ''),
-                log.get('user_id', ''),
-                log.get('ip_address', ''),
-                log.get('endpoint', ''),
-                log.get('method', ''),
-                log.get('status_code', ''),
-                details_str
-            ])
-        
-        admin_username = g.current_user.get('username', 'admin')
-        log_data_export('admin', admin_username, 'activity_logs', len(logs))
-        
-        output.seek(0)
-        from flask import Response
-        
-        return Response(
-            output.getvalue(),
-            mimetype='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename=activity_logs_{date_from or "all"}_{date_to or "now"}.csv'
-            }
+        return create_export_response(
+            rows,
+            ACTIVITY_LOG_CSV_COLUMNS,
+            f'activity_logs_{date_from or "all"}_{date_to or "now"}',
+            export_format='csv',
+            on_complete=lambda count: log_data_export('admin', admin_username, 'activity_logs', count)
         )
         
     except Exception as e:
+        if connection:
+            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
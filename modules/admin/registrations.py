@@ -8,6 +8,7 @@ from psycopg2 import Error
 from .blueprint import admin_bp
 from ..auth import require_admin
 from ..db_pool import get_db_connection, return_db_connection
+from ..mlm_core import graph_set_parent
 from datetime import datetime
 
 @admin_bp.route('/api/admin/registrations', methods=['GET'])
@@ -18,7 +19,7 @@ def get_registrations():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -86,7 +87,7 @@ def get_registrations():
 @require_admin
 def get_pending_registrations_count():
     """Get count of pending registrations"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -120,7 +121,7 @@ def approve_registration(registration_id):
     if not ctv_code:
         return jsonify({'status': 'error', 'message': 'CTV code is required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -186,6 +187,8 @@ def approve_registration(registration_id):
         cursor.close()
         return_db_connection(connection)
         
+        graph_set_parent(ctv_code, registration['referrer_code'])
+        
         success_msg = f'Registration approved. CTV account {ctv_code} created.'
         if warning_message:
             success_msg += warning_message
@@ -211,7 +214,7 @@ def reject_registration(registration_id):
     admin_username = g.current_user.get('username', 'admin') if hasattr(g, 'current_user') and g.current_user else 'admin'
     reason = data.get('reason', 'No reason provided')
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
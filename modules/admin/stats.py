@@ -1,22 +1,35 @@
 import datetime
 import os
 import logging
-from pathlib import Path
 from flask import jsonify, request
 from psycopg2.extras import RealDictCursor
 from psycopg2 import Error
 from .blueprint import admin_bp
 from ..auth import require_admin
-from ..db_pool import get_db_connection, return_db_connection
-from ..mlm_core import calculate_new_commissions_fast
+from ..db_pool import get_db_connection, return_db_connection, get_pool_stats
+from ..mlm_core import enqueue_commission_job, get_commission_freshness, month_date_range
+from ..sync_leader import get_sync_leader_status
 
 logger = logging.getLogger(__name__)
 
+
+def _queue_commission_refresh(cursor, connection):
+    """
+    DOES: Queue an incremental commission job if new transactions are waiting
+    OUTPUTS: Freshness dict from get_commission_freshness()
+    """
+    freshness = get_commission_freshness(cursor)
+    if freshness['pending_rows'] and not freshness['pending_jobs']:
+        if enqueue_commission_job('incremental', requested_by='admin_stats', connection=connection):
+            freshness['pending_jobs'] = 1
+    return freshness
+
+
 @admin_bp.route('/api/admin/stats', methods=['GET'])
 @require_admin
 def get_stats():
     """Get dashboard statistics with optional date filters (month, day, or from_date/to_date)"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -31,95 +44,75 @@ def get_stats():
         cursor.execute("SELECT COUNT(*) as count FROM ctv WHERE is_active = TRUE OR is_active IS NULL")
         total_ctv = cursor.fetchone()['count']
         
-        # Build date filter conditions for PostgreSQL
-        if from_date and to_date:
-            date_condition = f"DATE(created_at) >= '{from_date}' AND DATE(created_at) <= '{to_date}'"
-            date_condition_services = f"DATE(date_entered) >= '{from_date}' AND DATE(date_entered) <= '{to_date}'"
-        elif day_filter:
-            date_condition = f"DATE(created_at) = '{day_filter}'"
-            date_condition_services = f"DATE(date_entered) = '{day_filter}'"
-        elif month_filter:
-            date_condition = f"TO_CHAR(created_at, 'YYYY-MM') = '{month_filter}'"
-            date_condition_services = f"TO_CHAR(date_entered, 'YYYY-MM') = '{month_filter}'"
-        else:
-            date_condition = "TO_CHAR(created_at, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-            date_condition_services = "TO_CHAR(date_entered, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-        
-        # Calculate missing commissions incrementally
-        calculate_new_commissions_fast(connection=connection)
+        # Resolve the filter to an inclusive [from, to] day range (default: current month)
+        try:
+            if from_date and to_date:
+                range_start, range_end = from_date, to_date
+            elif day_filter:
+                range_start, range_end = day_filter, day_filter
+            elif month_filter:
+                range_start, range_end = month_date_range(month_filter)
+            else:
+                range_start, range_end = month_date_range(datetime.date.today().strftime('%Y-%m'))
+        except ValueError:
+            cursor.close()
+            return_db_connection(connection)
+            return jsonify({'status': 'error', 'message': 'Invalid month format'}), 400
         
-        # Build date conditions for source tables
-        if from_date and to_date:
-            kh_date_condition = f"DATE(kh.ngay_hen_lam) >= '{from_date}' AND DATE(kh.ngay_hen_lam) <= '{to_date}'"
-            svc_date_condition = f"DATE(svc.date_entered) >= '{from_date}' AND DATE(svc.date_entered) <= '{to_date}'"
-        elif day_filter:
-            kh_date_condition = f"DATE(kh.ngay_hen_lam) = '{day_filter}'"
-            svc_date_condition = f"DATE(svc.date_entered) = '{day_filter}'"
-        elif month_filter:
-            kh_date_condition = f"TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = '{month_filter}'"
-            svc_date_condition = f"TO_CHAR(svc.date_entered, 'YYYY-MM') = '{month_filter}'"
-        else:
-            kh_date_condition = "TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-            svc_date_condition = "TO_CHAR(svc.date_entered, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
+        # Commissions and the rollup are maintained by the sync worker; only ask for a run
+        data_freshness = _queue_commission_refresh(cursor, connection)
         
-        # Get monthly commission from stored commissions table
-        cursor.execute(f"""
-            SELECT COALESCE(SUM(c.commission_amount), 0) as total
-            FROM commissions c
-            LEFT JOIN khach_hang kh ON c.transaction_id = -ABS(kh.id)
-            LEFT JOIN services svc ON c.transaction_id = svc.id AND c.transaction_id > 0
-            WHERE ({kh_date_condition} AND c.transaction_id < 0) 
-               OR ({svc_date_condition} AND c.transaction_id > 0)
-        """)
+        # Get monthly commission from the daily rollup
+        cursor.execute("""
+            SELECT COALESCE(SUM(commission), 0) as total
+            FROM ctv_daily_rollup
+            WHERE day BETWEEN %s AND %s
+        """, (range_start, range_end))
         monthly_commission = float(cursor.fetchone()['total'])
         
         kh_transactions = 0
         svc_transactions = 0
         
         try:
-            if from_date and to_date:
-                kh_date_cond = f"DATE(ngay_hen_lam) >= '{from_date}' AND DATE(ngay_hen_lam) <= '{to_date}'"
-            elif day_filter:
-                kh_date_cond = f"DATE(ngay_hen_lam) = '{day_filter}'"
-            elif month_filter:
-                kh_date_cond = f"TO_CHAR(ngay_hen_lam, 'YYYY-MM') = '{month_filter}'"
-            else:
-                kh_date_cond = "TO_CHAR(ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-            
-            cursor.execute(f"""
+            cursor.execute("""
                 SELECT COUNT(*) as count
                 FROM khach_hang
-                WHERE {kh_date_cond}
+                WHERE ngay_hen_lam BETWEEN %s AND %s
                 AND (trang_thai = 'Đã đến làm' OR trang_thai = 'Da den lam')
-            """)
+            """, (range_start, range_end))
             kh_transactions = cursor.fetchone()['count']
         except Error:
             pass
         
         try:
-            cursor.execute(f"""
+            cursor.execute("""
                 SELECT COUNT(*) as count
                 FROM services
-                WHERE {date_condition_services}
-            """)
+                WHERE date_entered BETWEEN %s AND %s
+            """, (range_start, range_end))
             svc_transactions = cursor.fetchone()['count']
         except Error:
             pass
         
         monthly_transactions = kh_transactions + svc_transactions
         
-        # Calculate monthly revenue
-        cursor.execute(f"""
+        # Calculate monthly revenue (each commissioned transaction counted once)
+        cursor.execute("""
             SELECT COALESCE(SUM(transaction_amount), 0) as total
             FROM (
                 SELECT DISTINCT c.transaction_id, c.transaction_amount
-                FROM commissions c
-                LEFT JOIN khach_hang kh ON c.transaction_id = -ABS(kh.id)
-                LEFT JOIN services svc ON c.transaction_id = svc.id AND c.transaction_id > 0
-                WHERE ({kh_date_condition} AND c.transaction_id < 0) 
-                   OR ({svc_date_condition} AND c.transaction_id > 0)
+                FROM khach_hang kh
+                JOIN commissions c ON c.transaction_id = -kh.id
+                WHERE kh.ngay_hen_lam BETWEEN %s AND %s
+                
+                UNION ALL
+                
+                SELECT DISTINCT c.transaction_id, c.transaction_amount
+                FROM services svc
+                JOIN commissions c ON c.transaction_id = svc.id
+                WHERE svc.date_entered BETWEEN %s AND %s
             ) as distinct_transactions
-        """)
+        """, (range_start, range_end, range_start, range_end))
         result = cursor.fetchone()
         monthly_revenue = float(result['total']) if result['total'] else 0.0
         
@@ -128,31 +121,22 @@ def get_stats():
             svc_revenue = 0
             
             try:
-                if from_date and to_date:
-                    kh_date_cond = f"DATE(ngay_hen_lam) >= '{from_date}' AND DATE(ngay_hen_lam) <= '{to_date}'"
-                elif day_filter:
-                    kh_date_cond = f"DATE(ngay_hen_lam) = '{day_filter}'"
-                elif month_filter:
-                    kh_date_cond = f"TO_CHAR(ngay_hen_lam, 'YYYY-MM') = '{month_filter}'"
-                else:
-                    kh_date_cond = "TO_CHAR(ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-                
-                cursor.execute(f"""
+                cursor.execute("""
                     SELECT COALESCE(SUM(tong_tien), 0) as total
                     FROM khach_hang
-                    WHERE {kh_date_cond}
+                    WHERE ngay_hen_lam BETWEEN %s AND %s
                     AND (trang_thai = 'Đã đến làm' OR trang_thai = 'Da den lam')
-                """)
+                """, (range_start, range_end))
                 kh_revenue = float(cursor.fetchone()['total'] or 0)
             except Error:
                 pass
             
             try:
-                cursor.execute(f"""
+                cursor.execute("""
                     SELECT COALESCE(SUM(tong_tien), 0) as total
                     FROM services
-                    WHERE {date_condition_services}
-                """)
+                    WHERE date_entered BETWEEN %s AND %s
+                """, (range_start, range_end))
                 svc_revenue = float(cursor.fetchone()['total'] or 0)
             except Error:
                 pass
@@ -167,39 +151,23 @@ def get_stats():
         """)
         ctv_by_level = {row['cap_bac']: row['count'] for row in cursor.fetchall()}
         
-        # Get top earners
+        # Get top earners (level 0 revenue = the CTV's own closed sales)
         top_earners = []
         try:
-            if from_date and to_date:
-                kh_date_cond = f"DATE(kh.ngay_hen_lam) >= '{from_date}' AND DATE(kh.ngay_hen_lam) <= '{to_date}'"
-                svc_date_cond = f"DATE(svc.date_entered) >= '{from_date}' AND DATE(svc.date_entered) <= '{to_date}'"
-            elif day_filter:
-                kh_date_cond = f"DATE(kh.ngay_hen_lam) = '{day_filter}'"
-                svc_date_cond = f"DATE(svc.date_entered) = '{day_filter}'"
-            elif month_filter:
-                kh_date_cond = f"TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = '{month_filter}'"
-                svc_date_cond = f"TO_CHAR(svc.date_entered, 'YYYY-MM') = '{month_filter}'"
-            else:
-                kh_date_cond = "TO_CHAR(kh.ngay_hen_lam, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-                svc_date_cond = "TO_CHAR(svc.date_entered, 'YYYY-MM') = TO_CHAR(CURRENT_TIMESTAMP, 'YYYY-MM')"
-            
-            cursor.execute(f"""
+            cursor.execute("""
                 SELECT 
-                    c.ctv_code,
+                    r.ctv_code,
                     ctv.ten,
-                    COALESCE(SUM(CASE WHEN c.level = 0 THEN c.transaction_amount ELSE 0 END), 0) as total_revenue,
-                    COALESCE(SUM(c.commission_amount), 0) as total_commission
-                FROM commissions c
-                JOIN ctv ON c.ctv_code = ctv.ma_ctv
-                LEFT JOIN khach_hang kh ON c.transaction_id = -ABS(kh.id)
-                LEFT JOIN services svc ON c.transaction_id = svc.id AND c.transaction_id > 0
-                WHERE ({kh_date_cond} AND c.transaction_id < 0) 
-                   OR ({svc_date_cond} AND c.transaction_id > 0)
-                GROUP BY c.ctv_code, ctv.ten
-                HAVING COALESCE(SUM(c.commission_amount), 0) > 0
+                    COALESCE(SUM(CASE WHEN r.level = 0 THEN r.revenue ELSE 0 END), 0) as total_revenue,
+                    COALESCE(SUM(r.commission), 0) as total_commission
+                FROM ctv_daily_rollup r
+                JOIN ctv ON r.ctv_code = ctv.ma_ctv
+                WHERE r.day BETWEEN %s AND %s
+                GROUP BY r.ctv_code, ctv.ten
+                HAVING COALESCE(SUM(r.commission), 0) > 0
                 ORDER BY total_commission DESC
                 LIMIT 5
-            """)
+            """, (range_start, range_end))
             top_earners_raw = cursor.fetchall()
             for row in top_earners_raw:
                 top_earners.append({
@@ -231,6 +199,13 @@ def get_stats():
         except Error:
             pass
         
+        # Which process currently holds the sync lock
+        sync_leader = None
+        try:
+            sync_leader = get_sync_leader_status(cursor)
+        except Error:
+            connection.rollback()
+        
         cursor.close()
         return_db_connection(connection)
         
@@ -247,7 +222,10 @@ def get_stats():
             'system_status': {
                 'sync_worker_last_run': sync_worker_last_run,
                 'sync_interval': 30,
-                'new_records': sync_new_records
+                'new_records': sync_new_records,
+                'data_freshness': data_freshness,
+                'sync_leader': sync_leader,
+                'db_pool': get_pool_stats()
             }
         })
         
@@ -261,7 +239,7 @@ def get_stats():
 @require_admin
 def reset_sync_counter():
     """Reset the new records counter to 0"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -288,15 +266,15 @@ def reset_sync_counter():
 @require_admin
 def get_date_ranges_with_data():
     """Check which date range presets have data available"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
 
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        # Calculate missing commissions incrementally to ensure red dots are accurate
-        calculate_new_commissions_fast(connection=connection)
+        # Red dots only depend on khach_hang / services; keep commissions moving for the next stats load
+        _queue_commission_refresh(cursor, connection)
         
         today = datetime.date.today()
         ranges_with_data = {}
@@ -340,21 +318,9 @@ def get_date_ranges_with_data():
             cursor.execute(query_svc, [from_date, to_date])
             svc_count = cursor.fetchone()['count']
 
-            query_comm = """
-                SELECT COUNT(*) as count
-                FROM commissions c
-                LEFT JOIN khach_hang kh ON c.transaction_id = -ABS(kh.id)
-                LEFT JOIN services s ON c.transaction_id = s.id AND c.transaction_id > 0
-                WHERE (
-                    (c.transaction_id < 0 AND DATE(kh.ngay_hen_lam) >= %s AND DATE(kh.ngay_hen_lam) <= %s)
-                    OR
-                    (c.transaction_id > 0 AND DATE(s.date_entered) >= %s AND DATE(s.date_entered) <= %s)
-                )
-            """
-            cursor.execute(query_comm, [from_date, to_date, from_date, to_date])
-            comm_count = cursor.fetchone()['count']
-
-            ranges_with_data[preset] = (kh_count > 0) or (svc_count > 0) or (comm_count > 0)
+            # Every commission row belongs to a khach_hang / services row dated in the
+            # same range, so the two counts above already cover commissions
+            ranges_with_data[preset] = (kh_count > 0) or (svc_count > 0)
 
         cursor.close()
         return_db_connection(connection)
@@ -377,7 +343,7 @@ def get_sync_row_counts():
     Get row counts comparison between database and Google Sheets.
     Returns counts for each source: tham_my, nha_khoa, gioi_thieu
     """
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -398,35 +364,18 @@ def get_sync_row_counts():
         sheet_error = None
         
         try:
-            import json
-            import gspread
-            from google.oauth2.service_account import Credentials
+            from ..sheets_client import get_sheets_client, get_worksheets
             
-            BASE_DIR = Path(__file__).parent.parent.parent.absolute()
             GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '12YrAEGiOKLoqzj4tE-VLZNQNIda7S5hdMaQJO5UEsnQ')
-            CREDENTIALS_FILE = BASE_DIR / 'google_credentials.json'
-            GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON')
             
-            scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-            client = None
-            
-            # Try environment variable first (for Railway/production)
-            if GOOGLE_CREDENTIALS_JSON:
-                try:
-                    creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-                    credentials = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-                    client = gspread.authorize(credentials)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse GOOGLE_CREDENTIALS_JSON: {e}")
-            
-            # Fall back to file (for local development)
-            if not client and CREDENTIALS_FILE.exists():
-                credentials = Credentials.from_service_account_file(str(CREDENTIALS_FILE), scopes=scopes)
-                client = gspread.authorize(credentials)
+            # Shared client (None if there are no usable credentials)
+            try:
+                client = get_sheets_client()
+            except (ValueError, FileNotFoundError) as e:
+                logger.error(f"Google credentials unavailable: {e}")
+                client = None
             
             if client:
-                spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
-                
                 # Tab name variations for each source
                 tab_variations = {
                     'tham_my': ['Khach hang Tham my', 'Khách hàng Thẩm mỹ', 'Tham My', 'Thẩm mỹ'],
@@ -434,7 +383,7 @@ def get_sync_row_counts():
                     'gioi_thieu': ['Khach gioi thieu', 'Khách giới thiệu', 'Gioi Thieu', 'Referral']
                 }
                 
-                worksheets = spreadsheet.worksheets()
+                worksheets = get_worksheets(GOOGLE_SHEET_ID)
                 
                 for source, variations in tab_variations.items():
                     found = False
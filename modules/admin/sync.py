@@ -2,7 +2,9 @@ from flask import jsonify, request
 from .blueprint import admin_bp
 from ..auth import require_admin
 from ..google_sync import GoogleSheetSync, GOOGLE_SHEET_ID
+from ..sheets_client import get_spreadsheet, get_sheets_stats
 from ..db_pool import get_db_connection, return_db_connection
+from ..sync_leader import get_sync_leader_status
 from psycopg2.extras import RealDictCursor
 import logging
 import os
@@ -17,7 +19,7 @@ def reset_data_preview():
     Returns counts for each source type.
     """
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(shared=True)
         cur = conn.cursor()
         
         # Get counts for each source
@@ -34,7 +36,7 @@ def reset_data_preview():
         counts['total'] = counts['tham_my'] + counts['nha_khoa'] + counts['gioi_thieu']
         
         cur.close()
-        conn.close()
+        return_db_connection(conn)
         
         logger.info(f"Hard Reset Preview - Database counts: {counts}")
         
@@ -105,7 +107,7 @@ def reset_data():
 def reset_step_delete():
     """Step 1: Delete all records from khach_hang and commissions"""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(shared=True)
         cur = conn.cursor()
         
         # Delete khach_hang records
@@ -119,6 +121,10 @@ def reset_step_delete():
         cur.execute("DELETE FROM commissions WHERE level >= 0")
         deleted_commissions = cur.rowcount
         
+        # Every sheet row has to be imported again by the delta sync
+        cur.execute("DELETE FROM sheet_row_state")
+        cur.execute("DELETE FROM sheet_tab_state")
+        
         conn.commit()
         cur.close()
         return_db_connection(conn)
@@ -146,8 +152,7 @@ def reset_step_import(tab_type):
     
     try:
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         conn = syncer.get_db_connection()
         
         logger.info(f"RESET STEP IMPORT: Starting {tab_type}")
@@ -182,7 +187,7 @@ def reset_step_commissions():
     try:
         from modules.mlm_core import calculate_new_commissions_fast
         
-        conn = get_db_connection()
+        conn = get_db_connection(shared=True)
         stats = calculate_new_commissions_fast(connection=conn)
         return_db_connection(conn)
         
@@ -222,8 +227,7 @@ def manual_sync():
             yield send_log("Connecting to Google Sheets...", 'info', 'connect')
             syncer = GoogleSheetSync()
             # Force re-auth to ensure fresh token
-            client = syncer.get_google_client()
-            spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+            spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
             yield send_log("Connected to Google Sheets ✓", 'success', 'connect')
             
             yield send_log("Connecting to database...", 'info', 'connect')
@@ -306,8 +310,7 @@ def sync_single_tab(tab_type):
         logger.info(f"SYNC TAB: Starting {tab_type}")
         
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         conn = syncer.get_db_connection()
         
         # Get count before
@@ -378,7 +381,7 @@ def diagnose_phone():
     }
     
     # Check database
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if connection:
         try:
             cursor = connection.cursor(cursor_factory=RealDictCursor)
@@ -427,8 +430,7 @@ def diagnose_phone():
     # Check Google Sheet
     try:
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         
         # Check all three tabs
         tabs_to_check = [
@@ -516,7 +518,7 @@ def integrity_check():
         'summary': {}
     }
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -553,8 +555,7 @@ def integrity_check():
     # Get Google Sheet counts
     try:
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         
         tabs_config = [
             ('tham_my', ['Khach hang Tham my', 'Khách hàng Thẩm mỹ', 'Tham My', 'Thẩm mỹ']),
@@ -611,14 +612,13 @@ def force_sync_tab():
     
     try:
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         conn = syncer.get_db_connection()
         
         logger.info(f"Force sync started for tab: {tab_type}")
         
         # Use phone matching sync (processes ALL rows)
-        processed, errors = syncer.sync_tab_by_phone_matching(spreadsheet, conn, tab_type)
+        processed, errors = syncer.sync_tab_by_phone_matching(spreadsheet, conn, tab_type, full_sync=True)
         
         # Update heartbeat
         syncer.update_heartbeat(conn, processed)
@@ -657,7 +657,7 @@ def find_missing_phones():
         'total_missing': 0
     }
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -677,8 +677,7 @@ def find_missing_phones():
     
     try:
         syncer = GoogleSheetSync()
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID)
         
         tabs_config = [
             ('tham_my', ['Khach hang Tham my', 'Khách hàng Thẩm mỹ', 'Tham My', 'Thẩm mỹ']),
@@ -746,7 +745,8 @@ def find_missing_phones():
 @require_admin
 def check_google_creds():
     try:
-        from ..google_sync import GOOGLE_SHEET_ID, GOOGLE_CREDENTIALS_JSON
+        from ..google_sync import GOOGLE_SHEET_ID
+        from ..sheets_client import GOOGLE_CREDENTIALS_JSON
         import os
         from pathlib import Path
         import json
@@ -787,6 +787,43 @@ def check_google_creds():
         return jsonify({'valid': False, 'message': str(e)}), 500
 
 
+@admin_bp.route('/api/admin/sync/status', methods=['GET'])
+@require_admin
+def get_sync_status():
+    """
+    Sync loop status: last heartbeat and which process is the sync leader.
+    Only the process holding the advisory lock syncs; the rest are on standby.
+    sheets_api holds the Sheets API counters of the process answering.
+    """
+    try:
+        conn = get_db_connection(shared=True)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cur.execute("""
+            SELECT last_updated, cache_value
+            FROM commission_cache
+            WHERE cache_key = 'sync_worker_heartbeat'
+        """)
+        heartbeat = cur.fetchone()
+        leader = get_sync_leader_status(cur)
+        
+        cur.close()
+        return_db_connection(conn)
+        
+        return jsonify({
+            'status': 'success',
+            'last_run': heartbeat['last_updated'].isoformat() if heartbeat and heartbeat['last_updated'] else None,
+            'new_records': int(heartbeat['cache_value'] or 0) if heartbeat and str(heartbeat['cache_value'] or '0').isdigit() else 0,
+            'sync_interval': 30,
+            'leader': leader,
+            'sheets_api': get_sheets_stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting sync status: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
 @admin_bp.route('/api/admin/sync/worker-logs', methods=['GET'])
 @require_admin
 def get_worker_logs():
@@ -802,7 +839,7 @@ def get_worker_logs():
         VN_TZ = timezone(timedelta(hours=7))
         MAX_LOGS = 10
         
-        conn = get_db_connection()
+        conn = get_db_connection(shared=True)
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # First, cleanup old logs - keep only last 10
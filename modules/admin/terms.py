@@ -15,7 +15,7 @@ def get_signup_terms(admin_session):
     """Get all signup terms (for admin panel)"""
     language = request.args.get('language', 'vi')
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -59,7 +59,7 @@ def get_active_signup_terms():
     """Get active signup terms (public endpoint for signup page)"""
     language = request.args.get('language', 'vi')
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -119,7 +119,7 @@ def create_signup_terms(admin_session):
     if not title or not content:
         return jsonify({'status': 'error', 'message': 'Title and content are required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -185,7 +185,7 @@ def update_signup_terms(admin_session, term_id):
     if not title or not content:
         return jsonify({'status': 'error', 'message': 'Title and content are required'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -227,7 +227,7 @@ def update_signup_terms(admin_session, term_id):
 @require_admin
 def activate_signup_terms(admin_session, term_id):
     """Activate a specific version of signup terms"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -281,7 +281,7 @@ def activate_signup_terms(admin_session, term_id):
 @require_admin
 def delete_signup_terms(admin_session, term_id):
     """Delete a version of signup terms (only if not active)"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
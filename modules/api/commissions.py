@@ -7,7 +7,7 @@ from ..db_pool import get_db_connection, return_db_connection
 @api_bp.route('/api/commission-labels', methods=['GET'])
 def get_commission_labels():
     """Get commission level labels for frontend display (public endpoint)"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'DB error'}), 500
     
@@ -38,7 +38,7 @@ def get_commission_labels():
 @api_bp.route('/api/commissions/transaction/<int:transaction_id>', methods=['GET'])
 def get_transaction_commissions(transaction_id):
     """Get all commissions for a specific transaction"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection: return jsonify({'status': 'error', 'message': 'DB error'}), 500
     
     try:
@@ -61,7 +61,7 @@ def get_transaction_commissions(transaction_id):
 @api_bp.route('/api/ctv/<ctv_code>/commissions', methods=['GET'])
 def get_ctv_commissions_legacy(ctv_code):
     """Legacy endpoint for CTV commissions"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection: return jsonify({'status': 'error', 'message': 'DB error'}), 500
     
     try:
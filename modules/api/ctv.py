@@ -8,7 +8,8 @@ from ..mlm_core import (
     build_hierarchy_tree, 
     calculate_level, 
     get_commission_rates,
-    calculate_commission_for_service
+    calculate_commission_for_service,
+    graph_set_parent
 )
 
 @api_bp.route('/api/ctv/import', methods=['POST'])
@@ -22,7 +23,7 @@ def import_ctv():
     if not is_valid:
         return jsonify({'status': 'error', 'message': error_msg}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -49,6 +50,8 @@ def import_ctv():
         connection.commit()
         cursor.close()
         return_db_connection(connection)
+        for ctv in data:
+            graph_set_parent(ctv['ma_ctv'], ctv.get('nguoi_gioi_thieu'))
         return jsonify({'status': 'success', 'message': f'Imported {len(data)} CTVs'})
     except Error as e:
         if connection: connection.rollback()
@@ -65,7 +68,7 @@ def get_ctv_hierarchy(ctv_code):
 @api_bp.route('/api/ctv/<ctv_code>/levels', methods=['GET'])
 def get_ctv_levels(ctv_code):
     """Get all CTVs and their level relative to this CTV"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection: return jsonify({'status': 'error', 'message': 'DB error'}), 500
     
     try:
@@ -97,7 +100,7 @@ def add_service():
     for f in required:
         if f not in data: return jsonify({'status': 'error', 'message': f'Missing {f}'}), 400
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection: return jsonify({'status': 'error', 'message': 'DB error'}), 500
     
     try:
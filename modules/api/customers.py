@@ -7,7 +7,7 @@ from ..db_pool import get_db_connection, return_db_connection
 @api_bp.route('/api/customer/<int:customer_id>', methods=['GET'])
 def get_customer(customer_id):
     """Get full customer details by ID"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -40,7 +40,7 @@ def get_customer(customer_id):
 @api_bp.route('/api/customer/<int:customer_id>/services', methods=['GET'])
 def get_customer_services(customer_id):
     """Get all services for a customer with CTV info"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
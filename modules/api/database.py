@@ -19,7 +19,7 @@ def validate_schema():
     Validate that the database has the correct schema for the CTV system.
     Returns detailed info about missing tables/columns.
     """
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({
             'status': 'error',
@@ -108,7 +108,7 @@ def validate_schema():
 @api_bp.route('/api/test-connection', methods=['GET'])
 def test_connection():
     """Test database connection"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if connection:
         try:
             cursor = connection.cursor()
@@ -137,7 +137,7 @@ def test_connection():
 @api_bp.route('/api/tables', methods=['GET'])
 def get_tables():
     """Get list of all tables in the database"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -162,7 +162,7 @@ def get_tables():
 @api_bp.route('/api/data', methods=['GET'])
 def get_data():
     """Fetch customer data (id, name, email, phone)"""
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
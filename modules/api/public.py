@@ -68,7 +68,7 @@ def create_public_booking():
     cleaned_referrer = clean_phone(referrer_phone) if referrer_phone else ''
     
     # Save to database
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -95,28 +95,25 @@ def create_public_booking():
         result = cursor.fetchone()
         booking_id = result[0] if result else None
         
+        # Google Sheets row goes out through the outbox, committed with the booking
+        from ..ctv.booking import queue_booking_for_sheet
+        from ..sheets_outbox import notify_sheets_outbox
+        booking_data = {
+            'customer_name': customer_name,
+            'customer_phone': cleaned_phone,
+            'service_interest': service_interest,
+            'notes': notes,
+            'region': region
+        }
+        queue_booking_for_sheet(cursor, booking_id, booking_data, cleaned_referrer)
+        
         connection.commit()
         cursor.close()
         return_db_connection(connection)
+        notify_sheets_outbox()
         
         logger.info(f"Public booking created with ID: {booking_id}, referrer: {cleaned_referrer}")
         
-        # Also try to sync to Google Sheets
-        try:
-            from ..ctv.booking import append_to_google_sheet
-            booking_data = {
-                'customer_name': customer_name,
-                'customer_phone': cleaned_phone,
-                'service_interest': service_interest,
-                'notes': notes,
-                'region': region
-            }
-            sheets_success, _ = append_to_google_sheet(booking_data, cleaned_referrer)
-            if sheets_success:
-                logger.info(f"Public booking synced to Google Sheets")
-        except Exception as e:
-            logger.warning(f"Failed to sync public booking to Google Sheets: {e}")
-        
         return jsonify({
             'status': 'success',
             'message': 'Booking created successfully',
@@ -28,6 +28,13 @@ Updated for PostgreSQL.
 #     DOES: Delete session from database (logout)
 #     OUTPUTS: Success status
 #
+# - load_session(token) -> dict | None
+#     DOES: Session + admin/CTV principal, served from the session cache
+#     OUTPUTS: Cache entry (see session_cache.py) or None
+#
+# - get_request_token() -> str | None
+#     DOES: Session token from Authorization / X-Session-Token / cookie
+#
 # - get_current_user() -> dict | None
 #     DOES: Get current user from request headers/cookies
 #     OUTPUTS: User info or None
@@ -72,6 +79,7 @@ SESSION_EXPIRY_HOURS = 24
 
 # Use connection pool for better performance
 from .db_pool import get_db_connection, return_db_connection
+from .session_cache import get_cached_principal, cache_principal, invalidate_session, invalidate_user
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -168,6 +176,9 @@ def create_session(user_type, user_id, remember_me=False):
         cursor.close()
         return_db_connection(connection)
         
+        # The deleted sessions may still be cached
+        invalidate_user(user_type, user_id)
+        
         return token
         
     except Error as e:
@@ -178,41 +189,102 @@ def create_session(user_type, user_id, remember_me=False):
         return None
 
 
-def validate_session(token):
+def load_session(token):
     """
-    DOES: Check if session token is valid and not expired
+    DOES: Resolve a session token to its cached entry (session + admin/CTV principal)
     INPUTS: token - session token from client
-    OUTPUTS: Dict with user info or None if invalid
+    OUTPUTS: {'user_type', 'user_id', 'expires_at' (epoch), 'principal'} or None if invalid
+    
+    Served from the session cache when warm; on a miss one query reads the
+    session together with the admin or CTV row and fills the cache.
     """
     if not token:
         return None
     
-    connection = get_db_connection()
+    entry = get_cached_principal(token)
+    if entry is not None:
+        return entry
+    
+    connection = get_db_connection(shared=True)
     if not connection:
         return None
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        # Get session and check expiry
         cursor.execute("""
-            SELECT user_type, user_id, expires_at 
-            FROM sessions 
-            WHERE id = %s AND expires_at > CURRENT_TIMESTAMP
+            SELECT 
+                s.user_type,
+                s.user_id,
+                s.expires_at,
+                a.id as admin_id,
+                a.username,
+                a.name,
+                a.created_at,
+                c.ma_ctv,
+                c.ten,
+                c.sdt,
+                c.email,
+                c.cap_bac,
+                c.nguoi_gioi_thieu,
+                c.is_active
+            FROM sessions s
+            LEFT JOIN admins a ON s.user_type = 'admin' AND s.user_id = a.username
+            LEFT JOIN ctv c ON s.user_type = 'ctv' AND s.user_id = c.ma_ctv
+            WHERE s.id = %s AND s.expires_at > CURRENT_TIMESTAMP
         """, (token,))
         
-        session = cursor.fetchone()
+        row = cursor.fetchone()
         
         cursor.close()
         return_db_connection(connection)
         
-        return dict(session) if session else None
-        
     except Error as e:
         print(f"Error validating session: {e}")
         if connection:
             return_db_connection(connection)
         return None
+    
+    if not row:
+        return None
+    
+    principal = None
+    if row['user_type'] == 'admin' and row['admin_id']:
+        principal = {
+            'id': row['admin_id'],
+            'username': row['username'],
+            'name': row['name'],
+            'created_at': row['created_at'].strftime('%Y-%m-%d %H:%M:%S') if row.get('created_at') else None
+        }
+    elif row['user_type'] == 'ctv' and row['ma_ctv']:
+        principal = {field: row[field] for field in
+                     ('ma_ctv', 'ten', 'sdt', 'email', 'cap_bac', 'nguoi_gioi_thieu', 'is_active')}
+    
+    entry = {
+        'user_type': row['user_type'],
+        'user_id': row['user_id'],
+        'expires_at': row['expires_at'].timestamp(),
+        'principal': principal
+    }
+    cache_principal(token, entry)
+    return entry
+
+
+def validate_session(token):
+    """
+    DOES: Check if session token is valid and not expired
+    INPUTS: token - session token from client
+    OUTPUTS: Dict with user info or None if invalid
+    """
+    entry = load_session(token)
+    if not entry:
+        return None
+    
+    return {
+        'user_type': entry['user_type'],
+        'user_id': entry['user_id'],
+        'expires_at': datetime.fromtimestamp(entry['expires_at'])
+    }
 
 
 def destroy_session(token):
@@ -238,6 +310,8 @@ def destroy_session(token):
         cursor.close()
         return_db_connection(connection)
         
+        invalidate_session(token)
+        
         return deleted
         
     except Error as e:
@@ -270,25 +344,26 @@ def cleanup_expired_sessions():
 # USER RETRIEVAL
 # ══════════════════════════════════════════════════════════════════════════════
 
-def get_current_user():
+def get_request_token():
     """
-    DOES: Get current user from request Authorization header or cookie
-    OUTPUTS: User info dict or None
+    DOES: Get session token from Authorization header, X-Session-Token header or cookie
+    OUTPUTS: Token string or None
     """
-    token = None
-    
     # Check Authorization header
     auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        token = auth_header[7:]
-    
-    # Check X-Session-Token header if no token yet
-    if not token:
-        token = request.headers.get('X-Session-Token')
+    if auth_header.startswith('Bearer ') and auth_header[7:]:
+        return auth_header[7:]
     
-    # Check cookie if still no token
-    if not token:
-        token = request.cookies.get('session_token')
+    # Check X-Session-Token header, then cookie
+    return request.headers.get('X-Session-Token') or request.cookies.get('session_token')
+
+
+def get_current_user():
+    """
+    DOES: Get current user from request Authorization header or cookie
+    OUTPUTS: User info dict or None
+    """
+    token = get_request_token()
     
     # Validate once if we found a token
     if token:
@@ -302,7 +377,7 @@ def get_admin_info(username):
     DOES: Get admin details by username
     OUTPUTS: Admin dict or None
     """
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return None
     
@@ -333,7 +408,7 @@ def get_ctv_info(ma_ctv):
     DOES: Get CTV details by ma_ctv
     OUTPUTS: CTV dict or None
     """
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return None
     
@@ -364,15 +439,7 @@ def require_admin(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Get token from request
-        token = None
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header.startswith('Bearer '):
-            token = auth_header[7:]
-        if not token:
-            token = request.headers.get('X-Session-Token')
-        if not token:
-            token = request.cookies.get('session_token')
+        token = get_request_token()
         
         if not token:
             return jsonify({
@@ -380,72 +447,37 @@ def require_admin(f):
                 'message': 'Authentication required'
             }), 401
         
-        # Combined query to validate session AND get admin info
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({
-                'status': 'error',
-                'message': 'Database connection failed'
-            }), 500
-        
+        # Session and admin info come from the session cache (one query on a miss)
         try:
-            cursor = connection.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute("""
-                SELECT 
-                    s.user_type,
-                    s.user_id,
-                    s.expires_at,
-                    a.id as admin_id,
-                    a.username,
-                    a.name,
-                    a.created_at
-                FROM sessions s
-                LEFT JOIN admins a ON s.user_type = 'admin' AND s.user_id = a.username
-                WHERE s.id = %s AND s.expires_at > CURRENT_TIMESTAMP
-            """, (token,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            return_db_connection(connection)
-            
-            if not result:
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Authentication required'
-                }), 401
-            
-            if result.get('user_type') != 'admin':
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Admin access required'
-                }), 403
-            
-            if not result.get('admin_id'):
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Admin account not found'
-                }), 401
-            
-            admin_info = {
-                'id': result['admin_id'],
-                'username': result['username'],
-                'name': result['name'],
-                'created_at': result['created_at'].strftime('%Y-%m-%d %H:%M:%S') if result.get('created_at') else None
-            }
-            
-            g.current_user = admin_info
-            g.user_type = 'admin'
-            
-            return f(*args, **kwargs)
-            
+            entry = load_session(token)
         except Exception as e:
-            if connection:
-                return_db_connection(connection)
             return jsonify({
                 'status': 'error',
                 'message': f'Authentication error: {str(e)}'
             }), 500
+        
+        if not entry:
+            return jsonify({
+                'status': 'error',
+                'message': 'Authentication required'
+            }), 401
+        
+        if entry['user_type'] != 'admin':
+            return jsonify({
+                'status': 'error',
+                'message': 'Admin access required'
+            }), 403
+        
+        if not entry['principal']:
+            return jsonify({
+                'status': 'error',
+                'message': 'Admin account not found'
+            }), 401
+        
+        g.current_user = dict(entry['principal'])
+        g.user_type = 'admin'
+        
+        return f(*args, **kwargs)
     
     return decorated_function
 
@@ -457,22 +489,22 @@ def require_ctv(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user = get_current_user()
+        entry = load_session(get_request_token())
         
-        if not user:
+        if not entry:
             return jsonify({
                 'status': 'error',
                 'message': 'Authentication required'
             }), 401
         
-        if user.get('user_type') != 'ctv':
+        if entry['user_type'] != 'ctv':
             return jsonify({
                 'status': 'error',
                 'message': 'CTV access required'
             }), 403
         
-        # Get full CTV info
-        ctv_info = get_ctv_info(user['user_id'])
+        # Full CTV info is cached with the session
+        ctv_info = entry['principal']
         if not ctv_info:
             return jsonify({
                 'status': 'error',
@@ -485,7 +517,7 @@ def require_ctv(f):
                 'message': 'CTV account is deactivated'
             }), 403
         
-        g.current_user = ctv_info
+        g.current_user = dict(ctv_info)
         g.user_type = 'ctv'
         
         return f(*args, **kwargs)
@@ -728,6 +760,8 @@ def change_ctv_password(ma_ctv, current_password, new_password):
         cursor.close()
         return_db_connection(connection)
         
+        invalidate_user('ctv', ctv['ma_ctv'])
+        
         return {'success': True}
         
     except Error as e:
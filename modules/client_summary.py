@@ -0,0 +1,183 @@
+"""
+Client Summary Module
+Helpers for client_summary (one row per client card: sdt, ten_khach) and for
+keyset-paginated client lists.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - rebuild_client_summary(connection=None) -> int or None
+#     DOES: Recomputes every row from khach_hang
+#
+# - check_client_summary(connection=None) -> dict or None
+#     DOES: Compares the table with freshly computed rows
+#
+# - encode_client_cursor(last_visit_date, sdt, ten_khach) -> str
+#     DOES: Opaque keyset cursor of the last client of a page
+#
+# - decode_client_cursor(cursor_value) -> (date, str, str)
+#     DOES: Reverse of encode_client_cursor (ValueError if malformed)
+#
+# - count_client_summary(cursor, where_sql, params) -> (int, bool)
+#     DOES: Number of client_summary rows matching a filter, exact while it
+#           is cheap and estimated above CLIENT_COUNT_EXACT_LIMIT
+#
+# NOTES:
+# - Day-to-day maintenance is done by statement triggers on khach_hang, in the
+#   same transaction as the write (see migrate_client_summary.py).
+# - ten_khach is stored as '' for rows without a name.
+# - last_visit_date is MAX(ngay_nhap_don), UNDATED_DAY for clients without
+#   one, so keyset comparisons never meet NULL.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import json
+import base64
+from datetime import date
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+from .db_pool import get_db_connection, return_db_connection
+
+# Filtered lists are counted exactly up to this many clients, then estimated
+CLIENT_COUNT_EXACT_LIMIT = 10000
+
+SUMMARY_COLUMNS = """
+    sdt, ten_khach, sdt_norm, co_so, first_visit_date, last_visit_date,
+    nguoi_chot, closers, service_count, deposit_count, last_done_visit
+"""
+
+
+def rebuild_client_summary(connection=None):
+    """
+    DOES: Recompute the whole client_summary table
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Number of summary rows written, or None on failure
+
+    Writes to khach_hang are blocked (reads are not) until the rebuild commits.
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("LOCK TABLE khach_hang IN SHARE MODE")
+        cursor.execute("DELETE FROM client_summary")
+        cursor.execute(f"""
+            INSERT INTO client_summary ({SUMMARY_COLUMNS})
+            SELECT * FROM client_summary_rows(ARRAY(SELECT DISTINCT sdt::TEXT FROM khach_hang))
+        """)
+        rows = cursor.rowcount
+        connection.commit()
+        cursor.close()
+
+        if should_close:
+            return_db_connection(connection)
+        return rows
+
+    except Error as e:
+        print(f"Error rebuilding client_summary: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def check_client_summary(connection=None):
+    """
+    DOES: Verify client_summary against khach_hang
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Dict {'rows', 'missing', 'extra', 'consistent'}, or None on failure
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
+            WITH expected AS (
+                SELECT * FROM client_summary_rows(ARRAY(SELECT DISTINCT sdt::TEXT FROM khach_hang))
+            ),
+            actual AS (
+                SELECT {SUMMARY_COLUMNS} FROM client_summary
+            )
+            SELECT
+                (SELECT COUNT(*) FROM actual) as rows,
+                (SELECT COUNT(*) FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual) missing) as missing,
+                (SELECT COUNT(*) FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected) extra) as extra
+        """)
+        result = dict(cursor.fetchone())
+        result['consistent'] = result['missing'] == 0 and result['extra'] == 0
+        cursor.close()
+
+        if should_close:
+            return_db_connection(connection)
+        return result
+
+    except Error as e:
+        print(f"Error checking client_summary: {e}")
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def encode_client_cursor(last_visit_date, sdt, ten_khach):
+    """Opaque keyset cursor of the last client of a page"""
+    raw = json.dumps([last_visit_date.isoformat(), sdt, ten_khach or ''])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_client_cursor(cursor_value):
+    """(last_visit_date, sdt, ten_khach) of a cursor; raises ValueError if malformed"""
+    try:
+        last_visit, sdt, ten_khach = json.loads(base64.urlsafe_b64decode(cursor_value.encode('ascii')))
+        return date.fromisoformat(last_visit), str(sdt), str(ten_khach)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def count_client_summary(cursor, where_sql, params):
+    """
+    DOES: Count client_summary rows for a list's total
+    INPUTS: RealDictCursor, where_sql ('' or 'WHERE ...'), params of where_sql
+    OUTPUTS: (total, is_estimate)
+
+    The unfiltered total comes from the table statistics. Filtered totals are
+    counted up to CLIENT_COUNT_EXACT_LIMIT rows; past that the planner's row
+    estimate is used, so a broad filter costs the same as a narrow one.
+    """
+    if not where_sql:
+        cursor.execute("SELECT reltuples::BIGINT AS estimate FROM pg_class WHERE oid = 'client_summary'::regclass")
+        row = cursor.fetchone()
+        estimate = row['estimate'] if row else -1
+        if estimate >= 0:
+            return estimate, True
+        # Never analyzed
+        cursor.execute("SELECT COUNT(*) AS total FROM client_summary")
+        return cursor.fetchone()['total'], False
+
+    cursor.execute(f"""
+        SELECT COUNT(*) AS total FROM (
+            SELECT 1 FROM client_summary {where_sql} LIMIT %s
+        ) capped
+    """, list(params) + [CLIENT_COUNT_EXACT_LIMIT + 1])
+    total = cursor.fetchone()['total']
+    if total <= CLIENT_COUNT_EXACT_LIMIT:
+        return total, False
+
+    cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM client_summary {where_sql}", list(params))
+    plan = cursor.fetchone()['QUERY PLAN']
+    return max(int(plan[0]['Plan']['Plan Rows']), CLIENT_COUNT_EXACT_LIMIT + 1), True
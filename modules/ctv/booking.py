@@ -1,31 +1,25 @@
 """
 CTV Portal - Booking Appointments Module
 Handles creation of customer bookings/referrals from CTVs
-Saves to both database and Google Sheets
+Saves to the database and queues the row for Google Sheets (sheets_outbox)
 """
 
 import os
-import json
 import logging
 from datetime import datetime
-from pathlib import Path
 
 from flask import jsonify, request, g
 from psycopg2.extras import RealDictCursor
 
-import gspread
-from google.oauth2.service_account import Credentials
-
 from .blueprint import ctv_bp
 from ..auth import require_ctv
 from ..db_pool import get_db_connection, return_db_connection
+from ..google_sync import TAB_VARIATIONS
+from ..sheets_client import get_worksheet
+from ..sheets_outbox import enqueue_sheet_row, notify_sheets_outbox
 
 # Configuration
-BASE_DIR = Path(__file__).parent.parent.parent.absolute()
 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '12YrAEGiOKLoqzj4tE-VLZNQNIda7S5hdMaQJO5UEsnQ')
-CREDENTIALS_FILE = BASE_DIR / 'google_credentials.json'
-# Environment variable for credentials (JSON string) - used in production
-GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON')
 
 logger = logging.getLogger(__name__)
 
@@ -48,106 +42,56 @@ def clean_phone(phone):
     return cleaned[:15] if cleaned else None
 
 
-def get_google_client():
-    """Get authenticated Google Sheets client - supports both file and env variable"""
-    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+def build_booking_sheet_row(booking_data, referrer_phone, booking_date=None):
+    """
+    Build the 'Khách giới thiệu' row of a booking
+    Columns: Ngày nhập đơn, Tên khách hàng, Số điện thoại, Dịch vụ Quan tâm, Ghi chú,
+             Khu vực của khách hàng, SDT người giới thiệu
+    """
+    # Format date as DD/MM/YYYY for Google Sheets
+    booking_date = booking_date or datetime.now()
     
-    # Try environment variable first (for production/Railway)
-    if GOOGLE_CREDENTIALS_JSON:
-        try:
-            creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-            credentials = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-            logger.info("Using Google credentials from environment variable")
-            return gspread.authorize(credentials)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse GOOGLE_CREDENTIALS_JSON: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Failed to get Google client from env: {e}")
-            return None
+    # Format phone numbers as text strings to preserve leading zeros
+    # Prepend apostrophe to force Google Sheets to treat as text (apostrophe won't be visible in cell)
+    customer_phone_text = f"'{booking_data.get('customer_phone', '')}" if booking_data.get('customer_phone') else ''
+    referrer_phone_text = f"'{referrer_phone}" if referrer_phone else ''
     
-    # Fall back to file (for local development)
-    try:
-        if CREDENTIALS_FILE.exists():
-            credentials = Credentials.from_service_account_file(str(CREDENTIALS_FILE), scopes=scopes)
-            logger.info("Using Google credentials from file")
-            return gspread.authorize(credentials)
-        else:
-            logger.error(f"Google credentials file not found: {CREDENTIALS_FILE}")
-            return None
-    except Exception as e:
-        logger.error(f"Failed to get Google client from file: {e}")
-        return None
-
-
-def normalize_header(header):
-    """Normalize Vietnamese header to ASCII for comparison"""
-    import unicodedata
-    if not header:
-        return ''
-    vn_map = {
-        '\u0111': 'd', '\u0110': 'D', '\u0103': 'a', '\u0102': 'A', '\u00e2': 'a', '\u00c2': 'A',
-        '\u00ea': 'e', '\u00ca': 'E', '\u00f4': 'o', '\u00d4': 'O', '\u01a1': 'o', '\u01a0': 'O',
-        '\u01b0': 'u', '\u01af': 'U',
-    }
-    text = str(header)
-    for vn_char, ascii_char in vn_map.items():
-        text = text.replace(vn_char, ascii_char)
-    normalized = unicodedata.normalize('NFD', text)
-    return ''.join(c for c in normalized if unicodedata.category(c) != 'Mn').strip()
-
-
-def find_worksheet(spreadsheet, tab_variations):
-    """Find worksheet by trying multiple name variations"""
-    worksheets = spreadsheet.worksheets()
-    for variation in tab_variations:
-        for ws in worksheets:
-            if ws.title == variation:
-                return ws
-            if ws.title.lower() == variation.lower():
-                return ws
-            if normalize_header(ws.title) == normalize_header(variation):
-                return ws
-    return None
+    return [
+        booking_date.strftime('%d/%m/%Y'),          # Ngày nhập đơn
+        booking_data['customer_name'],              # Tên khách hàng
+        customer_phone_text,                        # Số điện thoại (as text to preserve leading zeros)
+        booking_data['service_interest'],           # Dịch vụ Quan tâm
+        booking_data.get('notes', ''),              # Ghi chú
+        booking_data.get('region', ''),             # Khu vực của khách hàng
+        referrer_phone_text                          # SDT người giới thiệu (as text to preserve leading zeros)
+    ]
+
+
+def queue_booking_for_sheet(cursor, booking_id, booking_data, referrer_phone):
+    """
+    Queue a booking's sheet row in the transaction that inserted it
+    The sheets_outbox dispatcher appends it after the commit
+    """
+    enqueue_sheet_row(
+        cursor,
+        f"khach_hang:{booking_id}",
+        'gioi_thieu',
+        build_booking_sheet_row(booking_data, referrer_phone),
+        GOOGLE_SHEET_ID
+    )
 
 
 def append_to_google_sheet(booking_data, referrer_phone):
-    """Append booking data to Google Sheets 'Khách giới thiệu' tab"""
+    """Append booking data to Google Sheets 'Khách giới thiệu' tab right away (bypasses the outbox)"""
     try:
-        client = get_google_client()
-        if not client:
-            logger.error("Failed to get Google client for booking")
-            return False, "Could not connect to Google Sheets"
-        
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
-        
-        # Find the Khách giới thiệu worksheet
-        variations = ['Khách giới thiệu', 'Khach gioi thieu', 'Gioi Thieu', 'Referral']
-        worksheet = find_worksheet(spreadsheet, variations)
+        # Shared client and cached worksheet handle (sheets_client)
+        worksheet = get_worksheet(GOOGLE_SHEET_ID, TAB_VARIATIONS['gioi_thieu'])
         
         if not worksheet:
             logger.error("Could not find 'Khách giới thiệu' worksheet")
             return False, "Could not find the referral worksheet"
         
-        # Format date as DD/MM/YYYY for Google Sheets
-        today = datetime.now().strftime('%d/%m/%Y')
-        
-        # Format phone numbers as text strings to preserve leading zeros
-        # Prepend apostrophe to force Google Sheets to treat as text (apostrophe won't be visible in cell)
-        customer_phone_text = f"'{booking_data.get('customer_phone', '')}" if booking_data.get('customer_phone') else ''
-        referrer_phone_text = f"'{referrer_phone}" if referrer_phone else ''
-        
-        # Build the row to append
-        # Columns: Ngày nhập đơn, Tên khách hàng, Số điện thoại, Dịch vụ Quan tâm, Ghi chú, Khu vực của khách hàng, SDT người giới thiệu
-        row = [
-            today,                                      # Ngày nhập đơn
-            booking_data['customer_name'],              # Tên khách hàng
-            customer_phone_text,                        # Số điện thoại (as text to preserve leading zeros)
-            booking_data['service_interest'],           # Dịch vụ Quan tâm
-            booking_data.get('notes', ''),              # Ghi chú
-            booking_data.get('region', ''),             # Khu vực của khách hàng
-            referrer_phone_text                          # SDT người giới thiệu (as text to preserve leading zeros)
-        ]
+        row = build_booking_sheet_row(booking_data, referrer_phone)
         
         worksheet.append_row(row, value_input_option='USER_ENTERED')
         logger.info(f"Successfully appended booking to Google Sheets for customer: {booking_data['customer_name']}")
@@ -161,7 +105,7 @@ def append_to_google_sheet(booking_data, referrer_phone):
 
 
 def save_to_database(booking_data, referrer_phone):
-    """Save booking to khach_hang table in database"""
+    """Save booking to khach_hang table and queue its sheet row, in one transaction"""
     connection = get_db_connection()
     if not connection:
         return False, "Database connection failed"
@@ -198,9 +142,12 @@ def save_to_database(booking_data, referrer_phone):
         result = cursor.fetchone()
         booking_id = result[0] if result else None
         
+        queue_booking_for_sheet(cursor, booking_id, booking_data, referrer_phone)
+        
         connection.commit()
         cursor.close()
         return_db_connection(connection)
+        notify_sheets_outbox()
         
         logger.info(f"Successfully saved booking to database with ID: {booking_id}")
         return True, booking_id
@@ -221,7 +168,8 @@ def create_booking():
     """
     Create a new customer booking/referral
     - Saves to database (khach_hang table)
-    - Appends to Google Sheets (Khách giới thiệu tab)
+    - Queues the Google Sheets row (Khách giới thiệu tab); a background
+      dispatcher appends it, so Sheets errors do not fail the booking
     """
     ctv = g.current_user
     
@@ -274,15 +222,9 @@ def create_booking():
             'message': f'Failed to save booking: {db_result}'
         }), 500
     
-    # Append to Google Sheets
-    sheets_success, sheets_error = append_to_google_sheet(booking_data, referrer_phone)
-    if not sheets_success:
-        # Log the error but don't fail the request since DB was successful
-        logger.warning(f"Google Sheets append failed: {sheets_error}")
-    
     return jsonify({
         'status': 'success',
         'message': 'Booking created successfully',
         'booking_id': db_result,
-        'sheets_synced': sheets_success
+        'sheets_queued': True
     })
@@ -4,7 +4,14 @@ from psycopg2 import Error
 from .blueprint import ctv_bp
 from ..auth import require_ctv
 from ..db_pool import get_db_connection, return_db_connection
-from .customers import normalize_phone
+from ..mlm_core import UNDATED_DAY
+from ..client_summary import encode_client_cursor, decode_client_cursor
+from .customers import build_phone_match_condition
+
+# Cards per page (?limit=) and services shown per card (?services_limit=, 0 = all)
+CLIENT_CARDS_MAX_LIMIT = 200
+CLIENT_CARD_SERVICES = 5
+
 
 @ctv_bp.route('/api/ctv/clients-with-services', methods=['GET'])
 @require_ctv
@@ -13,220 +20,223 @@ def get_ctv_clients_with_services():
     
     This includes both khach_hang (Beauty) and services (Dental) tables,
     using nguoi_chot as the closer for both.
+    
+    One query returns the page of clients (newest last visit first) together
+    with each client's latest services (ROW_NUMBER per sdt, ten_khach).
+    Query params: search, limit, services_limit (0 = all), cursor (next_cursor
+    of the previous page).
     """
     ctv = g.current_user
     
-    connection = get_db_connection()
+    search = request.args.get('search', '').strip()
+    limit = min(max(request.args.get('limit', 50, type=int), 1), CLIENT_CARDS_MAX_LIMIT)
+    services_limit = max(request.args.get('services_limit', CLIENT_CARD_SERVICES, type=int), 0)
+    cursor_value = request.args.get('cursor', '').strip()
+    
+    after = None
+    if cursor_value:
+        try:
+            after = decode_client_cursor(cursor_value)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        search = request.args.get('search', '').strip()
-        limit = request.args.get('limit', 50, type=int)
-        
-        # Normalize CTV code for matching (handles 0972020908 vs 972020908)
+        # Normalized key matching for nguoi_chot (handles 0972020908 vs 972020908)
         ctv_code = ctv['ma_ctv']
-        ctv_code_normalized = normalize_phone(ctv_code)
-        ctv_code_with_zero = '0' + ctv_code_normalized if ctv_code_normalized else ctv_code
         
-        # Get distinct clients from BOTH khach_hang and services where CTV is the closer
-        # Use normalized phone matching for nguoi_chot
-        client_query = """
-            SELECT 
-                sdt,
-                ten_khach,
-                MIN(co_so) as co_so,
-                MIN(first_date) as first_visit_date,
-                COUNT(*) as service_count
-            FROM (
+        # Rows from BOTH khach_hang and services where CTV is the closer
+        params = []
+        closer_filter_kh = build_phone_match_condition('nguoi_chot_norm', ctv_code, params)
+        closer_filter_svc = build_phone_match_condition('s.nguoi_chot_norm', ctv_code, params)
+        
+        # Undated rows sort as UNDATED_DAY so the keyset never compares NULLs
+        params.append(UNDATED_DAY)
+        
+        search_filter = ''
+        if search:
+            search_filter = "AND (ten_khach ILIKE %s OR sdt ILIKE %s)"
+            search_term = f"%{search}%"
+            params.extend([search_term, search_term])
+        
+        keyset_filter = ''
+        if after:
+            keyset_filter = "HAVING (COALESCE(MAX(ngay_nhap_don), %s), sdt, COALESCE(ten_khach, '')) < (%s, %s, %s)"
+            params.extend([UNDATED_DAY, after[0], after[1], after[2]])
+        params.extend([limit + 1, services_limit, services_limit])
+        
+        cursor.execute(f"""
+            WITH all_rows AS (
                 SELECT 
+                    id,
                     sdt,
                     ten_khach,
                     co_so,
-                    ngay_nhap_don as first_date,
-                    source
+                    dich_vu,
+                    tong_tien,
+                    tien_coc,
+                    phai_dong,
+                    ngay_hen_lam,
+                    ngay_nhap_don,
+                    trang_thai,
+                    source as source_type
                 FROM khach_hang
-                WHERE (nguoi_chot = %s OR nguoi_chot = %s OR nguoi_chot = %s
-                       OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {closer_filter_kh}
                 AND sdt IS NOT NULL AND sdt != ''
                 
                 UNION ALL
                 
                 SELECT 
+                    s.id,
                     c.phone as sdt,
                     c.name as ten_khach,
                     NULL as co_so,
-                    s.date_entered as first_date,
-                    'nha_khoa' as source
+                    s.service_name as dich_vu,
+                    s.tong_tien,
+                    0 as tien_coc,
+                    s.tong_tien as phai_dong,
+                    s.date_scheduled as ngay_hen_lam,
+                    s.date_entered as ngay_nhap_don,
+                    s.status as trang_thai,
+                    'nha_khoa' as source_type
                 FROM services s
                 JOIN customers c ON s.customer_id = c.id
-                WHERE (COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                       OR COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                       OR COALESCE(s.nguoi_chot, s.ctv_code) = %s
-                       OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {closer_filter_svc}
                 AND c.phone IS NOT NULL AND c.phone != ''
-            ) AS all_services
-            WHERE sdt IS NOT NULL AND sdt != ''
-        """
-        params = [ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized,
-                  ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized]
-        
-        if search:
-            client_query += " AND (ten_khach ILIKE %s OR sdt ILIKE %s)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term])
+            ),
+            page AS (
+                SELECT 
+                    sdt,
+                    ten_khach,
+                    MIN(co_so) as co_so,
+                    MIN(ngay_nhap_don) as first_visit_date,
+                    COALESCE(MAX(ngay_nhap_don), %s) as last_visit_date,
+                    COUNT(*) as service_count
+                FROM all_rows
+                WHERE 1=1 {search_filter}
+                GROUP BY sdt, ten_khach
+                {keyset_filter}
+                ORDER BY last_visit_date DESC, sdt DESC, COALESCE(ten_khach, '') DESC
+                LIMIT %s
+            ),
+            ranked AS (
+                SELECT 
+                    r.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY r.sdt, r.ten_khach
+                        ORDER BY r.ngay_nhap_don DESC, r.id DESC
+                    ) as rn
+                FROM all_rows r
+                JOIN page p ON p.sdt = r.sdt AND p.ten_khach IS NOT DISTINCT FROM r.ten_khach
+            )
+            SELECT 
+                p.sdt,
+                p.ten_khach,
+                p.co_so,
+                p.first_visit_date,
+                p.last_visit_date,
+                p.service_count,
+                em.email,
+                sv.id,
+                sv.dich_vu,
+                sv.tong_tien,
+                sv.tien_coc,
+                sv.phai_dong,
+                sv.ngay_hen_lam,
+                sv.ngay_nhap_don,
+                sv.trang_thai,
+                sv.source_type,
+                sv.rn
+            FROM page p
+            LEFT JOIN ranked sv
+                ON sv.sdt = p.sdt AND sv.ten_khach IS NOT DISTINCT FROM p.ten_khach
+                AND (%s = 0 OR sv.rn <= %s)
+            LEFT JOIN LATERAL (
+                SELECT email FROM customers
+                WHERE phone = p.sdt AND email IS NOT NULL AND email != ''
+                LIMIT 1
+            ) em ON TRUE
+            ORDER BY p.last_visit_date DESC, p.sdt DESC, COALESCE(p.ten_khach, '') DESC, sv.rn
+        """, params)
+        rows = cursor.fetchall()
         
-        # Sort by date
-        client_query += """
-            GROUP BY sdt, ten_khach
-            ORDER BY 
-                MAX(first_date) DESC
-            LIMIT %s
-        """
-        params.append(limit)
+        # Referrer and level of the CTV (the same on every card)
+        cursor.execute("""
+            SELECT nguoi_gioi_thieu, cap_bac FROM ctv WHERE ma_ctv = %s
+        """, (ctv['ma_ctv'],))
+        ctv_info = cursor.fetchone()
+        referrer_ctv_code = ctv_info.get('nguoi_gioi_thieu') if ctv_info else None
+        client_level = (ctv_info.get('cap_bac') if ctv_info else None) or 'Cong tac vien'
         
-        cursor.execute(client_query, params)
-        clients_raw = [dict(row) for row in cursor.fetchall()]
+        cursor.close()
+        return_db_connection(connection)
         
         clients = []
-        for client_row in clients_raw:
-            sdt = client_row['sdt']
-            ten_khach = client_row['ten_khach']
-            
-            # Get services from BOTH tables for this client where CTV is the closer
-            # Use normalized phone matching for nguoi_chot
-            cursor.execute("""
-                SELECT 
-                    id,
-                    dich_vu,
-                    tong_tien,
-                    tien_coc,
-                    phai_dong,
-                    ngay_hen_lam,
-                    ngay_nhap_don,
-                    trang_thai,
-                    nguoi_chot,
-                    source_type
-                FROM (
-                    SELECT 
-                        id,
-                        dich_vu,
-                        tong_tien,
-                        tien_coc,
-                        phai_dong,
-                        ngay_hen_lam,
-                        ngay_nhap_don,
-                        trang_thai,
-                        nguoi_chot,
-                        source as source_type
-                    FROM khach_hang
-                    WHERE sdt = %s AND (nguoi_chot = %s OR nguoi_chot = %s OR nguoi_chot = %s
-                           OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
-                    
-                    UNION ALL
-                    
-                    SELECT 
-                        s.id,
-                        s.service_name as dich_vu,
-                        s.tong_tien,
-                        0 as tien_coc,
-                        s.tong_tien as phai_dong,
-                        s.date_scheduled as ngay_hen_lam,
-                        s.date_entered as ngay_nhap_don,
-                        s.status as trang_thai,
-                        COALESCE(s.nguoi_chot, s.ctv_code) as nguoi_chot,
-                        'nha_khoa' as source_type
-                    FROM services s
-                    JOIN customers c ON s.customer_id = c.id
-                    WHERE c.phone = %s AND (COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                           OR COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                           OR COALESCE(s.nguoi_chot, s.ctv_code) = %s
-                           OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = %s)
-                ) AS all_svc
-                ORDER BY 
-                    ngay_nhap_don DESC
-                LIMIT 5
-            """, (sdt, ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized,
-                  sdt, ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized))
-            
-            services_raw = [dict(row) for row in cursor.fetchall()]
-            
-            services = []
-            for idx, svc in enumerate(services_raw):
-                tien_coc = float(svc['tien_coc'] or 0)
-                tong_tien = float(svc['tong_tien'] or 0)
-                phai_dong = float(svc['phai_dong'] or 0)
-                
-                deposit_status = 'Da coc' if tien_coc > 0 else 'Chua coc'
-                source_type = svc.get('source_type', 'tham_my')
-                
-                services.append({
-                    'id': svc['id'],
-                    'service_number': idx + 1,
-                    'dich_vu': svc['dich_vu'] or '',
-                    'tong_tien': tong_tien,
-                    'tien_coc': tien_coc,
-                    'phai_dong': phai_dong,
-                    'ngay_nhap_don': svc['ngay_nhap_don'].strftime('%d/%m/%Y') if svc['ngay_nhap_don'] else None,
-                    'ngay_hen_lam': svc['ngay_hen_lam'].strftime('%d/%m/%Y') if svc['ngay_hen_lam'] else None,
-                    'trang_thai': svc['trang_thai'] or '',
-                    'deposit_status': deposit_status,
-                    'source_type': source_type,
-                    'source': source_type
+        cursors = []
+        for row in rows:
+            key = (row['last_visit_date'], row['sdt'], row['ten_khach'])
+            if not cursors or cursors[-1] != key:
+                first_visit = row['first_visit_date']
+                clients.append({
+                    'ten_khach': row['ten_khach'] or '',
+                    'sdt': row['sdt'] or '',
+                    'email': row['email'] or '',
+                    'co_so': row['co_so'] or '',
+                    'first_visit_date': first_visit.strftime('%d/%m/%Y') if first_visit else None,
+                    'nguoi_chot': ctv['ma_ctv'],
+                    'referrer_ctv_code': referrer_ctv_code or '',
+                    'level': client_level,
+                    'service_count': row['service_count'],
+                    'overall_status': '',
+                    'overall_deposit': 'Chua coc',
+                    'services': []
                 })
+                cursors.append(key)
             
-            overall_status = services[0]['trang_thai'] if services else ''
-            overall_deposit = services[0]['deposit_status'] if services else 'Chua coc'
-            
-            first_visit = client_row['first_visit_date']
-            first_visit_str = first_visit.strftime('%d/%m/%Y') if first_visit else None
+            if row['rn'] is None:
+                continue
             
-            referrer_ctv_code = None
-            client_level = None
+            tien_coc = float(row['tien_coc'] or 0)
+            tong_tien = float(row['tong_tien'] or 0)
+            phai_dong = float(row['phai_dong'] or 0)
             
-            cursor.execute("""
-                SELECT nguoi_gioi_thieu, cap_bac FROM ctv WHERE ma_ctv = %s
-            """, (ctv['ma_ctv'],))
-            ctv_info = cursor.fetchone()
-            if ctv_info:
-                referrer_ctv_code = ctv_info.get('nguoi_gioi_thieu')
-                client_level = ctv_info.get('cap_bac') or 'Cong tac vien'
+            deposit_status = 'Da coc' if tien_coc > 0 else 'Chua coc'
+            source_type = row.get('source_type', 'tham_my')
             
-            email = ''
-            try:
-                cursor.execute("""
-                    SELECT email FROM customers WHERE phone = %s LIMIT 1
-                """, (sdt,))
-                email_row = cursor.fetchone()
-                if email_row and email_row.get('email'):
-                    email = email_row['email']
-            except Error:
-                pass
-            
-            clients.append({
-                'ten_khach': ten_khach or '',
-                'sdt': sdt or '',
-                'email': email,
-                'co_so': client_row['co_so'] or '',
-                'first_visit_date': first_visit_str,
-                'nguoi_chot': ctv['ma_ctv'],
-                'referrer_ctv_code': referrer_ctv_code or '',
-                'level': client_level or 'Cong tac vien',
-                'service_count': client_row['service_count'],
-                'overall_status': overall_status,
-                'overall_deposit': overall_deposit,
-                'services': services
+            client = clients[-1]
+            client['services'].append({
+                'id': row['id'],
+                'service_number': row['rn'],
+                'dich_vu': row['dich_vu'] or '',
+                'tong_tien': tong_tien,
+                'tien_coc': tien_coc,
+                'phai_dong': phai_dong,
+                'ngay_nhap_don': row['ngay_nhap_don'].strftime('%d/%m/%Y') if row['ngay_nhap_don'] else None,
+                'ngay_hen_lam': row['ngay_hen_lam'].strftime('%d/%m/%Y') if row['ngay_hen_lam'] else None,
+                'trang_thai': row['trang_thai'] or '',
+                'deposit_status': deposit_status,
+                'source_type': source_type,
+                'source': source_type
             })
+            if row['rn'] == 1:
+                client['overall_status'] = row['trang_thai'] or ''
+                client['overall_deposit'] = deposit_status
         
-        cursor.close()
-        return_db_connection(connection)
+        # limit + 1 clients were read to know whether another page exists
+        has_more = len(clients) > limit
+        clients = clients[:limit]
         
         return jsonify({
             'status': 'success',
             'clients': clients,
-            'total': len(clients)
+            'total': len(clients),
+            'has_more': has_more,
+            'next_cursor': encode_client_cursor(*cursors[limit - 1]) if has_more else None
         })
         
     except Error as e:
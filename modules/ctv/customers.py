@@ -5,7 +5,8 @@ from psycopg2 import Error
 from .blueprint import ctv_bp
 from ..auth import require_ctv
 from ..db_pool import get_db_connection, return_db_connection
-from ..mlm_core import get_all_descendants, calculate_new_commissions_fast
+from ..mlm_core import get_all_descendants, build_rollup_date_condition
+from ..dashboard_cache import get_ctv_dashboard, TTL_DATE_RANGES
 
 
 def normalize_phone(phone):
@@ -37,34 +38,29 @@ def normalize_phone(phone):
 def build_phone_match_condition(column_name, phone_value, param_list):
     """
     Build SQL condition for flexible phone matching.
-    Handles cases where phone may have leading zero or not.
+    Handles cases where phone may have leading zero or not by comparing
+    against a persisted normalized key column (see migrate_phone_norm.py),
+    so the match is an indexed equality instead of a per-row REGEXP_REPLACE.
     
     Args:
-        column_name: SQL column name (e.g., 'nguoi_chot')
-        phone_value: Phone number to match
+        column_name: Normalized key column (e.g., 'nguoi_chot_norm', 'kh.sdt_norm')
+        phone_value: Phone number or CTV code to match
         param_list: List to append parameters to
         
     Returns:
         SQL condition string
     """
-    normalized = normalize_phone(phone_value)
-    if not normalized:
-        param_list.append(phone_value)
-        return f"{column_name} = %s"
-    
-    # Match using RIGHT() to compare last 9 digits
-    param_list.append(normalized)
-    param_list.append(normalized)
-    return f"(RIGHT(REGEXP_REPLACE({column_name}, '[^0-9]', '', 'g'), 9) = %s OR RIGHT(REGEXP_REPLACE({column_name}, '[^0-9]', '', 'g'), 9) = LPAD(%s, 9, '0'))"
+    param_list.append(phone_value)
+    return f"{column_name} = phone_key(%s)"
 
 
 def build_phone_in_condition(column_name, phone_list):
     """
-    Build SQL condition for matching column against list of phones with normalization.
+    Build SQL condition for matching a normalized key column against a list of phones.
     
     Args:
-        column_name: SQL column name (e.g., 'nguoi_chot')
-        phone_list: List of phone numbers
+        column_name: Normalized key column (e.g., 'nguoi_chot_norm')
+        phone_list: List of phone numbers or CTV codes
         
     Returns:
         Tuple of (SQL condition string, parameters list)
@@ -72,33 +68,102 @@ def build_phone_in_condition(column_name, phone_list):
     if not phone_list:
         return "FALSE", []
     
-    # Normalize all phones in the list
-    normalized_phones = [normalize_phone(p) for p in phone_list]
-    # Also keep originals for exact match
-    all_variants = set()
-    for p in phone_list:
-        all_variants.add(str(p))
-        norm = normalize_phone(p)
-        if norm:
-            all_variants.add(norm)
-            # Add with leading zero
-            all_variants.add('0' + norm)
+    # Keys are computed once from the array, then matched with an index scan
+    return (
+        f"{column_name} = ANY(ARRAY(SELECT phone_key(code) FROM unnest(%s::text[]) AS code))",
+        [[str(p) for p in phone_list]]
+    )
+
+def get_personal_sales_totals(cursor, ctv_code, from_date=None, to_date=None):
+    """
+    Revenue and transaction count of a CTV's own closed sales (level 0),
+    read from ctv_daily_rollup.
     
-    all_variants = list(all_variants)
-    placeholders = ','.join(['%s'] * len(all_variants))
+    Args:
+        cursor: RealDictCursor
+        ctv_code: CTV code
+        from_date: Optional inclusive lower bound (ngay_hen_lam / date_entered)
+        to_date: Optional inclusive upper bound (ngay_hen_lam / date_entered)
+        
+    Returns:
+        Dict {'total_revenue': float, 'transaction_count': int}
+    """
+    params = [ctv_code]
+    day_condition = build_rollup_date_condition('day', from_date, to_date, params)
+    cursor.execute(f"""
+        SELECT 
+            COALESCE(SUM(revenue), 0) as total_revenue,
+            COALESCE(SUM(tx_count), 0) as transaction_count
+        FROM ctv_daily_rollup
+        WHERE ctv_code = %s AND level = 0
+        AND {day_condition}
+    """, params)
+    row = cursor.fetchone()
+    return {
+        'total_revenue': float(row['total_revenue'] or 0),
+        'transaction_count': int(row['transaction_count'] or 0)
+    }
+
+
+def get_downline_level_totals(cursor, ctv_code, from_date=None, to_date=None, max_level=4):
+    """
+    Revenue and transaction count of every downline level in one query.
+    Levels come from ctv_closure; sales are the level 0 rows of ctv_daily_rollup.
+    CTVs sharing a normalized code share their sales, so each key is counted
+    once per level (like matching khach_hang / services on the key directly).
     
-    # Match either exact or normalized
-    return f"({column_name} IN ({placeholders}) OR RIGHT(REGEXP_REPLACE({column_name}, '[^0-9]', '', 'g'), 9) IN ({placeholders}))", all_variants + [normalize_phone(p) for p in phone_list]
-
-@ctv_bp.route('/api/ctv/lifetime-stats', methods=['GET'])
-@require_ctv
-def get_lifetime_stats():
-    """Get lifetime statistics for the CTV - all-time cumulative data"""
-    ctv = g.current_user
+    Args:
+        cursor: RealDictCursor
+        ctv_code: Root CTV code
+        from_date: Optional inclusive lower bound (ngay_hen_lam / date_entered)
+        to_date: Optional inclusive upper bound (ngay_hen_lam / date_entered)
+        max_level: Deepest level to include
+        
+    Returns:
+        Dict {level: {'total_revenue': float, 'transaction_count': int}} for every
+        level 1..max_level that has at least one CTV
+    """
+    params = [ctv_code, max_level]
+    day_condition = build_rollup_date_condition('r.day', from_date, to_date, params)
     
-    connection = get_db_connection()
+    cursor.execute(f"""
+        WITH level_keys AS (
+            SELECT DISTINCT cl.depth, d.ma_ctv_norm
+            FROM ctv_closure cl
+            JOIN ctv d ON d.ma_ctv = cl.descendant
+            WHERE cl.ancestor = %s AND cl.depth BETWEEN 1 AND %s
+        ),
+        key_sales AS (
+            SELECT DISTINCT ON (c.ma_ctv_norm, r.day) c.ma_ctv_norm, r.revenue, r.tx_count
+            FROM ctv_daily_rollup r
+            JOIN ctv c ON c.ma_ctv = r.ctv_code
+            WHERE r.level = 0
+            AND c.ma_ctv_norm IN (SELECT ma_ctv_norm FROM level_keys)
+            AND {day_condition}
+        )
+        SELECT 
+            lk.depth as level,
+            COALESCE(SUM(ks.revenue), 0) as total_revenue,
+            COALESCE(SUM(ks.tx_count), 0) as transaction_count
+        FROM level_keys lk
+        LEFT JOIN key_sales ks ON ks.ma_ctv_norm = lk.ma_ctv_norm
+        GROUP BY lk.depth
+        ORDER BY lk.depth
+    """, params)
+    
+    return {
+        row['level']: {
+            'total_revenue': float(row['total_revenue'] or 0),
+            'transaction_count': int(row['transaction_count'] or 0)
+        }
+        for row in cursor.fetchall()
+    }
+
+def _build_lifetime_stats(ctv_code):
+    """All-time cumulative stats payload of /api/ctv/lifetime-stats (None if the database is unreachable)"""
+    connection = get_db_connection(shared=True)
     if not connection:
-        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        return None
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
@@ -111,39 +176,10 @@ def get_lifetime_stats():
         commission_rates = {row['level']: float(row['percent']) / 100 for row in rates_rows}
         active_levels = {row['level'] for row in rates_rows if row.get('is_active', True)}
         
-        # Normalize CTV code for matching (handles 0972020908 vs 972020908)
-        ctv_code = ctv['ma_ctv']
-        ctv_code_normalized = normalize_phone(ctv_code)
-        ctv_code_with_zero = '0' + ctv_code_normalized if ctv_code_normalized else ctv_code
-        
-        # Level 0 (Personal Sales) - Use normalized phone matching for nguoi_chot
-        level0_query_kh = """
-            SELECT 
-                SUM(tong_tien) as total_revenue,
-                COUNT(*) as transaction_count
-            FROM khach_hang
-            WHERE (nguoi_chot = %s OR nguoi_chot = %s OR nguoi_chot = %s
-                   OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
-            AND trang_thai IN ('Da den lam', 'Đã đến làm')
-        """
-        cursor.execute(level0_query_kh, (ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized))
-        level0_kh = cursor.fetchone()
-        
-        level0_query_svc = """
-            SELECT 
-                SUM(tong_tien) as total_revenue,
-                COUNT(*) as transaction_count
-            FROM services
-            WHERE (COALESCE(nguoi_chot, ctv_code) = %s 
-                   OR COALESCE(nguoi_chot, ctv_code) = %s 
-                   OR COALESCE(nguoi_chot, ctv_code) = %s
-                   OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) = %s)
-        """
-        cursor.execute(level0_query_svc, (ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized))
-        level0_svc = cursor.fetchone()
-        
-        level0_revenue = float(level0_kh['total_revenue'] or 0) + float(level0_svc['total_revenue'] or 0)
-        level0_count = int(level0_kh['transaction_count'] or 0) + int(level0_svc['transaction_count'] or 0)
+        # Level 0 (Personal Sales)
+        level0 = get_personal_sales_totals(cursor, ctv_code)
+        level0_revenue = level0['total_revenue']
+        level0_count = level0['transaction_count']
         level0_rate = commission_rates.get(0, 0.25)
         # Only calculate commission if level 0 is active
         level0_commission = level0_revenue * level0_rate if 0 in active_levels else 0
@@ -153,106 +189,33 @@ def get_lifetime_stats():
         total_transactions = level0_count
         
         # Network Stats
-        my_network = get_all_descendants(ctv['ma_ctv'], connection)
+        my_network = get_all_descendants(ctv_code, connection)
         network_size = len(my_network) if my_network else 0
         
         cursor.execute("""
             SELECT COUNT(*) as direct_count
             FROM ctv
             WHERE nguoi_gioi_thieu = %s AND (is_active = TRUE OR is_active IS NULL)
-        """, (ctv['ma_ctv'],))
+        """, (ctv_code,))
         direct_result = cursor.fetchone()
         direct_referrals = int(direct_result['direct_count']) if direct_result else 0
         
-        # Calculate Downline Commissions
-        my_network_excluding_self = [c for c in my_network if c != ctv['ma_ctv']]
-        
-        if my_network_excluding_self:
-            # OPTIMIZED: Get descendants with levels in ONE query
-            cursor.execute("""
-                WITH RECURSIVE network AS (
-                    SELECT ma_ctv, 0 as level 
-                    FROM ctv 
-                    WHERE ma_ctv = %s
-                    
-                    UNION ALL
-                    
-                    SELECT c.ma_ctv, n.level + 1
-                    FROM ctv c
-                    JOIN network n ON c.nguoi_gioi_thieu = n.ma_ctv
-                    WHERE n.level < 4
-                )
-                SELECT ma_ctv, level FROM network WHERE level > 0
-            """, (ctv['ma_ctv'],))
-            
-            network_with_levels = cursor.fetchall()
-            
-            ctvs_by_level = {1: [], 2: [], 3: [], 4: []}
-            for row in network_with_levels:
-                lvl = row['level']
-                if lvl in ctvs_by_level:
-                    ctvs_by_level[lvl].append(row['ma_ctv'])
+        # Calculate Downline Commissions (one GROUP BY depth over ctv_closure)
+        for level, totals in get_downline_level_totals(cursor, ctv_code).items():
+            level_revenue = totals['total_revenue']
+            level_count = totals['transaction_count']
+            # Only calculate commission if level is active
+            level_commission = level_revenue * commission_rates.get(level, 0) if level in active_levels else 0
             
-            for level in range(1, 5):
-                level_ctv_list = ctvs_by_level.get(level, [])
-                
-                if level_ctv_list:
-                    # Build normalized phone matching for nguoi_chot
-                    # Include both original and normalized versions of each CTV code
-                    all_code_variants = set()
-                    normalized_codes = []
-                    for code in level_ctv_list:
-                        all_code_variants.add(code)
-                        norm = normalize_phone(code)
-                        if norm:
-                            all_code_variants.add(norm)
-                            all_code_variants.add('0' + norm)
-                            normalized_codes.append(norm)
-                    
-                    all_code_variants = list(all_code_variants)
-                    placeholders = ','.join(['%s'] * len(all_code_variants))
-                    norm_placeholders = ','.join(['%s'] * len(normalized_codes)) if normalized_codes else "''"
-                    
-                    level_query_kh = f"""
-                        SELECT 
-                            COALESCE(SUM(tong_tien), 0) as total_revenue,
-                            COUNT(*) as transaction_count
-                        FROM khach_hang
-                        WHERE (nguoi_chot IN ({placeholders})
-                               OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
-                        AND trang_thai IN ('Da den lam', 'Đã đến làm')
-                    """
-                    cursor.execute(level_query_kh, all_code_variants + normalized_codes)
-                    level_data_kh = cursor.fetchone()
-                    
-                    level_query_svc = f"""
-                        SELECT 
-                            COALESCE(SUM(tong_tien), 0) as total_revenue,
-                            COUNT(*) as transaction_count
-                        FROM services
-                        WHERE (COALESCE(nguoi_chot, ctv_code) IN ({placeholders})
-                               OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
-                    """
-                    cursor.execute(level_query_svc, all_code_variants + normalized_codes)
-                    level_data_svc = cursor.fetchone()
-                    
-                    level_revenue = float(level_data_kh['total_revenue'] or 0) + float(level_data_svc['total_revenue'] or 0)
-                    level_count = int(level_data_kh['transaction_count'] or 0) + int(level_data_svc['transaction_count'] or 0)
-                    # Only calculate commission if level is active
-                    level_commission = level_revenue * commission_rates.get(level, 0) if level in active_levels else 0
-                    
-                    total_commissions += level_commission
-                    total_revenue += level_revenue
-                    total_transactions += level_count
+            total_commissions += level_commission
+            total_revenue += level_revenue
+            total_transactions += level_count
         
         # Get total services count (completed) - same as total_transactions in this context
         total_services = total_transactions
         
         cursor.close()
-        return_db_connection(connection)
-        
-        return jsonify({
-            'status': 'success',
+        return {
             'stats': {
                 'total_commissions': total_commissions,
                 'total_revenue': total_revenue,
@@ -267,14 +230,27 @@ def get_lifetime_stats():
                     'transactions': level0_count
                 }
             }
-        })
-        
+        }
+    finally:
+        return_db_connection(connection)
+
+
+@ctv_bp.route('/api/ctv/lifetime-stats', methods=['GET'])
+@require_ctv
+def get_lifetime_stats():
+    """Get lifetime statistics for the CTV - all-time cumulative data"""
+    ctv = g.current_user
+    
+    try:
+        payload = get_ctv_dashboard(ctv['ma_ctv'], 'lifetime', (), lambda: _build_lifetime_stats(ctv['ma_ctv']))
     except Exception as e:
         import traceback
         traceback.print_exc()
-        if connection:
-            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e), 'traceback': traceback.format_exc()}), 500
+    
+    if payload is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify(dict(payload, status='success'))
 
 
 @ctv_bp.route('/api/ctv/customers', methods=['GET'])
@@ -283,7 +259,7 @@ def get_ctv_customers():
     """Get all service transactions where CTV is the closer (from both khach_hang and services)"""
     ctv = g.current_user
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -294,17 +270,17 @@ def get_ctv_customers():
         from_date = request.args.get('from')
         to_date = request.args.get('to')
         
-        # Normalize CTV code for matching (handles 0972020908 vs 972020908)
+        # Normalized key matching for nguoi_chot (handles 0972020908 vs 972020908)
         ctv_code = ctv['ma_ctv']
-        ctv_code_normalized = normalize_phone(ctv_code)
-        ctv_code_with_zero = '0' + ctv_code_normalized if ctv_code_normalized else ctv_code
         
         # Build date filters
         date_filter_kh = ""
         date_filter_svc = ""
         # Parameters for normalized nguoi_chot matching
-        params_kh = [ctv_code, ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized]
-        params_svc = [ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized]
+        params_kh = [ctv_code]
+        closer_filter_kh = build_phone_match_condition('kh.nguoi_chot_norm', ctv_code, params_kh)
+        params_svc = []
+        closer_filter_svc = build_phone_match_condition('s.nguoi_chot_norm', ctv_code, params_svc)
         
         if status:
             date_filter_kh += " AND kh.trang_thai = %s"
@@ -346,8 +322,7 @@ def get_ctv_customers():
                     'tham_my' as source_type
                 FROM khach_hang kh
                 LEFT JOIN commissions c ON c.transaction_id = -ABS(kh.id) AND c.ctv_code = %s AND c.level = 0
-                WHERE (kh.nguoi_chot = %s OR kh.nguoi_chot = %s OR kh.nguoi_chot = %s
-                       OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {closer_filter_kh}
                 {date_filter_kh}
                 
                 UNION ALL
@@ -373,10 +348,7 @@ def get_ctv_customers():
                 FROM services s
                 LEFT JOIN customers cust ON s.customer_id = cust.id
                 LEFT JOIN commissions c ON c.transaction_id = s.id AND c.ctv_code = COALESCE(s.nguoi_chot, s.ctv_code) AND c.level = 0
-                WHERE (COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                       OR COALESCE(s.nguoi_chot, s.ctv_code) = %s 
-                       OR COALESCE(s.nguoi_chot, s.ctv_code) = %s
-                       OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {closer_filter_svc}
                 {date_filter_svc}
             ) AS all_transactions
             ORDER BY ngay_hen_lam DESC, id DESC
@@ -399,7 +371,10 @@ def get_ctv_customers():
             c['commission_amount'] = float(c.get('commission_amount') or 0)
         
         # Summary from both tables with normalized phone matching
-        cursor.execute("""
+        summary_params = []
+        summary_filter_kh = build_phone_match_condition('nguoi_chot_norm', ctv_code, summary_params)
+        summary_filter_svc = build_phone_match_condition('nguoi_chot_norm', ctv_code, summary_params)
+        cursor.execute(f"""
             SELECT 
                 COALESCE(kh.total_count, 0) + COALESCE(svc.total_count, 0) as total_count,
                 COALESCE(kh.completed_count, 0) + COALESCE(svc.completed_count, 0) as completed_count,
@@ -412,8 +387,7 @@ def get_ctv_customers():
                     SUM(CASE WHEN trang_thai IN ('Da den lam', 'Đã đến làm') THEN tong_tien ELSE 0 END) as total_revenue,
                     SUM(CASE WHEN trang_thai IN ('Da coc', 'Đã cọc') THEN 1 ELSE 0 END) as pending_count
                 FROM khach_hang
-                WHERE (nguoi_chot = %s OR nguoi_chot = %s OR nguoi_chot = %s
-                       OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {summary_filter_kh}
             ) kh,
             (
                 SELECT 
@@ -421,13 +395,9 @@ def get_ctv_customers():
                     COUNT(*) as completed_count,
                     SUM(tong_tien) as total_revenue
                 FROM services
-                WHERE (COALESCE(nguoi_chot, ctv_code) = %s 
-                       OR COALESCE(nguoi_chot, ctv_code) = %s 
-                       OR COALESCE(nguoi_chot, ctv_code) = %s
-                       OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) = %s)
+                WHERE {summary_filter_svc}
             ) svc
-        """, (ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized,
-              ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized))
+        """, summary_params)
         
         summary = cursor.fetchone()
         
@@ -459,7 +429,7 @@ def get_ctv_earliest_date():
     """Get the earliest customer date for the CTV and their network"""
     ctv = g.current_user
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -471,15 +441,15 @@ def get_ctv_earliest_date():
         if not my_network:
             my_network = [ctv['ma_ctv']]
         
-        placeholders = ','.join(['%s'] * len(my_network))
+        network_condition, network_params = build_phone_in_condition('nguoi_chot_norm', list(my_network))
         query = f"""
             SELECT MIN(ngay_hen_lam) as earliest_date
             FROM khach_hang
-            WHERE nguoi_chot IN ({placeholders})
+            WHERE {network_condition}
             AND ngay_hen_lam IS NOT NULL
         """
         
-        cursor.execute(query, list(my_network))
+        cursor.execute(query, network_params)
         result = cursor.fetchone()
         
         earliest_date = None
@@ -502,103 +472,26 @@ def get_ctv_earliest_date():
         return jsonify({'status': 'error', 'message': str(e), 'traceback': traceback.format_exc()}), 500
 
 
-@ctv_bp.route('/api/ctv/commission', methods=['GET'])
-@require_ctv
-def get_ctv_commission():
-    """Get commission based on khach_hang table with date filter on ngay_hen_lam"""
-    ctv = g.current_user
-
-    connection = get_db_connection()
+def _build_ctv_commission(ctv_code, from_date, to_date):
+    """Per-level commission payload of /api/ctv/commission (None if the database is unreachable)"""
+    connection = get_db_connection(shared=True)
     if not connection:
-        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        return None
 
     try:
-        # REMOVED calculate_new_commissions_fast(connection=connection)
-        
         cursor = connection.cursor(cursor_factory=RealDictCursor)
 
-        from_date = request.args.get('from')
-        to_date = request.args.get('to')
-        month = request.args.get('month')
-        day = request.args.get('day')
-
-        if month and not from_date and not to_date:
-            if day:
-                from_date = day
-                to_date = day
-            else:
-                try:
-                    year, month_num = map(int, month.split('-'))
-                    from_date = f"{year}-{month_num:02d}-01"
-                    if month_num == 12:
-                        to_date = f"{year+1}-01-01"
-                    else:
-                        to_date = f"{year}-{month_num+1:02d}-01"
-                except ValueError:
-                    return jsonify({'status': 'error', 'message': 'Invalid month format'}), 400
-        
         cursor.execute("SELECT level, percent, is_active FROM hoa_hong_config ORDER BY level")
         rates_rows = cursor.fetchall()
         commission_rates = {row['level']: float(row['percent']) / 100 for row in rates_rows}
         active_levels = {row['level'] for row in rates_rows if row.get('is_active', True)}
         
-        # Normalize CTV code for matching (handles 0972020908 vs 972020908)
-        ctv_code = ctv['ma_ctv']
-        ctv_code_normalized = normalize_phone(ctv_code)
-        ctv_code_with_zero = '0' + ctv_code_normalized if ctv_code_normalized else ctv_code
-        
-        # Level 0 query with normalized phone matching for nguoi_chot
-        level0_query_kh = """
-            SELECT 
-                SUM(tong_tien) as total_revenue,
-                COUNT(*) as transaction_count
-            FROM khach_hang
-            WHERE (nguoi_chot = %s OR nguoi_chot = %s OR nguoi_chot = %s
-                   OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) = %s)
-            AND trang_thai IN ('Da den lam', 'Đã đến làm')
-        """
-        level0_params_kh = [ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized]
-        
-        if from_date:
-            level0_query_kh += " AND ngay_hen_lam >= %s"
-            level0_params_kh.append(from_date)
-        if to_date:
-            level0_query_kh += " AND ngay_hen_lam <= %s"
-            level0_params_kh.append(to_date)
-        
-        cursor.execute(level0_query_kh, level0_params_kh)
-        level0_kh = cursor.fetchone()
-        
-        # Use COALESCE(nguoi_chot, ctv_code) to get closer (not referrer) with normalized matching
-        level0_query_svc = """
-            SELECT 
-                SUM(tong_tien) as total_revenue,
-                COUNT(*) as transaction_count
-            FROM services
-            WHERE (COALESCE(nguoi_chot, ctv_code) = %s 
-                   OR COALESCE(nguoi_chot, ctv_code) = %s 
-                   OR COALESCE(nguoi_chot, ctv_code) = %s
-                   OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) = %s)
-        """
-        level0_params_svc = [ctv_code, ctv_code_normalized, ctv_code_with_zero, ctv_code_normalized]
-        
-        if from_date:
-            level0_query_svc += " AND date_entered >= %s"
-            level0_params_svc.append(from_date)
-        if to_date:
-            level0_query_svc += " AND date_entered <= %s"
-            level0_params_svc.append(to_date)
-        
-        cursor.execute(level0_query_svc, level0_params_svc)
-        level0_svc = cursor.fetchone()
-        
-        level0_revenue = float(level0_kh['total_revenue'] or 0) + float(level0_svc['total_revenue'] or 0)
-        level0_count = int(level0_kh['transaction_count'] or 0) + int(level0_svc['transaction_count'] or 0)
+        # Level 0 (Personal Sales)
+        level0 = get_personal_sales_totals(cursor, ctv_code, from_date, to_date)
+        level0_revenue = level0['total_revenue']
+        level0_count = level0['transaction_count']
         level0_commission = level0_revenue * commission_rates.get(0, 0.25)
         
-        my_network = get_all_descendants(ctv['ma_ctv'], connection)
-        my_network_excluding_self = [c for c in my_network if c != ctv['ma_ctv']]
-        
         level_commissions = [{
             'level': 0,
             'description': 'Doanh so ban than',
@@ -608,107 +501,17 @@ def get_ctv_commission():
             'commission': level0_commission
         }]
         
-        if my_network_excluding_self:
-            # OPTIMIZED: Get descendants with levels in ONE query
-            cursor.execute("""
-                WITH RECURSIVE network AS (
-                    SELECT ma_ctv, 0 as level 
-                    FROM ctv 
-                    WHERE ma_ctv = %s
-                    
-                    UNION ALL
-                    
-                    SELECT c.ma_ctv, n.level + 1
-                    FROM ctv c
-                    JOIN network n ON c.nguoi_gioi_thieu = n.ma_ctv
-                    WHERE n.level < 4
-                )
-                SELECT ma_ctv, level FROM network WHERE level > 0
-            """, (ctv['ma_ctv'],))
-            
-            network_with_levels = cursor.fetchall()
-            
-            # Group by level
-            ctvs_by_level = {1: [], 2: [], 3: [], 4: []}
-            for row in network_with_levels:
-                lvl = row['level']
-                if lvl in ctvs_by_level:
-                    ctvs_by_level[lvl].append(row['ma_ctv'])
-            
-            for level in range(1, 5):
-                level_ctv_list = ctvs_by_level.get(level, [])
-                
-                if level_ctv_list:
-                    # Build normalized phone matching for nguoi_chot
-                    # Include both original and normalized versions of each CTV code
-                    all_code_variants = set()
-                    normalized_codes = []
-                    for code in level_ctv_list:
-                        all_code_variants.add(code)
-                        norm = normalize_phone(code)
-                        if norm:
-                            all_code_variants.add(norm)
-                            all_code_variants.add('0' + norm)
-                            normalized_codes.append(norm)
-                    
-                    all_code_variants = list(all_code_variants)
-                    placeholders = ','.join(['%s'] * len(all_code_variants))
-                    norm_placeholders = ','.join(['%s'] * len(normalized_codes)) if normalized_codes else "''"
-                    
-                    level_query_kh = f"""
-                        SELECT 
-                            COALESCE(SUM(tong_tien), 0) as total_revenue,
-                            COUNT(*) as transaction_count
-                        FROM khach_hang
-                        WHERE (nguoi_chot IN ({placeholders})
-                               OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
-                        AND trang_thai IN ('Da den lam', 'Đã đến làm')
-                    """
-                    level_params_kh = all_code_variants + normalized_codes
-                    
-                    if from_date:
-                        level_query_kh += " AND ngay_hen_lam >= %s"
-                        level_params_kh.append(from_date)
-                    if to_date:
-                        level_query_kh += " AND ngay_hen_lam <= %s"
-                        level_params_kh.append(to_date)
-                    
-                    cursor.execute(level_query_kh, level_params_kh)
-                    level_data_kh = cursor.fetchone()
-                    
-                    # Use COALESCE(nguoi_chot, ctv_code) to get closer (not referrer) with normalized matching
-                    level_query_svc = f"""
-                        SELECT 
-                            COALESCE(SUM(tong_tien), 0) as total_revenue,
-                            COUNT(*) as transaction_count
-                        FROM services
-                        WHERE (COALESCE(nguoi_chot, ctv_code) IN ({placeholders})
-                               OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
-                    """
-                    level_params_svc = all_code_variants + normalized_codes
-                    
-                    if from_date:
-                        level_query_svc += " AND date_entered >= %s"
-                        level_params_svc.append(from_date)
-                    if to_date:
-                        level_query_svc += " AND date_entered <= %s"
-                        level_params_svc.append(to_date)
-                    
-                    cursor.execute(level_query_svc, level_params_svc)
-                    level_data_svc = cursor.fetchone()
-                    
-                    level_revenue = float(level_data_kh['total_revenue'] or 0) + float(level_data_svc['total_revenue'] or 0)
-                    level_count = int(level_data_kh['transaction_count'] or 0) + int(level_data_svc['transaction_count'] or 0)
-                    level_commission = level_revenue * commission_rates.get(level, 0)
-                    
-                    level_commissions.append({
-                        'level': level,
-                        'description': f'Doanh so Level {level}',
-                        'total_revenue': level_revenue,
-                        'transaction_count': level_count,
-                        'rate': commission_rates.get(level, 0) * 100,
-                        'commission': level_commission
-                    })
+        # Downline levels (one GROUP BY depth over ctv_closure)
+        level_totals = get_downline_level_totals(cursor, ctv_code, from_date, to_date)
+        for level, totals in level_totals.items():
+            level_commissions.append({
+                'level': level,
+                'description': f'Doanh so Level {level}',
+                'total_revenue': totals['total_revenue'],
+                'transaction_count': totals['transaction_count'],
+                'rate': commission_rates.get(level, 0) * 100,
+                'commission': totals['total_revenue'] * commission_rates.get(level, 0)
+            })
         
         # Filter out inactive levels from the response
         active_level_commissions = [lc for lc in level_commissions if lc['level'] in active_levels]
@@ -718,10 +521,7 @@ def get_ctv_commission():
         total_revenue = sum(lc['total_revenue'] for lc in active_level_commissions)
         
         cursor.close()
-        return_db_connection(connection)
-        
-        return jsonify({
-            'status': 'success',
+        return {
             'filter': {
                 'from': from_date,
                 'to': to_date
@@ -732,49 +532,66 @@ def get_ctv_commission():
                 'transactions': total_transactions,
                 'revenue': total_revenue
             }
-        })
-        
+        }
+    finally:
+        return_db_connection(connection)
+
+
+@ctv_bp.route('/api/ctv/commission', methods=['GET'])
+@require_ctv
+def get_ctv_commission():
+    """Get commission based on khach_hang table with date filter on ngay_hen_lam"""
+    ctv = g.current_user
+
+    from_date = request.args.get('from')
+    to_date = request.args.get('to')
+    month = request.args.get('month')
+    day = request.args.get('day')
+
+    if month and not from_date and not to_date:
+        if day:
+            from_date = day
+            to_date = day
+        else:
+            try:
+                year, month_num = map(int, month.split('-'))
+                from_date = f"{year}-{month_num:02d}-01"
+                if month_num == 12:
+                    to_date = f"{year+1}-01-01"
+                else:
+                    to_date = f"{year}-{month_num+1:02d}-01"
+            except ValueError:
+                return jsonify({'status': 'error', 'message': 'Invalid month format'}), 400
+
+    try:
+        payload = get_ctv_dashboard(ctv['ma_ctv'], 'commission', (from_date, to_date),
+                                    lambda: _build_ctv_commission(ctv['ma_ctv'], from_date, to_date))
     except Exception as e:
         import traceback
         traceback.print_exc()
-        if connection:
-            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e), 'traceback': traceback.format_exc()}), 500
 
+    if payload is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify(dict(payload, status='success'))
 
-@ctv_bp.route('/api/ctv/date-ranges-with-data', methods=['GET'])
-@require_ctv
-def get_date_ranges_with_data():
-    """Check which date range presets have data available"""
-    ctv = g.current_user
 
-    connection = get_db_connection()
+def _build_date_ranges_with_data(ctv_code, today):
+    """Preset -> has-data flags payload of /api/ctv/date-ranges-with-data (None if the database is unreachable)"""
+    connection = get_db_connection(shared=True)
     if not connection:
-        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        return None
 
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
-        today = datetime.date.today()
         ranges_with_data = {}
 
-        my_network = get_all_descendants(ctv['ma_ctv'], connection)
-        my_network_excluding_self = [c for c in my_network if c != ctv['ma_ctv']]
-        all_ctvs = [ctv['ma_ctv']] + my_network_excluding_self
-        
-        # Build normalized phone matching for nguoi_chot
-        all_code_variants = set()
-        normalized_codes = []
-        for code in all_ctvs:
-            all_code_variants.add(code)
-            norm = normalize_phone(code)
-            if norm:
-                all_code_variants.add(norm)
-                all_code_variants.add('0' + norm)
-                normalized_codes.append(norm)
-        
-        all_code_variants = list(all_code_variants)
-        placeholders = ','.join(['%s'] * len(all_code_variants))
-        norm_placeholders = ','.join(['%s'] * len(normalized_codes)) if normalized_codes else "''"
+        my_network = get_all_descendants(ctv_code, connection)
+        my_network_excluding_self = [c for c in my_network if c != ctv_code]
+        all_ctvs = [ctv_code] + my_network_excluding_self
+        
+        # Normalized key matching for nguoi_chot
+        code_condition, code_params = build_phone_in_condition('nguoi_chot_norm', all_ctvs)
 
         days_since_sunday = (today.weekday() + 1) % 7
         week_start = today - datetime.timedelta(days=days_since_sunday)
@@ -801,43 +618,52 @@ def get_date_ranges_with_data():
             query_kh = f"""
                 SELECT COUNT(*) as count
                 FROM khach_hang
-                WHERE (nguoi_chot IN ({placeholders})
-                       OR RIGHT(REGEXP_REPLACE(nguoi_chot, '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
+                WHERE {code_condition}
                 AND ngay_hen_lam >= %s
                 AND ngay_hen_lam <= %s
             """
-            cursor.execute(query_kh, all_code_variants + normalized_codes + [from_date, to_date])
+            cursor.execute(query_kh, code_params + [from_date, to_date])
             kh_count = cursor.fetchone()['count']
 
-            # Use COALESCE(nguoi_chot, ctv_code) to get closer with normalized matching
+            # services.nguoi_chot_norm is keyed on the closer with normalized matching
             query_svc = f"""
                 SELECT COUNT(*) as count
                 FROM services
-                WHERE (COALESCE(nguoi_chot, ctv_code) IN ({placeholders})
-                       OR RIGHT(REGEXP_REPLACE(COALESCE(nguoi_chot, ctv_code), '[^0-9]', '', 'g'), 9) IN ({norm_placeholders}))
+                WHERE {code_condition}
                 AND date_entered >= %s
                 AND date_entered <= %s
             """
-            cursor.execute(query_svc, all_code_variants + normalized_codes + [from_date, to_date])
+            cursor.execute(query_svc, code_params + [from_date, to_date])
             svc_count = cursor.fetchone()['count']
 
             ranges_with_data[preset] = (kh_count > 0) or (svc_count > 0)
 
         cursor.close()
+        return {'ranges_with_data': ranges_with_data}
+    finally:
         return_db_connection(connection)
 
-        return jsonify({
-            'status': 'success',
-            'ranges_with_data': ranges_with_data
-        })
 
+@ctv_bp.route('/api/ctv/date-ranges-with-data', methods=['GET'])
+@require_ctv
+def get_date_ranges_with_data():
+    """Check which date range presets have data available"""
+    ctv = g.current_user
+    today = datetime.date.today()
+
+    try:
+        payload = get_ctv_dashboard(ctv['ma_ctv'], 'date_ranges', (today,),
+                                    lambda: _build_date_ranges_with_data(ctv['ma_ctv'], today),
+                                    ttl=TTL_DATE_RANGES)
     except Exception as e:
         import traceback
         traceback.print_exc()
-        if connection:
-            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e), 'traceback': traceback.format_exc()}), 500
 
+    if payload is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify(dict(payload, status='success'))
+
 
 def calculate_level_simple_v2(ancestor_code, descendant_code, cursor):
     """Efficient helper to calculate level between ancestor and descendant using shared cursor"""
@@ -884,31 +710,20 @@ def check_phone():
     if len(phone) < 8:
         return jsonify({'status': 'error', 'message': 'Invalid phone number'}), 400
     
-    # Normalize phone for comparison (handles leading zero variations)
-    normalized = normalize_phone(phone)
-    # Also create variant with leading zero for matching
-    phone_with_zero = '0' + normalized if normalized and not normalized.startswith('0') else normalized
-    
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
         cursor = connection.cursor()
         
-        # Use multiple matching strategies:
-        # 1. Exact match
-        # 2. Match by last 9 digits (normalized comparison)
-        # 3. Match with/without leading zero
-        cursor.execute("""
+        # Match by normalized key (last 9 digits) - covers exact and with/without leading zero
+        params = []
+        phone_condition = build_phone_match_condition('sdt_norm', phone, params)
+        cursor.execute(f"""
             SELECT EXISTS(
                 SELECT 1 FROM khach_hang
-                WHERE (
-                    -- Exact match
-                    sdt = %s OR sdt = %s
-                    -- Normalized match (last 9 digits)
-                    OR RIGHT(REGEXP_REPLACE(sdt, '[^0-9]', '', 'g'), 9) = %s
-                )
+                WHERE {phone_condition}
                 AND (
                     (trang_thai IN ('Đã đến làm', 'Đã cọc', 'Da den lam', 'Da coc')
                      AND ngay_hen_lam >= CURRENT_DATE - INTERVAL '360 days')
@@ -917,7 +732,7 @@ def check_phone():
                     OR ngay_nhap_don >= CURRENT_DATE - INTERVAL '60 days'
                 )
             ) AS is_duplicate
-        """, (phone, phone_with_zero, normalized))
+        """, params)
         
         result = cursor.fetchone()
         is_duplicate = result[0] if result else False
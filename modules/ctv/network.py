@@ -1,10 +1,12 @@
+import datetime
 from flask import jsonify, g
 from psycopg2.extras import RealDictCursor
 from psycopg2 import Error
 from .blueprint import ctv_bp
 from ..auth import require_ctv
 from ..db_pool import get_db_connection, return_db_connection
-from ..mlm_core import build_hierarchy_tree, get_all_descendants, get_network_stats
+from ..mlm_core import build_hierarchy_tree, get_network_stats
+from ..dashboard_cache import get_ctv_dashboard
 
 @ctv_bp.route('/api/ctv/my-downline', methods=['GET'])
 @require_ctv
@@ -12,7 +14,7 @@ def get_my_downline():
     """Get all CTVs directly under me (Level 1 only)"""
     ctv = g.current_user
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -76,26 +78,16 @@ def get_my_customers():
     """Get all customers in my network (from both khach_hang and services)"""
     ctv = g.current_user
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
     try:
-        my_network = get_all_descendants(ctv['ma_ctv'], connection)
-        
-        if not my_network:
-            return jsonify({
-                'status': 'success',
-                'customers': [],
-                'total': 0
-            })
-        
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        placeholders = ','.join(['%s'] * len(my_network))
-        
-        # UNION query combining both khach_hang and services tables
-        cursor.execute(f"""
+        # UNION query combining both khach_hang and services tables;
+        # the network (self + all descendants) comes from ctv_closure
+        cursor.execute("""
             SELECT * FROM (
                 SELECT DISTINCT ON (phone, name)
                     id,
@@ -117,7 +109,7 @@ def get_my_customers():
                         kh.nguoi_chot as served_by,
                         'tham_my' as source_type
                     FROM khach_hang kh
-                    WHERE kh.nguoi_chot IN ({placeholders})
+                    WHERE kh.nguoi_chot IN (SELECT descendant FROM ctv_closure WHERE ancestor = %s)
                     AND kh.sdt IS NOT NULL AND kh.sdt != ''
                     
                     UNION ALL
@@ -133,14 +125,14 @@ def get_my_customers():
                         'nha_khoa' as source_type
                     FROM customers c
                     JOIN services s ON c.id = s.customer_id
-                    WHERE COALESCE(s.nguoi_chot, s.ctv_code) IN ({placeholders})
+                    WHERE COALESCE(s.nguoi_chot, s.ctv_code) IN (SELECT descendant FROM ctv_closure WHERE ancestor = %s)
                     AND c.phone IS NOT NULL AND c.phone != ''
                 ) AS all_customers
                 ORDER BY phone, name, last_service_date DESC
             ) AS unique_customers
             ORDER BY last_service_date DESC
             LIMIT 100
-        """, list(my_network) + list(my_network))
+        """, (ctv['ma_ctv'], ctv['ma_ctv']))
         
         customers = [dict(row) for row in cursor.fetchall()]
         
@@ -163,20 +155,16 @@ def get_my_customers():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
-@ctv_bp.route('/api/ctv/my-stats', methods=['GET'])
-@require_ctv
-def get_my_stats():
-    """Get detailed statistics for my network"""
-    ctv = g.current_user
-    
-    connection = get_db_connection()
+def _build_my_stats(ctv_code):
+    """Network and commission stats payload of /api/ctv/my-stats (None if the database is unreachable)"""
+    connection = get_db_connection(shared=True)
     if not connection:
-        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        return None
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
-        stats = get_network_stats(ctv['ma_ctv'], connection)
+        stats = get_network_stats(ctv_code, connection)
         
         cursor.execute("""
             SELECT 
@@ -187,7 +175,7 @@ def get_my_stats():
             WHERE ctv_code = %s
             GROUP BY level
             ORDER BY level
-        """, (ctv['ma_ctv'],))
+        """, (ctv_code,))
         commission_by_level = [dict(row) for row in cursor.fetchall()]
         
         for c in commission_by_level:
@@ -202,26 +190,37 @@ def get_my_stats():
             AND created_at >= CURRENT_TIMESTAMP - INTERVAL '6 months'
             GROUP BY TO_CHAR(created_at, 'YYYY-MM')
             ORDER BY month
-        """, (ctv['ma_ctv'],))
+        """, (ctv_code,))
         monthly_trend = [dict(row) for row in cursor.fetchall()]
         
         for m in monthly_trend:
             m['total'] = float(m['total'] or 0)
         
         cursor.close()
-        return_db_connection(connection)
-        
-        return jsonify({
-            'status': 'success',
+        return {
             'stats': {
                 'network': stats,
                 'commission_by_level': commission_by_level,
                 'monthly_trend': monthly_trend
             }
-        })
-        
+        }
+    finally:
+        return_db_connection(connection)
+
+
+@ctv_bp.route('/api/ctv/my-stats', methods=['GET'])
+@require_ctv
+def get_my_stats():
+    """Get detailed statistics for my network"""
+    ctv = g.current_user
+    
+    try:
+        # The monthly trend covers the last 6 months, so the payload changes with the date
+        payload = get_ctv_dashboard(ctv['ma_ctv'], 'my_stats', (datetime.date.today(),),
+                                    lambda: _build_my_stats(ctv['ma_ctv']))
     except Error as e:
-        if connection:
-            return_db_connection(connection)
         return jsonify({'status': 'error', 'message': str(e)}), 500
-
+    
+    if payload is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify(dict(payload, status='success'))
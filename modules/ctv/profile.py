@@ -5,7 +5,7 @@ from psycopg2 import Error
 from .blueprint import ctv_bp
 from ..auth import require_ctv
 from ..db_pool import get_db_connection, return_db_connection
-from ..mlm_core import get_network_stats, calculate_new_commissions_fast
+from ..mlm_core import get_network_stats
 
 @ctv_bp.route('/api/ctv/me', methods=['GET'])
 @require_ctv
@@ -14,7 +14,7 @@ def get_profile():
     ctv = g.current_user
     print(f"DEBUG: get_profile for {ctv['ma_ctv']}")
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         print("DEBUG: connection failed")
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
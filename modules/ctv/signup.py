@@ -8,6 +8,7 @@ from psycopg2 import Error
 from .blueprint import ctv_bp
 from ..db_pool import get_db_connection, return_db_connection
 from ..auth import hash_password
+from ..mlm_core import graph_set_parent
 import base64
 import json
 import os
@@ -170,7 +171,7 @@ def check_referrer_phone():
             'message': 'Phone number too short'
         })
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -265,7 +266,7 @@ def ctv_signup():
     # Hash password using proper hash_password function (salt:hash format)
     password_hash = hash_password(password)
     
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection:
         return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
     
@@ -367,6 +368,8 @@ def ctv_signup():
         cursor.close()
         return_db_connection(connection)
         
+        graph_set_parent(ctv_code, referrer_id)
+        
         return jsonify({
             'status': 'success',
             'message': f'Đăng ký thành công! Mã CTV của bạn là {ctv_code}. Đăng nhập bằng số điện thoại hoặc mã CTV.',
@@ -0,0 +1,125 @@
+"""
+Dashboard Cache Module
+Cached CTV portal payloads (lifetime stats, commission, my-stats, date ranges),
+invalidated per CTV by the sync cycle and globally by settings changes.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - get_ctv_dashboard(ctv_code, view, params, loader, ttl=TTL_DASHBOARD) -> dict
+#     DOES: Cached payload of one dashboard view; loader() builds it on a miss
+#
+# - invalidate_ctv_dashboards(ctv_codes) -> None
+#     DOES: Drop the cached dashboards of the given CTVs (sync: CTVs whose
+#           subtree had rollup rows change)
+#
+# - invalidate_all_dashboards() -> None
+#     DOES: Bump the global data version (commission settings, rollup rebuild,
+#           referral tree changes)
+#
+# - check_ctv_tree_watermark(connection) -> bool
+#     DOES: Sync cycle hook: bump the global version when the referral tree
+#           (codes, referrers, active flags) changed since the last cycle
+#
+# CACHE KEY PATTERN:
+# - dashboard:{ctv_code}:v{ctv_version}:dashboard:v{data_version}:{view}:{params}
+#     ctv_version  - bumped for that CTV when its subtree's data changes
+#     data_version - bumped for everyone (see invalidate_all_dashboards)
+#
+# NOTES:
+# - Both versions are versioned namespaces of redis_cache, so a hit is an
+#   in-process L1 read; versions are re-read from Redis every few seconds.
+# - refresh_ctv_daily_rollup() diffs the rollup rows it rewrites and calls
+#   invalidate_ctv_dashboards() with every ancestor of the CTVs whose rows changed.
+# - Referral tree edits (admin, signup, sync) are picked up by
+#   check_ctv_tree_watermark() within one sync cycle.
+# - 'date_ranges' also counts bookings that are not completed yet, which the
+#   rollup does not see; it uses the shorter TTL_DATE_RANGES instead.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+from psycopg2 import Error
+from .redis_cache import ns_key, cache_get_or_set, invalidate_namespace, invalidate_namespaces
+
+TTL_DASHBOARD = 3600       # 1 hour (versions do the invalidation)
+TTL_DATE_RANGES = 300      # 5 minutes
+
+DASHBOARD_NAMESPACE = 'dashboard'
+TREE_WATERMARK_KEY = 'ctv_tree_watermark'
+
+
+def _ctv_namespace(ctv_code):
+    return f"{DASHBOARD_NAMESPACE}:{ctv_code}"
+
+
+def get_ctv_dashboard(ctv_code, view, params, loader, ttl=TTL_DASHBOARD):
+    """
+    DOES: Return a CTV's cached dashboard payload, building it once on a miss
+    INPUTS:
+        ctv_code - CTV the payload belongs to
+        view - payload name, e.g. 'lifetime', 'commission'
+        params - tuple of the request parameters the payload depends on
+        loader - function returning the JSON-serializable payload
+        ttl - time to live in seconds
+    OUTPUTS: Payload dict
+    """
+    suffix = ':'.join('' if p is None else str(p) for p in params)
+    key = ns_key(_ctv_namespace(ctv_code), ns_key(DASHBOARD_NAMESPACE, f"{view}:{suffix}"))
+    return cache_get_or_set(key, loader, ttl)
+
+
+def invalidate_ctv_dashboards(ctv_codes):
+    """
+    DOES: Invalidate the cached dashboards of some CTVs
+    INPUTS: ctv_codes - iterable of CTV codes (include the ancestors of changed CTVs)
+    """
+    invalidate_namespaces(_ctv_namespace(code) for code in ctv_codes)
+
+
+def invalidate_all_dashboards():
+    """
+    DOES: Invalidate every cached dashboard
+    Call this when commission settings or the referral tree change
+    """
+    invalidate_namespace(DASHBOARD_NAMESPACE)
+
+
+def check_ctv_tree_watermark(connection):
+    """
+    DOES: Compare a fingerprint of the referral tree with the previous cycle's
+          and invalidate all dashboards if it changed
+    INPUTS: connection - database connection (committed by this function)
+    OUTPUTS: True if the tree changed (or on the first run), False otherwise
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) || ':' || COALESCE(SUM(hashtext(
+                ma_ctv || '|' || COALESCE(nguoi_gioi_thieu, '') || '|' || COALESCE(is_active::text, '')
+            )), 0)
+            FROM ctv
+        """)
+        watermark = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO commission_cache (cache_key, cache_value, last_updated)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                cache_value = EXCLUDED.cache_value,
+                last_updated = CURRENT_TIMESTAMP
+            RETURNING (SELECT cache_value FROM commission_cache WHERE cache_key = %s)
+        """, (TREE_WATERMARK_KEY, watermark, TREE_WATERMARK_KEY))
+        previous = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+    except Error as e:
+        print(f"Error checking CTV tree watermark: {e}")
+        connection.rollback()
+        return False
+
+    if previous == watermark:
+        return False
+    invalidate_all_dashboards()
+    return True
@@ -25,17 +25,51 @@ Utilities for generating XLSX Excel files from data.
 #   INPUTS: numeric value
 #   OUTPUTS: Formatted string
 #
+# STREAMING EXPORTS (constant memory, for exports of any size):
+# - iter_query_rows(connection, query, params, transform, chunk_size,
+#                   release_connection) -> iterator
+#   DOES: Runs the query on a server-side (named) cursor and yields row dicts
+#         fetched chunk_size at a time
+#
+# - estimate_column_widths(sample_rows, columns) -> list
+#   DOES: Column widths from the header and a sample of rows
+#
+# - write_xlsx_rows(rows, columns, output, sheet_name) -> int
+#   DOES: Writes rows through an openpyxl write_only workbook into output
+#   OUTPUTS: Number of data rows written
+#
+# - iter_csv_chunks(rows, columns) -> iterator of bytes
+#   DOES: CSV (UTF-8 with BOM) generated row by row
+#
+# - create_export_response(rows, columns, filename, sheet_name, export_format,
+#                          on_complete) -> Flask Response
+#   DOES: Chunked XLSX or CSV download of a row iterator;
+#         on_complete(row_count) runs once the last row was sent
+#
 # ══════════════════════════════════════════════════════════════════════════════
 
 Created: December 30, 2025
 """
 
 import io
+import csv
+import itertools
+import tempfile
+import uuid
 from datetime import datetime
-from flask import Response
+from flask import Response, stream_with_context
+from psycopg2.extras import RealDictCursor
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
+from .db_pool import return_db_connection
+
+EXPORT_CHUNK_SIZE = 2000          # rows per server-side cursor fetch
+EXPORT_WIDTH_SAMPLE = 500         # rows used to estimate column widths
+EXPORT_READ_SIZE = 64 * 1024      # bytes per chunk of a streamed XLSX file
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
 
 def create_xlsx_response(data, columns, filename, sheet_name="Data"):
@@ -221,6 +255,249 @@ def format_currency_vnd(value):
         return str(value)
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+# STREAMING EXPORTS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def iter_query_rows(connection, query, params=None, transform=None, chunk_size=EXPORT_CHUNK_SIZE,
+                    release_connection=False):
+    """
+    Run a query on a server-side cursor and iterate over its rows
+    
+    DOES: Declares a named cursor (errors in the query raise here, before any
+          row is read) and returns an iterator fetching chunk_size rows at a time
+    INPUTS:
+        - connection: Database connection; it stays in a transaction until the
+          iterator is exhausted or closed
+        - query, params: SQL and its parameters
+        - transform: Optional function applied to each row dict
+        - chunk_size: Rows per round trip
+        - release_connection: Return the connection to the pool once the
+          iterator is exhausted or closed (not when execute raises)
+    OUTPUTS: Iterator of row dicts
+    """
+    cursor = connection.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(query, params)
+    except Exception:
+        cursor.close()
+        raise
+    
+    def rows():
+        try:
+            for row in cursor:
+                row = dict(row)
+                yield transform(row) if transform else row
+        finally:
+            cursor.close()
+            if release_connection:
+                return_db_connection(connection)
+    
+    return rows()
+
+
+def _export_value(value, format_type):
+    """Cell value of one field (None -> '', currency/percent -> float)"""
+    if value is None:
+        return ''
+    if format_type in ('currency', 'percent') and value != '':
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            pass
+    return value
+
+
+def estimate_column_widths(sample_rows, columns):
+    """
+    Estimate column widths from a sample of rows
+    
+    DOES: Same rule as auto_size_columns (longest value + 2, at most 50),
+          but over sample_rows only; explicit 'width' configs win
+    INPUTS: list of row dicts, column configurations
+    OUTPUTS: List of widths, one per column
+    """
+    widths = []
+    for col_config in columns:
+        if 'width' in col_config:
+            widths.append(col_config['width'])
+            continue
+        max_length = len(str(col_config['header']))
+        for row in sample_rows:
+            value = row.get(col_config['key'])
+            if value is not None and value != '':
+                max_length = max(max_length, len(str(value)))
+        widths.append(min(max_length + 2, 50))
+    return widths
+
+
+def _add_export_styles(wb):
+    """Register the named styles used by write_xlsx_rows; returns header, currency, percent"""
+    styles = (
+        NamedStyle(name='export_header',
+                   fill=PatternFill(start_color='1a1a24', end_color='1a1a24', fill_type='solid'),
+                   font=Font(bold=True, color='06b6d4', size=11),
+                   alignment=Alignment(horizontal='center', vertical='center')),
+        NamedStyle(name='export_currency', number_format='#,##0', alignment=Alignment(horizontal='right')),
+        NamedStyle(name='export_percent', number_format='0.00%', alignment=Alignment(horizontal='right')),
+    )
+    for style in styles:
+        wb.add_named_style(style)
+    return [style.name for style in styles]
+
+
+def write_xlsx_rows(rows, columns, output, sheet_name="Data"):
+    """
+    Write rows into an XLSX file without holding them in memory
+    
+    DOES: Uses an openpyxl write_only workbook (rows go to a temporary file as
+          they are appended). Header styling, number formats, widths and the
+          frozen header match create_xlsx_response; data cells have no borders
+          (a styled cell costs several times a plain value). Column widths
+          come from the first EXPORT_WIDTH_SAMPLE rows.
+    INPUTS: iterator of row dicts, column configurations, path or binary file
+            object to save to, sheet name
+    OUTPUTS: Number of data rows written
+    """
+    rows = iter(rows)
+    sample = list(itertools.islice(rows, EXPORT_WIDTH_SAMPLE))
+    
+    wb = Workbook(write_only=True)
+    header_style, currency_style, percent_style = _add_export_styles(wb)
+    ws = wb.create_sheet(title=sheet_name)
+    
+    # Sheet settings must be set before the first row
+    for col_idx, width in enumerate(estimate_column_widths(sample, columns), 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+    ws.freeze_panes = 'A2'
+    
+    header = []
+    for col_config in columns:
+        cell = WriteOnlyCell(ws, value=col_config['header'])
+        cell.style = header_style
+        header.append(cell)
+    ws.append(header)
+    
+    cell_styles = {'currency': currency_style, 'percent': percent_style}
+    fields = [(c['key'], c.get('format'), cell_styles.get(c.get('format'))) for c in columns]
+    
+    count = 0
+    for row_data in itertools.chain(sample, rows):
+        values = []
+        for key, format_type, style in fields:
+            value = _export_value(row_data.get(key), format_type)
+            if style and value != '':
+                value = WriteOnlyCell(ws, value=value)
+                value.style = style
+            values.append(value)
+        ws.append(values)
+        count += 1
+    
+    wb.save(output)
+    return count
+
+
+def iter_csv_chunks(rows, columns, rows_per_chunk=500):
+    """
+    Generate a CSV file row by row
+    
+    DOES: Yields UTF-8 encoded CSV (with BOM so Excel reads Vietnamese headers),
+          a few hundred rows per chunk
+    INPUTS: iterator of row dicts, column configurations
+    OUTPUTS: Iterator of bytes
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([c['header'] for c in columns])
+    
+    keys = [c['key'] for c in columns]
+    pending = 0
+    for row_data in rows:
+        writer.writerow(['' if row_data.get(key) is None else row_data.get(key) for key in keys])
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _iter_xlsx_chunks(rows, columns, sheet_name):
+    """Write the workbook to a temporary file and read it back in chunks"""
+    with tempfile.TemporaryFile() as output:
+        write_xlsx_rows(rows, columns, output, sheet_name)
+        output.seek(0)
+        while True:
+            chunk = output.read(EXPORT_READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+class _RowCounter:
+    """Iterator wrapper counting the rows that went through it"""
+    
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.count = 0
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        row = next(self._rows)
+        self.count += 1
+        return row
+
+
+def create_export_response(rows, columns, filename, sheet_name="Data", export_format='xlsx', on_complete=None):
+    """
+    Stream an export as a chunked download
+    
+    DOES: Sends rows as XLSX (write_only workbook) or CSV without building the
+          file in memory. The generator runs inside the request context, so a
+          request-scoped database connection stays usable until the last row.
+    INPUTS:
+        - rows: Iterator of row dicts (e.g. from iter_query_rows)
+        - columns: Column configurations (see create_xlsx_response)
+        - filename: Name of the file (without extension)
+        - sheet_name: Name of the Excel sheet
+        - export_format: 'xlsx' or 'csv'
+        - on_complete: Optional function called with the row count at the end
+    OUTPUTS: Flask Response with the file as attachment
+    """
+    counted = _RowCounter(rows)
+    
+    def generate():
+        if export_format == 'csv':
+            yield from iter_csv_chunks(counted, columns)
+        else:
+            yield from _iter_xlsx_chunks(counted, columns, sheet_name)
+        if on_complete:
+            on_complete(counted.count)
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if export_format == 'csv':
+        mimetype = 'text/csv; charset=utf-8'
+        full_filename = f"{filename}_{timestamp}.csv"
+    else:
+        mimetype = XLSX_MIMETYPE
+        full_filename = f"{filename}_{timestamp}.xlsx"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={full_filename}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # COLUMN CONFIGURATIONS FOR DIFFERENT EXPORTS
 # ══════════════════════════════════════════════════════════════════════════════
@@ -0,0 +1,513 @@
+"""
+Export Jobs Module
+Background generation of large admin exports, with progress and cached files.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - register_export_type(name, build, params, tables, version=None, count_inserts=True) -> None
+#     DOES: Declares an export that can run as a job (done by admin/export.py)
+#
+# - submit_export_job(export_type, params, export_format, requested_by) -> dict
+#     DOES: Returns the finished job of an identical export if its file is still
+#           there, joins an identical running job, or queues a new one
+#
+# - get_export_job(job_id) -> dict or None
+#     DOES: Status and progress of one job
+#
+# - list_export_jobs(limit=20) -> list
+#     DOES: Most recent jobs
+#
+# - get_export_file(job_id) -> (path, file_name) or None
+#     DOES: Finished, unexpired file of a job, if it exists on this server
+#
+# - cleanup_export_jobs() -> dict
+#     DOES: Deletes expired files, fails jobs whose worker went away, removes
+#           old job rows (runs at most every CLEANUP_INTERVAL from submit)
+#
+# CACHE KEY:
+# - sha256 of [export_type, format, normalized params, data version]
+#     data version = per table: export_version_<table> (advanced with nextval()
+#                    by statement triggers, see migrate_export_jobs.py) and its
+#                    pg_stat_user_tables change counters (all partitions)
+#                    (+ the export type's own version function, if any)
+#     Neither takes a lock writers wait for.
+#
+# NOTES:
+# - Jobs run on a thread pool (EXPORT_WORKERS threads) in the process that
+#   accepted them and write to EXPORT_DIR on local disk, so gunicorn threads
+#   are not held for the length of an export.
+# - Status lives in export_jobs, so any worker process can answer a poll.
+#   Files are on the local disk of the server that ran the job.
+# - Progress (rows_done) is written every PROGRESS_INTERVAL seconds on a
+#   separate connection; the export itself reads one server-side cursor.
+#   rows_total is the planner's estimate, so the query runs only once.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+from .db_pool import get_db_connection, return_db_connection
+from .activity_logger import log_data_export
+from .export_excel import iter_query_rows, write_xlsx_rows, iter_csv_chunks
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'ctv_exports'))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))          # job threads per process
+EXPORT_TTL_SECONDS = int(os.environ.get('EXPORT_TTL', 24 * 3600))  # finished files are kept this long
+EXPORT_STALE_SECONDS = 600       # running job without progress for this long -> failed
+PROGRESS_INTERVAL = 2.0          # seconds between progress writes
+CLEANUP_INTERVAL = 600           # seconds between cleanups of one process
+JOB_HISTORY_DAYS = 30            # failed/expired job rows are deleted after this
+
+EXPORT_FORMATS = ('xlsx', 'csv')
+
+# name -> {'build', 'params', 'tables', 'version', 'count_inserts'} (see register_export_type)
+EXPORT_TYPES = {}
+
+JOB_COLUMNS = """
+    id, export_type, export_format, params, status, rows_done, rows_total,
+    file_name, file_size, error, requested_by, created_at, started_at,
+    finished_at, expires_at
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def register_export_type(name, build, params, tables, version=None, count_inserts=True):
+    """
+    DOES: Declare an export type that can run as a background job
+    INPUTS:
+        name - export type name used by the API
+        build - function(params) -> {'query', 'params', 'columns', 'filename',
+                'sheet_name', 'transform'}; params is a dict, not request.args
+        params - names of the request parameters the export accepts
+        tables - tables whose change counters the output depends on
+        version - optional function(cursor, params) -> str for data the
+                  counters do not cover
+        count_inserts - False when version covers inserts itself (only
+                        updates and deletes of the tables then count; the
+                        tables have no INSERT version trigger either)
+    """
+    EXPORT_TYPES[name] = {
+        'build': build,
+        'params': tuple(params),
+        'tables': tuple(tables),
+        'version': version,
+        'count_inserts': count_inserts,
+    }
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export-job')
+        return _executor
+
+
+def _normalize_params(spec, params):
+    """Accepted, non-empty parameters as stripped strings"""
+    normalized = {}
+    for name in spec['params']:
+        value = (params or {}).get(name)
+        if value is None:
+            continue
+        value = str(value).strip()
+        if value:
+            normalized[name] = value
+    return normalized
+
+
+def _data_version(cursor, spec, params):
+    # export_version_<table> moves as soon as a write statement runs, but before
+    # it commits; the pg_stat counters follow the commit within a few seconds,
+    # so a file made from a snapshot that missed the write is not reused for long
+    cursor.execute("""
+        SELECT t.table_name,
+            (SELECT last_value FROM pg_sequences
+             WHERE schemaname = current_schema() AND sequencename = 'export_version_' || t.table_name) as changes,
+            md5(string_agg(
+                concat_ws(':', s.relid, pg_relation_filenode(s.relid),
+                          CASE WHEN %s THEN s.n_tup_ins ELSE 0 END + s.n_tup_upd + s.n_tup_del),
+                ',' ORDER BY s.relid
+            )) as counters
+        FROM unnest(%s::text[]) AS t(table_name)
+        CROSS JOIN LATERAL (
+            SELECT t.table_name::regclass AS relid
+            UNION SELECT relid FROM pg_partition_tree(t.table_name::regclass)
+        ) p
+        JOIN pg_stat_user_tables s ON s.relid = p.relid
+        GROUP BY t.table_name
+    """, (spec['count_inserts'], list(spec['tables'])))
+    versions = {row['table_name']: f"{row['changes']}:{row['counters']}" for row in cursor.fetchall()}
+    version = [versions.get(table) for table in spec['tables']]
+    if spec['version']:
+        version.append(spec['version'](cursor, params))
+    return version
+
+
+def _job_to_dict(row, cached=False):
+    job = dict(row)
+    for key in ('created_at', 'started_at', 'finished_at', 'expires_at'):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+    total = job.get('rows_total')
+    if job['status'] == 'done':
+        job['progress'] = 100
+    elif total:
+        job['progress'] = min(99, int(job['rows_done'] * 100 / total))
+    else:
+        job['progress'] = 0
+    job['cached'] = cached
+    job['download_url'] = f"/api/admin/export-jobs/{job['id']}/download" if job['status'] == 'done' else None
+    return job
+
+
+def submit_export_job(export_type, params=None, export_format='xlsx', requested_by=None):
+    """
+    DOES: Queue an export, or reuse an identical one
+    INPUTS: export_type (registered name), params (dict of filters),
+            export_format ('xlsx' or 'csv'), requested_by (admin username)
+    OUTPUTS: Job dict; 'cached' is True when an existing file is reused
+    Raises ValueError for an unknown type or format, psycopg2.Error on database errors
+    """
+    spec = EXPORT_TYPES.get(export_type)
+    if not spec:
+        raise ValueError(f"Unknown export type: {export_type}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    try:
+        _maybe_cleanup()
+    except Exception as e:
+        print(f"Error cleaning up export jobs: {e}")
+
+    params = _normalize_params(spec, params)
+    connection = get_db_connection()
+    if not connection:
+        raise Error("Database connection failed")
+
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        version = _data_version(cursor, spec, params)
+        cache_key = hashlib.sha256(
+            json.dumps([export_type, export_format, params, version], sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+        # A finished file for the same data
+        cursor.execute(f"""
+            SELECT {JOB_COLUMNS}, file_path FROM export_jobs
+            WHERE cache_key = %s AND status = 'done' AND expires_at > CURRENT_TIMESTAMP
+            ORDER BY id DESC
+        """, (cache_key,))
+        for row in cursor.fetchall():
+            if row['file_path'] and os.path.exists(row['file_path']):
+                row.pop('file_path')
+                connection.commit()
+                cursor.close()
+                return_db_connection(connection)
+                return _job_to_dict(row, cached=True)
+
+        # A live identical job, or a new one
+        cursor.execute(f"""
+            INSERT INTO export_jobs (export_type, export_format, params, cache_key, requested_by)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) WHERE status IN ('pending', 'running') DO NOTHING
+            RETURNING {JOB_COLUMNS}
+        """, (export_type, export_format, json.dumps(params), cache_key, requested_by))
+        row = cursor.fetchone()
+        created = row is not None
+        if not created:
+            cursor.execute(f"""
+                SELECT {JOB_COLUMNS} FROM export_jobs
+                WHERE cache_key = %s AND status IN ('pending', 'running')
+            """, (cache_key,))
+            row = cursor.fetchone()
+        connection.commit()
+        cursor.close()
+        return_db_connection(connection)
+
+    except Error:
+        connection.rollback()
+        return_db_connection(connection)
+        raise
+
+    if created:
+        _get_executor().submit(_run_export_job, row['id'])
+    return _job_to_dict(row)
+
+
+def _update_job(job_id, sql, params):
+    """Run one UPDATE on export_jobs on its own connection (progress, failure)"""
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"UPDATE export_jobs SET {sql}, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                       tuple(params) + (job_id,))
+        connection.commit()
+        cursor.close()
+    except Error as e:
+        print(f"Error updating export job {job_id}: {e}")
+        connection.rollback()
+    return_db_connection(connection)
+
+
+def _track_progress(job_id, rows, progress):
+    """Pass rows through, counting them in progress['rows'] and writing the
+    count to the job every PROGRESS_INTERVAL seconds"""
+    last_write = time.time()
+    for row in rows:
+        progress['rows'] += 1
+        if time.time() - last_write >= PROGRESS_INTERVAL:
+            _update_job(job_id, "rows_done = %s", (progress['rows'],))
+            last_write = time.time()
+        yield row
+
+
+def _run_export_job(job_id):
+    """Worker thread: generate the file of one job"""
+    connection = get_db_connection()
+    if not connection:
+        _update_job(job_id, "status = 'failed', error = %s, finished_at = CURRENT_TIMESTAMP",
+                    ("Database connection failed",))
+        return
+
+    part_path = None
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            UPDATE export_jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'pending'
+            RETURNING export_type, export_format, params, cache_key, requested_by
+        """, (job_id,))
+        job = cursor.fetchone()
+        connection.commit()
+        if not job:
+            cursor.close()
+            return_db_connection(connection)
+            return
+
+        export = EXPORT_TYPES[job['export_type']]['build'](job['params'] or {})
+
+        # Estimate for the progress bar; an exact COUNT(*) would run the query twice
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {export['query']}", export['params'])
+        rows_total = int(cursor.fetchone()['QUERY PLAN'][0]['Plan']['Plan Rows'])
+        cursor.execute("UPDATE export_jobs SET rows_total = %s WHERE id = %s", (rows_total, job_id))
+        connection.commit()
+        cursor.close()
+
+        extension = job['export_format']
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        file_path = os.path.join(EXPORT_DIR, f"{job_id}_{job['cache_key'][:16]}.{extension}")
+        part_path = file_path + '.part'
+
+        progress = {'rows': 0}
+        rows = _track_progress(job_id, iter_query_rows(
+            connection, export['query'], export['params'], transform=export.get('transform')
+        ), progress)
+        if extension == 'csv':
+            with open(part_path, 'wb') as output:
+                for chunk in iter_csv_chunks(rows, export['columns']):
+                    output.write(chunk)
+        else:
+            write_xlsx_rows(rows, export['columns'], part_path, export['sheet_name'])
+        connection.rollback()
+        os.replace(part_path, file_path)
+        part_path = None
+
+        count = progress['rows']
+        file_name = f"{export['filename']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        _update_job(job_id, """
+            status = 'done', rows_done = %s, file_path = %s, file_name = %s, file_size = %s,
+            finished_at = CURRENT_TIMESTAMP,
+            expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        """, (count, file_path, file_name, os.path.getsize(file_path), EXPORT_TTL_SECONDS))
+
+        log_data_export('admin', job['requested_by'] or 'admin', job['export_type'], count)
+
+    except Exception as e:
+        print(f"Error running export job {job_id}: {e}")
+        try:
+            connection.rollback()
+        except Error:
+            pass
+        _update_job(job_id, "status = 'failed', error = %s, finished_at = CURRENT_TIMESTAMP", (str(e),))
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+    return_db_connection(connection)
+
+
+def get_export_job(job_id):
+    """
+    DOES: Get one export job
+    INPUTS: job_id
+    OUTPUTS: Job dict (status, rows_done, rows_total, progress, download_url...) or None
+    """
+    connection = get_db_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"SELECT {JOB_COLUMNS} FROM export_jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return_db_connection(connection)
+        return _job_to_dict(row) if row else None
+    except Error as e:
+        print(f"Error getting export job: {e}")
+        connection.rollback()
+        return_db_connection(connection)
+        return None
+
+
+def list_export_jobs(limit=20):
+    """
+    DOES: Most recent export jobs
+    OUTPUTS: List of job dicts, newest first
+    """
+    connection = get_db_connection()
+    if not connection:
+        return []
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"SELECT {JOB_COLUMNS} FROM export_jobs ORDER BY id DESC LIMIT %s", (limit,))
+        jobs = [_job_to_dict(row) for row in cursor.fetchall()]
+        cursor.close()
+        return_db_connection(connection)
+        return jobs
+    except Error as e:
+        print(f"Error listing export jobs: {e}")
+        connection.rollback()
+        return_db_connection(connection)
+        return []
+
+
+def get_export_file(job_id):
+    """
+    DOES: Locate the file of a finished job
+    OUTPUTS: (path, file_name), or None if the job is not done, expired or its
+             file is not on this server
+    """
+    connection = get_db_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT file_path, file_name FROM export_jobs
+            WHERE id = %s AND status = 'done' AND expires_at > CURRENT_TIMESTAMP
+        """, (job_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return_db_connection(connection)
+    except Error as e:
+        print(f"Error getting export file: {e}")
+        connection.rollback()
+        return_db_connection(connection)
+        return None
+
+    if not row or not row[0] or not os.path.exists(row[0]):
+        return None
+    return row[0], row[1]
+
+
+def _maybe_cleanup():
+    global _last_cleanup
+    if time.time() - _last_cleanup < CLEANUP_INTERVAL:
+        return
+    _last_cleanup = time.time()
+    cleanup_export_jobs()
+
+
+def cleanup_export_jobs():
+    """
+    DOES: Expire old files and jobs
+          - done jobs past expires_at: file deleted, status 'expired'
+          - running jobs without progress for EXPORT_STALE_SECONDS, or jobs
+            still pending after 6x that (their process is gone): status 'failed'
+          - files in EXPORT_DIR no job points to, older than EXPORT_TTL_SECONDS
+          - failed/expired job rows older than JOB_HISTORY_DAYS
+    OUTPUTS: {'expired': n, 'stale': n, 'orphans': n, 'deleted_jobs': n}
+    """
+    result = {'expired': 0, 'stale': 0, 'orphans': 0, 'deleted_jobs': 0}
+    connection = get_db_connection()
+    if not connection:
+        return result
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE export_jobs SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'done' AND expires_at <= CURRENT_TIMESTAMP
+            RETURNING file_path
+        """)
+        expired = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+            UPDATE export_jobs
+            SET status = 'failed', error = 'Export worker stopped', finished_at = CURRENT_TIMESTAMP
+            WHERE (status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            OR (status = 'pending' AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+        """, (EXPORT_STALE_SECONDS, EXPORT_STALE_SECONDS * 6))
+        result['stale'] = cursor.rowcount
+
+        cursor.execute("""
+            DELETE FROM export_jobs
+            WHERE status IN ('failed', 'expired')
+            AND created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        """, (JOB_HISTORY_DAYS,))
+        result['deleted_jobs'] = cursor.rowcount
+
+        cursor.execute("SELECT file_path FROM export_jobs WHERE status IN ('done', 'running') AND file_path IS NOT NULL")
+        live_files = {row[0] for row in cursor.fetchall()}
+        connection.commit()
+        cursor.close()
+    except Error as e:
+        print(f"Error cleaning up export jobs: {e}")
+        connection.rollback()
+        return_db_connection(connection)
+        return result
+    return_db_connection(connection)
+
+    # Every web worker runs this; another one may remove a file first
+    for path in expired:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        result['expired'] += 1
+
+    if os.path.isdir(EXPORT_DIR):
+        cutoff = time.time() - EXPORT_TTL_SECONDS
+        for name in os.listdir(EXPORT_DIR):
+            path = os.path.join(EXPORT_DIR, name)
+            if path in live_files:
+                continue
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            result['orphans'] += 1
+
+    return result
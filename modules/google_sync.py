@@ -1,26 +1,53 @@
+import io
 import os
-import json
 import time
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
-import gspread
-from google.oauth2.service_account import Credentials
+from gspread.utils import rowcol_to_a1, absolute_range_name, fill_gaps
 import psycopg2
 from psycopg2.extras import execute_values
 
+from .db_pool import get_db_connection as get_pooled_connection, return_db_connection
+from .sheets_client import build_google_client, get_sheets_client, get_worksheet
+
 # Configuration
 BASE_DIR = Path(__file__).parent.parent.absolute()
 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '12YrAEGiOKLoqzj4tE-VLZNQNIda7S5hdMaQJO5UEsnQ')
-CREDENTIALS_FILE = BASE_DIR / 'google_credentials.json'
-# Environment variable for credentials (JSON string) - used in production
-GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON')
 
 # Batch size for bulk inserts - process this many rows before committing
 BATCH_SIZE = 500
 
+# sheet_batch temp table layouts (prepared row tuple order, then match keys)
+KHACH_HANG_BATCH_COLUMNS = [
+    ('ngay_nhap_don', 'DATE'), ('ten_khach', 'TEXT'), ('sdt', 'TEXT'), ('co_so', 'TEXT'),
+    ('ngay_hen_lam', 'DATE'), ('gio', 'TEXT'), ('dich_vu', 'TEXT'), ('tong_tien', 'NUMERIC'),
+    ('tien_coc', 'NUMERIC'), ('phai_dong', 'NUMERIC'), ('nguoi_chot', 'TEXT'), ('ghi_chu', 'TEXT'),
+    ('trang_thai', 'TEXT'), ('source', 'TEXT'), ('dich_vu_key', 'TEXT'), ('ten_key', 'TEXT')
+]
+GIOI_THIEU_BATCH_COLUMNS = [
+    ('ngay_nhap_don', 'DATE'), ('ten_khach', 'TEXT'), ('sdt', 'TEXT'), ('dich_vu', 'TEXT'),
+    ('ghi_chu', 'TEXT'), ('khu_vuc', 'TEXT'), ('nguoi_chot', 'TEXT')
+]
+
+# Delta sync (sheet_row_state / sheet_tab_state)
+FULL_RESYNC_INTERVAL = 6 * 3600  # Seconds between full passes that re-check every row against the DB
+RANGE_READ_HEADROOM = 200        # Extra rows requested beyond the last known row count
+MODIFIED_TIME_TTL = 10           # Seconds a spreadsheet modifiedTime is reused across tabs
+
+# Concurrent tab sync
+TAB_TYPES = ['tham_my', 'nha_khoa', 'gioi_thieu']
+TAB_VARIATIONS = {
+    'tham_my': ['Khach hang Tham my', 'Khách hàng Thẩm mỹ', 'Tham My', 'Thẩm mỹ'],
+    'nha_khoa': ['Khach hang Nha khoa', 'Khách hàng Nha khoa', 'Nha Khoa', 'Nha khoa'],
+    'gioi_thieu': ['Khach gioi thieu', 'Khách giới thiệu', 'Gioi Thieu', 'Referral'],
+}
+SYNC_MAX_WORKERS = int(os.getenv('SYNC_MAX_WORKERS', 3))
+
 DATABASE_URL = os.getenv('DATABASE_URL')
 if DATABASE_URL:
     parsed = urlparse(DATABASE_URL)
@@ -58,32 +85,15 @@ class GoogleSheetSync:
     def __init__(self):
         self.client = None
         self.spreadsheet = None
+        self._modified_times = {}
 
     def get_google_client(self):
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        
-        # Try environment variable first (for production/Railway)
-        if GOOGLE_CREDENTIALS_JSON:
-            try:
-                creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-                credentials = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-                logger.info("Using Google credentials from environment variable")
-                return gspread.authorize(credentials)
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse GOOGLE_CREDENTIALS_JSON: {e}")
-                raise ValueError("Invalid JSON in GOOGLE_CREDENTIALS_JSON environment variable")
-        
-        # Fall back to file (for local development)
-        if CREDENTIALS_FILE.exists():
-            credentials = Credentials.from_service_account_file(str(CREDENTIALS_FILE), scopes=scopes)
-            logger.info("Using Google credentials from file")
-            return gspread.authorize(credentials)
-        
-        raise FileNotFoundError(
-            "Google credentials not found. Please either:\n"
-            "1. Set GOOGLE_CREDENTIALS_JSON environment variable with the JSON content, or\n"
-            "2. Place google_credentials.json file in the project root"
-        )
+        """New authorized client (credentials are parsed once per process, see sheets_client)"""
+        return build_google_client()
+
+    def get_shared_google_client(self, refresh=False):
+        """Authorized client shared by every sync cycle, booking and dispatcher of this process"""
+        return get_sheets_client(refresh)
 
     def get_db_connection(self):
         """Get a fresh database connection with keepalive settings"""
@@ -151,8 +161,9 @@ class GoogleSheetSync:
         normalized = unicodedata.normalize('NFD', text)
         return ''.join(c for c in normalized if unicodedata.category(c) != 'Mn').strip()
 
-    def find_worksheet(self, spreadsheet, tab_variations):
-        worksheets = spreadsheet.worksheets()
+    def find_worksheet(self, spreadsheet, tab_variations, worksheets=None):
+        if worksheets is None:
+            worksheets = spreadsheet.worksheets()
         for variation in tab_variations:
             for ws in worksheets:
                 if ws.title == variation: return ws
@@ -290,35 +301,84 @@ class GoogleSheetSync:
             cur.close()
             return False
 
-    def check_exact_record_exists(self, conn, sdt, ngay_nhap, dich_vu, source, ten_khach=None):
+    def _copy_value(self, value):
+        """Format one value for COPY ... (FORMAT csv): NULL unquoted, everything else quoted"""
+        if value is None:
+            return ''
+        return '"' + str(value).replace('"', '""') + '"'
+
+    def load_sheet_batch(self, cur, columns, rows):
+        """
+        COPY a batch of prepared rows into the sheet_batch temp table (dropped on commit).
+        columns: [(name, type)] matching each row tuple; seq (batch order) and matched are added.
+        """
+        column_defs = ', '.join(f"{name} {col_type}" for name, col_type in columns)
+        cur.execute(f"""
+            CREATE TEMP TABLE sheet_batch (
+                seq INTEGER, {column_defs}, matched BOOLEAN DEFAULT FALSE
+            ) ON COMMIT DROP
+        """)
+        buffer = io.StringIO()
+        for seq, row in enumerate(rows):
+            buffer.write(','.join([str(seq)] + [self._copy_value(v) for v in row]) + '\n')
+        buffer.seek(0)
+        column_names = ', '.join(['seq'] + [name for name, _ in columns])
+        cur.copy_expert(f"COPY sheet_batch ({column_names}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def bulk_insert_new_khach_hang(self, conn, rows, source, match_name):
         """
-        Check if an EXACT record exists.
-        New Logic (User Request):
-        Duplicate if (Date matches AND Service matches) AND (Phone matches OR Name matches).
+        Insert the rows of a batch that are not already in khach_hang; returns (inserted, skipped).
+        Duplicate = same date + service AND (same phone OR, if match_name, same name),
+        checked against the records that existed before the batch.
+        
+        Row tuple indices from prepare_khach_hang_row:
+        0: ngay_nhap, 1: ten_khach, 2: sdt, 3: co_so, 4: ngay_lam, 5: gio,
+        6: dich_vu, 7: tong_tien, 8: tien_coc, 9: phai_dong, 10: nguoi_chot, 
+        11: ghi_chu, 12: trang_thai, 13: tab_type
         """
+        if not rows:
+            return 0, 0
+        
         cur = conn.cursor()
         try:
-            # Normalize service for comparison (trim whitespace)
-            dich_vu_clean = str(dich_vu).strip() if dich_vu else ''
-            ten_khach_clean = str(ten_khach).strip() if ten_khach else ''
+            self.load_sheet_batch(cur, KHACH_HANG_BATCH_COLUMNS, [
+                row + (str(row[6]).strip() if row[6] else '',
+                       str(row[1]).strip() if match_name and row[1] else '')
+                for row in rows
+            ])
             
+            # 1. Match against existing records (one hash join per batch)
             cur.execute("""
-                SELECT COUNT(*) FROM khach_hang 
-                WHERE 
-                    ngay_nhap_don IS NOT DISTINCT FROM %s 
-                    AND TRIM(COALESCE(dich_vu, '')) = %s
-                    AND source = %s
-                    AND (
-                        sdt = %s 
-                        OR (%s != '' AND TRIM(COALESCE(ten_khach, '')) = %s)
-                    )
-            """, (ngay_nhap, dich_vu_clean, source, sdt, ten_khach_clean, ten_khach_clean))
-            count = cur.fetchone()[0]
+                UPDATE sheet_batch b SET matched = TRUE
+                WHERE EXISTS (
+                    SELECT 1 FROM khach_hang kh
+                    WHERE kh.source = %s
+                    AND COALESCE(kh.ngay_nhap_don, DATE '0001-01-01') = COALESCE(b.ngay_nhap_don, DATE '0001-01-01')
+                    AND TRIM(COALESCE(kh.dich_vu, '')) = b.dich_vu_key
+                    AND (kh.sdt = b.sdt OR (b.ten_key != '' AND TRIM(COALESCE(kh.ten_khach, '')) = b.ten_key))
+                )
+            """, (source,))
+            skipped = cur.rowcount
+            
+            # 2. Insert the rest, in sheet order
+            cur.execute("""
+                INSERT INTO khach_hang 
+                (ngay_nhap_don, ten_khach, sdt, co_so, ngay_hen_lam, gio, 
+                 dich_vu, tong_tien, tien_coc, phai_dong, nguoi_chot, ghi_chu, trang_thai, source)
+                SELECT ngay_nhap_don, ten_khach, sdt, co_so, ngay_hen_lam, gio,
+                       dich_vu, tong_tien, tien_coc, phai_dong, nguoi_chot, ghi_chu, trang_thai, %s
+                FROM sheet_batch
+                WHERE NOT matched
+                ORDER BY seq
+            """, (source,))
+            inserted = cur.rowcount
+            conn.commit()
             cur.close()
-            return count > 0
-        except Exception:
+            return inserted, skipped
+        except Exception as e:
+            conn.rollback()
             cur.close()
-            return False
+            raise e
 
     def bulk_insert_or_update_tham_my(self, conn, rows):
         """
@@ -327,31 +387,7 @@ class GoogleSheetSync:
         Each service visit should be a separate row!
         Returns (inserted_count, skipped_count)
         """
-        if not rows:
-            return 0, 0
-        
-        inserted = 0
-        skipped = 0
-        insert_batch = []
-        
-        for row in rows:
-            sdt = row[2]        # Phone number
-            ngay_nhap = row[0]  # Date
-            dich_vu = row[6]    # Service
-            ten_khach = row[1]  # Name
-            
-            # Only skip if EXACT same record exists
-            if self.check_exact_record_exists(conn, sdt, ngay_nhap, dich_vu, 'tham_my', ten_khach):
-                skipped += 1
-            else:
-                # New service entry - add to insert batch
-                insert_batch.append(row)
-        
-        # Bulk insert all new service entries
-        if insert_batch:
-            inserted = self.bulk_insert_khach_hang(conn, insert_batch, 'tham_my')
-        
-        return inserted, skipped
+        return self.bulk_insert_new_khach_hang(conn, rows, 'tham_my', match_name=True)
 
     def bulk_insert_khach_hang(self, conn, rows, tab_type):
         """Bulk insert rows into khach_hang table"""
@@ -378,43 +414,33 @@ class GoogleSheetSync:
             cur.close()
             raise e
 
-    def bulk_insert_or_update_nha_khoa(self, conn, rows):
-        """
-        For Nha Khoa tab: Insert ALL rows as separate entries.
-        Only skip exact duplicates (same phone/name + date + service).
-        Each service visit should be a separate row!
-        Returns (inserted_count, skipped_count)
-        
-        Row tuple indices from prepare_khach_hang_row:
-        0: ngay_nhap, 1: ten_khach, 2: sdt, 3: co_so, 4: ngay_lam, 5: gio,
-        6: dich_vu, 7: tong_tien, 8: tien_coc, 9: phai_dong, 10: nguoi_chot, 
-        11: ghi_chu, 12: trang_thai, 13: tab_type
-        """
-        if not rows:
-            return 0, 0
-        
-        inserted = 0
-        skipped = 0
-        insert_batch = []
-        
-        for row in rows:
-            sdt = row[2]        # Phone number
-            ngay_nhap = row[0]  # Date
-            dich_vu = row[6]    # Service (index 6, NOT 3!)
-            ten_khach = row[1]  # Name
+    def create_missing_ctvs(self, cur, ctv_phones):
+        """Create CTV accounts (default password) for referrer phones not in the ctv table yet"""
+        unique_ctvs = set(p for p in ctv_phones if p)
+        if not unique_ctvs:
+            return
+        
+        # Check which CTVs already exist
+        cur.execute("SELECT ma_ctv FROM ctv WHERE ma_ctv = ANY(%s)", (list(unique_ctvs),))
+        existing = set(row[0] for row in cur.fetchall())
+        
+        # Create missing CTVs
+        new_ctvs = unique_ctvs - existing
+        if new_ctvs:
+            import hashlib
+            import secrets
+            ctv_rows = []
+            for phone in new_ctvs:
+                salt = secrets.token_hex(16)
+                password = 'ctv123'
+                hash_obj = hashlib.sha256((salt + password).encode())
+                password_hash = f"{salt}:{hash_obj.hexdigest()}"
+                ctv_rows.append((phone, phone, password_hash, True))
             
-            # Only skip if EXACT same record exists
-            if self.check_exact_record_exists(conn, sdt, ngay_nhap, dich_vu, 'nha_khoa', ten_khach):
-                skipped += 1
-            else:
-                # New service entry - add to insert batch
-                insert_batch.append(row)
-        
-        # Bulk insert all new service entries
-        if insert_batch:
-            inserted = self.bulk_insert_khach_hang(conn, insert_batch, 'nha_khoa')
-        
-        return inserted, skipped        
+            execute_values(cur, 
+                "INSERT INTO ctv (ma_ctv, ten, password_hash, is_active) VALUES %s ON CONFLICT DO NOTHING",
+                ctv_rows)
+            logger.info(f"  Created {len(new_ctvs)} new CTV accounts")
 
     def bulk_insert_gioi_thieu(self, conn, rows, ctv_phones):
         """Bulk insert referral rows and create CTVs if needed"""
@@ -424,29 +450,7 @@ class GoogleSheetSync:
         cur = conn.cursor()
         
         # First, create any missing CTVs
-        unique_ctvs = set(p for p in ctv_phones if p)
-        if unique_ctvs:
-            # Check which CTVs already exist
-            cur.execute("SELECT ma_ctv FROM ctv WHERE ma_ctv = ANY(%s)", (list(unique_ctvs),))
-            existing = set(row[0] for row in cur.fetchall())
-            
-            # Create missing CTVs
-            new_ctvs = unique_ctvs - existing
-            if new_ctvs:
-                import hashlib
-                import secrets
-                ctv_rows = []
-                for phone in new_ctvs:
-                    salt = secrets.token_hex(16)
-                    password = 'ctv123'
-                    hash_obj = hashlib.sha256((salt + password).encode())
-                    password_hash = f"{salt}:{hash_obj.hexdigest()}"
-                    ctv_rows.append((phone, phone, password_hash, True))
-                
-                execute_values(cur, 
-                    "INSERT INTO ctv (ma_ctv, ten, password_hash, is_active) VALUES %s ON CONFLICT DO NOTHING",
-                    ctv_rows)
-                logger.info(f"  Created {len(new_ctvs)} new CTV accounts")
+        self.create_missing_ctvs(cur, ctv_phones)
         
         # Now insert the referral records
         insert_sql = """
@@ -501,50 +505,230 @@ class GoogleSheetSync:
         except Exception:
             return None
 
-    def sync_tab_by_phone_matching(self, spreadsheet, conn, tab_type, timestamp_column=None):
+    # ══════════════════════════════════════════════════════════════════════════
+    # DELTA SYNC STATE
+    # sheet_tab_state: one row per tab (Drive modifiedTime seen, row count)
+    # sheet_row_state: content hash + record fingerprint per sheet row number
+    # ══════════════════════════════════════════════════════════════════════════
+
+    def get_sheet_modified_time(self, spreadsheet):
+        """Drive modifiedTime of the spreadsheet (one metadata call, shared by the tabs of a cycle)"""
+        cached = self._modified_times.get(spreadsheet.id)
+        if cached and time.time() - cached[0] < MODIFIED_TIME_TTL:
+            return cached[1]
+        try:
+            modified_time = spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            logger.warning(f"  Could not read spreadsheet modifiedTime: {e}")
+            return None
+        self._modified_times[spreadsheet.id] = (time.time(), modified_time)
+        return modified_time
+
+    def row_hash(self, row):
+        """Content hash of a sheet row (trailing empty cells ignored)"""
+        cells = list(row)
+        while cells and not str(cells[-1]).strip():
+            cells.pop()
+        return hashlib.md5('\x1f'.join(str(c) for c in cells).encode('utf-8')).hexdigest()
+
+    def row_fingerprint(self, prepared, tab_type):
+        """Identity of the record a prepared row maps to (the duplicate-check key)"""
+        if tab_type == 'gioi_thieu':
+            key = f"{prepared[2]}|{prepared[6] or ''}"
+        else:
+            key = f"{prepared[2]}|{prepared[0] or ''}|{str(prepared[6] or '').strip()}"
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def load_tab_state(self, conn, tab_type):
+        """
+        Load the delta-sync state of a tab.
+        Returns (tab_state dict or None, {row_number: (row_hash, fingerprint)}),
+        or (None, None) if the state tables are missing.
+        """
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT modified_time, row_count,
+                       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - full_synced_at)) as full_sync_age
+                FROM sheet_tab_state WHERE tab_type = %s
+            """, (tab_type,))
+            row = cur.fetchone()
+            tab_state = {'modified_time': row[0], 'row_count': row[1], 'full_sync_age': row[2]} if row else None
+
+            cur.execute("""
+                SELECT row_number, row_hash, fingerprint
+                FROM sheet_row_state WHERE tab_type = %s
+            """, (tab_type,))
+            row_state = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+            conn.commit()
+            cur.close()
+            return tab_state, row_state
+        except Exception as e:
+            conn.rollback()
+            cur.close()
+            logger.warning(f"  Delta sync state unavailable, processing all rows ({e})")
+            return None, None
+
+    def tab_is_unchanged(self, tab_state, modified_time):
+        """True if the spreadsheet was not edited since the tab's last sync and no full pass is due"""
+        return bool(
+            tab_state and modified_time
+            and tab_state['modified_time'] == modified_time
+            and tab_state['full_sync_age'] is not None
+            and tab_state['full_sync_age'] <= FULL_RESYNC_INTERVAL
+        )
+
+    def load_tab_states(self, conn, tab_types):
+        """sheet_tab_state of several tabs in one query: {tab_type: tab_state} (empty if unavailable)"""
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT tab_type, modified_time, row_count,
+                       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - full_synced_at)) as full_sync_age
+                FROM sheet_tab_state WHERE tab_type = ANY(%s)
+            """, (list(tab_types),))
+            states = {r[0]: {'modified_time': r[1], 'row_count': r[2], 'full_sync_age': r[3]}
+                      for r in cur.fetchall()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            states = {}
+        cur.close()
+        return states
+
+    def save_tab_state(self, conn, tab_type, modified_time, row_count, row_updates, full_pass):
+        """
+        Store the rows that are now in sync and the tab metadata.
+        row_updates: [(row_number, row_hash, fingerprint)] whose stored value changed
+        """
+        cur = conn.cursor()
+        try:
+            if row_updates:
+                execute_values(cur, """
+                    INSERT INTO sheet_row_state (tab_type, row_number, row_hash, fingerprint)
+                    VALUES %s
+                    ON CONFLICT (tab_type, row_number) DO UPDATE SET
+                        row_hash = EXCLUDED.row_hash,
+                        fingerprint = EXCLUDED.fingerprint,
+                        synced_at = CURRENT_TIMESTAMP
+                """, [(tab_type, n, h, f) for n, h, f in row_updates], page_size=BATCH_SIZE)
+            cur.execute("DELETE FROM sheet_row_state WHERE tab_type = %s AND row_number > %s",
+                        (tab_type, row_count))
+            cur.execute("""
+                INSERT INTO sheet_tab_state (tab_type, modified_time, row_count, full_synced_at, synced_at)
+                VALUES (%s, %s, %s, CASE WHEN %s THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+                ON CONFLICT (tab_type) DO UPDATE SET
+                    modified_time = EXCLUDED.modified_time,
+                    row_count = EXCLUDED.row_count,
+                    full_synced_at = COALESCE(EXCLUDED.full_synced_at, sheet_tab_state.full_synced_at),
+                    synced_at = CURRENT_TIMESTAMP
+            """, (tab_type, modified_time, row_count, full_pass))
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            conn.rollback()
+            cur.close()
+            logger.warning(f"  Failed to save delta sync state for {tab_type}: {e}")
+
+    def clear_sheet_state(self, conn):
+        """Forget all delta-sync state (after khach_hang is wiped, every row must be imported again)"""
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM sheet_row_state")
+            cur.execute("DELETE FROM sheet_tab_state")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Failed to clear delta sync state: {e}")
+        cur.close()
+
+    def read_tab_values(self, worksheet, known_rows=None):
+        """
+        Read a worksheet's values, bounded by the last known row count when there is one.
+        Falls back to the whole sheet when the bounded range comes back full.
+        """
+        if known_rows:
+            bound = known_rows + RANGE_READ_HEADROOM
+            if bound < worksheet.row_count:
+                values = worksheet.get_values(f"A1:{rowcol_to_a1(bound, worksheet.col_count)}")
+                if len(values) < bound:
+                    return values
+        return worksheet.get_all_values()
+
+    def _flush_phone_matching_batch(self, conn, tab_type, batch, ctv_phones):
+        """Write one batch of prepared rows; returns (inserted, updated/skipped)"""
+        if tab_type == 'tham_my':
+            return self.bulk_insert_or_update_tham_my(conn, batch)
+        if tab_type == 'nha_khoa':
+            return self.bulk_insert_or_update_nha_khoa(conn, batch)
+        return self.bulk_insert_or_update_gioi_thieu(conn, batch, ctv_phones)
+
+    def sync_tab_by_phone_matching(self, spreadsheet, conn, tab_type, timestamp_column=None, full_sync=False,
+                                   prefetched=None):
         """
         Sync a tab from Google Sheets to database using phone matching.
-        This processes ALL rows and detects updates vs inserts by phone number.
+        Only rows added or changed since the last sync are matched against the DB
+        (see sheet_row_state); full_sync, a header change or FULL_RESYNC_INTERVAL
+        forces a pass over every row.
         
         Args:
             spreadsheet: Google Sheets spreadsheet object
             conn: Database connection
             tab_type: 'tham_my', 'nha_khoa', or 'gioi_thieu'
             timestamp_column: Optional column name for last modified timestamp
+            full_sync: Re-check every row against the DB
+            prefetched: Optional {'values', 'modified_time'} already read by sync_tabs_concurrently
         
         Returns:
             (processed_count, error_count)
         """
-        if tab_type == 'tham_my':
-            variations = ['Khach hang Tham my', 'Khách hàng Thẩm mỹ', 'Tham My', 'Thẩm mỹ']
-        elif tab_type == 'nha_khoa':
-            variations = ['Khach hang Nha khoa', 'Khách hàng Nha khoa', 'Nha Khoa', 'Nha khoa']
+        # Nothing edited in the spreadsheet since the last sync: no download, no DB matching
+        if prefetched:
+            modified_time = prefetched['modified_time']
         else:
-            variations = ['Khach gioi thieu', 'Khách giới thiệu', 'Gioi Thieu', 'Referral']
-        
-        worksheet = self.find_worksheet(spreadsheet, variations)
-        if not worksheet:
-            logger.warning(f"  Tab not found for {tab_type}")
+            modified_time = self.get_sheet_modified_time(spreadsheet)
+        tab_state, row_state = self.load_tab_state(conn, tab_type)
+        state_available = row_state is not None
+        full_pass = full_sync or not state_available or not tab_state or (
+            tab_state['full_sync_age'] is None or tab_state['full_sync_age'] > FULL_RESYNC_INTERVAL)
+        if not full_pass and self.tab_is_unchanged(tab_state, modified_time):
+            logger.info(f"  {tab_type}: spreadsheet unchanged since last sync")
             return 0, 0
         
-        
-        logger.info(f"  Found worksheet: {worksheet.title}")
-        logger.info(f"  Downloading data from '{worksheet.title}'...")
-        
-        try:
-            all_values = worksheet.get_all_values()
-            logger.info(f"  Downloaded {len(all_values)} rows. Analyzing data...")
-        except Exception as e:
-            logger.error(f"  Error reading worksheet: {e}")
-            return 0, 0
+        if prefetched:
+            all_values = prefetched['values']
+        else:
+            worksheet = self.find_worksheet(spreadsheet, TAB_VARIATIONS[tab_type])
+            if not worksheet:
+                logger.warning(f"  Tab not found for {tab_type}")
+                return 0, 0
+            
+            
+            logger.info(f"  Found worksheet: {worksheet.title}")
+            logger.info(f"  Downloading data from '{worksheet.title}'...")
+            
+            try:
+                known_rows = tab_state['row_count'] if tab_state and not full_pass else None
+                all_values = self.read_tab_values(worksheet, known_rows)
+                logger.info(f"  Downloaded {len(all_values)} rows. Analyzing data...")
+            except Exception as e:
+                logger.error(f"  Error reading worksheet: {e}")
+                return 0, 0
         
         if len(all_values) < 2:
-            logger.info(f"  No data rows found in '{worksheet.title}'")
+            logger.info(f"  No data rows found for {tab_type}")
             return 0, 0
         
         headers = all_values[0]
         normalized_headers = [self.normalize_header(h) for h in headers]
         
+        # Column mapping changed: stored hashes no longer say anything about the rows
+        header_hash = self.row_hash(headers)
+        if state_available and row_state.get(1, (None, None))[0] != header_hash:
+            full_pass = True
+        known_hashes = {} if full_pass else {h: f for h, f in row_state.values()}
+        known_fingerprints = set() if full_pass else {f for f in known_hashes.values() if f}
+        
         # Check for timestamp column
         timestamp_col_idx = None
         if timestamp_column:
@@ -564,104 +748,219 @@ class GoogleSheetSync:
         sheet_count = len(all_values) - 1
         data_rows = all_values[1:]  # Skip header row
         
-        # Ensure connection is alive
-        conn = self.ensure_connection(conn)
-        
-        logger.info(f"  Processing ALL {sheet_count} rows with phone matching...")
-        
-        processed = 0
-        errors = 0
-        inserted = 0
-        updated = 0
-        skipped = 0
-        
-        # Process in batches for efficiency
-        batch = []
-        ctv_phones = []  # For gioi_thieu only
-        
-        for i, row in enumerate(data_rows):
-            if not row:
-                continue
+        # ensure_connection replaces a lost connection with a direct one the caller never sees
+        caller_conn = conn
+        try:
+            # Ensure connection is alive
+            conn = self.ensure_connection(conn)
             
-            # If using timestamp filtering, skip rows that haven't changed
-            if timestamp_col_idx is not None and last_sync_time:
-                row_timestamp = self.parse_date(row[timestamp_col_idx]) if timestamp_col_idx < len(row) else None
-                if row_timestamp and row_timestamp < last_sync_time.date():
-                    skipped += 1
-                    continue
+            if full_pass:
+                logger.info(f"  Processing ALL {sheet_count} rows with phone matching...")
+            else:
+                logger.info(f"  Processing changed rows of {sheet_count} with phone matching...")
             
-            row_data = {}
-            for j, header in enumerate(normalized_headers):
-                if j < len(row):
-                    row_data[header] = row[j]
+            processed = 0
+            errors = 0
+            inserted = 0
+            updated = 0
+            skipped = 0
+            unchanged = 0
             
-            try:
-                if tab_type in ['tham_my', 'nha_khoa']:
-                    prepared = self.prepare_khach_hang_row(row_data, tab_type)
-                    if prepared:
-                        batch.append(prepared)
-                else:  # gioi_thieu
-                    prepared, ctv_phone = self.prepare_gioi_thieu_row(row_data)
-                    if prepared:
-                        batch.append(prepared)
-                        ctv_phones.append(ctv_phone)
+            # Process in batches for efficiency
+            batch = []
+            ctv_phones = []  # For gioi_thieu only
+            batch_state = []  # (row_number, row_hash, fingerprint) of the rows in batch
+            synced_state = [(1, header_hash, None)]  # Rows now in sync with the DB
+            
+            for i, row in enumerate(data_rows):
+                row_number = i + 2
+                current_hash = self.row_hash(row)
                 
-                # Commit batch when full
-                if len(batch) >= BATCH_SIZE:
-                    conn = self.ensure_connection(conn)
+                # Row content already synced (possibly at another position)
+                if current_hash in known_hashes:
+                    unchanged += 1
+                    synced_state.append((row_number, current_hash, known_hashes[current_hash]))
+                    continue
+                
+                if not row:
+                    synced_state.append((row_number, current_hash, None))
+                    continue
+                
+                # If using timestamp filtering, skip rows that haven't changed
+                if timestamp_col_idx is not None and last_sync_time:
+                    row_timestamp = self.parse_date(row[timestamp_col_idx]) if timestamp_col_idx < len(row) else None
+                    if row_timestamp and row_timestamp < last_sync_time.date():
+                        skipped += 1
+                        continue
+                
+                row_data = {}
+                for j, header in enumerate(normalized_headers):
+                    if j < len(row):
+                        row_data[header] = row[j]
+                
+                try:
+                    if tab_type in ['tham_my', 'nha_khoa']:
+                        prepared = self.prepare_khach_hang_row(row_data, tab_type)
+                        ctv_phone = None
+                    else:  # gioi_thieu
+                        prepared, ctv_phone = self.prepare_gioi_thieu_row(row_data)
                     
-                    if tab_type == 'tham_my':
-                        ins, upd = self.bulk_insert_or_update_tham_my(conn, batch)
-                        inserted += ins
-                        updated += upd
-                        processed += ins + upd
-                    elif tab_type == 'nha_khoa':
-                        ins, upd = self.bulk_insert_or_update_nha_khoa(conn, batch)
-                        inserted += ins
-                        updated += upd
-                        processed += ins + upd
-                    else:
-                        ins, upd = self.bulk_insert_or_update_gioi_thieu(conn, batch, ctv_phones)
+                    if not prepared:
+                        synced_state.append((row_number, current_hash, None))
+                        continue
+                    
+                    fingerprint = self.row_fingerprint(prepared, tab_type)
+                    # Edited row of an already-imported visit: the duplicate check would skip it anyway
+                    if tab_type != 'gioi_thieu' and fingerprint in known_fingerprints:
+                        unchanged += 1
+                        synced_state.append((row_number, current_hash, fingerprint))
+                        continue
+                    
+                    batch.append(prepared)
+                    ctv_phones.append(ctv_phone)
+                    batch_state.append((row_number, current_hash, fingerprint))
+                    
+                    # Commit batch when full
+                    if len(batch) >= BATCH_SIZE:
+                        conn = self.ensure_connection(conn)
+                        
+                        ins, upd = self._flush_phone_matching_batch(conn, tab_type, batch, ctv_phones)
                         inserted += ins
                         updated += upd
                         processed += ins + upd
+                        synced_state.extend(batch_state)
+                        
+                        logger.info(f"    Batch: {processed} processed ({inserted} new, {updated} skipped duplicates)")
+                        batch = []
+                        ctv_phones = []
+                        batch_state = []
+                        
+                except Exception as e:
+                    logger.error(f"    Row {row_number}: Error - {e}")
+                    errors += 1
+            
+            # Commit remaining rows
+            if batch:
+                try:
+                    conn = self.ensure_connection(conn)
                     
-                    logger.info(f"    Batch: {processed} processed ({inserted} new, {updated} skipped duplicates)")
-                    batch = []
-                    ctv_phones = []
-                    
-            except Exception as e:
-                logger.error(f"    Row {i + 2}: Error - {e}")
-                errors += 1
-        
-        # Commit remaining rows
-        if batch:
-            try:
-                conn = self.ensure_connection(conn)
-                
-                if tab_type == 'tham_my':
-                    ins, upd = self.bulk_insert_or_update_tham_my(conn, batch)
-                    inserted += ins
-                    updated += upd
-                    processed += ins + upd
-                elif tab_type == 'nha_khoa':
-                    ins, upd = self.bulk_insert_or_update_nha_khoa(conn, batch)
-                    inserted += ins
-                    updated += upd
-                    processed += ins + upd
-                else:
-                    ins, upd = self.bulk_insert_or_update_gioi_thieu(conn, batch, ctv_phones)
+                    ins, upd = self._flush_phone_matching_batch(conn, tab_type, batch, ctv_phones)
                     inserted += ins
                     updated += upd
                     processed += ins + upd
-            except Exception as e:
-                logger.error(f"    Final batch error: {e}")
-                errors += len(batch)
+                    synced_state.extend(batch_state)
+                except Exception as e:
+                    logger.error(f"    Final batch error: {e}")
+                    errors += len(batch)
+            
+            # Remember what is in sync; rows that failed keep their old state and are retried
+            if state_available:
+                row_updates = [entry for entry in synced_state
+                               if row_state.get(entry[0], (None,))[0] != entry[1]]
+                # Forget modifiedTime on errors so the next cycle reads the sheet again
+                self.save_tab_state(conn, tab_type, modified_time if errors == 0 else None,
+                                    len(all_values), row_updates, full_pass)
+            
+            if skipped > 0:
+                logger.info(f"  Skipped {skipped} unchanged rows (timestamp filtering)")
+            if unchanged > 0:
+                logger.info(f"  Skipped {unchanged} rows already in sync")
+            logger.info(f"  Completed: {processed} processed ({inserted} new, {updated} updated), {errors} errors")
+            return processed, errors
+        finally:
+            if conn is not caller_conn:
+                conn.close()
+
+    def sync_tabs_concurrently(self, spreadsheet, tab_types=TAB_TYPES, timestamp_column=None,
+                               full_sync=False, max_workers=SYNC_MAX_WORKERS):
+        """
+        Sync several tabs at once: the tabs that need reading are fetched with a single
+        values_batch_get, then each tab is matched on its own pooled connection in a
+        bounded thread pool, so a cycle takes as long as its slowest tab.
         
-        if skipped > 0:
-            logger.info(f"  Skipped {skipped} unchanged rows (timestamp filtering)")
-        logger.info(f"  Completed: {processed} processed ({inserted} new, {updated} updated), {errors} errors")
-        return processed, errors
+        Returns:
+            {tab_type: {'processed', 'errors', 'duration', 'rows'}} - rows is the sheet
+            row count read (None when the tab was skipped as unchanged)
+        """
+        stats = {tab: {'processed': 0, 'errors': 0, 'duration': 0.0, 'rows': None} for tab in tab_types}
+        modified_time = self.get_sheet_modified_time(spreadsheet)
+        
+        conn = get_pooled_connection()
+        try:
+            tab_states = self.load_tab_states(conn, tab_types) if conn and not full_sync else {}
+        finally:
+            if conn:
+                return_db_connection(conn)
+        to_read = [tab for tab in tab_types
+                   if full_sync or not self.tab_is_unchanged(tab_states.get(tab), modified_time)]
+        if not to_read:
+            logger.info("  Spreadsheet unchanged since last sync, nothing to read")
+            return stats
+        
+        # Cached tab list (sheets_client) to resolve the tabs, one values call for all of them
+        worksheets = {}
+        for tab in to_read:
+            worksheet = get_worksheet(spreadsheet.id, TAB_VARIATIONS[tab])
+            if worksheet:
+                worksheets[tab] = worksheet
+            else:
+                logger.warning(f"  Tab not found for {tab}")
+        if not worksheets:
+            return stats
+        
+        # Bounded by the last known row count like read_tab_values (not on a full pass)
+        ranges = []
+        bounds = {}
+        for tab, worksheet in worksheets.items():
+            tab_state = tab_states.get(tab)
+            full_pass = full_sync or not tab_state or (
+                tab_state['full_sync_age'] is None or tab_state['full_sync_age'] > FULL_RESYNC_INTERVAL)
+            known_rows = tab_state['row_count'] if tab_state and not full_pass else None
+            if known_rows and known_rows + RANGE_READ_HEADROOM < worksheet.row_count:
+                bounds[tab] = known_rows + RANGE_READ_HEADROOM
+                ranges.append(absolute_range_name(
+                    worksheet.title, f"A1:{rowcol_to_a1(bounds[tab], worksheet.col_count)}"))
+            else:
+                ranges.append(absolute_range_name(worksheet.title))
+        
+        start_time = time.time()
+        response = spreadsheet.values_batch_get(ranges)
+        values = {tab: fill_gaps(value_range.get('values', []))
+                  for tab, value_range in zip(worksheets, response.get('valueRanges', []))}
+        
+        # A bounded range that came back full may have cut the tab off
+        for tab, bound in bounds.items():
+            if len(values.get(tab, [])) >= bound:
+                logger.info(f"  {tab}: more than {bound} rows, reading the whole tab")
+                values[tab] = worksheets[tab].get_all_values()
+        logger.info(f"  Downloaded {', '.join(f'{tab}={len(rows)}' for tab, rows in values.items())} rows "
+                    f"in one request ({time.time() - start_time:.2f}s)")
+        
+        def sync_one(tab):
+            tab_start = time.time()
+            tab_conn = get_pooled_connection()
+            if not tab_conn:
+                return tab, 0, 1, time.time() - tab_start
+            try:
+                p, e = self.sync_tab_by_phone_matching(
+                    spreadsheet, tab_conn, tab, timestamp_column, full_sync,
+                    prefetched={'values': values[tab], 'modified_time': modified_time}
+                )
+            except Exception as ex:
+                logger.error(f"  Tab {tab} error: {ex}")
+                p, e = 0, 1
+            finally:
+                # Closed when it was lost mid-sync: the pool drops it instead of lending it out again
+                return_db_connection(tab_conn, close=tab_conn.closed)
+            return tab, p, e, time.time() - tab_start
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(values)))) as executor:
+            for tab, p, e, duration in executor.map(sync_one, list(values)):
+                stats[tab].update({'processed': p, 'errors': e, 'duration': round(duration, 2),
+                                   'rows': len(values[tab])})
+                logger.info(f"  {tab}: {p} processed, {e} errors ({duration:.2f}s)")
+        
+        return stats
 
     def bulk_insert_or_update_nha_khoa(self, conn, rows):
         """
@@ -669,118 +968,8 @@ class GoogleSheetSync:
         Only skip exact duplicates (same phone + date + service).
         Each service visit should be a separate row!
         Returns (inserted_count, skipped_count)
-        
-        Row tuple indices from prepare_khach_hang_row:
-        0: ngay_nhap, 1: ten_khach, 2: sdt, 3: co_so, 4: ngay_lam, 5: gio,
-        6: dich_vu, 7: tong_tien, 8: tien_coc, 9: phai_dong, 10: nguoi_chot, 
-        11: ghi_chu, 12: trang_thai, 13: tab_type
         """
-        if not rows:
-            return 0, 0
-        
-        inserted = 0
-        skipped = 0
-        insert_batch = []
-        
-        for row in rows:
-            sdt = row[2]        # Phone number
-            ngay_nhap = row[0]  # Date
-            dich_vu = row[6]    # Service (index 6, NOT 3!)
-            
-            # Only skip if EXACT same record exists (phone + date + service)
-            if self.check_exact_record_exists(conn, sdt, ngay_nhap, dich_vu, 'nha_khoa'):
-                skipped += 1
-            else:
-                # New service entry - add to insert batch
-                insert_batch.append(row)
-        
-        # Bulk insert all new service entries
-        if insert_batch:
-            inserted = self.bulk_insert_khach_hang(conn, insert_batch, 'nha_khoa')
-        
-        return inserted, skipped
-
-    def check_record_exists(self, conn, sdt, ngay_nhap, source):
-        """Check if a specific record exists (same phone + date + source)"""
-        cur = conn.cursor()
-        try:
-            if ngay_nhap:
-                cur.execute("""
-                    SELECT COUNT(*) FROM khach_hang 
-                    WHERE sdt = %s AND ngay_nhap_don = %s AND source = %s
-                """, (sdt, ngay_nhap, source))
-            else:
-                cur.execute("""
-                    SELECT COUNT(*) FROM khach_hang 
-                    WHERE sdt = %s AND source = %s
-                """, (sdt, source))
-            count = cur.fetchone()[0]
-            cur.close()
-            return count > 0
-        except Exception:
-            cur.close()
-            return False
-
-    def update_nha_khoa_record(self, conn, sdt, ngay_nhap, row_data):
-        """Update an existing Nha Khoa record"""
-        cur = conn.cursor()
-        try:
-            if ngay_nhap:
-                cur.execute("""
-                    UPDATE khach_hang SET
-                        ten_khach = COALESCE(%s, ten_khach),
-                        co_so = COALESCE(%s, co_so),
-                        ngay_hen_lam = COALESCE(%s, ngay_hen_lam),
-                        gio = COALESCE(%s, gio),
-                        dich_vu = COALESCE(%s, dich_vu),
-                        tong_tien = COALESCE(%s, tong_tien),
-                        tien_coc = COALESCE(%s, tien_coc),
-                        phai_dong = COALESCE(%s, phai_dong),
-                        nguoi_chot = COALESCE(%s, nguoi_chot),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE sdt = %s AND ngay_nhap_don = %s AND source = 'nha_khoa'
-                """, (
-                    row_data[1],   # ten_khach
-                    row_data[3],   # co_so
-                    row_data[4],   # ngay_hen_lam
-                    row_data[5],   # gio
-                    row_data[6],   # dich_vu
-                    row_data[7],   # tong_tien
-                    row_data[8],   # tien_coc
-                    row_data[9],   # phai_dong
-                    row_data[10],  # nguoi_chot
-                    sdt,
-                    ngay_nhap
-                ))
-            else:
-                cur.execute("""
-                    UPDATE khach_hang SET
-                        ten_khach = COALESCE(%s, ten_khach),
-                        co_so = COALESCE(%s, co_so),
-                        ngay_hen_lam = COALESCE(%s, ngay_hen_lam),
-                        gio = COALESCE(%s, gio),
-                        dich_vu = COALESCE(%s, dich_vu),
-                        tong_tien = COALESCE(%s, tong_tien),
-                        tien_coc = COALESCE(%s, tien_coc),
-                        phai_dong = COALESCE(%s, phai_dong),
-                        nguoi_chot = COALESCE(%s, nguoi_chot),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE sdt = %s AND source = 'nha_khoa'
-                    AND id = (SELECT id FROM khach_hang WHERE sdt = %s AND source = 'nha_khoa' 
-                              ORDER BY ngay_nhap_don DESC NULLS LAST LIMIT 1)
-                """, (
-                    row_data[1], row_data[3], row_data[4], row_data[5],
-                    row_data[6], row_data[7], row_data[8], row_data[9], row_data[10],
-                    sdt, sdt
-                ))
-            conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            conn.rollback()
-            cur.close()
-            logger.error(f"  Error updating nha_khoa record {sdt}: {e}")
-            return False
+        return self.bulk_insert_new_khach_hang(conn, rows, 'nha_khoa', match_name=False)
 
     def bulk_insert_or_update_gioi_thieu(self, conn, rows, ctv_phones):
         """
@@ -791,104 +980,57 @@ class GoogleSheetSync:
         if not rows:
             return 0, 0
         
-        # First, create any missing CTVs
-        cur = conn.cursor()
-        unique_ctvs = set(p for p in ctv_phones if p)
-        if unique_ctvs:
-            cur.execute("SELECT ma_ctv FROM ctv WHERE ma_ctv = ANY(%s)", (list(unique_ctvs),))
-            existing = set(row[0] for row in cur.fetchall())
-            
-            new_ctvs = unique_ctvs - existing
-            if new_ctvs:
-                import hashlib
-                import secrets
-                ctv_rows = []
-                for phone in new_ctvs:
-                    salt = secrets.token_hex(16)
-                    password = 'ctv123'
-                    hash_obj = hashlib.sha256((salt + password).encode())
-                    password_hash = f"{salt}:{hash_obj.hexdigest()}"
-                    ctv_rows.append((phone, phone, password_hash, True))
-                
-                execute_values(cur, 
-                    "INSERT INTO ctv (ma_ctv, ten, password_hash, is_active) VALUES %s ON CONFLICT DO NOTHING",
-                    ctv_rows)
-                logger.info(f"  Created {len(new_ctvs)} new CTV accounts")
-        cur.close()
-        
-        inserted = 0
-        updated = 0
-        insert_batch = []
-        insert_ctv_phones = []
-        
-        for idx, row in enumerate(rows):
-            sdt = row[2]  # Phone number is at index 2
-            nguoi_chot = row[6]  # Referrer phone at index 6
-            
-            # Check if this referral record exists (same customer phone + referrer)
-            if self.check_gioi_thieu_exists(conn, sdt, nguoi_chot):
-                # Update existing record
-                if self.update_gioi_thieu_record(conn, sdt, nguoi_chot, row):
-                    updated += 1
-                else:
-                    insert_batch.append(row)
-                    insert_ctv_phones.append(ctv_phones[idx] if idx < len(ctv_phones) else None)
-            else:
-                # New record
-                insert_batch.append(row)
-                insert_ctv_phones.append(ctv_phones[idx] if idx < len(ctv_phones) else None)
-        
-        # Bulk insert new records
-        if insert_batch:
-            inserted = self.bulk_insert_gioi_thieu(conn, insert_batch, insert_ctv_phones)
-        
-        return inserted, updated
-
-    def check_gioi_thieu_exists(self, conn, sdt, nguoi_chot):
-        """Check if a gioi_thieu record exists (same customer phone + referrer)"""
         cur = conn.cursor()
         try:
+            self.create_missing_ctvs(cur, ctv_phones)
+            self.load_sheet_batch(cur, GIOI_THIEU_BATCH_COLUMNS, rows)
+            
+            # 1. Match on customer phone + referrer
             cur.execute("""
-                SELECT COUNT(*) FROM khach_hang 
-                WHERE sdt = %s AND nguoi_chot = %s AND source = 'gioi_thieu'
-            """, (sdt, nguoi_chot))
-            count = cur.fetchone()[0]
-            cur.close()
-            return count > 0
-        except Exception:
-            cur.close()
-            return False
-
-    def update_gioi_thieu_record(self, conn, sdt, nguoi_chot, row_data):
-        """Update an existing Gioi Thieu record"""
-        cur = conn.cursor()
-        try:
+                UPDATE sheet_batch b SET matched = TRUE
+                WHERE EXISTS (
+                    SELECT 1 FROM khach_hang kh
+                    WHERE kh.sdt = b.sdt AND kh.nguoi_chot = b.nguoi_chot AND kh.source = 'gioi_thieu'
+                )
+            """)
+            updated = cur.rowcount
+            
+            # 2. Update existing records (the last sheet row of a key wins)
             cur.execute("""
-                UPDATE khach_hang SET
-                    ngay_nhap_don = COALESCE(%s, ngay_nhap_don),
-                    ten_khach = COALESCE(%s, ten_khach),
-                    dich_vu = COALESCE(%s, dich_vu),
-                    ghi_chu = COALESCE(%s, ghi_chu),
-                    khu_vuc = COALESCE(%s, khu_vuc),
+                UPDATE khach_hang kh SET
+                    ngay_nhap_don = COALESCE(b.ngay_nhap_don, kh.ngay_nhap_don),
+                    ten_khach = COALESCE(b.ten_khach, kh.ten_khach),
+                    dich_vu = COALESCE(b.dich_vu, kh.dich_vu),
+                    ghi_chu = COALESCE(b.ghi_chu, kh.ghi_chu),
+                    khu_vuc = COALESCE(b.khu_vuc, kh.khu_vuc),
                     updated_at = CURRENT_TIMESTAMP
-                WHERE sdt = %s AND nguoi_chot = %s AND source = 'gioi_thieu'
-            """, (
-                row_data[0],  # ngay_nhap_don
-                row_data[1],  # ten_khach
-                row_data[3],  # dich_vu
-                row_data[4],  # ghi_chu
-                row_data[5],  # khu_vuc
-                sdt,
-                nguoi_chot
-            ))
+                FROM (
+                    SELECT DISTINCT ON (sdt, nguoi_chot) *
+                    FROM sheet_batch
+                    WHERE matched
+                    ORDER BY sdt, nguoi_chot, seq DESC
+                ) b
+                WHERE kh.sdt = b.sdt AND kh.nguoi_chot = b.nguoi_chot AND kh.source = 'gioi_thieu'
+            """)
+            
+            # 3. Insert new referrals, in sheet order
+            cur.execute("""
+                INSERT INTO khach_hang 
+                (ngay_nhap_don, ten_khach, sdt, dich_vu, ghi_chu, khu_vuc, nguoi_chot, source, trang_thai)
+                SELECT ngay_nhap_don, ten_khach, sdt, dich_vu, ghi_chu, khu_vuc, nguoi_chot,
+                       'gioi_thieu', 'Cho xac nhan'
+                FROM sheet_batch
+                WHERE NOT matched
+                ORDER BY seq
+            """)
+            inserted = cur.rowcount
             conn.commit()
             cur.close()
-            return True
+            return inserted, updated
         except Exception as e:
             conn.rollback()
             cur.close()
-            logger.error(f"  Error updating gioi_thieu record {sdt}: {e}")
-            return False
+            raise e
 
     def sync_tab_by_count(self, spreadsheet, conn, tab_type, hard_reset=False):
         """Sync a tab from Google Sheets to database with batch processing"""
@@ -1103,6 +1245,7 @@ class GoogleSheetSync:
                 """)
                 deleted_count = cur.rowcount
                 conn.commit()
+                self.clear_sheet_state(conn)
                 add_log(f"✓ Deleted {deleted_count:,} records from khach_hang", 'success', 'delete')
                 
                 add_log("Deleting commission records...", 'info', 'delete')
@@ -4,6 +4,7 @@ from .commissions import (
     calculate_commissions,
     calculate_commission_for_khach_hang,
     calculate_commission_for_service,
+    calculate_commissions_bulk,
     recalculate_commissions_for_record,
     recalculate_all_commissions,
     calculate_missing_commissions,
@@ -20,8 +21,32 @@ from .hierarchy import (
     get_all_descendants,
     get_max_depth_below,
     get_total_downline,
+    get_downline_counts,
     get_network_stats
 )
+from .graph import (
+    ReferralGraph,
+    get_referral_graph,
+    refresh_referral_graph,
+    graph_set_parent,
+    graph_remove_ctv
+)
+from .closure import (
+    rebuild_ctv_closure,
+    check_ctv_closure
+)
+from .rollup import (
+    refresh_ctv_daily_rollup,
+    rebuild_ctv_daily_rollup,
+    month_date_range,
+    build_rollup_date_condition,
+    UNDATED_DAY
+)
+from .jobs import (
+    enqueue_commission_job,
+    process_commission_jobs,
+    get_commission_freshness
+)
 from .validation import validate_ctv_data
 
 __all__ = [
@@ -30,6 +55,7 @@ __all__ = [
     'calculate_commissions',
     'calculate_commission_for_khach_hang',
     'calculate_commission_for_service',
+    'calculate_commissions_bulk',
     'recalculate_commissions_for_record',
     'recalculate_all_commissions',
     'calculate_missing_commissions',
@@ -44,7 +70,23 @@ __all__ = [
     'get_all_descendants',
     'get_max_depth_below',
     'get_total_downline',
+    'get_downline_counts',
     'get_network_stats',
+    'ReferralGraph',
+    'get_referral_graph',
+    'refresh_referral_graph',
+    'graph_set_parent',
+    'graph_remove_ctv',
+    'rebuild_ctv_closure',
+    'check_ctv_closure',
+    'refresh_ctv_daily_rollup',
+    'rebuild_ctv_daily_rollup',
+    'month_date_range',
+    'build_rollup_date_condition',
+    'UNDATED_DAY',
+    'enqueue_commission_job',
+    'process_commission_jobs',
+    'get_commission_freshness',
     'validate_ctv_data'
 ]
 
@@ -0,0 +1,117 @@
+"""
+CTV Closure Module
+Maintenance helpers for the ctv_closure(ancestor, descendant, depth) table.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - rebuild_ctv_closure(connection=None) -> int or None
+#     DOES: Recomputes every row from ctv.nguoi_gioi_thieu
+#
+# - check_ctv_closure(connection=None) -> dict or None
+#     DOES: Compares the table with freshly computed ancestor chains
+#
+# NOTES:
+# - Day-to-day maintenance is done by the ctv_closure_sync trigger, in the same
+#   transaction as the ctv write (see migrate_ctv_closure.py). These helpers are
+#   for the initial build and for repairing drift.
+# - Every CTV has a depth 0 row pointing at itself, so "downline including self"
+#   is simply WHERE ancestor = %s.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+from ..db_pool import get_db_connection, return_db_connection
+
+
+def rebuild_ctv_closure(connection=None):
+    """
+    DOES: Recompute the whole ctv_closure table
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Number of closure rows written, or None on failure
+
+    Writes to ctv are blocked (reads are not) until the rebuild commits.
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("LOCK TABLE ctv IN SHARE MODE")
+        cursor.execute("DELETE FROM ctv_closure")
+        cursor.execute("""
+            INSERT INTO ctv_closure (ancestor, descendant, depth)
+            SELECT * FROM ctv_closure_paths(ARRAY(SELECT ma_ctv::TEXT FROM ctv))
+        """)
+        rows = cursor.rowcount
+        connection.commit()
+        cursor.close()
+
+        if should_close:
+            return_db_connection(connection)
+        return rows
+
+    except Error as e:
+        print(f"Error rebuilding ctv_closure: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def check_ctv_closure(connection=None):
+    """
+    DOES: Verify ctv_closure against the ancestor chains in the ctv table
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Dict {'rows', 'missing', 'extra', 'consistent'}, or None on failure
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            WITH expected AS (
+                SELECT * FROM ctv_closure_paths(ARRAY(SELECT ma_ctv::TEXT FROM ctv))
+            )
+            SELECT
+                (SELECT COUNT(*) FROM ctv_closure) as rows,
+                (SELECT COUNT(*) FROM (
+                    SELECT ancestor, descendant, depth FROM expected
+                    EXCEPT
+                    SELECT ancestor, descendant, depth FROM ctv_closure
+                ) missing) as missing,
+                (SELECT COUNT(*) FROM (
+                    SELECT ancestor, descendant, depth FROM ctv_closure
+                    EXCEPT
+                    SELECT ancestor, descendant, depth FROM expected
+                ) extra) as extra
+        """)
+        result = dict(cursor.fetchone())
+        result['consistent'] = result['missing'] == 0 and result['extra'] == 0
+        cursor.close()
+
+        if should_close:
+            return_db_connection(connection)
+        return result
+
+    except Error as e:
+        print(f"Error checking ctv_closure: {e}")
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
@@ -1,12 +1,12 @@
 from psycopg2 import Error
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from ..db_pool import get_db_connection, return_db_connection
 from ..redis_cache import (
-    cache_commission_rates,
-    get_cached_commission_rates,
+    get_or_load_commission_rates,
     invalidate_commission_cache
 )
 from .hierarchy import build_ancestor_chain, get_parent
+from .graph import refresh_referral_graph
 
 # Maximum level for commission calculations
 MAX_LEVEL = 4
@@ -15,6 +15,10 @@ MAX_LEVEL = 4
 # For returning customers closed by staff, original CTV gets L1 rate, upline gets L2 rate
 CSKH_MAX_LEVELS = 2  # Only 2 levels for CSKH commissions
 
+# Transactions per bulk calculation pass / rows per INSERT statement
+BULK_BATCH_SIZE = 2000
+BULK_PAGE_SIZE = 1000
+
 # Default commission rates (fallback if database is empty)
 DEFAULT_COMMISSION_RATES = {
     0: 0.25,      # 25% - self
@@ -49,16 +53,11 @@ def find_original_ctv_for_customer(cursor, customer_phone):
         cursor.execute("""
             SELECT c.ma_ctv
             FROM khach_hang kh
-            JOIN ctv c ON (
-                LOWER(kh.nguoi_chot) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = 
-                   RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
-            WHERE RIGHT(REGEXP_REPLACE(kh.sdt, '[^0-9]', '', 'g'), 9) = 
-                  RIGHT(REGEXP_REPLACE(%s, '[^0-9]', '', 'g'), 9)
+            JOIN ctv c ON kh.nguoi_chot_norm = c.ma_ctv_norm
+            WHERE kh.sdt_norm = phone_key(%s)
             AND kh.trang_thai IN ('Đã đến làm', 'Da den lam')
             AND kh.ngay_hen_lam >= CURRENT_DATE - INTERVAL '365 days'
-            ORDER BY kh.ngay_hen_lam ASC
+            ORDER BY kh.ngay_hen_lam ASC, kh.id ASC, c.ma_ctv ASC
             LIMIT 1
         """, (customer_phone,))
         
@@ -91,8 +90,7 @@ def count_customer_visits(cursor, customer_phone, days=365):
         cursor.execute("""
             SELECT COUNT(*) as visit_count
             FROM khach_hang
-            WHERE RIGHT(REGEXP_REPLACE(sdt, '[^0-9]', '', 'g'), 9) = 
-                  RIGHT(REGEXP_REPLACE(%s, '[^0-9]', '', 'g'), 9)
+            WHERE sdt_norm = phone_key(%s)
             AND trang_thai IN ('Đã đến làm', 'Da den lam')
             AND ngay_hen_lam >= CURRENT_DATE - INTERVAL '%s days'
         """ % ('%s', days), (customer_phone,))
@@ -113,18 +111,22 @@ def get_commission_rates(connection=None):
     INPUTS: Optional connection (creates new if not provided)
     OUTPUTS: Dict {level: rate} or DEFAULT_COMMISSION_RATES on failure
     """
-    # Try cache first
-    cached_rates = get_cached_commission_rates()
-    if cached_rates:
-        return cached_rates
-    
+    rates = get_or_load_commission_rates(lambda: _load_commission_rates(connection))
+    return rates if rates else DEFAULT_COMMISSION_RATES.copy()
+
+
+def _load_commission_rates(connection=None):
+    """
+    DOES: Uncached body of get_commission_rates
+    OUTPUTS: Dict {level: rate} or None if no rates are configured / on failure
+    """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
-        return DEFAULT_COMMISSION_RATES.copy()
+        return None
     
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
@@ -148,7 +150,6 @@ def get_commission_rates(connection=None):
                 if should_close:
                     return_db_connection(connection)
                 
-                cache_commission_rates(rates)
                 return rates
         
         # Try commission_settings fallback
@@ -170,20 +171,19 @@ def get_commission_rates(connection=None):
                 if should_close:
                     return_db_connection(connection)
                 
-                cache_commission_rates(rates)
                 return rates
         
         cursor.close()
         if should_close:
             return_db_connection(connection)
         
-        return DEFAULT_COMMISSION_RATES.copy()
+        return None
         
     except Error as e:
         print(f"Error loading commission rates: {e}")
         if should_close and connection:
             return_db_connection(connection)
-        return DEFAULT_COMMISSION_RATES.copy()
+        return None
 
 def calculate_commissions(transaction_id, ctv_code, amount, connection=None, commit=True):
     """
@@ -375,6 +375,194 @@ def calculate_cskh_commission_for_khach_hang(khach_hang_id, original_ctv_code, a
     return calculate_cskh_commissions(-abs(khach_hang_id), original_ctv_code, amount, connection, commit=commit)
 
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# BULK ENGINE
+# Same rows as calculate_commissions / calculate_cskh_commissions, but a whole
+# batch of transactions costs one DELETE and a handful of multi-row INSERTs.
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _bulk_ancestor_chains(cursor, ctv_codes, graph):
+    """
+    DOES: Resolve build_ancestor_chain() for many CTVs at once
+    OUTPUTS: Dict {ctv_code: [(ancestor_code, level), ...]}
+    """
+    codes = list({code for code in ctv_codes if code})
+    if graph is not None:
+        return {code: graph.ancestors(code, MAX_LEVEL) for code in codes}
+
+    chains = {code: [] for code in codes}
+    if not codes:
+        return chains
+
+    cursor.execute("""
+        WITH RECURSIVE ancestors AS (
+            SELECT b.code AS start_code, c.ma_ctv, c.nguoi_gioi_thieu, 0 as level
+            FROM unnest(%s::text[]) AS b(code)
+            JOIN ctv c ON LOWER(c.ma_ctv) = LOWER(b.code)
+
+            UNION ALL
+
+            SELECT a.start_code, c.ma_ctv, c.nguoi_gioi_thieu, a.level + 1
+            FROM ctv c
+            INNER JOIN ancestors a ON LOWER(c.ma_ctv) = LOWER(a.nguoi_gioi_thieu)
+            WHERE a.level < %s AND a.nguoi_gioi_thieu IS NOT NULL
+        )
+        SELECT start_code, ma_ctv, level FROM ancestors ORDER BY start_code, level
+    """, (codes, MAX_LEVEL))
+    for row in cursor.fetchall():
+        chains[row['start_code']].append((row['ma_ctv'], row['level']))
+    return chains
+
+
+def _bulk_parents(cursor, ctv_codes, graph):
+    """
+    DOES: Resolve get_parent() for many CTVs at once
+    OUTPUTS: Dict {ctv_code: parent_code or None}
+    """
+    codes = list({code for code in ctv_codes if code})
+    if graph is not None:
+        return {code: graph.get_parent(code) for code in codes}
+
+    parents = {code: None for code in codes}
+    if not codes:
+        return parents
+
+    cursor.execute("""
+        SELECT b.code, c.nguoi_gioi_thieu
+        FROM unnest(%s::text[]) AS b(code)
+        JOIN ctv c ON LOWER(c.ma_ctv) = LOWER(b.code)
+    """, (codes,))
+    for row in cursor.fetchall():
+        parents[row['code']] = row['nguoi_gioi_thieu']
+    return parents
+
+
+def _calculate_commission_batch(cursor, transactions, cskh_transactions, rates, graph):
+    """
+    DOES: Replace the commission rows of a batch of transactions
+    INPUTS:
+        cursor - RealDictCursor on the caller's connection (caller commits)
+        transactions - [(transaction_id, ctv_code, amount)] for direct commissions
+        cskh_transactions - [(transaction_id, original_ctv_code, amount)] for CSKH commissions
+        rates - Dict {level: rate} from get_commission_rates()
+        graph - ReferralGraph, or None to resolve ancestors with SQL
+    OUTPUTS: Dict {'transactions': n, 'commissions': n, 'errors': n}
+
+    A transaction listed more than once keeps its last entry, exactly like
+    calling calculate_commissions() for each entry in order.
+    """
+    chains = _bulk_ancestor_chains(cursor, [code for _, code, _ in transactions], graph)
+    parents = _bulk_parents(cursor, [code for _, code, _ in cskh_transactions], graph)
+
+    rows_by_transaction = {}
+    errors = 0
+
+    for transaction_id, ctv_code, amount in transactions:
+        chain = chains.get(ctv_code, [])
+        if chain and amount is None:
+            # calculate_commissions() fails on float(None) before inserting anything
+            rows_by_transaction[transaction_id] = []
+            errors += 1
+            continue
+
+        rows = []
+        for ancestor_code, level in chain:
+            rate = rates.get(level, 0)
+            rows.append((transaction_id, ancestor_code, level, rate, amount, float(amount) * rate, 'direct'))
+        rows_by_transaction[transaction_id] = rows
+
+    for transaction_id, original_ctv_code, amount in cskh_transactions:
+        rows = []
+        level_1_rate = rates.get(1, 0.04)
+        if level_1_rate > 0:
+            rows.append((transaction_id, original_ctv_code, 1, level_1_rate, amount,
+                         float(amount) * level_1_rate, 'cskh'))
+
+        upline_code = parents.get(original_ctv_code)
+        if upline_code:
+            level_2_rate = rates.get(2, 0.02)
+            if level_2_rate > 0:
+                rows.append((transaction_id, upline_code, 2, level_2_rate, amount,
+                             float(amount) * level_2_rate, 'cskh'))
+        rows_by_transaction[transaction_id] = rows
+
+    if rows_by_transaction:
+        cursor.execute(
+            "DELETE FROM commissions WHERE transaction_id = ANY(%s)",
+            (list(rows_by_transaction),)
+        )
+
+    all_rows = [row for rows in rows_by_transaction.values() for row in rows]
+    if all_rows:
+        execute_values(cursor, """
+            INSERT INTO commissions
+            (transaction_id, ctv_code, level, commission_rate, transaction_amount, commission_amount, commission_type)
+            VALUES %s
+        """, all_rows, page_size=BULK_PAGE_SIZE)
+
+    return {
+        'transactions': len(rows_by_transaction),
+        'commissions': len(all_rows),
+        'errors': errors
+    }
+
+
+def calculate_commissions_bulk(transactions, cskh_transactions=(), connection=None, commit=True):
+    """
+    DOES: Calculate and store commissions for many transactions in one pass
+    INPUTS:
+        transactions - Iterable of (transaction_id, ctv_code, amount) for direct commissions
+        cskh_transactions - Iterable of (transaction_id, original_ctv_code, amount) for CSKH
+        connection - Optional database connection
+        commit - Whether to commit the transaction
+    OUTPUTS: Dict {'transactions': n, 'commissions': n, 'errors': n}
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return {'transactions': 0, 'commissions': 0, 'errors': 0}
+
+    try:
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        rates = get_commission_rates(connection)
+        graph = refresh_referral_graph(connection)
+
+        transactions = list(transactions)
+        cskh_transactions = list(cskh_transactions)
+        stats = {'transactions': 0, 'commissions': 0, 'errors': 0}
+
+        for start in range(0, max(len(transactions), len(cskh_transactions)), BULK_BATCH_SIZE):
+            batch_stats = _calculate_commission_batch(
+                cursor,
+                transactions[start:start + BULK_BATCH_SIZE],
+                cskh_transactions[start:start + BULK_BATCH_SIZE],
+                rates, graph
+            )
+            for key in stats:
+                stats[key] += batch_stats[key]
+
+        if commit:
+            connection.commit()
+            invalidate_commission_cache()
+
+        cursor.close()
+        if should_close:
+            return_db_connection(connection)
+
+        return stats
+
+    except Error as e:
+        print(f"Error calculating bulk commissions: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return {'error': str(e)}
+
+
 def recalculate_commissions_for_record(record_id, source_type, connection=None):
     """
     DOES: Recalculate commissions for a single record (khach_hang or service)
@@ -428,9 +616,11 @@ def recalculate_commissions_for_record(record_id, source_type, connection=None):
             return_db_connection(connection)
         return 0
 
-def recalculate_all_commissions(connection=None, batch_size=100):
+def recalculate_all_commissions(connection=None, batch_size=BULK_BATCH_SIZE):
     """
     DOES: Recalculate all commissions from khach_hang and services tables
+    INPUTS: Optional connection, batch_size transactions per bulk pass (one commit each)
+    OUTPUTS: Dict {'khach_hang': n, 'services': n, 'errors': n}
     """
     should_close = False
     if connection is None:
@@ -446,6 +636,8 @@ def recalculate_all_commissions(connection=None, batch_size=100):
         connection.commit()
         
         stats = {'khach_hang': 0, 'services': 0, 'errors': 0}
+        rates = get_commission_rates(connection)
+        graph = refresh_referral_graph(connection)
         
         cursor.execute("""
             SELECT id, tong_tien, nguoi_chot
@@ -455,14 +647,14 @@ def recalculate_all_commissions(connection=None, batch_size=100):
             AND tong_tien > 0
             AND (trang_thai = 'Đã đến làm' OR trang_thai = 'Da den lam')
         """)
-        kh_records = cursor.fetchall()
+        kh_transactions = [(-abs(kh['id']), kh['nguoi_chot'], kh['tong_tien']) for kh in cursor.fetchall()]
         
-        for kh in kh_records:
-            try:
-                calculate_commission_for_khach_hang(kh['id'], kh['nguoi_chot'], kh['tong_tien'], connection)
-                stats['khach_hang'] += 1
-            except Exception:
-                stats['errors'] += 1
+        for start in range(0, len(kh_transactions), batch_size):
+            batch = kh_transactions[start:start + batch_size]
+            batch_stats = _calculate_commission_batch(cursor, batch, (), rates, graph)
+            connection.commit()
+            stats['khach_hang'] += len(batch) - batch_stats['errors']
+            stats['errors'] += batch_stats['errors']
         
         cursor.execute("""
             SELECT id, tong_tien, COALESCE(nguoi_chot, ctv_code) as ctv_code
@@ -471,15 +663,16 @@ def recalculate_all_commissions(connection=None, batch_size=100):
             OR (ctv_code IS NOT NULL AND ctv_code != '')
             AND tong_tien > 0
         """)
-        svc_records = cursor.fetchall()
+        svc_transactions = [(svc['id'], svc['ctv_code'], svc['tong_tien']) for svc in cursor.fetchall()]
         
-        for svc in svc_records:
-            try:
-                calculate_commission_for_service(svc['id'], svc['ctv_code'], svc['tong_tien'], connection)
-                stats['services'] += 1
-            except Exception:
-                stats['errors'] += 1
+        for start in range(0, len(svc_transactions), batch_size):
+            batch = svc_transactions[start:start + batch_size]
+            batch_stats = _calculate_commission_batch(cursor, batch, (), rates, graph)
+            connection.commit()
+            stats['services'] += len(batch) - batch_stats['errors']
+            stats['errors'] += batch_stats['errors']
         
+        invalidate_commission_cache()
         cursor.close()
         if should_close:
             return_db_connection(connection)
@@ -488,6 +681,8 @@ def recalculate_all_commissions(connection=None, batch_size=100):
         
     except Error as e:
         print(f"Error recalculating all commissions: {e}")
+        if connection:
+            connection.rollback()
         if should_close and connection:
             return_db_connection(connection)
         return {'error': str(e)}
@@ -517,12 +712,7 @@ def calculate_missing_commissions(connection=None):
             AND (kh.trang_thai = 'Đã đến làm' OR kh.trang_thai = 'Da den lam')
             AND c.id IS NULL
         """)
-        kh_missing = cursor.fetchall()
-        
-        count = 0
-        for kh in kh_missing:
-            calculate_commission_for_khach_hang(kh['id'], kh['nguoi_chot'], kh['tong_tien'], connection)
-            count += 1
+        transactions = [(-abs(kh['id']), kh['nguoi_chot'], kh['tong_tien']) for kh in cursor.fetchall()]
             
         cursor.execute("""
             SELECT s.id, s.tong_tien, COALESCE(s.nguoi_chot, s.ctv_code) as ctv_code
@@ -532,17 +722,16 @@ def calculate_missing_commissions(connection=None):
             AND s.tong_tien > 0
             AND c.id IS NULL
         """)
-        svc_missing = cursor.fetchall()
-        
-        for svc in svc_missing:
-            calculate_commission_for_service(svc['id'], svc['ctv_code'], svc['tong_tien'], connection)
-            count += 1
-            
+        transactions.extend((svc['id'], svc['ctv_code'], svc['tong_tien']) for svc in cursor.fetchall())
         cursor.close()
+        
+        result = calculate_commissions_bulk(transactions, connection=connection)
         if should_close:
             return_db_connection(connection)
-            
-        return {'total': count}
+        
+        if 'error' in result:
+            return result
+        return {'total': len(transactions)}
         
     except Error as e:
         print(f"Error calculating missing commissions: {e}")
@@ -579,72 +768,49 @@ def calculate_new_commissions_fast(connection=None):
         max_svc_id = cache_row['last_svc_max_id']
         
         # New khach_hang records - ONLY where nguoi_chot exists in ctv table
-        # Use phone normalization to handle leading zero variations (972020881 vs 0972020881)
+        # Normalized keys handle leading zero variations (972020881 vs 0972020881)
         cursor.execute("""
             SELECT kh.id, kh.tong_tien, c.ma_ctv as nguoi_chot
             FROM khach_hang kh
-            JOIN ctv c ON (
-                LOWER(kh.nguoi_chot) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
+            JOIN ctv c ON kh.nguoi_chot_norm = c.ma_ctv_norm
             WHERE kh.id > %s
             AND kh.tong_tien > 0
             AND (kh.trang_thai = 'Đã đến làm' OR kh.trang_thai = 'Da den lam')
-            ORDER BY kh.id ASC
+            ORDER BY kh.id ASC, c.ma_ctv ASC
         """, (max_kh_id,))
         new_kh = cursor.fetchall()
         
-        count = 0
-        new_max_kh = max_kh_id
-        for kh in new_kh:
-            try:
-                calculate_commission_for_khach_hang(kh['id'], kh['nguoi_chot'], kh['tong_tien'], connection, commit=False)
-                new_max_kh = max(new_max_kh, kh['id'])
-                count += 1
-            except Exception as e:
-                print(f"Error processing khach_hang {kh['id']}: {e}")
-            
         # New service records - ONLY where ctv_code exists in ctv table
-        # Use phone normalization to handle leading zero variations (972020881 vs 0972020881)
+        # Normalized keys handle leading zero variations (972020881 vs 0972020881)
         cursor.execute("""
             SELECT s.id, s.tong_tien, c.ma_ctv as ctv_code
             FROM services s
-            JOIN ctv c ON (
-                LOWER(COALESCE(s.nguoi_chot, s.ctv_code)) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(COALESCE(s.nguoi_chot, s.ctv_code), '[^0-9]', '', 'g'), 9) = RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
+            JOIN ctv c ON s.nguoi_chot_norm = c.ma_ctv_norm
             WHERE s.id > %s
             AND s.tong_tien > 0
-            ORDER BY s.id ASC
+            ORDER BY s.id ASC, c.ma_ctv ASC
         """, (max_svc_id,))
         new_svc = cursor.fetchall()
         
-        new_max_svc = max_svc_id
-        for svc in new_svc:
-            try:
-                calculate_commission_for_service(svc['id'], svc['ctv_code'], svc['tong_tien'], connection, commit=False)
-                new_max_svc = max(new_max_svc, svc['id'])
-                count += 1
-            except Exception as e:
-                print(f"Error processing service {svc['id']}: {e}")
+        transactions = [(-abs(kh['id']), kh['nguoi_chot'], kh['tong_tien']) for kh in new_kh]
+        transactions.extend((svc['id'], svc['ctv_code'], svc['tong_tien']) for svc in new_svc)
+        count = len(transactions)
+        
+        new_max_kh = max([max_kh_id] + [kh['id'] for kh in new_kh])
+        new_max_svc = max([max_svc_id] + [svc['id'] for svc in new_svc])
         
         # ═══════════════════════════════════════════════════════════════════════════
         # CSKH: Process staff-closed records for returning customers
         # When nguoi_chot is NOT a CTV (staff), check if customer is returning,
         # and credit the original CTV who first brought them
         # ═══════════════════════════════════════════════════════════════════════════
-        cskh_count = 0
         
         # Find staff-closed khach_hang records that don't have commissions yet
         # Staff = nguoi_chot does NOT match any CTV
         cursor.execute("""
-            SELECT kh.id, kh.sdt, kh.tong_tien, kh.nguoi_chot
+            SELECT kh.id, kh.sdt, kh.sdt_norm, kh.tong_tien, kh.nguoi_chot
             FROM khach_hang kh
-            LEFT JOIN ctv c ON (
-                LOWER(kh.nguoi_chot) = LOWER(c.ma_ctv)
-                OR RIGHT(REGEXP_REPLACE(kh.nguoi_chot, '[^0-9]', '', 'g'), 9) = 
-                   RIGHT(REGEXP_REPLACE(c.ma_ctv, '[^0-9]', '', 'g'), 9)
-            )
+            LEFT JOIN ctv c ON kh.nguoi_chot_norm = c.ma_ctv_norm
             LEFT JOIN commissions comm ON comm.transaction_id = -abs(kh.id)
             WHERE kh.id > %s
             AND c.ma_ctv IS NULL  -- nguoi_chot is NOT a CTV (staff closed)
@@ -657,29 +823,48 @@ def calculate_new_commissions_fast(connection=None):
         """, (max_kh_id,))
         staff_closed = cursor.fetchall()
         
-        for record in staff_closed:
-            try:
-                kh_id = record['id']
-                customer_phone = record['sdt']
-                amount = record['tong_tien']
-                
-                # Check if this is a returning customer (visit count >= 2)
-                visit_count = count_customer_visits(cursor, customer_phone, days=365)
-                
-                if visit_count >= 2:
-                    # Find the original CTV who first brought this customer
-                    original_ctv = find_original_ctv_for_customer(cursor, customer_phone)
-                    
-                    if original_ctv:
-                        # Calculate CSKH commission (L1 rate for original CTV, L2 rate for upline)
-                        calculate_cskh_commission_for_khach_hang(kh_id, original_ctv, amount, connection, commit=False)
-                        cskh_count += 1
-                        print(f"CSKH: Customer {customer_phone} (visit #{visit_count}) -> credited to original CTV {original_ctv}")
-                
-                new_max_kh = max(new_max_kh, kh_id)
-                
-            except Exception as e:
-                print(f"Error processing CSKH for khach_hang {record['id']}: {e}")
+        cskh_transactions = []
+        if staff_closed:
+            new_max_kh = max(new_max_kh, staff_closed[-1]['id'])
+            phone_keys = list({record['sdt_norm'] for record in staff_closed if record['sdt_norm']})
+            
+            # Returning customer = at least 2 completed visits within 365 days
+            # (same rule as count_customer_visits, for all phones at once)
+            cursor.execute("""
+                SELECT sdt_norm, COUNT(*) as visit_count
+                FROM khach_hang
+                WHERE sdt_norm = ANY(%s)
+                AND trang_thai IN ('Đã đến làm', 'Da den lam')
+                AND ngay_hen_lam >= CURRENT_DATE - INTERVAL '365 days'
+                GROUP BY sdt_norm
+            """, (phone_keys,))
+            visit_counts = {row['sdt_norm']: row['visit_count'] for row in cursor.fetchall()}
+            
+            # Earliest CTV who closed each customer (same rule as find_original_ctv_for_customer)
+            cursor.execute("""
+                SELECT DISTINCT ON (kh.sdt_norm) kh.sdt_norm, c.ma_ctv
+                FROM khach_hang kh
+                JOIN ctv c ON kh.nguoi_chot_norm = c.ma_ctv_norm
+                WHERE kh.sdt_norm = ANY(%s)
+                AND kh.trang_thai IN ('Đã đến làm', 'Da den lam')
+                AND kh.ngay_hen_lam >= CURRENT_DATE - INTERVAL '365 days'
+                ORDER BY kh.sdt_norm, kh.ngay_hen_lam ASC, kh.id ASC, c.ma_ctv ASC
+            """, (phone_keys,))
+            original_ctvs = {row['sdt_norm']: row['ma_ctv'] for row in cursor.fetchall()}
+            
+            for record in staff_closed:
+                phone = record['sdt_norm']
+                if visit_counts.get(phone, 0) >= 2 and original_ctvs.get(phone):
+                    cskh_transactions.append((-abs(record['id']), original_ctvs[phone], record['tong_tien']))
+        
+        cskh_count = len(cskh_transactions)
+        if transactions or cskh_transactions:
+            result = calculate_commissions_bulk(transactions, cskh_transactions, connection, commit=False)
+            if 'error' in result:
+                cursor.close()
+                if should_close:
+                    return_db_connection(connection)
+                return result
         
         if cskh_count > 0:
             print(f"CSKH commissions calculated: {cskh_count} returning customers")
@@ -711,7 +896,7 @@ def get_commission_cache_status():
     """
     DOES: Check how many transactions are missing from commissions table
     """
-    connection = get_db_connection()
+    connection = get_db_connection(shared=True)
     if not connection: return None
     
     try:
@@ -744,7 +929,7 @@ def get_active_levels(connection=None):
     """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
@@ -0,0 +1,359 @@
+"""
+Referral Graph Module
+Process-wide in-memory copy of the CTV referral forest (ma_ctv -> nguoi_gioi_thieu).
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# CLASSES:
+# - ReferralGraph
+#     DOES: Parent/child adjacency arrays keyed by interned integer ids.
+#           Answers ancestors, descendants by level, subtree sizes and depth
+#           without touching the database.
+#           subtree_sizes() counts the downline of every CTV in one pass.
+#
+# FUNCTIONS:
+# - get_referral_graph(connection=None, max_age=GRAPH_MAX_AGE) -> ReferralGraph or None
+#     DOES: Returns the shared graph, (re)loading it with one SELECT when stale
+#
+# - refresh_referral_graph(connection=None) -> ReferralGraph or None
+#     DOES: Forces a full reload (used at the start of batch jobs)
+#
+# - graph_set_parent(ctv_code, parent_code) -> None
+#     DOES: Incremental update after a CTV is created or its referrer changes
+#
+# - graph_remove_ctv(ctv_code) -> None
+#     DOES: Incremental update after a hard delete
+#
+# NOTES:
+# - Codes are matched case-insensitively, like build_ancestor_chain always did.
+# - Each process holds its own copy. Writes in this process update it in place;
+#   writes from other processes are picked up when the copy is older than
+#   GRAPH_MAX_AGE seconds.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import threading
+import time
+from psycopg2 import Error
+from ..db_pool import get_db_connection, return_db_connection
+
+# Reload the graph from the database when the in-memory copy is older than this
+GRAPH_MAX_AGE = 60
+
+# Marker for "no parent" in the parent array
+NO_PARENT = -1
+
+
+class ReferralGraph:
+    """
+    DOES: In-memory referral forest with interned integer node ids
+
+    Every ma_ctv (and every referrer code it points at) gets an integer id.
+    _parent[id] is the parent id (or NO_PARENT), _children[id] the child ids.
+    Referrer codes that have no ctv row are kept as placeholder nodes so
+    get_parent() still reports them, but traversals stop there just like
+    the recursive CTEs did.
+    """
+
+    def __init__(self, edges=()):
+        self._lock = threading.RLock()
+        self._ids = {}          # lower(code) -> id
+        self._codes = []        # id -> ma_ctv as stored
+        self._present = []      # id -> True if a ctv row exists
+        self._parent = []       # id -> parent id or NO_PARENT
+        self._children = []     # id -> [child ids]
+        self.loaded_at = time.time()
+
+        edges = list(edges)
+        for code, _ in edges:
+            node = self._intern(code)
+            self._present[node] = True
+        for code, parent_code in edges:
+            self._link(self._ids[code.lower()], parent_code)
+
+    # ─────────────────────────────────────────────────────────────────────
+    # Internal helpers (callers hold self._lock for writes)
+    # ─────────────────────────────────────────────────────────────────────
+
+    def _intern(self, code):
+        key = code.lower()
+        node = self._ids.get(key)
+        if node is None:
+            node = len(self._codes)
+            self._ids[key] = node
+            self._codes.append(code)
+            self._present.append(False)
+            self._parent.append(NO_PARENT)
+            self._children.append([])
+        return node
+
+    def _link(self, node, parent_code):
+        old_parent = self._parent[node]
+        if old_parent != NO_PARENT:
+            try:
+                self._children[old_parent].remove(node)
+            except ValueError:
+                pass
+            self._parent[node] = NO_PARENT
+
+        if parent_code:
+            parent = self._intern(parent_code)
+            self._parent[node] = parent
+            self._children[parent].append(node)
+
+    def _node(self, code):
+        if not code:
+            return None
+        node = self._ids.get(str(code).lower())
+        if node is None or not self._present[node]:
+            return None
+        return node
+
+    # ─────────────────────────────────────────────────────────────────────
+    # Queries
+    # ─────────────────────────────────────────────────────────────────────
+
+    def __contains__(self, code):
+        return self._node(code) is not None
+
+    def __len__(self):
+        return sum(1 for present in self._present if present)
+
+    def get_parent(self, ctv_code):
+        """
+        DOES: Get the referrer code of a CTV (None if no referrer or unknown CTV)
+        """
+        node = self._node(ctv_code)
+        if node is None:
+            return None
+        parent = self._parent[node]
+        return self._codes[parent] if parent != NO_PARENT else None
+
+    def ancestors(self, ctv_code, max_levels):
+        """
+        DOES: List (ma_ctv, level) from the CTV itself (level 0) up to max_levels
+        OUTPUTS: [] if the CTV does not exist
+        """
+        node = self._node(ctv_code)
+        if node is None:
+            return []
+
+        chain = [(self._codes[node], 0)]
+        seen = {node}
+        for level in range(1, max_levels + 1):
+            node = self._parent[node]
+            if node == NO_PARENT or node in seen or not self._present[node]:
+                break
+            seen.add(node)
+            chain.append((self._codes[node], level))
+        return chain
+
+    def level_between(self, ctv_code, ancestor_code, max_levels):
+        """
+        DOES: Distance from a CTV up to one of its ancestors, None if not within max_levels
+        """
+        target = self._node(ancestor_code)
+        if target is None:
+            return None
+        for code, level in self.ancestors(ctv_code, max_levels):
+            if code.lower() == self._codes[target].lower():
+                return level
+        return None
+
+    def descendants_by_level(self, ctv_code, max_depth=None):
+        """
+        DOES: Breadth-first walk below a CTV
+        OUTPUTS: {level: [ma_ctv, ...]} with the CTV itself at level 0,
+                 {} if the CTV does not exist
+        """
+        node = self._node(ctv_code)
+        if node is None:
+            return {}
+
+        by_level = {0: [self._codes[node]]}
+        seen = {node}
+        frontier = [node]
+        level = 0
+        while frontier and (max_depth is None or level < max_depth):
+            level += 1
+            next_frontier = []
+            for current in frontier:
+                for child in self._children[current]:
+                    if child not in seen and self._present[child]:
+                        seen.add(child)
+                        next_frontier.append(child)
+            if next_frontier:
+                by_level[level] = [self._codes[child] for child in next_frontier]
+            frontier = next_frontier
+        return by_level
+
+    def descendants(self, ctv_code, max_depth=None):
+        """
+        DOES: Set of CTV codes below a CTV, including itself
+        """
+        codes = set()
+        for level_codes in self.descendants_by_level(ctv_code, max_depth).values():
+            codes.update(level_codes)
+        return codes
+
+    def subtree_size(self, ctv_code, max_depth=None):
+        """
+        DOES: Number of CTVs below a CTV (excluding itself)
+        """
+        by_level = self.descendants_by_level(ctv_code, max_depth)
+        return sum(len(codes) for level, codes in by_level.items() if level > 0)
+
+    def subtree_sizes(self, max_depth=None):
+        """
+        DOES: subtree_size() of every CTV in one bottom-up pass over the forest
+        OUTPUTS: {ma_ctv: number of CTVs below it}
+
+        Children are visited before their parents, each node summing its
+        children's per-level counts, so the cost is O(nodes * max_depth)
+        instead of one walk per CTV.
+        """
+        # Parents before children: breadth-first from every root
+        order = [node for node in range(len(self._codes))
+                 if self._present[node] and (self._parent[node] == NO_PARENT
+                                             or not self._present[self._parent[node]])]
+        seen = set(order)
+        index = 0
+        while index < len(order):
+            for child in self._children[order[index]]:
+                if child not in seen and self._present[child]:
+                    seen.add(child)
+                    order.append(child)
+            index += 1
+
+        levels = max_depth if max_depth is not None else 0
+        counts = {}
+        for node in reversed(order):
+            if max_depth is None:
+                counts[node] = 1 + sum(counts[child] for child in self._children[node] if child in counts)
+            else:
+                by_level = [1] + [0] * levels
+                for child in self._children[node]:
+                    child_levels = counts.get(child)
+                    if child_levels is not None:
+                        for level in range(1, levels + 1):
+                            by_level[level] += child_levels[level - 1]
+                counts[node] = by_level
+
+        sizes = {}
+        for node, value in counts.items():
+            sizes[self._codes[node]] = (value if max_depth is None else sum(value)) - 1
+
+        # Referral cycles have no root; fall back to walking those nodes
+        for node in range(len(self._codes)):
+            if self._present[node] and node not in seen:
+                sizes[self._codes[node]] = self.subtree_size(self._codes[node], max_depth)
+        return sizes
+
+    def depth_below(self, ctv_code, max_depth=None):
+        """
+        DOES: Number of levels below a CTV (0 if it has no downline)
+        """
+        by_level = self.descendants_by_level(ctv_code, max_depth)
+        return max(by_level) if by_level else 0
+
+    # ─────────────────────────────────────────────────────────────────────
+    # Incremental updates
+    # ─────────────────────────────────────────────────────────────────────
+
+    def set_parent(self, ctv_code, parent_code):
+        """
+        DOES: Add a CTV or move it under a new referrer (parent_code may be None)
+        """
+        with self._lock:
+            node = self._intern(ctv_code)
+            self._present[node] = True
+            self._link(node, parent_code or None)
+
+    def remove(self, ctv_code):
+        """
+        DOES: Drop a CTV; its direct referrals lose their referrer (ON DELETE SET NULL)
+        """
+        with self._lock:
+            node = self._ids.get(ctv_code.lower())
+            if node is None:
+                return
+            for child in list(self._children[node]):
+                self._parent[child] = NO_PARENT
+            self._children[node] = []
+            self._link(node, None)
+            self._present[node] = False
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PROCESS-WIDE INSTANCE
+# ══════════════════════════════════════════════════════════════════════════════
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def _load_graph(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT ma_ctv, nguoi_gioi_thieu FROM ctv")
+    edges = [(row[0], row[1]) for row in cursor.fetchall() if row[0]]
+    cursor.close()
+    return ReferralGraph(edges)
+
+
+def refresh_referral_graph(connection=None):
+    """
+    DOES: Reload the shared graph from the ctv table
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: ReferralGraph, or the previous graph (possibly None) on failure
+    """
+    global _graph
+
+    should_close = False
+    if connection is None:
+        connection = get_db_connection(shared=True)
+        should_close = True
+
+    if not connection:
+        return _graph
+
+    try:
+        graph = _load_graph(connection)
+        with _graph_lock:
+            _graph = graph
+    except Error as e:
+        print(f"Error loading referral graph: {e}")
+    finally:
+        if should_close:
+            return_db_connection(connection)
+
+    return _graph
+
+
+def get_referral_graph(connection=None, max_age=GRAPH_MAX_AGE):
+    """
+    DOES: Get the shared referral graph, reloading it when older than max_age seconds
+    OUTPUTS: ReferralGraph or None if it could not be loaded
+    """
+    graph = _graph
+    if graph is not None and time.time() - graph.loaded_at < max_age:
+        return graph
+    return refresh_referral_graph(connection)
+
+
+def graph_set_parent(ctv_code, parent_code):
+    """
+    DOES: Apply a committed create / referrer change to the in-memory graph
+    """
+    if _graph is not None and ctv_code:
+        _graph.set_parent(ctv_code, parent_code)
+
+
+def graph_remove_ctv(ctv_code):
+    """
+    DOES: Apply a committed hard delete to the in-memory graph
+    """
+    if _graph is not None and ctv_code:
+        _graph.remove(ctv_code)
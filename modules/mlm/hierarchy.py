@@ -2,9 +2,9 @@ from psycopg2 import Error
 from psycopg2.extras import RealDictCursor
 from ..db_pool import get_db_connection, return_db_connection
 from ..redis_cache import (
-    cache_hierarchy,
-    get_cached_hierarchy
+    get_or_build_hierarchy
 )
+from .graph import get_referral_graph
 
 # Maximum level for commission calculations
 MAX_LEVEL = 4
@@ -13,6 +13,10 @@ def get_parent(cursor, ctv_code):
     """
     DOES: Get the immediate referrer (parent) of a CTV
     """
+    graph = get_referral_graph(cursor.connection)
+    if graph is not None:
+        return graph.get_parent(ctv_code)
+    
     cursor.execute("SELECT nguoi_gioi_thieu FROM ctv WHERE LOWER(ma_ctv) = LOWER(%s)", (ctv_code,))
     result = cursor.fetchone()
     if not result:
@@ -28,22 +32,20 @@ def calculate_level(cursor, ctv_code, ancestor_code):
     if ctv_code == ancestor_code:
         return 0
     
+    graph = get_referral_graph(cursor.connection)
+    if graph is not None:
+        return graph.level_between(ctv_code, ancestor_code, MAX_LEVEL)
+    
     try:
         cursor.execute("""
-            WITH RECURSIVE chain AS (
-                SELECT ma_ctv, nguoi_gioi_thieu, 0 as level
-                FROM ctv
-                WHERE LOWER(ma_ctv) = LOWER(%s)
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, c.nguoi_gioi_thieu, chain.level + 1
-                FROM ctv c
-                INNER JOIN chain ON c.ma_ctv = chain.nguoi_gioi_thieu
-                WHERE chain.level < %s
-            )
-            SELECT level FROM chain WHERE LOWER(ma_ctv) = LOWER(%s)
-        """, (ctv_code, MAX_LEVEL + 1, ancestor_code))
+            SELECT cl.depth as level
+            FROM ctv_closure cl
+            JOIN ctv d ON d.ma_ctv = cl.descendant
+            JOIN ctv a ON a.ma_ctv = cl.ancestor
+            WHERE LOWER(d.ma_ctv) = LOWER(%s)
+            AND LOWER(a.ma_ctv) = LOWER(%s)
+            AND cl.depth <= %s
+        """, (ctv_code, ancestor_code, MAX_LEVEL + 1))
         
         result = cursor.fetchone()
         if result:
@@ -76,21 +78,18 @@ def build_ancestor_chain(cursor, ctv_code, max_levels=MAX_LEVEL):
     """
     DOES: Build list of all ancestors up to max_levels deep
     """
+    graph = get_referral_graph(cursor.connection)
+    if graph is not None:
+        return graph.ancestors(ctv_code, max_levels)
+    
     try:
         cursor.execute("""
-            WITH RECURSIVE ancestors AS (
-                SELECT ma_ctv, nguoi_gioi_thieu, 0 as level
-                FROM ctv
-                WHERE LOWER(ma_ctv) = LOWER(%s)
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, c.nguoi_gioi_thieu, a.level + 1
-                FROM ctv c
-                INNER JOIN ancestors a ON LOWER(c.ma_ctv) = LOWER(a.nguoi_gioi_thieu)
-                WHERE a.level < %s AND a.nguoi_gioi_thieu IS NOT NULL
-            )
-            SELECT ma_ctv, level FROM ancestors ORDER BY level
+            SELECT cl.ancestor as ma_ctv, cl.depth as level
+            FROM ctv_closure cl
+            JOIN ctv d ON d.ma_ctv = cl.descendant
+            WHERE LOWER(d.ma_ctv) = LOWER(%s)
+            AND cl.depth <= %s
+            ORDER BY cl.depth
         """, (ctv_code, max_levels))
         
         results = cursor.fetchall()
@@ -125,14 +124,16 @@ def build_hierarchy_tree(root_ctv_code, connection=None):
     """
     DOES: Build complete hierarchy tree from a CTV's perspective
     Only includes levels that are active (enabled) in commission settings
+    Cached; when the entry expires only one worker rebuilds it
     """
-    cached_tree = get_cached_hierarchy(root_ctv_code)
-    if cached_tree:
-        return cached_tree
-    
+    return get_or_build_hierarchy(root_ctv_code, lambda: _build_hierarchy_tree(root_ctv_code, connection))
+
+
+def _build_hierarchy_tree(root_ctv_code, connection=None):
+    """DOES: Uncached body of build_hierarchy_tree"""
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
@@ -154,23 +155,33 @@ def build_hierarchy_tree(root_ctv_code, connection=None):
         rates = get_commission_rates(connection)
         active_levels = get_active_levels(connection)
         
-        cursor.execute("""
-            WITH RECURSIVE hierarchy AS (
-                SELECT ma_ctv, ten, sdt, email, cap_bac, nguoi_gioi_thieu, 0 as level
+        graph = get_referral_graph(connection)
+        if graph is not None:
+            # Levels come from the in-memory graph; one indexed lookup loads the details
+            level_by_code = {}
+            for level, codes in graph.descendants_by_level(root_ctv_code, MAX_LEVEL).items():
+                for code in codes:
+                    level_by_code[code] = level
+            
+            cursor.execute("""
+                SELECT ma_ctv, ten, sdt, email, cap_bac, nguoi_gioi_thieu
                 FROM ctv
-                WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, c.ten, c.sdt, c.email, c.cap_bac, c.nguoi_gioi_thieu, h.level + 1
-                FROM ctv c
-                INNER JOIN hierarchy h ON c.nguoi_gioi_thieu = h.ma_ctv
-                WHERE h.level < %s
-            )
-            SELECT * FROM hierarchy ORDER BY level, ma_ctv
-        """, (root_ctv_code, MAX_LEVEL))
-        
-        all_nodes = cursor.fetchall()
+                WHERE ma_ctv = ANY(%s)
+            """, (list(level_by_code),))
+            
+            all_nodes = [dict(row, level=level_by_code[row['ma_ctv']]) for row in cursor.fetchall()]
+            all_nodes.sort(key=lambda node: (node['level'], node['ma_ctv']))
+        else:
+            cursor.execute("""
+                SELECT c.ma_ctv, c.ten, c.sdt, c.email, c.cap_bac, c.nguoi_gioi_thieu, cl.depth as level
+                FROM ctv_closure cl
+                JOIN ctv c ON c.ma_ctv = cl.descendant
+                WHERE cl.ancestor = %s
+                AND cl.depth <= %s
+                ORDER BY level, ma_ctv
+            """, (root_ctv_code, MAX_LEVEL))
+            
+            all_nodes = cursor.fetchall()
         
         # Filter nodes to only include active levels
         active_nodes = [node for node in all_nodes if node['level'] in active_levels]
@@ -201,9 +212,6 @@ def build_hierarchy_tree(root_ctv_code, connection=None):
         if should_close:
             return_db_connection(connection)
         
-        if tree:
-            cache_hierarchy(root_ctv_code, tree)
-        
         return tree
         
     except Error as e:
@@ -215,33 +223,29 @@ def build_hierarchy_tree(root_ctv_code, connection=None):
 def get_all_descendants(ctv_code, connection=None):
     """
     DOES: Get all CTV codes under a CTV (including self)
+    OUTPUTS: Set of codes; {ctv_code} when the CTV is unknown or the lookup fails
     """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
         return {ctv_code}
     
+    graph = get_referral_graph(connection)
+    if graph is not None:
+        if should_close:
+            return_db_connection(connection)
+        return graph.descendants(ctv_code) or {ctv_code}
+    
     try:
         cursor = connection.cursor()
         
-        cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT ma_ctv FROM ctv WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv
-                FROM ctv c
-                INNER JOIN descendants d ON c.nguoi_gioi_thieu = d.ma_ctv
-            )
-            SELECT ma_ctv FROM descendants
-        """, (ctv_code,))
+        cursor.execute("SELECT descendant FROM ctv_closure WHERE ancestor = %s", (ctv_code,))
         
         results = cursor.fetchall()
-        descendants = {row[0] for row in results}
+        descendants = {row[0] for row in results} or {ctv_code}
         
         cursor.close()
         if should_close:
@@ -261,29 +265,25 @@ def get_max_depth_below(ctv_code, connection=None):
     """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
         return 0
     
+    graph = get_referral_graph(connection)
+    if graph is not None:
+        if should_close:
+            return_db_connection(connection)
+        return graph.depth_below(ctv_code, MAX_LEVEL)
+    
     try:
         cursor = connection.cursor()
         
         cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT ma_ctv, 0 as level FROM ctv WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, d.level + 1
-                FROM ctv c
-                INNER JOIN descendants d ON c.nguoi_gioi_thieu = d.ma_ctv
-                WHERE d.level < %s
-            )
-            SELECT MAX(level) as max_depth
-            FROM descendants
-            WHERE level > 0
+            SELECT MAX(depth) as max_depth
+            FROM ctv_closure
+            WHERE ancestor = %s AND depth BETWEEN 1 AND %s
         """, (ctv_code, MAX_LEVEL))
         
         result = cursor.fetchone()
@@ -307,29 +307,25 @@ def get_total_downline(ctv_code, connection=None):
     """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
         return 0
     
+    graph = get_referral_graph(connection)
+    if graph is not None:
+        if should_close:
+            return_db_connection(connection)
+        return graph.subtree_size(ctv_code, MAX_LEVEL)
+    
     try:
         cursor = connection.cursor()
         
         cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT ma_ctv, 0 as level FROM ctv WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, d.level + 1
-                FROM ctv c
-                INNER JOIN descendants d ON c.nguoi_gioi_thieu = d.ma_ctv
-                WHERE d.level < %s
-            )
             SELECT COUNT(*) as total
-            FROM descendants
-            WHERE level > 0
+            FROM ctv_closure
+            WHERE ancestor = %s AND depth BETWEEN 1 AND %s
         """, (ctv_code, MAX_LEVEL))
         
         result = cursor.fetchone()
@@ -347,37 +343,85 @@ def get_total_downline(ctv_code, connection=None):
             return_db_connection(connection)
         return 0
 
+def get_downline_counts(connection=None):
+    """
+    DOES: get_total_downline() for every CTV at once
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: {ma_ctv: downline count}; CTVs without downline may be missing
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection(shared=True)
+        should_close = True
+
+    if not connection:
+        return {}
+
+    graph = get_referral_graph(connection)
+    if graph is not None:
+        if should_close:
+            return_db_connection(connection)
+        return graph.subtree_sizes(MAX_LEVEL)
+
+    try:
+        cursor = connection.cursor()
+
+        cursor.execute("""
+            SELECT ancestor, COUNT(*) as total
+            FROM ctv_closure
+            WHERE depth BETWEEN 1 AND %s
+            GROUP BY ancestor
+        """, (MAX_LEVEL,))
+
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+
+        cursor.close()
+        if should_close:
+            return_db_connection(connection)
+
+        return counts
+
+    except Error as e:
+        print(f"Error getting downline counts: {e}")
+        if should_close and connection:
+            return_db_connection(connection)
+        return {}
+
 def get_network_stats(ctv_code, connection=None):
     """
     DOES: Get network statistics for a CTV
     """
     should_close = False
     if connection is None:
-        connection = get_db_connection()
+        connection = get_db_connection(shared=True)
         should_close = True
     
     if not connection:
         return {'total': 0, 'by_level': {}}
     
+    graph = get_referral_graph(connection)
+    if graph is not None:
+        if should_close:
+            return_db_connection(connection)
+        by_level = {
+            level: len(codes)
+            for level, codes in graph.descendants_by_level(ctv_code, MAX_LEVEL).items()
+            if level > 0
+        }
+        return {
+            'total': sum(by_level.values()),
+            'by_level': by_level
+        }
+    
     try:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         
         cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT ma_ctv, 0 as level FROM ctv WHERE ma_ctv = %s
-                
-                UNION ALL
-                
-                SELECT c.ma_ctv, d.level + 1
-                FROM ctv c
-                INNER JOIN descendants d ON c.nguoi_gioi_thieu = d.ma_ctv
-                WHERE d.level < %s
-            )
-            SELECT level, COUNT(*) as count
-            FROM descendants
-            WHERE level > 0
-            GROUP BY level
-            ORDER BY level
+            SELECT depth as level, COUNT(*) as count
+            FROM ctv_closure
+            WHERE ancestor = %s AND depth BETWEEN 1 AND %s
+            GROUP BY depth
+            ORDER BY depth
         """, (ctv_code, MAX_LEVEL))
         
         results = cursor.fetchall()
@@ -0,0 +1,236 @@
+"""
+Commission Jobs Module
+Postgres-backed queue for commission calculation work.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - enqueue_commission_job(job_type='incremental', requested_by=None, connection=None) -> int or None
+#     DOES: Queues a job (no-op if one of that type is already pending)
+#
+# - process_commission_jobs(connection=None, max_jobs=JOB_BATCH_LIMIT) -> list
+#     DOES: Claims and runs pending jobs one at a time (sync worker)
+#
+# - get_commission_freshness(cursor) -> dict
+#     DOES: How far commissions and the daily rollup trail the source tables
+#
+# NOTES:
+# - Request handlers only enqueue; the sync worker (standalone or embedded in
+#   backend.py) runs the jobs, so a dashboard load never waits on a backfill.
+# - A job is claimed with FOR UPDATE SKIP LOCKED on a separate connection that
+#   keeps its transaction open until the job finishes. If the worker dies the
+#   lock goes away and the job is simply pending again.
+# - A transaction-level advisory lock in the claim transaction makes every
+#   worker process (gunicorn workers, sync_worker.py) run at most one job at a
+#   time between them.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import json
+import time
+from datetime import datetime
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+from ..db_pool import get_db_connection, return_db_connection
+from .commissions import (
+    calculate_new_commissions_fast,
+    calculate_missing_commissions,
+    recalculate_all_commissions
+)
+
+# job_type -> function(connection=...) returning a stats dict ({'error': ...} on failure)
+JOB_HANDLERS = {
+    'incremental': calculate_new_commissions_fast,
+    'missing': calculate_missing_commissions,
+    'recalculate_all': recalculate_all_commissions,
+}
+
+# Maximum jobs handled by one process_commission_jobs() call
+JOB_BATCH_LIMIT = 10
+
+
+def enqueue_commission_job(job_type='incremental', requested_by=None, connection=None):
+    """
+    DOES: Queue a commission job
+    INPUTS: job_type (key of JOB_HANDLERS), requested_by (free text for the admin UI),
+            optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Id of the pending job of that type (new or already queued), or None on failure
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown commission job type: {job_type}")
+
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            INSERT INTO commission_jobs (job_type, requested_by)
+            VALUES (%s, %s)
+            ON CONFLICT (job_type) WHERE status = 'pending' DO NOTHING
+            RETURNING id
+        """, (job_type, requested_by))
+        row = cursor.fetchone()
+        if not row:
+            cursor.execute(
+                "SELECT id FROM commission_jobs WHERE job_type = %s AND status = 'pending'",
+                (job_type,)
+            )
+            row = cursor.fetchone()
+        connection.commit()
+        cursor.close()
+
+        if should_close:
+            return_db_connection(connection)
+        return row[0] if row else None
+
+    except Error as e:
+        print(f"Error enqueueing commission job: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def _claim_next_job(claim_cursor):
+    """Lock the oldest pending job, or None if nothing is claimable right now"""
+    claim_cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('commission_jobs')) as locked")
+    if not claim_cursor.fetchone()['locked']:
+        return None
+
+    claim_cursor.execute("""
+        SELECT id, job_type, attempts
+        FROM commission_jobs
+        WHERE status = 'pending'
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """)
+    return claim_cursor.fetchone()
+
+
+def process_commission_jobs(connection=None, max_jobs=JOB_BATCH_LIMIT):
+    """
+    DOES: Claim and run pending commission jobs until the queue is empty
+    INPUTS: connection the jobs run on (borrows one from the pool if not provided),
+            max_jobs upper bound for this call
+    OUTPUTS: List of {'id', 'job_type', 'status', 'result', 'duration'} for the jobs run
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    claim_connection = get_db_connection()
+    if not connection or not claim_connection:
+        if should_close and connection:
+            return_db_connection(connection)
+        if claim_connection:
+            return_db_connection(claim_connection)
+        return []
+
+    processed = []
+    try:
+        claim_cursor = claim_connection.cursor(cursor_factory=RealDictCursor)
+
+        while len(processed) < max_jobs:
+            job = _claim_next_job(claim_cursor)
+            if not job:
+                claim_connection.rollback()
+                break
+
+            started_at = datetime.now()
+            start_time = time.time()
+            try:
+                result = JOB_HANDLERS[job['job_type']](connection=connection)
+            except Exception as e:
+                result = {'error': str(e)}
+            if isinstance(result, dict) and 'error' in result:
+                connection.rollback()
+
+            status = 'failed' if not isinstance(result, dict) or 'error' in result else 'done'
+            claim_cursor.execute("""
+                UPDATE commission_jobs
+                SET status = %s, attempts = attempts + 1, result = %s, error = %s,
+                    started_at = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (
+                status,
+                json.dumps(result, default=str),
+                result.get('error') if isinstance(result, dict) else None,
+                started_at,
+                job['id']
+            ))
+            claim_connection.commit()
+
+            processed.append({
+                'id': job['id'],
+                'job_type': job['job_type'],
+                'status': status,
+                'result': result,
+                'duration': round(time.time() - start_time, 2)
+            })
+
+        claim_cursor.close()
+
+    except Error as e:
+        print(f"Error processing commission jobs: {e}")
+        claim_connection.rollback()
+
+    return_db_connection(claim_connection)
+    if should_close:
+        return_db_connection(connection)
+    return processed
+
+
+def get_commission_freshness(cursor):
+    """
+    DOES: Report how far commissions and ctv_daily_rollup trail the source tables
+    INPUTS: RealDictCursor
+    OUTPUTS: Dict with
+             last_calculated_at - when the last commission job finished (ISO string or None)
+             pending_jobs       - commission jobs waiting for the worker
+             pending_rows       - commissionable khach_hang / services rows past the watermark
+             rollup_pending_days - days queued for the next rollup refresh
+             stale_seconds      - age of the oldest change not yet reflected (0 if none)
+    """
+    cursor.execute("""
+        SELECT
+            (SELECT MAX(finished_at) FROM commission_jobs WHERE status = 'done') as last_calculated_at,
+            (SELECT COUNT(*) FROM commission_jobs WHERE status = 'pending') as pending_jobs,
+            (SELECT MIN(created_at) FROM commission_jobs WHERE status = 'pending') as oldest_job_at,
+            (SELECT COUNT(*) FROM khach_hang kh
+             WHERE kh.id > COALESCE((SELECT last_kh_max_id FROM commission_cache WHERE cache_key = 'global'), 0)
+             AND kh.tong_tien > 0
+             AND kh.trang_thai IN ('Đã đến làm', 'Da den lam')
+             AND (COALESCE(kh.sdt, '') != ''
+                  OR EXISTS (SELECT 1 FROM ctv c WHERE c.ma_ctv_norm = kh.nguoi_chot_norm)))
+            + (SELECT COUNT(*) FROM services s
+               WHERE s.id > COALESCE((SELECT last_svc_max_id FROM commission_cache WHERE cache_key = 'global'), 0)
+               AND s.tong_tien > 0
+               AND EXISTS (SELECT 1 FROM ctv c WHERE c.ma_ctv_norm = s.nguoi_chot_norm)) as pending_rows,
+            (SELECT COUNT(DISTINCT day) FROM ctv_daily_rollup_dirty) as rollup_pending_days,
+            (SELECT MIN(marked_at) FROM ctv_daily_rollup_dirty) as oldest_dirty_at,
+            CURRENT_TIMESTAMP::timestamp as now
+    """)
+    row = cursor.fetchone()
+
+    waiting_since = [ts for ts in (row['oldest_job_at'], row['oldest_dirty_at']) if ts]
+    stale_seconds = int((row['now'] - min(waiting_since)).total_seconds()) if waiting_since else 0
+
+    return {
+        'last_calculated_at': row['last_calculated_at'].isoformat() if row['last_calculated_at'] else None,
+        'pending_jobs': int(row['pending_jobs']),
+        'pending_rows': int(row['pending_rows']),
+        'rollup_pending_days': int(row['rollup_pending_days']),
+        'stale_seconds': max(stale_seconds, 0)
+    }
@@ -0,0 +1,229 @@
+"""
+CTV Daily Rollup Module
+Maintenance and read helpers for ctv_daily_rollup(ctv_code, day, level, revenue, tx_count, commission).
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - refresh_ctv_daily_rollup(connection=None) -> int or None
+#     DOES: Recomputes the days queued in ctv_daily_rollup_dirty (sync worker, every cycle)
+#
+# - rebuild_ctv_daily_rollup(connection=None) -> int or None
+#     DOES: Recomputes every row from khach_hang, services and commissions
+#
+# - month_date_range(month) -> (date, date)
+#     DOES: First and last day of a 'YYYY-MM' month
+#
+# - build_rollup_date_condition(column_name, from_date, to_date, param_list) -> str
+#     DOES: Inclusive day-range condition on a rollup day column
+#
+# NOTES:
+# - Row meaning per level is documented on the table in schema/postgresql_schema.sql.
+# - Writes to khach_hang, services, commissions and ctv queue the affected days
+#   through triggers (see migrate_ctv_daily_rollup.py); nothing else has to
+#   remember to invalidate the rollup.
+# - refresh_ctv_daily_rollup() invalidates the cached CTV dashboards of every
+#   CTV whose rows changed, plus their upline (see dashboard_cache.py).
+# - Undated transactions are rolled up on UNDATED_DAY so all-time totals still
+#   include them; any date filter leaves them out, like DATE(NULL) did.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import datetime
+from psycopg2 import Error
+from ..db_pool import get_db_connection, return_db_connection
+from ..dashboard_cache import invalidate_ctv_dashboards, invalidate_all_dashboards
+
+# Day used for transactions without ngay_hen_lam / date_entered
+UNDATED_DAY = datetime.date(1900, 1, 1)
+
+# One statement per source; {kh_days} / {svc_days} restrict it to the refreshed days
+ROLLUP_ROWS_QUERY = """
+    SELECT ctv_code, day, level, SUM(revenue), SUM(tx_count), SUM(commission)
+    FROM (
+        SELECT c.ma_ctv as ctv_code, COALESCE(kh.ngay_hen_lam, %(undated)s) as day, 0 as level,
+               COALESCE(kh.tong_tien, 0) as revenue, 1 as tx_count, 0 as commission
+        FROM khach_hang kh
+        JOIN ctv c ON c.ma_ctv_norm = kh.nguoi_chot_norm
+        WHERE kh.trang_thai IN ('Da den lam', 'Đã đến làm')
+        AND {kh_days}
+
+        UNION ALL
+
+        SELECT c.ma_ctv, COALESCE(s.date_entered, %(undated)s), 0,
+               COALESCE(s.tong_tien, 0), 1, 0
+        FROM services s
+        JOIN ctv c ON c.ma_ctv_norm = s.nguoi_chot_norm
+        WHERE {svc_days}
+
+        UNION ALL
+
+        SELECT cm.ctv_code, COALESCE(kh.ngay_hen_lam, %(undated)s), cm.level,
+               CASE WHEN cm.level = 0 THEN 0 ELSE cm.transaction_amount END,
+               CASE WHEN cm.level = 0 THEN 0 ELSE 1 END,
+               cm.commission_amount
+        FROM commissions cm
+        JOIN khach_hang kh ON cm.transaction_id = -kh.id
+        WHERE {kh_days}
+
+        UNION ALL
+
+        SELECT cm.ctv_code, COALESCE(s.date_entered, %(undated)s), cm.level,
+               CASE WHEN cm.level = 0 THEN 0 ELSE cm.transaction_amount END,
+               CASE WHEN cm.level = 0 THEN 0 ELSE 1 END,
+               cm.commission_amount
+        FROM commissions cm
+        JOIN services s ON cm.transaction_id = s.id
+        WHERE {svc_days}
+    ) rows
+    GROUP BY ctv_code, day, level
+"""
+
+INSERT_ROLLUP = "INSERT INTO ctv_daily_rollup (ctv_code, day, level, revenue, tx_count, commission) "
+ROLLUP_COLUMNS = " RETURNING ctv_code, day, level, revenue, tx_count, commission"
+
+
+def _days_condition(column_name):
+    """Match the refreshed days, including UNDATED_DAY for NULL dates"""
+    return (f"({column_name} = ANY(%(days)s) "
+            f"OR ({column_name} IS NULL AND %(undated)s = ANY(%(days)s)))")
+
+
+def refresh_ctv_daily_rollup(connection=None):
+    """
+    DOES: Recompute the rollup rows of every day queued since the last refresh
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Number of days refreshed, or None on failure
+
+    Queue entries written by transactions that have not committed yet stay
+    invisible to the DELETE and are picked up by the next refresh.
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM ctv_daily_rollup_dirty RETURNING day")
+        days = sorted({row[0] for row in cursor.fetchall()})
+
+        affected = []
+        if days:
+            cursor.execute("DELETE FROM ctv_daily_rollup WHERE day = ANY(%s)" + ROLLUP_COLUMNS, (days,))
+            old_rows = set(cursor.fetchall())
+            cursor.execute(
+                INSERT_ROLLUP + ROLLUP_ROWS_QUERY.format(
+                    kh_days=_days_condition('kh.ngay_hen_lam'),
+                    svc_days=_days_condition('s.date_entered')
+                ) + ROLLUP_COLUMNS,
+                {'days': days, 'undated': UNDATED_DAY}
+            )
+            new_rows = set(cursor.fetchall())
+
+            # Dashboards of the CTVs whose rows changed, and of their upline, are stale
+            changed = list({row[0] for row in old_rows ^ new_rows})
+            if changed:
+                cursor.execute("SELECT DISTINCT ancestor FROM ctv_closure WHERE descendant = ANY(%s)", (changed,))
+                affected = [row[0] for row in cursor.fetchall()]
+
+        connection.commit()
+        cursor.close()
+        invalidate_ctv_dashboards(affected)
+
+        if should_close:
+            return_db_connection(connection)
+        return len(days)
+
+    except Error as e:
+        print(f"Error refreshing ctv_daily_rollup: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def rebuild_ctv_daily_rollup(connection=None):
+    """
+    DOES: Recompute the whole ctv_daily_rollup table
+    INPUTS: Optional connection (borrows one from the pool if not provided)
+    OUTPUTS: Number of rollup rows written, or None on failure
+    """
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        # Clear the queue first: anything marked after this is refreshed again later
+        cursor.execute("DELETE FROM ctv_daily_rollup_dirty")
+        cursor.execute("DELETE FROM ctv_daily_rollup")
+        cursor.execute(
+            INSERT_ROLLUP + ROLLUP_ROWS_QUERY.format(kh_days='TRUE', svc_days='TRUE'),
+            {'undated': UNDATED_DAY}
+        )
+        rows = cursor.rowcount
+        connection.commit()
+        cursor.close()
+        invalidate_all_dashboards()
+
+        if should_close:
+            return_db_connection(connection)
+        return rows
+
+    except Error as e:
+        print(f"Error rebuilding ctv_daily_rollup: {e}")
+        if connection:
+            connection.rollback()
+        if should_close and connection:
+            return_db_connection(connection)
+        return None
+
+
+def month_date_range(month):
+    """
+    DOES: Convert 'YYYY-MM' into its first and last day
+    OUTPUTS: (date, date); raises ValueError on a malformed month
+    """
+    year, month_num = map(int, month.split('-'))
+    first_day = datetime.date(year, month_num, 1)
+    next_month = (first_day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return first_day, next_month - datetime.timedelta(days=1)
+
+
+def build_rollup_date_condition(column_name, from_date, to_date, param_list):
+    """
+    Build an inclusive day-range condition on a rollup day column.
+    Undated rows only match when neither bound is given (all-time totals).
+
+    Args:
+        column_name: Day column (e.g., 'day', 'r.day')
+        from_date: Optional lower bound (date or 'YYYY-MM-DD')
+        to_date: Optional upper bound (date or 'YYYY-MM-DD')
+        param_list: List to append parameters to
+
+    Returns:
+        SQL condition string
+    """
+    conditions = []
+    if from_date:
+        conditions.append(f"{column_name} >= %s")
+        param_list.append(from_date)
+    if to_date:
+        conditions.append(f"{column_name} <= %s")
+        param_list.append(to_date)
+        if not from_date:
+            conditions.append(f"{column_name} > %s")
+            param_list.append(UNDATED_DAY)
+    return " AND ".join(conditions) if conditions else "TRUE"
@@ -6,6 +6,8 @@ import time
 from pathlib import Path
 from slugify import slugify
 
+from .sheets_client import get_worksheets, invalidate_sheets_cache
+
 logger = logging.getLogger(__name__)
 
 # Resolve project root from this file's location (modules/pricing_sync.py -> project root)
@@ -86,14 +88,15 @@ def _fetch_sheet_data_with_retry(client, sheet_id):
     last_error = None
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            sheet = client.open_by_key(sheet_id)
-            worksheet = sheet.get_worksheet(0)
+            # First tab, from the cached spreadsheet metadata (sheets_client)
+            worksheet = get_worksheets(sheet_id, client)[0]
             rows = worksheet.get_all_values()
             if attempt > 1:
                 logger.info(f"  Pricing sheet fetch succeeded on attempt {attempt}")
             return rows
         except Exception as e:
             last_error = e
+            invalidate_sheets_cache(sheet_id)
             if attempt < MAX_RETRIES and _is_retryable_error(e):
                 delay = RETRY_BASE_DELAY * (3 ** (attempt - 1))  # 5s, 15s, 45s
                 logger.warning(f"  Pricing fetch attempt {attempt}/{MAX_RETRIES} failed: {e}")
@@ -12,17 +12,27 @@ Provides caching utilities for frequently accessed data.
 # - get_redis_client() -> Redis client or None
 # - is_cache_available() -> bool
 #
-# Basic Operations:
+# Basic Operations (in-process L1 first, then Redis):
 # - cache_get(key) -> value or None
 # - cache_set(key, value, ttl) -> bool
 # - cache_delete(key) -> bool
 # - cache_exists(key) -> bool
+# - cache_get_or_set(key, loader, ttl) -> value
+#     DOES: Read-through with single-flight: on a miss only one thread per
+#           process and one process per key (Redis lock) runs loader()
+#
+# Namespaces:
+# - ns_key(namespace, key) -> versioned key '{namespace}:v{version}:{key}'
+# - invalidate_namespace(namespace) -> drop every key of a namespace at once
+# - invalidate_namespaces(namespaces) -> same for many namespaces, one round trip
 #
 # Specialized Caching:
 # - cache_hierarchy(ctv_code, tree) -> cache CTV hierarchy
 # - get_cached_hierarchy(ctv_code) -> get cached hierarchy
+# - get_or_build_hierarchy(ctv_code, builder) -> cached tree, built once on a miss
 # - cache_commission_rates() -> cache commission rates
 # - get_cached_commission_rates() -> get cached rates
+# - get_or_load_commission_rates(loader) -> cached rates, loaded once on a miss
 #
 # Decorators:
 # - cached(key_prefix, ttl) -> decorator for caching function results
@@ -32,12 +42,28 @@ Provides caching utilities for frequently accessed data.
 # - invalidate_all_hierarchies() -> invalidate all hierarchies
 # - invalidate_commission_cache() -> invalidate commission data
 #
+# Statistics:
+# - get_cache_stats() -> Redis server stats plus this process's hit/miss/latency counters
+#
 # CACHE KEY PATTERNS:
-# - hierarchy:{ctv_code} -> CTV hierarchy tree (TTL: 15 min)
-# - commissions:{ctv_code}:{month} -> Commission reports (TTL: 1 hour)
+# - hierarchy:v{n}:{ctv_code} -> CTV hierarchy tree (TTL: 15 min)
+# - commissions:v{n}:{ctv_code}:{month} -> Commission reports (TTL: 1 hour)
+# - commission_rates:v{n}:all -> Commission rate config (TTL: 1 hour)
 # - duplicate_check:{phone} -> Duplicate check results (TTL: 1 hour)
 # - ctv_info:{ctv_code} -> CTV details (TTL: 30 min)
-# - commission_rates -> Commission rate config (TTL: 1 hour)
+# - cache_ns:{namespace} -> current version of a namespace (no TTL)
+# - lock:{key} -> single-flight lock while one process recomputes key
+# - session:{token_sha256}, session_user:{type}:{id} -> see session_cache.py
+#
+# NOTES:
+# - L1 keeps JSON text, so every hit returns a fresh copy with the same types
+#   as a Redis hit. It is bounded by L1_MAX_ENTRIES, L1_MAX_BYTES and L1_TTL.
+# - invalidate_namespace() INCRs cache_ns:{namespace}. Old keys are never
+#   scanned; they stop being read and expire with their TTL. Other processes
+#   see the new version within NS_VERSION_REFRESH seconds.
+# - A single-key cache_delete() reaches other processes' L1 only after L1_TTL.
+# - While Redis is down (or after a connection error) the cache runs L1-only
+#   and reconnects after _redis_backoff seconds.
 #
 # Created: January 2, 2026
 # ══════════════════════════════════════════════════════════════════════════════
@@ -45,6 +71,9 @@ Provides caching utilities for frequently accessed data.
 
 import os
 import json
+import uuid
+import threading
+from collections import OrderedDict
 from functools import wraps
 from datetime import timedelta
 
@@ -54,7 +83,7 @@ try:
     REDIS_AVAILABLE = True
 except ImportError:
     REDIS_AVAILABLE = False
-    print("WARNING: Redis not installed. Caching will be disabled.")
+    print("WARNING: Redis not installed. Caching will be in-process only.")
 
 # Redis configuration
 REDIS_CONFIG = {
@@ -62,7 +91,8 @@ REDIS_CONFIG = {
     'port': int(os.environ.get('REDIS_PORT', 6379)),
     'db': int(os.environ.get('REDIS_DB', 0)),
     'password': os.environ.get('REDIS_PASSWORD', None),
-    'decode_responses': True
+    'decode_responses': True,
+    'socket_connect_timeout': 2
 }
 
 # Default TTLs (in seconds)
@@ -72,6 +102,24 @@ TTL_CTV_INFO = 1800        # 30 minutes
 TTL_DUPLICATE_CHECK = 3600  # 1 hour
 TTL_COMMISSION_REPORT = 3600  # 1 hour
 
+# In-process tier
+L1_TTL = int(os.environ.get('CACHE_L1_TTL', 30))             # seconds (capped by the entry's own TTL)
+L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 2000))
+L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 32 * 1024 * 1024))
+
+# Namespaces and single-flight
+NS_VERSION_REFRESH = 2     # seconds between reads of a namespace version from Redis
+LOCK_TTL_MS = 30000        # lock of a crashed loader expires after this
+LOCK_WAIT = 10             # seconds a waiter waits for the loader's result before loading itself
+LOCK_POLL = 0.05
+
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
 import time
 
 # Singleton Redis client
@@ -79,6 +127,20 @@ _redis_client = None
 _last_redis_attempt = 0
 _redis_backoff = 60  # 1 minute backoff on failure
 
+_l1 = OrderedDict()        # key -> (expires_at, json text)
+_l1_bytes = 0
+_l1_lock = threading.Lock()
+
+_ns_versions = {}          # namespace -> (version, fetched_at)
+_inflight = {}             # key -> {'event', 'value'} while a thread of this process loads key
+_inflight_lock = threading.Lock()
+
+_stats = {
+    'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0,
+    'l2_gets': 0, 'l2_get_ms_total': 0.0, 'l2_get_ms_max': 0.0,
+    'loads': 0, 'load_ms_total': 0.0, 'lock_waits': 0, 'l1_evictions': 0
+}
+
 
 def get_redis_client():
     """
@@ -86,17 +148,17 @@ def get_redis_client():
     OUTPUTS: Redis client instance or None if not available
     """
     global _redis_client, _last_redis_attempt
-    
+
     if not REDIS_AVAILABLE:
         return None
-    
+
     current_time = time.time()
-    
+
     if _redis_client is None:
         # Don't retry too often if it keeps failing
         if current_time - _last_redis_attempt < _redis_backoff:
             return None
-            
+
         _last_redis_attempt = current_time
         try:
             _redis_client = redis.Redis(**REDIS_CONFIG)
@@ -107,10 +169,20 @@ def get_redis_client():
             # Only print error once per backoff period to avoid log spam
             print(f"Redis connection failed: {e}. Retrying in {_redis_backoff}s...")
             _redis_client = None
-    
+
     return _redis_client
 
 
+def _redis_failed(e, action):
+    """Count a Redis error; on a lost connection drop the client so calls run L1-only until the backoff ends"""
+    global _redis_client, _last_redis_attempt
+    _stats['errors'] += 1
+    print(f"Cache {action} error: {e}")
+    if isinstance(e, (redis.ConnectionError, redis.TimeoutError)):
+        _redis_client = None
+        _last_redis_attempt = time.time()
+
+
 def is_cache_available():
     """
     DOES: Check if caching is available
@@ -125,27 +197,96 @@ def is_cache_available():
         return False
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+# L1 (IN-PROCESS LRU)
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _l1_pop(key):
+    """Remove one L1 entry (caller holds _l1_lock)"""
+    global _l1_bytes
+    item = _l1.pop(key, None)
+    if item is not None:
+        _l1_bytes -= len(item[1])
+
+
+def _l1_get(key):
+    now = time.time()
+    with _l1_lock:
+        item = _l1.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            _l1_pop(key)
+            return None
+        _l1.move_to_end(key)
+        return item[1]
+
+
+def _l1_set(key, text, ttl):
+    global _l1_bytes
+    # One huge value must not flush the whole tier
+    if len(text) > L1_MAX_BYTES // 4:
+        return
+    expires_at = time.time() + min(ttl, L1_TTL)
+    with _l1_lock:
+        _l1_pop(key)
+        _l1[key] = (expires_at, text)
+        _l1_bytes += len(text)
+        while len(_l1) > L1_MAX_ENTRIES or _l1_bytes > L1_MAX_BYTES:
+            _, (_, old) = _l1.popitem(last=False)
+            _l1_bytes -= len(old)
+            _stats['l1_evictions'] += 1
+
+
+def _l1_drop_prefix(prefix):
+    """Drop L1 entries starting with prefix (a string or a tuple of strings)"""
+    with _l1_lock:
+        for key in [k for k in _l1 if k.startswith(prefix)]:
+            _l1_pop(key)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # BASIC CACHE OPERATIONS
 # ══════════════════════════════════════════════════════════════════════════════
 
+def _l2_get(client, key):
+    """Redis GET of the raw JSON text, timed for get_cache_stats()"""
+    started = time.perf_counter()
+    try:
+        return client.get(key)
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        _stats['l2_gets'] += 1
+        _stats['l2_get_ms_total'] += elapsed
+        _stats['l2_get_ms_max'] = max(_stats['l2_get_ms_max'], elapsed)
+
+
 def cache_get(key):
     """
-    DOES: Get a value from cache
+    DOES: Get a value from cache (L1, then Redis; Redis hits are copied into L1)
     INPUTS: key - cache key
     OUTPUTS: Deserialized value or None
     """
+    text = _l1_get(key)
+    if text is not None:
+        _stats['l1_hits'] += 1
+        return json.loads(text)
+
     client = get_redis_client()
     if not client:
+        _stats['misses'] += 1
         return None
-    
+
     try:
-        value = client.get(key)
+        value = _l2_get(client, key)
         if value:
+            _l1_set(key, value, L1_TTL)
+            _stats['l2_hits'] += 1
             return json.loads(value)
+        _stats['misses'] += 1
         return None
     except (redis.RedisError, json.JSONDecodeError) as e:
-        print(f"Cache get error: {e}")
+        _redis_failed(e, 'get')
         return None
 
 
@@ -153,18 +294,26 @@ def cache_set(key, value, ttl=3600):
     """
     DOES: Set a value in cache
     INPUTS: key - cache key, value - value to cache, ttl - time to live in seconds
-    OUTPUTS: True if successful, False otherwise
+    OUTPUTS: True if successful (L1 only while Redis is unavailable), False otherwise
     """
+    try:
+        serialized = json.dumps(value)
+    except TypeError as e:
+        print(f"Cache set error: {e}")
+        return False
+
+    _l1_set(key, serialized, ttl)
+    _stats['sets'] += 1
+
     client = get_redis_client()
     if not client:
-        return False
-    
+        return True
+
     try:
-        serialized = json.dumps(value)
         client.setex(key, ttl, serialized)
         return True
-    except (redis.RedisError, TypeError) as e:
-        print(f"Cache set error: {e}")
+    except redis.RedisError as e:
+        _redis_failed(e, 'set')
         return False
 
 
@@ -174,35 +323,48 @@ def cache_delete(key):
     INPUTS: key - cache key
     OUTPUTS: True if deleted, False otherwise
     """
+    with _l1_lock:
+        _l1_pop(key)
+
     client = get_redis_client()
     if not client:
         return False
-    
+
     try:
         client.delete(key)
         return True
     except redis.RedisError as e:
-        print(f"Cache delete error: {e}")
+        _redis_failed(e, 'delete')
         return False
 
 
 def cache_delete_pattern(pattern):
     """
-    DOES: Delete all keys matching a pattern
-    INPUTS: pattern - key pattern (e.g., "hierarchy:*")
+    DOES: Delete all keys matching a pattern (prefer invalidate_namespace for groups of keys)
+    INPUTS: pattern - key pattern (e.g., "duplicate_check:*")
     OUTPUTS: Number of deleted keys
     """
+    if pattern.endswith('*') and '*' not in pattern[:-1]:
+        _l1_drop_prefix(pattern[:-1])
+
     client = get_redis_client()
     if not client:
         return 0
-    
+
     try:
-        keys = client.keys(pattern)
-        if keys:
-            return client.delete(*keys)
-        return 0
+        # Incremental SCAN instead of KEYS, which blocks Redis on big keyspaces
+        deleted = 0
+        batch = []
+        for key in client.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += client.delete(*batch)
+        return deleted
     except redis.RedisError as e:
-        print(f"Cache delete pattern error: {e}")
+        _redis_failed(e, 'delete pattern')
         return 0
 
 
@@ -212,16 +374,173 @@ def cache_exists(key):
     INPUTS: key - cache key
     OUTPUTS: True if exists, False otherwise
     """
+    if _l1_get(key) is not None:
+        return True
+
     client = get_redis_client()
     if not client:
         return False
-    
+
     try:
         return client.exists(key) > 0
     except redis.RedisError:
         return False
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+# VERSIONED NAMESPACES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _namespace_version(namespace):
+    """Current version of a namespace, re-read from Redis at most every NS_VERSION_REFRESH seconds"""
+    now = time.time()
+    known = _ns_versions.get(namespace)
+    if known and now - known[1] < NS_VERSION_REFRESH:
+        return known[0]
+
+    version = known[0] if known else 0
+    client = get_redis_client()
+    if client:
+        try:
+            version = int(client.get(f"cache_ns:{namespace}") or 0)
+        except (redis.RedisError, ValueError) as e:
+            _redis_failed(e, 'namespace')
+    _ns_versions[namespace] = (version, now)
+    return version
+
+
+def ns_key(namespace, key):
+    """
+    DOES: Build the key of an entry in a versioned namespace
+    INPUTS: namespace - e.g. 'hierarchy', key - key inside the namespace
+    OUTPUTS: '{namespace}:v{version}:{key}'
+    """
+    return f"{namespace}:v{_namespace_version(namespace)}:{key}"
+
+
+def invalidate_namespace(namespace):
+    """
+    DOES: Invalidate every key of a namespace by moving it to a new version
+    INPUTS: namespace - e.g. 'hierarchy'
+    """
+    _l1_drop_prefix(f"{namespace}:")
+    version = (_ns_versions.get(namespace) or (0, 0))[0] + 1
+    client = get_redis_client()
+    if client:
+        try:
+            version = client.incr(f"cache_ns:{namespace}")
+        except redis.RedisError as e:
+            _redis_failed(e, 'namespace')
+    _ns_versions[namespace] = (version, time.time())
+
+
+def invalidate_namespaces(namespaces):
+    """
+    DOES: invalidate_namespace() for many namespaces in one Redis round trip
+    INPUTS: namespaces - iterable of namespace names
+    """
+    namespaces = list(dict.fromkeys(namespaces))
+    if not namespaces:
+        return
+    prefixes = tuple(f"{namespace}:" for namespace in namespaces)
+    _l1_drop_prefix(prefixes)
+    versions = [(_ns_versions.get(namespace) or (0, 0))[0] + 1 for namespace in namespaces]
+    client = get_redis_client()
+    if client:
+        try:
+            pipe = client.pipeline()
+            for namespace in namespaces:
+                pipe.incr(f"cache_ns:{namespace}")
+            versions = pipe.execute()
+        except redis.RedisError as e:
+            _redis_failed(e, 'namespace')
+    now = time.time()
+    for namespace, version in zip(namespaces, versions):
+        _ns_versions[namespace] = (version, now)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# READ-THROUGH WITH SINGLE-FLIGHT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _load_once(key, loader, ttl):
+    """Run loader() under the Redis lock of key; if another process holds it, wait for its result"""
+    client = get_redis_client()
+    token = uuid.uuid4().hex
+    acquired = False
+    if client:
+        try:
+            acquired = bool(client.set(f"lock:{key}", token, nx=True, px=LOCK_TTL_MS))
+            if not acquired:
+                _stats['lock_waits'] += 1
+                deadline = time.time() + LOCK_WAIT
+                while time.time() < deadline:
+                    time.sleep(LOCK_POLL)
+                    text = client.get(key)
+                    if text:
+                        _l1_set(key, text, ttl)
+                        return json.loads(text)
+                    if not client.exists(f"lock:{key}"):
+                        break    # loader finished without a result (or died)
+        except (redis.RedisError, json.JSONDecodeError) as e:
+            _redis_failed(e, 'lock')
+
+    started = time.perf_counter()
+    try:
+        value = loader()
+        _stats['loads'] += 1
+        _stats['load_ms_total'] += (time.perf_counter() - started) * 1000
+        if value is not None:
+            cache_set(key, value, ttl)
+        return value
+    finally:
+        if acquired:
+            try:
+                client.eval(_RELEASE_LOCK, 1, f"lock:{key}", token)
+            except redis.RedisError as e:
+                _redis_failed(e, 'unlock')
+
+
+def cache_get_or_set(key, loader, ttl=3600):
+    """
+    DOES: Return the cached value of key, computing it with loader() on a miss
+    INPUTS:
+        key - cache key (build it with ns_key() to make it invalidatable as a group)
+        loader - function returning the value; None results are not cached
+        ttl - time to live in seconds
+    OUTPUTS: Cached or freshly loaded value
+
+    Concurrent misses on one key share a single loader() call: other threads
+    of this process wait for it, other processes wait on the Redis lock and
+    read the stored result.
+    """
+    value = cache_get(key)
+    if value is not None:
+        return value
+
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = {'event': threading.Event(), 'value': None}
+
+    if not leader:
+        _stats['lock_waits'] += 1
+        if not call['event'].wait(LOCK_WAIT):
+            return loader()
+        # Read back through L1 so each caller gets its own copy
+        value = cache_get(key)
+        return value if value is not None else call['value']
+
+    try:
+        call['value'] = _load_once(key, loader, ttl)
+        return call['value']
+    finally:
+        call['event'].set()
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # SPECIALIZED CACHING FUNCTIONS
 # ══════════════════════════════════════════════════════════════════════════════
@@ -232,7 +551,7 @@ def cache_hierarchy(ctv_code, tree):
     INPUTS: ctv_code - CTV code, tree - hierarchy tree dict
     OUTPUTS: True if successful
     """
-    key = f"hierarchy:{ctv_code}"
+    key = ns_key('hierarchy', ctv_code)
     return cache_set(key, tree, TTL_HIERARCHY)
 
 
@@ -242,16 +561,25 @@ def get_cached_hierarchy(ctv_code):
     INPUTS: ctv_code - CTV code
     OUTPUTS: Hierarchy tree dict or None
     """
-    key = f"hierarchy:{ctv_code}"
+    key = ns_key('hierarchy', ctv_code)
     return cache_get(key)
 
 
+def get_or_build_hierarchy(ctv_code, builder):
+    """
+    DOES: Get a cached hierarchy tree; on a miss only one worker runs builder()
+    INPUTS: ctv_code - CTV code, builder - function returning the tree or None
+    OUTPUTS: Hierarchy tree dict or None
+    """
+    return cache_get_or_set(ns_key('hierarchy', ctv_code), builder, TTL_HIERARCHY)
+
+
 def invalidate_hierarchy(ctv_code):
     """
     DOES: Invalidate a specific CTV's hierarchy cache
     INPUTS: ctv_code - CTV code
     """
-    key = f"hierarchy:{ctv_code}"
+    key = ns_key('hierarchy', ctv_code)
     cache_delete(key)
 
 
@@ -260,7 +588,7 @@ def invalidate_all_hierarchies():
     DOES: Invalidate all hierarchy caches
     Call this when CTV relationships change
     """
-    cache_delete_pattern("hierarchy:*")
+    invalidate_namespace('hierarchy')
 
 
 def cache_ctv_info(ctv_code, info):
@@ -283,13 +611,18 @@ def get_cached_ctv_info(ctv_code):
     return cache_get(key)
 
 
+def _rates_from_json(rates):
+    # JSON object keys come back as strings; commission levels are ints
+    return {int(level): rate for level, rate in rates.items()} if rates else rates
+
+
 def cache_commission_rates(rates):
     """
     DOES: Cache commission rates configuration
     INPUTS: rates - dict of level: rate
     OUTPUTS: True if successful
     """
-    key = "commission_rates"
+    key = ns_key('commission_rates', 'all')
     return cache_set(key, rates, TTL_COMMISSION_RATES)
 
 
@@ -298,8 +631,18 @@ def get_cached_commission_rates():
     DOES: Get cached commission rates
     OUTPUTS: Dict of level: rate or None
     """
-    key = "commission_rates"
-    return cache_get(key)
+    key = ns_key('commission_rates', 'all')
+    return _rates_from_json(cache_get(key))
+
+
+def get_or_load_commission_rates(loader):
+    """
+    DOES: Get cached commission rates; on a miss only one worker runs loader()
+    INPUTS: loader - function returning dict of level: rate, or None on failure
+    OUTPUTS: Dict of level: rate or None
+    """
+    rates = cache_get_or_set(ns_key('commission_rates', 'all'), loader, TTL_COMMISSION_RATES)
+    return _rates_from_json(rates)
 
 
 def invalidate_commission_cache():
@@ -307,8 +650,8 @@ def invalidate_commission_cache():
     DOES: Invalidate all commission-related caches
     Call this when new transactions are created
     """
-    cache_delete("commission_rates")
-    cache_delete_pattern("commissions:*")
+    invalidate_namespace('commission_rates')
+    invalidate_namespace('commissions')
 
 
 def cache_duplicate_check(phone, is_duplicate):
@@ -338,63 +681,45 @@ def get_cached_duplicate_check(phone):
 def cached(key_prefix, ttl=3600, key_builder=None):
     """
     DOES: Decorator to cache function results
-    
+
     INPUTS:
-    - key_prefix: Prefix for cache key
+    - key_prefix: Namespace of the cache keys (invalidate_namespace(key_prefix) drops them all)
     - ttl: Time to live in seconds
     - key_builder: Optional function to build cache key from args
-    
+
+    Concurrent misses on the same key run the function once (see cache_get_or_set).
+
     USAGE:
     @cached("user", ttl=300)
     def get_user(user_id):
         # This will be cached for 5 minutes
         return db.get_user(user_id)
-    
+
     @cached("report", ttl=3600, key_builder=lambda ctv, month: f"{ctv}:{month}")
     def get_report(ctv_code, month):
         return calculate_report(ctv_code, month)
     """
     def decorator(func):
+        def build_key(*args, **kwargs):
+            if key_builder:
+                return ns_key(key_prefix, key_builder(*args, **kwargs))
+            # Default: use first positional argument
+            return ns_key(key_prefix, args[0] if args else '')
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Build cache key
-            if key_builder:
-                cache_key = f"{key_prefix}:{key_builder(*args, **kwargs)}"
-            else:
-                # Default: use first positional argument
-                if args:
-                    cache_key = f"{key_prefix}:{args[0]}"
-                else:
-                    cache_key = key_prefix
-            
-            # Try to get from cache
-            cached_value = cache_get(cache_key)
-            if cached_value is not None:
-                return cached_value
-            
-            # Call function and cache result
-            result = func(*args, **kwargs)
-            if result is not None:
-                cache_set(cache_key, result, ttl)
-            
-            return result
-        
+            return cache_get_or_set(build_key(*args, **kwargs), lambda: func(*args, **kwargs), ttl)
+
         # Add method to bypass cache
         def bypass(*args, **kwargs):
             return func(*args, **kwargs)
         wrapper.bypass = bypass
-        
+
         # Add method to invalidate cache
         def invalidate(*args, **kwargs):
-            if key_builder:
-                cache_key = f"{key_prefix}:{key_builder(*args, **kwargs)}"
-            elif args:
-                cache_key = f"{key_prefix}:{args[0]}"
-            else:
-                cache_key = key_prefix
-            cache_delete(cache_key)
+            cache_delete(build_key(*args, **kwargs))
         wrapper.invalidate = invalidate
-        
+
         return wrapper
     return decorator
 
@@ -406,29 +731,42 @@ def cached(key_prefix, ttl=3600, key_builder=None):
 def get_cache_stats():
     """
     DOES: Get cache statistics
-    OUTPUTS: Dict with cache stats or None if unavailable
-    """
+    OUTPUTS: Dict with
+             connected - False while running L1-only
+             local     - this process's L1/L2 hits, misses, loads, lock waits,
+                         L1 size, Redis GET latency and loader latency
+             hits, misses, hit_rate, used_memory, total_keys - Redis server stats
+    """
+    with _l1_lock:
+        local = dict(_stats, l1_entries=len(_l1), l1_bytes=_l1_bytes)
+    lookups = local['l1_hits'] + local['l2_hits'] + local['misses']
+    local['hit_rate'] = round((local['l1_hits'] + local['l2_hits']) / max(lookups, 1) * 100, 2)
+    local['l2_get_ms_avg'] = round(local.pop('l2_get_ms_total') / max(local['l2_gets'], 1), 2)
+    local['l2_get_ms_max'] = round(local['l2_get_ms_max'], 2)
+    local['load_ms_avg'] = round(local.pop('load_ms_total') / max(local['loads'], 1), 2)
+
     client = get_redis_client()
     if not client:
-        return None
-    
+        return {'connected': False, 'local': local}
+
     try:
         info = client.info('stats')
         memory = client.info('memory')
-        
+
         return {
             'connected': True,
+            'local': local,
             'hits': info.get('keyspace_hits', 0),
             'misses': info.get('keyspace_misses', 0),
             'hit_rate': round(
-                info.get('keyspace_hits', 0) / 
+                info.get('keyspace_hits', 0) /
                 max(info.get('keyspace_hits', 0) + info.get('keyspace_misses', 0), 1) * 100, 2
             ),
             'used_memory': memory.get('used_memory_human', 'N/A'),
             'total_keys': client.dbsize()
         }
     except redis.RedisError as e:
-        return {'connected': False, 'error': str(e)}
+        return {'connected': False, 'local': local, 'error': str(e)}
 
 
 def clear_all_cache():
@@ -436,10 +774,15 @@ def clear_all_cache():
     DOES: Clear all cached data (use with caution)
     OUTPUTS: True if successful
     """
+    global _l1_bytes
+    with _l1_lock:
+        _l1.clear()
+        _l1_bytes = 0
+
     client = get_redis_client()
     if not client:
         return False
-    
+
     try:
         client.flushdb()
         print("All cache cleared")
@@ -452,4 +795,3 @@ def clear_all_cache():
 # Initialize Redis connection on module import
 if REDIS_AVAILABLE:
     _redis_client = get_redis_client()
-
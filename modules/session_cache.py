@@ -0,0 +1,291 @@
+"""
+Session Cache Module
+Two-tier cache of session principals so authenticated requests skip the database.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - token_key(token) -> str
+#     DOES: SHA256 of the session token (raw tokens are never used as cache keys)
+#
+# - get_cached_principal(token) -> dict | None
+#     DOES: L1 (in-process) then L2 (Redis) lookup of a session entry
+#
+# - cache_principal(token, entry) -> None
+#     DOES: Store a session entry in both tiers
+#
+# - invalidate_session(token) -> None
+#     DOES: Drop one session everywhere (logout)
+#
+# - invalidate_user(user_type, user_id) -> None
+#     DOES: Drop every cached session of a user (password change, admin edit,
+#           deactivation, new login)
+#
+# - get_session_cache_stats() -> dict
+#     DOES: Hit/miss counters and L1 size
+#
+# ENTRY FORMAT:
+#   {'user_type': 'admin'|'ctv', 'user_id': str, 'expires_at': epoch seconds,
+#    'principal': admin info / ctv info dict, or None if the account is missing}
+#
+# CACHE KEY PATTERNS (Redis):
+# - session:{token_sha256} -> session entry (TTL: min(session left, 10 min))
+# - session_user:{user_type}:{user_id} -> set of token hashes of that user
+#
+# NOTES:
+# - Invalidations delete the Redis keys and publish on SESSION_CHANNEL; every
+#   process runs one subscriber thread that drops the matching L1 entries.
+# - L1 is only used while that subscriber is connected, so a logout or
+#   deactivation in one gunicorn worker is never missed by another. Without
+#   Redis every lookup misses and auth falls back to Postgres.
+# - L1 entries also expire after L1_TTL seconds as a safety net.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .redis_cache import get_redis_client
+
+# In-process tier
+L1_TTL = 60            # seconds
+L1_MAX_ENTRIES = 5000
+
+# Redis tier
+L2_TTL = 600           # seconds (capped by the session's own expiry)
+SESSION_CHANNEL = 'session_invalidate'
+
+_l1 = OrderedDict()    # token hash -> (l1_expiry, entry)
+_l1_lock = threading.Lock()
+_stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'invalidations': 0}
+
+_subscriber_pid = None
+_subscriber_lock = threading.Lock()
+_subscribed = threading.Event()    # L1 is trusted only while set
+
+
+def token_key(token):
+    """DOES: Hash a session token for use as a cache key"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# L1 (IN-PROCESS)
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _l1_get(key):
+    if not _subscribed.is_set():
+        return None
+    now = time.time()
+    with _l1_lock:
+        item = _l1.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del _l1[key]
+            return None
+        _l1.move_to_end(key)
+        return item[1]
+
+
+def _l1_set(key, entry):
+    if not _subscribed.is_set():
+        return
+    expiry = min(time.time() + L1_TTL, entry['expires_at'])
+    with _l1_lock:
+        _l1[key] = (expiry, entry)
+        _l1.move_to_end(key)
+        while len(_l1) > L1_MAX_ENTRIES:
+            _l1.popitem(last=False)
+
+
+def _l1_drop(key=None, user_type=None, user_id=None):
+    with _l1_lock:
+        if key is not None:
+            _l1.pop(key, None)
+            return
+        stale = [k for k, (_, entry) in _l1.items()
+                 if entry['user_type'] == user_type and entry['user_id'] == user_id]
+        for k in stale:
+            del _l1[k]
+
+
+def _l1_clear():
+    with _l1_lock:
+        _l1.clear()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PUB/SUB INVALIDATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _apply_invalidation(message):
+    try:
+        data = json.loads(message)
+    except (TypeError, ValueError):
+        return
+    if data.get('key'):
+        _l1_drop(key=data['key'])
+    elif data.get('user_type'):
+        _l1_drop(user_type=data['user_type'], user_id=data.get('user_id'))
+
+
+def _subscriber_loop(client):
+    """Listen for invalidations until the process exits; reconnect on errors"""
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(SESSION_CHANNEL)
+            # Messages may have been missed while disconnected
+            _l1_clear()
+            _subscribed.set()
+            for message in pubsub.listen():
+                if message.get('type') == 'message':
+                    _apply_invalidation(message.get('data'))
+        except Exception as e:
+            _subscribed.clear()
+            print(f"Session cache subscriber error: {e}. Reconnecting in 5s...")
+            time.sleep(5)
+
+
+def _ensure_subscriber(client):
+    """Start this process's subscriber thread (once per pid, so forked workers get their own)"""
+    global _subscriber_pid
+    if _subscriber_pid == os.getpid():
+        return
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+        # A forked worker inherits the parent's L1 but not its subscriber thread
+        _subscribed.clear()
+        _l1_clear()
+        thread = threading.Thread(target=_subscriber_loop, args=(client,), daemon=True)
+        thread.start()
+        _subscriber_pid = os.getpid()
+
+
+def _publish(payload):
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        client.publish(SESSION_CHANNEL, json.dumps(payload))
+    except Exception as e:
+        print(f"Session cache publish error: {e}")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PUBLIC API
+# ══════════════════════════════════════════════════════════════════════════════
+
+def get_cached_principal(token):
+    """
+    DOES: Look up a session entry, L1 first, then Redis
+    INPUTS: token - raw session token
+    OUTPUTS: Entry dict (see ENTRY FORMAT) or None on miss / expired session
+    """
+    key = token_key(token)
+    client = get_redis_client()
+    if client:
+        _ensure_subscriber(client)
+
+    entry = _l1_get(key)
+    if entry is not None:
+        _stats['l1_hits'] += 1
+        return entry
+
+    if client:
+        try:
+            value = client.get(f"session:{key}")
+            if value:
+                entry = json.loads(value)
+                if entry['expires_at'] > time.time():
+                    _l1_set(key, entry)
+                    _stats['l2_hits'] += 1
+                    return entry
+        except Exception as e:
+            print(f"Session cache get error: {e}")
+
+    _stats['misses'] += 1
+    return None
+
+
+def cache_principal(token, entry):
+    """
+    DOES: Store a session entry in L1 and Redis
+    INPUTS: token - raw session token, entry - dict (see ENTRY FORMAT)
+    """
+    ttl = int(min(L2_TTL, entry['expires_at'] - time.time()))
+    if ttl <= 0:
+        return
+    key = token_key(token)
+    _l1_set(key, entry)
+
+    client = get_redis_client()
+    if not client:
+        return
+    _ensure_subscriber(client)
+    try:
+        user_set = f"session_user:{entry['user_type']}:{entry['user_id']}"
+        pipe = client.pipeline()
+        pipe.setex(f"session:{key}", ttl, json.dumps(entry, default=str))
+        pipe.sadd(user_set, key)
+        pipe.expire(user_set, L2_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"Session cache set error: {e}")
+
+
+def invalidate_session(token):
+    """
+    DOES: Remove one session from every tier and every process
+    INPUTS: token - raw session token
+    """
+    key = token_key(token)
+    _stats['invalidations'] += 1
+    _l1_drop(key=key)
+    client = get_redis_client()
+    if client:
+        try:
+            client.delete(f"session:{key}")
+        except Exception as e:
+            print(f"Session cache delete error: {e}")
+    _publish({'key': key})
+
+
+def invalidate_user(user_type, user_id):
+    """
+    DOES: Remove every cached session of one user from every tier and every process
+    INPUTS: user_type ('admin' or 'ctv'), user_id (username or ma_ctv)
+    """
+    _stats['invalidations'] += 1
+    _l1_drop(user_type=user_type, user_id=user_id)
+    client = get_redis_client()
+    if client:
+        try:
+            user_set = f"session_user:{user_type}:{user_id}"
+            keys = client.smembers(user_set)
+            pipe = client.pipeline()
+            for key in keys:
+                pipe.delete(f"session:{key}")
+            pipe.delete(user_set)
+            pipe.execute()
+        except Exception as e:
+            print(f"Session cache delete error: {e}")
+    _publish({'user_type': user_type, 'user_id': user_id})
+
+
+def get_session_cache_stats():
+    """
+    DOES: Report session cache effectiveness for this process
+    OUTPUTS: Dict with l1_hits, l2_hits, misses, invalidations, l1_size
+    """
+    with _l1_lock:
+        size = len(_l1)
+    return dict(_stats, l1_size=size)
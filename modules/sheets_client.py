@@ -0,0 +1,300 @@
+"""
+Sheets Client Module
+Process-wide Google Sheets access: one authorized gspread client, cached
+spreadsheet / worksheet handles and per-call API counters.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - load_google_credentials() -> Credentials
+#     DOES: Service-account credentials from GOOGLE_CREDENTIALS_JSON or
+#           google_credentials.json (parsed once per process)
+#
+# - build_google_client() -> gspread.Client
+#     DOES: New instrumented client (scripts that want their own)
+#
+# - get_sheets_client(refresh=False) -> gspread.Client
+#     DOES: The shared client; refreshes its access token before it expires
+#
+# - get_spreadsheet(spreadsheet_id, client=None, ttl=SPREADSHEET_TTL) -> Spreadsheet
+#     DOES: Cached open_by_key
+#
+# - get_worksheets(spreadsheet_id, client=None, ttl=WORKSHEET_TTL) -> list
+#     DOES: Cached spreadsheet.worksheets()
+#
+# - get_worksheet(spreadsheet_id, tab_variations, client=None, ttl=WORKSHEET_TTL) -> Worksheet or None
+#     DOES: Cached find_worksheet() title matching
+#
+# - invalidate_sheets_cache(spreadsheet_id=None) -> None
+#     DOES: Drop cached handles (after a tab rename, or an error that may be one)
+#
+# - get_sheets_stats() -> dict
+#     DOES: Calls, errors, quota errors and latency per API operation
+#
+# NOTES:
+# - Handles are only cached for the client that opened them, so a caller that
+#   passes its own client never gets another client's handle.
+# - Cached worksheet properties (row_count, col_count) can be up to
+#   WORKSHEET_TTL old; the values themselves are always read live.
+# - Counters are per process and reset on restart.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import gspread
+from gspread.http_client import HTTPClient
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+
+BASE_DIR = Path(__file__).parent.parent.absolute()
+CREDENTIALS_FILE = BASE_DIR / 'google_credentials.json'
+# Environment variable for credentials (JSON string) - used in production
+GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON')
+
+SHEETS_SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+SPREADSHEET_TTL = 600           # seconds an open_by_key handle is reused
+WORKSHEET_TTL = 600             # seconds the worksheet list of a spreadsheet is reused
+TOKEN_REFRESH_MARGIN = 300      # refresh the access token this many seconds before it expires
+SHEETS_HTTP_TIMEOUT = 120       # seconds per API request
+
+_credentials = None
+_client = None
+_client_lock = threading.Lock()
+
+# spreadsheet_id -> (loaded_at, client, value)
+_spreadsheets = {}
+_worksheets = {}
+_cache_lock = threading.Lock()
+
+_stats = {}
+_counters = {'clients_built': 0, 'token_refreshes': 0, 'cache_hits': 0, 'cache_misses': 0}
+_stats_lock = threading.Lock()
+
+_SPREADSHEET_PATH = re.compile(r'/v4/spreadsheets/[^/:]+(.*)$')
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# INSTRUMENTATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _operation_name(method, url):
+    """Short API operation name of a request, e.g. 'values.append'"""
+    path = url.split('?', 1)[0]
+    if '/drive/' in path:
+        return f"drive.{method.lower()}"
+    match = _SPREADSHEET_PATH.search(path)
+    if not match:
+        return method.lower()
+    rest = match.group(1)
+    if rest.startswith('/values'):
+        verb = rest.rsplit(':', 1)[1] if ':' in rest else {'GET': 'get', 'PUT': 'update'}.get(method, method.lower())
+        return f"values.{verb}"
+    if rest.startswith(':'):
+        return f"spreadsheets.{rest[1:]}"
+    return f"spreadsheets.{method.lower()}"
+
+
+def _record_call(operation, elapsed, status):
+    with _stats_lock:
+        entry = _stats.get(operation)
+        if entry is None:
+            entry = _stats[operation] = {'calls': 0, 'errors': 0, 'quota_errors': 0,
+                                         'total_ms': 0.0, 'max_ms': 0.0}
+        entry['calls'] += 1
+        entry['total_ms'] += elapsed * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+        if status is None or status >= 400:
+            entry['errors'] += 1
+        if status == 429:
+            entry['quota_errors'] += 1
+
+
+class InstrumentedHTTPClient(HTTPClient):
+    """gspread HTTP client that times every request and counts errors per operation"""
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self.timeout = SHEETS_HTTP_TIMEOUT
+
+    def request(self, method, endpoint, *args, **kwargs):
+        start = time.time()
+        status = None
+        try:
+            response = super().request(method, endpoint, *args, **kwargs)
+            status = response.status_code
+            return response
+        except gspread.exceptions.APIError as e:
+            status = e.response.status_code
+            raise
+        finally:
+            _record_call(_operation_name(method, endpoint), time.time() - start, status)
+
+
+def get_sheets_stats():
+    """
+    DOES: Per-operation Sheets API counters of this process
+    OUTPUTS: {'operations': {name: {'calls', 'errors', 'quota_errors', 'avg_ms', 'max_ms'}},
+              'clients_built', 'token_refreshes', 'cache_hits', 'cache_misses'}
+    """
+    with _stats_lock:
+        operations = {
+            name: {
+                'calls': entry['calls'],
+                'errors': entry['errors'],
+                'quota_errors': entry['quota_errors'],
+                'avg_ms': round(entry['total_ms'] / entry['calls'], 1) if entry['calls'] else 0,
+                'max_ms': round(entry['max_ms'], 1),
+            }
+            for name, entry in sorted(_stats.items())
+        }
+        return dict(_counters, operations=operations)
+
+
+def _count(name):
+    with _stats_lock:
+        _counters[name] += 1
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLIENT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def load_google_credentials():
+    """
+    DOES: Load the service-account credentials (environment variable first, then file)
+    OUTPUTS: Credentials shared by every client of this process
+    Raises ValueError for invalid JSON and FileNotFoundError if there are none
+    """
+    global _credentials
+    if _credentials is not None:
+        return _credentials
+
+    # Try environment variable first (for production/Railway)
+    if GOOGLE_CREDENTIALS_JSON:
+        try:
+            creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in GOOGLE_CREDENTIALS_JSON environment variable: {e}")
+        _credentials = Credentials.from_service_account_info(creds_dict, scopes=SHEETS_SCOPES)
+        return _credentials
+
+    # Fall back to file (for local development)
+    if CREDENTIALS_FILE.exists():
+        _credentials = Credentials.from_service_account_file(str(CREDENTIALS_FILE), scopes=SHEETS_SCOPES)
+        return _credentials
+
+    raise FileNotFoundError(
+        "Google credentials not found. Please either:\n"
+        "1. Set GOOGLE_CREDENTIALS_JSON environment variable with the JSON content, or\n"
+        "2. Place google_credentials.json file in the project root"
+    )
+
+
+def build_google_client():
+    """
+    DOES: Authorize a new gspread client (instrumented like the shared one)
+    """
+    client = gspread.authorize(load_google_credentials(), http_client=InstrumentedHTTPClient)
+    _count('clients_built')
+    return client
+
+
+def _refresh_token_if_needed(client):
+    credentials = client.http_client.auth
+    expiry = getattr(credentials, 'expiry', None)
+    if credentials.token and expiry and (expiry - datetime.utcnow()).total_seconds() > TOKEN_REFRESH_MARGIN:
+        return
+    credentials.refresh(Request())
+    _count('token_refreshes')
+
+
+def get_sheets_client(refresh=False):
+    """
+    DOES: Get the process-wide client, building it on first use
+    INPUTS: refresh - build a new client and drop every cached handle
+    OUTPUTS: gspread.Client (raises like load_google_credentials)
+    """
+    global _client
+    with _client_lock:
+        if _client is None or refresh:
+            _client = build_google_client()
+            invalidate_sheets_cache()
+        _refresh_token_if_needed(_client)
+        return _client
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# HANDLE CACHE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _cached(cache, key, client, ttl, load):
+    with _cache_lock:
+        entry = cache.get(key)
+    if entry and entry[1] is client and time.time() - entry[0] < ttl:
+        _count('cache_hits')
+        return entry[2]
+
+    _count('cache_misses')
+    value = load()
+    with _cache_lock:
+        cache[key] = (time.time(), client, value)
+    return value
+
+
+def get_spreadsheet(spreadsheet_id, client=None, ttl=SPREADSHEET_TTL):
+    """
+    DOES: open_by_key, reusing the handle for ttl seconds
+    INPUTS: spreadsheet_id, optional client (the shared client by default)
+    """
+    client = client or get_sheets_client()
+    return _cached(_spreadsheets, spreadsheet_id, client, ttl,
+                   lambda: client.open_by_key(spreadsheet_id))
+
+
+def get_worksheets(spreadsheet_id, client=None, ttl=WORKSHEET_TTL):
+    """
+    DOES: The worksheets of a spreadsheet, reusing the list for ttl seconds
+    """
+    client = client or get_sheets_client()
+    return _cached(_worksheets, spreadsheet_id, client, ttl,
+                   lambda: get_spreadsheet(spreadsheet_id, client).worksheets())
+
+
+def get_worksheet(spreadsheet_id, tab_variations, client=None, ttl=WORKSHEET_TTL):
+    """
+    DOES: Find a worksheet by its title variations (see GoogleSheetSync.find_worksheet)
+    OUTPUTS: Worksheet or None; a miss re-reads the worksheet list once
+    """
+    from .google_sync import GoogleSheetSync
+
+    client = client or get_sheets_client()
+    syncer = GoogleSheetSync()
+    worksheet = syncer.find_worksheet(None, tab_variations, get_worksheets(spreadsheet_id, client, ttl))
+    if worksheet is None:
+        invalidate_sheets_cache(spreadsheet_id)
+        worksheet = syncer.find_worksheet(None, tab_variations, get_worksheets(spreadsheet_id, client, ttl))
+    return worksheet
+
+
+def invalidate_sheets_cache(spreadsheet_id=None):
+    """
+    DOES: Forget cached handles of one spreadsheet (or all of them)
+    """
+    with _cache_lock:
+        if spreadsheet_id is None:
+            _spreadsheets.clear()
+            _worksheets.clear()
+        else:
+            _spreadsheets.pop(spreadsheet_id, None)
+            _worksheets.pop(spreadsheet_id, None)
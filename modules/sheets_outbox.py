@@ -0,0 +1,294 @@
+"""
+Sheets Outbox Module
+Transactional outbox for rows the app appends to Google Sheets (bookings).
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# FUNCTIONS:
+# - enqueue_sheet_row(cursor, idempotency_key, tab_type, row_values, spreadsheet_id) -> None
+#     DOES: Queues one row in the caller's transaction (the caller commits)
+#
+# - notify_sheets_outbox() -> None
+#     DOES: Wakes this process's dispatcher thread (starting it if needed)
+#
+# - dispatch_sheets_outbox(connection=None, batch_size=OUTBOX_BATCH_SIZE) -> dict
+#     DOES: Claims due rows and appends them with one append_rows call per tab;
+#           failures are retried with exponential backoff
+#
+# - start_sheets_outbox_dispatcher() -> None
+#     DOES: Starts the background dispatcher thread of this process
+#
+# NOTES:
+# - A booking commits its khach_hang row and its outbox row together and
+#   returns; Sheets latency and quota errors never reach the user.
+# - Claiming a row increments attempts and moves next_attempt_at forward by
+#   OUTBOX_LEASE_SECONDS in a committed statement (FOR UPDATE SKIP LOCKED), so
+#   several processes can dispatch without sending a row twice, and a row
+#   whose dispatcher died is picked up again once the lease runs out.
+# - append_rows is not idempotent: a row that was claimed before may already
+#   be in the sheet. Before re-sending such rows the dispatcher reads the
+#   tab's match columns and skips a row only when the sheet holds more copies
+#   of it (match_key: hash of every booking cell) than the outbox has sent,
+#   so a second booking of the same customer and referrer still goes out.
+# - Rows that still fail after OUTBOX_MAX_ATTEMPTS are marked 'failed'.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import json
+import hashlib
+import threading
+from collections import Counter
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+from gspread.utils import rowcol_to_a1
+from .db_pool import get_db_connection, return_db_connection
+from .google_sync import GOOGLE_SHEET_ID, TAB_VARIATIONS
+from .sheets_client import get_sheets_client, get_worksheet, invalidate_sheets_cache
+
+OUTBOX_BATCH_SIZE = 100         # rows claimed (and appended) per batch
+OUTBOX_MAX_BATCHES = 20         # batches per dispatch_sheets_outbox() call
+OUTBOX_LEASE_SECONDS = 120      # a claimed row is invisible to other dispatchers this long
+OUTBOX_RETRY_BASE = 30          # seconds before the first retry, doubled per attempt
+OUTBOX_RETRY_MAX = 3600         # upper bound of the retry delay
+OUTBOX_MAX_ATTEMPTS = 10        # then the row is marked 'failed'
+OUTBOX_POLL_INTERVAL = 30       # dispatcher wakes at least this often for due retries
+
+# tab_type -> 1-based sheet columns whose cells make up the match key
+OUTBOX_MATCH_COLUMNS = {
+    'gioi_thieu': (1, 2, 3, 4, 5, 6, 7),    # the whole booking row (see ctv.booking)
+}
+
+_wake_event = threading.Event()
+_dispatcher_thread = None
+_dispatcher_lock = threading.Lock()
+
+
+def _key_of_cells(values):
+    """Hash of a row's match cells as the sheet shows them (text phones lose their apostrophe)"""
+    parts = [str(value or '').strip().lstrip("'").strip().lower() for value in values]
+    return hashlib.md5('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _match_key(tab_type, cells):
+    """Identity of a sheet row for the duplicate check (None if the tab has none)"""
+    columns = OUTBOX_MATCH_COLUMNS.get(tab_type)
+    if not columns:
+        return None
+    return _key_of_cells(cells[column - 1] if column - 1 < len(cells) else '' for column in columns)
+
+
+def enqueue_sheet_row(cursor, idempotency_key, tab_type, row_values, spreadsheet_id=GOOGLE_SHEET_ID):
+    """
+    DOES: Queue a row to be appended to a sheet tab
+    INPUTS:
+        cursor - cursor of the transaction that writes the source record
+        idempotency_key - unique key of the source record, e.g. 'khach_hang:123'
+                          (queueing the same key twice is a no-op)
+        tab_type - key of google_sync.TAB_VARIATIONS
+        row_values - list of cell values, as for worksheet.append_row
+        spreadsheet_id - target spreadsheet
+    Call notify_sheets_outbox() after the transaction commits.
+    """
+    cursor.execute("""
+        INSERT INTO sheets_outbox (idempotency_key, spreadsheet_id, tab_type, row_values, match_key)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (idempotency_key) DO NOTHING
+    """, (
+        idempotency_key,
+        spreadsheet_id,
+        tab_type,
+        json.dumps(row_values, ensure_ascii=False),
+        _match_key(tab_type, row_values)
+    ))
+
+
+def notify_sheets_outbox():
+    """
+    DOES: Wake the dispatcher so freshly committed rows go out right away
+    """
+    start_sheets_outbox_dispatcher()
+    _wake_event.set()
+
+
+def _claim_rows(connection, batch_size):
+    """Lease up to batch_size due rows, oldest first"""
+    cursor = connection.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        UPDATE sheets_outbox SET
+            attempts = attempts + 1,
+            next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        WHERE id IN (
+            SELECT id FROM sheets_outbox
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, spreadsheet_id, tab_type, row_values, match_key, attempts
+    """, (OUTBOX_LEASE_SECONDS, batch_size))
+    rows = sorted(cursor.fetchall(), key=lambda row: row['id'])
+    connection.commit()
+    cursor.close()
+    return rows
+
+
+def _existing_match_keys(worksheet, tab_type):
+    """Match keys of the rows already in a tab, with how often each occurs"""
+    columns = OUTBOX_MATCH_COLUMNS[tab_type]
+    first, last = min(columns), max(columns)
+    # Whole columns: the cached handle's row_count predates our own appends
+    letters = [rowcol_to_a1(1, column).rstrip('1') for column in (first, last)]
+    values = worksheet.get_values(f"{letters[0]}:{letters[1]}")
+    return Counter(
+        _key_of_cells(row[column - first] if column - first < len(row) else '' for column in columns)
+        for row in values
+    )
+
+
+def _sent_match_keys(cursor, tab_type, keys):
+    """How many rows with each match key the outbox has already sent to a tab"""
+    cursor.execute("""
+        SELECT match_key, COUNT(*) FROM sheets_outbox
+        WHERE tab_type = %s AND status = 'sent' AND match_key = ANY(%s)
+        GROUP BY match_key
+    """, (tab_type, list(keys)))
+    return Counter(dict(cursor.fetchall()))
+
+
+def _send_group(cursor, tab_type, spreadsheet_id, rows):
+    """
+    Append one tab's rows with a single append_rows call
+    Returns the ids of rows already present in the tab (skipped)
+    """
+    worksheet = get_worksheet(spreadsheet_id, TAB_VARIATIONS[tab_type])
+    if not worksheet:
+        raise ValueError(f"Worksheet for '{tab_type}' not found")
+
+    # Rows claimed before may have reached the sheet even though we never saw the reply.
+    # Copies the outbox already sent belong to earlier bookings: a retried row is
+    # skipped only for a copy beyond those.
+    skipped = []
+    retried = [row for row in rows if row['attempts'] > 1 and row['match_key']]
+    if tab_type in OUTBOX_MATCH_COLUMNS and retried:
+        unclaimed = _existing_match_keys(worksheet, tab_type)
+        unclaimed.subtract(_sent_match_keys(cursor, tab_type, {row['match_key'] for row in retried}))
+        for row in retried:
+            if unclaimed[row['match_key']] > 0:
+                unclaimed[row['match_key']] -= 1
+                skipped.append(row['id'])
+
+    values = [row['row_values'] for row in rows if row['id'] not in skipped]
+    if values:
+        worksheet.append_rows(values, value_input_option='USER_ENTERED')
+    return skipped
+
+
+def _retry_delay(attempts):
+    return min(OUTBOX_RETRY_BASE * 2 ** max(attempts - 1, 0), OUTBOX_RETRY_MAX)
+
+
+def dispatch_sheets_outbox(connection=None, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    DOES: Append due outbox rows to their sheets (shared client, cached worksheet handles)
+    INPUTS: Optional connection (borrows one from the pool if not provided),
+            batch_size rows per append_rows call
+    OUTPUTS: Dict with sent, skipped (already in the sheet), retry, failed counts
+             and 'error' if the Google client could not be created
+    """
+    stats = {'sent': 0, 'skipped': 0, 'retry': 0, 'failed': 0}
+
+    try:
+        get_sheets_client()
+    except Exception as e:
+        stats['error'] = str(e)
+        return stats
+
+    should_close = False
+    if connection is None:
+        connection = get_db_connection()
+        should_close = True
+
+    if not connection:
+        return stats
+
+    try:
+        for _ in range(OUTBOX_MAX_BATCHES):
+            rows = _claim_rows(connection, batch_size)
+            if not rows:
+                break
+
+            groups = {}
+            for row in rows:
+                groups.setdefault((row['spreadsheet_id'], row['tab_type']), []).append(row)
+
+            cursor = connection.cursor()
+            for (spreadsheet_id, tab_type), group in groups.items():
+                ids = [row['id'] for row in group]
+                try:
+                    skipped = _send_group(cursor, tab_type, spreadsheet_id, group)
+                except Exception as e:
+                    print(f"Error appending {len(group)} outbox row(s) to '{tab_type}': {e}")
+                    # The cached worksheet may be gone or renamed
+                    invalidate_sheets_cache(spreadsheet_id)
+                    for row in group:
+                        failed = row['attempts'] >= OUTBOX_MAX_ATTEMPTS
+                        cursor.execute("""
+                            UPDATE sheets_outbox SET
+                                status = %s,
+                                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                                last_error = %s
+                            WHERE id = %s
+                        """, ('failed' if failed else 'pending', _retry_delay(row['attempts']),
+                              str(e)[:1000], row['id']))
+                        stats['failed' if failed else 'retry'] += 1
+                    connection.commit()
+                    continue
+
+                cursor.execute("""
+                    UPDATE sheets_outbox
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ANY(%s)
+                """, (ids,))
+                connection.commit()
+                stats['sent'] += len(ids) - len(skipped)
+                stats['skipped'] += len(skipped)
+            cursor.close()
+
+            if len(rows) < batch_size:
+                break
+
+    except Error as e:
+        print(f"Error dispatching sheets outbox: {e}")
+        connection.rollback()
+
+    if should_close:
+        return_db_connection(connection)
+    return stats
+
+
+def _dispatch_loop():
+    while True:
+        _wake_event.wait(OUTBOX_POLL_INTERVAL)
+        _wake_event.clear()
+        try:
+            stats = dispatch_sheets_outbox()
+            if stats['retry'] or stats['failed']:
+                print(f"Sheets outbox: {stats}")
+        except Exception as e:
+            print(f"Sheets outbox dispatcher error: {e}")
+
+
+def start_sheets_outbox_dispatcher():
+    """
+    DOES: Start this process's dispatcher thread (no-op if already running)
+    """
+    global _dispatcher_thread
+    with _dispatcher_lock:
+        if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+            _dispatcher_thread = threading.Thread(
+                target=_dispatch_loop, name='sheets-outbox', daemon=True
+            )
+            _dispatcher_thread.start()
@@ -0,0 +1,151 @@
+"""
+Sync Leader Module
+Elects a single Google Sheets sync loop across all processes with a Postgres advisory lock.
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODULE STRUCTURE MAP
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# CLASSES:
+# - SyncLeader(connect, role)
+#     .ensure() -> bool          Call once per cycle: keep or try to take leadership
+#     .release()                 Give up leadership (shutdown)
+#
+# FUNCTIONS:
+# - get_sync_leader_status(cursor) -> dict
+#     DOES: Current leader, lock age and heartbeat age for the admin UI
+#
+# NOTES:
+# - Every gunicorn worker runs the embedded loop (backend.py) and the Procfile
+#   also starts sync_worker.py; only the process holding the lock syncs, the
+#   others stay on standby and retry every cycle.
+# - The lock is session-level and lives on a dedicated connection. If the
+#   leader process dies its connection closes, Postgres releases the lock and
+#   a standby takes over on its next cycle (within one SYNC_INTERVAL).
+# - The leader renews a heartbeat in commission_cache ('sync_leader') every
+#   cycle; that row is informational only, the lock decides who leads.
+#
+# ══════════════════════════════════════════════════════════════════════════════
+"""
+
+import os
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key shared by every sync loop
+SYNC_LEADER_LOCK_KEY = 727001
+
+
+class SyncLeader:
+    """Holds (or waits for) the cluster-wide sync lock on its own connection"""
+
+    def __init__(self, connect, role):
+        """
+        connect: Function returning a new psycopg2 connection (not a pooled one:
+                 the lock must stay on a connection nobody else uses)
+        role: Short label for the admin UI, e.g. 'sync_worker' or 'embedded'
+        """
+        self.connect = connect
+        self.worker_id = f"{role}@{socket.gethostname()}:{os.getpid()}"
+        self.conn = None
+        self.is_leader = False
+
+    def _reset(self):
+        if self.conn:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+        self.is_leader = False
+
+    def ensure(self):
+        """
+        DOES: Renew leadership if held (lock connection alive + heartbeat), otherwise try to acquire it
+        OUTPUTS: True if this process should run the sync cycle
+        """
+        try:
+            if self.conn is None or self.conn.closed:
+                self._reset()
+                self.conn = self.connect()
+                self.conn.autocommit = True
+
+            cur = self.conn.cursor()
+            if self.is_leader:
+                # Lost connection = lost lock; the query below raises in that case
+                cur.execute("""
+                    UPDATE commission_cache SET last_updated = CURRENT_TIMESTAMP
+                    WHERE cache_key = 'sync_leader'
+                """)
+                cur.close()
+                return True
+
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (SYNC_LEADER_LOCK_KEY,))
+            self.is_leader = cur.fetchone()[0]
+            if self.is_leader:
+                cur.execute("""
+                    INSERT INTO commission_cache (cache_key, cache_value, last_updated)
+                    VALUES ('sync_leader', json_build_object(
+                        'worker_id', %s, 'backend_pid', pg_backend_pid(), 'acquired_at', CURRENT_TIMESTAMP
+                    )::text, CURRENT_TIMESTAMP)
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        cache_value = EXCLUDED.cache_value,
+                        last_updated = CURRENT_TIMESTAMP
+                """, (self.worker_id,))
+                logger.info(f"Sync leadership acquired by {self.worker_id}")
+            cur.close()
+            return self.is_leader
+
+        except Exception as e:
+            if self.is_leader:
+                logger.warning(f"Sync leadership lost by {self.worker_id}: {e}")
+            self._reset()
+            return False
+
+    def release(self):
+        """DOES: Release the lock (closing the connection would release it as well)"""
+        if self.is_leader and self.conn and not self.conn.closed:
+            try:
+                cur = self.conn.cursor()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SYNC_LEADER_LOCK_KEY,))
+                cur.close()
+            except Exception:
+                pass
+        self._reset()
+
+
+def get_sync_leader_status(cursor):
+    """
+    DOES: Report which process leads the sync loop
+    INPUTS: RealDictCursor
+    OUTPUTS: Dict with
+             leader              - worker id ('role@host:pid') or None if no one holds the lock
+             lock_age_seconds    - how long the leader's lock connection has held the lock
+             heartbeat_age_seconds - seconds since the leader last renewed its heartbeat
+    """
+    cursor.execute("""
+        SELECT pid FROM pg_locks
+        WHERE locktype = 'advisory' AND granted
+        AND classid = 0 AND objid = %s AND objsubid = 1
+    """, (SYNC_LEADER_LOCK_KEY,))
+    lock = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT cache_value::json->>'worker_id' as worker_id,
+               (cache_value::json->>'backend_pid')::int as backend_pid,
+               EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - (cache_value::json->>'acquired_at')::timestamptz)) as lock_age,
+               EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - last_updated)) as heartbeat_age
+        FROM commission_cache WHERE cache_key = 'sync_leader'
+    """)
+    row = cursor.fetchone()
+
+    # The heartbeat row describes the lock holder only if it was written by that backend
+    held = bool(lock and row and row['backend_pid'] == lock['pid'])
+    return {
+        'leader': row['worker_id'] if held else None,
+        'lock_held': lock is not None,
+        'lock_age_seconds': int(row['lock_age']) if held else None,
+        'heartbeat_age_seconds': int(row['heartbeat_age']) if row and row['heartbeat_age'] is not None else None
+    }
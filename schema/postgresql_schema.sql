@@ -5,9 +5,17 @@
 -- ══════════════════════════════════════════════════════════════════════════════
 
 -- Drop existing tables if they exist (in reverse dependency order)
+DROP TABLE IF EXISTS activity_log_hourly CASCADE;
 DROP TABLE IF EXISTS activity_logs CASCADE;
+DROP TABLE IF EXISTS commission_jobs CASCADE;
+DROP TABLE IF EXISTS sheet_row_state CASCADE;
+DROP TABLE IF EXISTS sheet_tab_state CASCADE;
+DROP TABLE IF EXISTS ctv_daily_rollup_dirty CASCADE;
+DROP TABLE IF EXISTS ctv_daily_rollup CASCADE;
 DROP TABLE IF EXISTS commissions CASCADE;
+DROP TABLE IF EXISTS ctv_closure CASCADE;
 DROP TABLE IF EXISTS sessions CASCADE;
+DROP TABLE IF EXISTS client_summary CASCADE;
 DROP TABLE IF EXISTS khach_hang CASCADE;
 DROP TABLE IF EXISTS services CASCADE;
 DROP TABLE IF EXISTS customers CASCADE;
@@ -50,6 +58,7 @@ CREATE TABLE ctv (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     signature_image TEXT, -- Base64 encoded signature image from signup form
+    ma_ctv_norm VARCHAR(50),  -- phone_key(ma_ctv), maintained by trigger
     FOREIGN KEY (nguoi_gioi_thieu) REFERENCES ctv(ma_ctv) ON DELETE SET NULL
 );
 
@@ -59,6 +68,21 @@ CREATE INDEX idx_ctv_email ON ctv(email);
 CREATE INDEX idx_ctv_sdt ON ctv(sdt);
 CREATE INDEX idx_ctv_active ON ctv(is_active);
 CREATE INDEX idx_ctv_created ON ctv(created_at);
+CREATE INDEX idx_ctv_ma_ctv_norm ON ctv(ma_ctv_norm);
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 2.1 CTV_CLOSURE TABLE (every ancestor/descendant pair of the referral tree)
+-- ══════════════════════════════════════════════════════════════════════════════
+CREATE TABLE ctv_closure (
+    ancestor VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+    descendant VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+    depth INTEGER NOT NULL,  -- 0 = the CTV itself, 1 = direct referral, ...
+    PRIMARY KEY (ancestor, descendant)
+);
+
+-- Downline by level (ancestor, depth) and upline (descendant, depth)
+CREATE INDEX idx_ctv_closure_ancestor_depth ON ctv_closure(ancestor, depth);
+CREATE INDEX idx_ctv_closure_descendant_depth ON ctv_closure(descendant, depth);
 
 -- ══════════════════════════════════════════════════════════════════════════════
 -- 3. SESSIONS TABLE
@@ -109,6 +133,8 @@ CREATE TABLE khach_hang (
     trang_thai VARCHAR(50) DEFAULT 'Cho xac nhan',
     source VARCHAR(20),  -- Data source: 'tham_my', 'gioi_thieu', 'nha_khoa'
     khu_vuc VARCHAR(50),  -- Customer region (for Khách giới thiệu)
+    nguoi_chot_norm VARCHAR(50),  -- phone_key(nguoi_chot), maintained by trigger
+    sdt_norm VARCHAR(50),  -- phone_key(sdt), maintained by trigger
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -120,11 +146,43 @@ CREATE INDEX idx_khach_hang_date_status ON khach_hang(ngay_hen_lam, trang_thai);
 CREATE INDEX idx_khach_hang_chot_date ON khach_hang(nguoi_chot, ngay_hen_lam);
 CREATE INDEX idx_khach_hang_chot_status_date ON khach_hang(nguoi_chot, trang_thai, ngay_hen_lam);
 CREATE INDEX idx_khach_hang_nhap_don ON khach_hang(ngay_nhap_don);
+CREATE INDEX idx_khach_hang_chot_norm_date ON khach_hang(nguoi_chot_norm, ngay_hen_lam);
+CREATE INDEX idx_khach_hang_sdt_norm_date ON khach_hang(sdt_norm, ngay_hen_lam);
 
 -- Partial index for active customers only (reduces index size)
 CREATE INDEX idx_khach_hang_active ON khach_hang(sdt, trang_thai) 
 WHERE trang_thai IN ('Da den lam', 'Da coc', 'Cho xac nhan', 'Đã đến làm', 'Đã cọc', 'Chờ xác nhận');
 
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 5.1 CLIENT_SUMMARY TABLE (one row per client card of the admin clients list)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- Aggregates of the khach_hang rows of each (sdt, ten_khach), kept current by
+-- statement triggers on khach_hang (see CLIENT SUMMARY MAINTENANCE below).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE client_summary (
+    sdt VARCHAR(15) NOT NULL,
+    ten_khach VARCHAR(100) NOT NULL DEFAULT '',  -- '' for rows without a name
+    sdt_norm VARCHAR(50),  -- phone_key(sdt)
+    co_so VARCHAR(100),  -- MIN(co_so)
+    first_visit_date DATE,  -- MIN(ngay_nhap_don)
+    last_visit_date DATE NOT NULL,  -- MAX(ngay_nhap_don), 1900-01-01 when undated
+    nguoi_chot VARCHAR(50),  -- MIN(nguoi_chot)
+    closers TEXT[] NOT NULL DEFAULT '{}',  -- every nguoi_chot of the client
+    service_count INTEGER NOT NULL DEFAULT 0,
+    deposit_count INTEGER NOT NULL DEFAULT 0,  -- rows with tien_coc > 0
+    last_done_visit DATE,  -- MAX(ngay_hen_lam) of completed visits
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sdt, ten_khach)
+);
+
+-- Keyset pages (newest last visit first), phone lookups, closer filter, search
+CREATE INDEX idx_client_summary_recent ON client_summary(last_visit_date, sdt, ten_khach);
+CREATE INDEX idx_client_summary_sdt_norm ON client_summary(sdt_norm);
+CREATE INDEX idx_client_summary_closers ON client_summary USING GIN (closers);
+CREATE INDEX idx_client_summary_name_trgm ON client_summary USING GIN (ten_khach gin_trgm_ops);
+CREATE INDEX idx_client_summary_sdt_trgm ON client_summary USING GIN (sdt gin_trgm_ops);
+
 -- ══════════════════════════════════════════════════════════════════════════════
 -- 6. SERVICES TABLE
 -- ══════════════════════════════════════════════════════════════════════════════
@@ -139,6 +197,7 @@ CREATE TABLE services (
     ctv_code VARCHAR(20),
     nguoi_chot VARCHAR(20),
     tong_tien DECIMAL(15,0) DEFAULT 0,
+    nguoi_chot_norm VARCHAR(50),  -- phone_key(COALESCE(nguoi_chot, ctv_code)), maintained by trigger
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (ctv_code) REFERENCES ctv(ma_ctv) ON DELETE SET NULL,
     FOREIGN KEY (nguoi_chot) REFERENCES ctv(ma_ctv) ON DELETE SET NULL
@@ -148,6 +207,7 @@ CREATE INDEX idx_services_customer ON services(customer_id);
 CREATE INDEX idx_services_ctv ON services(ctv_code);
 CREATE INDEX idx_services_nguoi_chot ON services(nguoi_chot);
 CREATE INDEX idx_services_date ON services(date_entered);
+CREATE INDEX idx_services_chot_norm_date ON services(nguoi_chot_norm, date_entered);
 
 -- ══════════════════════════════════════════════════════════════════════════════
 -- 7. HOA_HONG_CONFIG (Commission Config) TABLE
@@ -230,11 +290,88 @@ INSERT INTO commission_cache (cache_key, last_kh_max_id, last_svc_max_id)
 VALUES ('global', 0, 0) 
 ON CONFLICT (cache_key) DO NOTHING;
 
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 9.2 CTV_DAILY_ROLLUP TABLE (per-CTV daily totals read by the dashboards)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- day is the transaction date (khach_hang.ngay_hen_lam / services.date_entered),
+-- 1900-01-01 for undated transactions.
+-- level 0: revenue / tx_count = the CTV's own closed sales (completed khach_hang
+--          visits + services, matched on the normalized closer key)
+-- level N: revenue / tx_count = the downline transactions behind the CTV's
+--          level N commission rows
+-- commission = SUM(commission_amount) of the CTV's commission rows at that level
+CREATE TABLE ctv_daily_rollup (
+    ctv_code VARCHAR(20) NOT NULL REFERENCES ctv(ma_ctv) ON DELETE CASCADE ON UPDATE CASCADE,
+    day DATE NOT NULL,
+    level INTEGER NOT NULL,
+    revenue DECIMAL(15,2) NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    commission DECIMAL(15,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (ctv_code, day, level)
+);
+
+-- Company-wide range totals (per-CTV ranges use the primary key)
+CREATE INDEX idx_ctv_daily_rollup_day ON ctv_daily_rollup(day);
+
+-- Days whose rollup rows are out of date. Filled by triggers, drained by the
+-- sync worker (append-only, so marking a day never waits on another writer).
+CREATE TABLE ctv_daily_rollup_dirty (
+    id BIGSERIAL PRIMARY KEY,
+    day DATE NOT NULL,
+    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 9.3 COMMISSION_JOBS TABLE (commission work queue, drained by the sync worker)
+-- ══════════════════════════════════════════════════════════════════════════════
+CREATE TABLE commission_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    job_type VARCHAR(30) NOT NULL,  -- 'incremental', 'missing', 'recalculate_all'
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending (row-locked while running), done, failed
+    requested_by VARCHAR(50),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- At most one pending job per type: enqueueing again is a no-op
+CREATE UNIQUE INDEX idx_commission_jobs_one_pending ON commission_jobs(job_type) WHERE status = 'pending';
+CREATE INDEX idx_commission_jobs_status ON commission_jobs(status, id);
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 9.4 SHEET_ROW_STATE / SHEET_TAB_STATE (Google Sheets delta sync)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- One row per sheet row already in sync with khach_hang; only rows whose
+-- content hash is not stored here are matched against the DB. Row 1 is the
+-- header: a different header hash forces a full pass.
+CREATE TABLE sheet_row_state (
+    tab_type VARCHAR(20) NOT NULL,  -- 'tham_my', 'nha_khoa', 'gioi_thieu'
+    row_number INTEGER NOT NULL,  -- 1-based sheet row
+    row_hash CHAR(32) NOT NULL,  -- md5 of the cell values
+    fingerprint CHAR(32),  -- md5 of the record identity (duplicate-check key)
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (tab_type, row_number)
+);
+
+CREATE TABLE sheet_tab_state (
+    tab_type VARCHAR(20) PRIMARY KEY,
+    modified_time VARCHAR(40),  -- Drive modifiedTime of the spreadsheet at the last sync
+    row_count INTEGER,  -- Sheet rows (header included) at the last sync
+    full_synced_at TIMESTAMP,  -- Last pass that re-checked every row
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- ══════════════════════════════════════════════════════════════════════════════
 -- 10. ACTIVITY_LOGS TABLE
 -- ══════════════════════════════════════════════════════════════════════════════
+-- Range-partitioned by month on timestamp. Monthly partitions
+-- (activity_logs_YYYY_MM) are created ahead of time by the app
+-- (activity_logger.ensure_log_partitions); retention drops whole partitions.
 CREATE TABLE activity_logs (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     event_type VARCHAR(50) NOT NULL,
     user_type VARCHAR(10),
     user_id VARCHAR(50),
@@ -244,10 +381,14 @@ CREATE TABLE activity_logs (
     method VARCHAR(10),
     status_code INTEGER,
     details JSONB,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches rows outside the created monthly ranges
+CREATE TABLE activity_logs_default PARTITION OF activity_logs DEFAULT;
 
--- Indexes for activity logs
+-- Indexes for activity logs (created on every partition)
 CREATE INDEX idx_activity_logs_timestamp ON activity_logs(timestamp);
 CREATE INDEX idx_activity_logs_event ON activity_logs(event_type);
 CREATE INDEX idx_activity_logs_user ON activity_logs(user_type, user_id);
@@ -257,6 +398,79 @@ CREATE INDEX idx_activity_logs_ip ON activity_logs(ip_address);
 CREATE INDEX idx_activity_logs_logins ON activity_logs(timestamp, user_id) 
 WHERE event_type IN ('login_success', 'login_failed');
 
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 10.1 ACTIVITY_LOG_HOURLY TABLE (per-hour counters kept by the log writer)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- dimension: event, user_type, status, endpoint, ip, failed_ip, ip_user
+-- (see activity_logger._aggregate_entries). Read by the logs stats and
+-- suspicious-IP endpoints instead of scanning activity_logs.
+CREATE TABLE activity_log_hourly (
+    hour TIMESTAMP NOT NULL,
+    dimension VARCHAR(20) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    last_seen TIMESTAMP,
+    PRIMARY KEY (hour, dimension, key)
+);
+
+CREATE INDEX idx_activity_log_hourly_dimension ON activity_log_hourly(dimension, hour);
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 10.2 EXPORT_JOBS (background admin exports)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- Files are written to the local disk of the app server (EXPORT_DIR). cache_key
+-- hashes the export type, format, filters and the data versions of the tables
+-- read (see EXPORT DATA VERSIONS), so an identical request is served from the
+-- finished file.
+CREATE TABLE export_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    export_type VARCHAR(30) NOT NULL,  -- 'commissions', 'clients', 'activity_logs'
+    export_format VARCHAR(10) NOT NULL DEFAULT 'xlsx',  -- 'xlsx', 'csv'
+    params JSONB,
+    cache_key CHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending, running, done, failed, expired
+    rows_done BIGINT NOT NULL DEFAULT 0,
+    rows_total BIGINT,  -- planner estimate, for the progress bar
+    file_path TEXT,
+    file_name VARCHAR(255),
+    file_size BIGINT,
+    error TEXT,
+    requested_by VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- progress heartbeat
+    finished_at TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+-- One live job per identical export: resubmitting joins it
+CREATE UNIQUE INDEX idx_export_jobs_one_live ON export_jobs(cache_key) WHERE status IN ('pending', 'running');
+CREATE INDEX idx_export_jobs_cache ON export_jobs(cache_key, status);
+CREATE INDEX idx_export_jobs_created ON export_jobs(created_at);
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- 10.3 SHEETS_OUTBOX TABLE (booking rows waiting to be appended to Google Sheets)
+-- ══════════════════════════════════════════════════════════════════════════════
+-- Written in the same transaction as the booking's khach_hang row and drained
+-- by modules/sheets_outbox.py. next_attempt_at doubles as the claim lease.
+CREATE TABLE sheets_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key VARCHAR(100) NOT NULL UNIQUE,  -- e.g. 'khach_hang:123'
+    spreadsheet_id VARCHAR(100) NOT NULL,
+    tab_type VARCHAR(30) NOT NULL,  -- key of google_sync.TAB_VARIATIONS
+    row_values JSONB NOT NULL,  -- cells passed to append_rows
+    match_key VARCHAR(100),  -- sync identity (phone|referrer), checked before a retry
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending, sent, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX idx_sheets_outbox_due ON sheets_outbox(next_attempt_at, id) WHERE status = 'pending';
+CREATE INDEX idx_sheets_outbox_created ON sheets_outbox(created_at);
+
 -- ══════════════════════════════════════════════════════════════════════════════
 -- UTILITY FUNCTIONS
 -- ══════════════════════════════════════════════════════════════════════════════
@@ -280,6 +494,422 @@ CREATE TRIGGER update_khach_hang_updated_at BEFORE UPDATE ON khach_hang
 CREATE TRIGGER update_hoa_hong_config_updated_at BEFORE UPDATE ON hoa_hong_config
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- ══════════════════════════════════════════════════════════════════════════════
+-- NORMALIZED PHONE KEYS
+-- ══════════════════════════════════════════════════════════════════════════════
+
+-- Matching key for phones / CTV codes: last 9 digits (0972020908 and 972020908
+-- share a key), or the lowercased value for codes without digits
+CREATE OR REPLACE FUNCTION phone_key(value TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN REGEXP_REPLACE(COALESCE(value, ''), '[^0-9]', '', 'g') <> ''
+            THEN RIGHT(REGEXP_REPLACE(value, '[^0-9]', '', 'g'), 9)
+        ELSE NULLIF(LOWER(TRIM(value)), '')
+    END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION set_khach_hang_phone_norm()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.nguoi_chot_norm = phone_key(NEW.nguoi_chot);
+    NEW.sdt_norm = phone_key(NEW.sdt);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION set_services_phone_norm()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.nguoi_chot_norm = phone_key(COALESCE(NEW.nguoi_chot, NEW.ctv_code));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION set_ctv_phone_norm()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.ma_ctv_norm = phone_key(NEW.ma_ctv);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER khach_hang_phone_norm BEFORE INSERT OR UPDATE OF nguoi_chot, sdt ON khach_hang
+    FOR EACH ROW EXECUTE FUNCTION set_khach_hang_phone_norm();
+
+CREATE TRIGGER services_phone_norm BEFORE INSERT OR UPDATE OF nguoi_chot, ctv_code ON services
+    FOR EACH ROW EXECUTE FUNCTION set_services_phone_norm();
+
+CREATE TRIGGER ctv_phone_norm BEFORE INSERT OR UPDATE OF ma_ctv ON ctv
+    FOR EACH ROW EXECUTE FUNCTION set_ctv_phone_norm();
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- CTV CLOSURE MAINTENANCE
+-- ══════════════════════════════════════════════════════════════════════════════
+
+-- Ancestor chains of the given CTVs, walked up ctv.nguoi_gioi_thieu
+-- (stops at a repeated code so a referral cycle cannot loop forever)
+CREATE OR REPLACE FUNCTION ctv_closure_paths(codes TEXT[])
+RETURNS TABLE(ancestor VARCHAR(20), descendant VARCHAR(20), depth INTEGER) AS $$
+    WITH RECURSIVE chain AS (
+        SELECT c.ma_ctv AS start_code, c.ma_ctv AS code, c.nguoi_gioi_thieu AS next_code,
+               0 AS lvl, ARRAY[c.ma_ctv::TEXT] AS path
+        FROM ctv c
+        WHERE c.ma_ctv = ANY(codes)
+
+        UNION ALL
+
+        SELECT chain.start_code, p.ma_ctv, p.nguoi_gioi_thieu, chain.lvl + 1, chain.path || p.ma_ctv::TEXT
+        FROM chain
+        INNER JOIN ctv p ON p.ma_ctv = chain.next_code
+        WHERE NOT p.ma_ctv = ANY(chain.path)
+    )
+    SELECT code, start_code, lvl FROM chain
+$$ LANGUAGE sql STABLE;
+
+-- Replace the closure rows of the given CTVs
+CREATE OR REPLACE FUNCTION refresh_ctv_closure(codes TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM ctv_closure WHERE descendant = ANY(codes);
+    INSERT INTO ctv_closure (ancestor, descendant, depth)
+    SELECT * FROM ctv_closure_paths(codes);
+END;
+$$ LANGUAGE plpgsql;
+
+-- A new CTV or a referrer change re-links the CTV's whole subtree.
+-- Deletes need no trigger: closure rows cascade, and the ON DELETE SET NULL
+-- on the children fires this trigger for each of them.
+CREATE OR REPLACE FUNCTION sync_ctv_closure()
+RETURNS TRIGGER AS $$
+DECLARE
+    affected TEXT[];
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.nguoi_gioi_thieu IS NOT DISTINCT FROM OLD.nguoi_gioi_thieu THEN
+        RETURN NULL;
+    END IF;
+
+    affected := ARRAY(SELECT descendant::TEXT FROM ctv_closure WHERE ancestor = NEW.ma_ctv);
+    IF NOT NEW.ma_ctv = ANY(affected) THEN
+        affected := affected || NEW.ma_ctv::TEXT;
+    END IF;
+
+    PERFORM refresh_ctv_closure(affected);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ctv_closure_sync AFTER INSERT OR UPDATE OF nguoi_gioi_thieu ON ctv
+    FOR EACH ROW EXECUTE FUNCTION sync_ctv_closure();
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- DAILY ROLLUP DIRTY-DAY TRACKING
+-- ══════════════════════════════════════════════════════════════════════════════
+
+-- Changes that move a day's totals queue that day for refresh_ctv_daily_rollup()
+CREATE OR REPLACE FUNCTION mark_rollup_days(days DATE[])
+RETURNS VOID AS $$
+    INSERT INTO ctv_daily_rollup_dirty (day)
+    SELECT DISTINCT COALESCE(d, DATE '1900-01-01') FROM unnest(days) AS d
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION mark_khach_hang_rollup_day()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM mark_rollup_days(ARRAY[NEW.ngay_hen_lam]);
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM mark_rollup_days(ARRAY[OLD.ngay_hen_lam, NEW.ngay_hen_lam]);
+    ELSE
+        PERFORM mark_rollup_days(ARRAY[OLD.ngay_hen_lam]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION mark_services_rollup_day()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM mark_rollup_days(ARRAY[NEW.date_entered]);
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM mark_rollup_days(ARRAY[OLD.date_entered, NEW.date_entered]);
+    ELSE
+        PERFORM mark_rollup_days(ARRAY[OLD.date_entered]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Commission rows are written in bulk, so this one is per statement
+CREATE OR REPLACE FUNCTION mark_commissions_rollup_days()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM mark_rollup_days(ARRAY(
+            SELECT kh.ngay_hen_lam FROM old_rows r JOIN khach_hang kh ON r.transaction_id = -kh.id
+            UNION
+            SELECT s.date_entered FROM old_rows r JOIN services s ON r.transaction_id = s.id
+        ));
+    ELSE
+        PERFORM mark_rollup_days(ARRAY(
+            SELECT kh.ngay_hen_lam FROM new_rows r JOIN khach_hang kh ON r.transaction_id = -kh.id
+            UNION
+            SELECT s.date_entered FROM new_rows r JOIN services s ON r.transaction_id = s.id
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A new or renamed CTV code picks up every sale already closed under its key
+CREATE OR REPLACE FUNCTION mark_ctv_rollup_days()
+RETURNS TRIGGER AS $$
+DECLARE
+    keys TEXT[];
+BEGIN
+    keys := ARRAY[NEW.ma_ctv_norm];
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.ma_ctv_norm IS NOT DISTINCT FROM OLD.ma_ctv_norm THEN
+            RETURN NULL;
+        END IF;
+        keys := keys || OLD.ma_ctv_norm;
+    END IF;
+
+    PERFORM mark_rollup_days(ARRAY(
+        SELECT ngay_hen_lam FROM khach_hang WHERE nguoi_chot_norm = ANY(keys)
+        UNION
+        SELECT date_entered FROM services WHERE nguoi_chot_norm = ANY(keys)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER khach_hang_rollup_day AFTER INSERT OR DELETE ON khach_hang
+    FOR EACH ROW EXECUTE FUNCTION mark_khach_hang_rollup_day();
+
+CREATE TRIGGER khach_hang_rollup_day_update AFTER UPDATE ON khach_hang
+    FOR EACH ROW
+    WHEN ((OLD.ngay_hen_lam, OLD.trang_thai, OLD.tong_tien, OLD.nguoi_chot_norm)
+          IS DISTINCT FROM (NEW.ngay_hen_lam, NEW.trang_thai, NEW.tong_tien, NEW.nguoi_chot_norm))
+    EXECUTE FUNCTION mark_khach_hang_rollup_day();
+
+CREATE TRIGGER services_rollup_day AFTER INSERT OR DELETE ON services
+    FOR EACH ROW EXECUTE FUNCTION mark_services_rollup_day();
+
+CREATE TRIGGER services_rollup_day_update AFTER UPDATE ON services
+    FOR EACH ROW
+    WHEN ((OLD.date_entered, OLD.tong_tien, OLD.nguoi_chot_norm)
+          IS DISTINCT FROM (NEW.date_entered, NEW.tong_tien, NEW.nguoi_chot_norm))
+    EXECUTE FUNCTION mark_services_rollup_day();
+
+CREATE TRIGGER commissions_rollup_days_insert AFTER INSERT ON commissions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days();
+
+CREATE TRIGGER commissions_rollup_days_update AFTER UPDATE ON commissions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days();
+
+CREATE TRIGGER commissions_rollup_days_delete AFTER DELETE ON commissions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_commissions_rollup_days();
+
+CREATE TRIGGER ctv_rollup_days AFTER INSERT OR UPDATE OF ma_ctv ON ctv
+    FOR EACH ROW EXECUTE FUNCTION mark_ctv_rollup_days();
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- CLIENT SUMMARY MAINTENANCE
+-- ══════════════════════════════════════════════════════════════════════════════
+
+-- Summary rows of the given phones, computed from khach_hang
+CREATE OR REPLACE FUNCTION client_summary_rows(phones TEXT[])
+RETURNS TABLE(
+    sdt VARCHAR(15), ten_khach VARCHAR(100), sdt_norm VARCHAR(50), co_so VARCHAR(100),
+    first_visit_date DATE, last_visit_date DATE, nguoi_chot VARCHAR(50), closers TEXT[],
+    service_count INTEGER, deposit_count INTEGER, last_done_visit DATE
+) AS $$
+    SELECT
+        kh.sdt,
+        COALESCE(kh.ten_khach, '')::VARCHAR(100),
+        MIN(kh.sdt_norm),
+        MIN(kh.co_so),
+        MIN(kh.ngay_nhap_don),
+        COALESCE(MAX(kh.ngay_nhap_don), DATE '1900-01-01'),
+        MIN(kh.nguoi_chot),
+        ARRAY_REMOVE(ARRAY_AGG(DISTINCT kh.nguoi_chot::TEXT), NULL),
+        COUNT(*)::INTEGER,
+        (COUNT(*) FILTER (WHERE kh.tien_coc > 0))::INTEGER,
+        MAX(kh.ngay_hen_lam) FILTER (WHERE kh.trang_thai IN ('Đã đến làm', 'Da den lam'))
+    FROM khach_hang kh
+    WHERE kh.sdt = ANY(phones) AND kh.sdt <> ''
+    GROUP BY kh.sdt, COALESCE(kh.ten_khach, '')
+$$ LANGUAGE sql STABLE;
+
+-- Recompute the summary rows of the given phones
+CREATE OR REPLACE FUNCTION refresh_client_summary(phones TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    IF phones IS NULL OR cardinality(phones) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Transactions writing the same phones take turns, so each recount
+    -- sees the rows the other one committed
+    PERFORM pg_advisory_xact_lock(hashtext('client_summary'), bucket)
+    FROM (
+        SELECT DISTINCT hashtext(p) & 255 AS bucket FROM unnest(phones) AS p ORDER BY 1
+    ) buckets;
+
+    DELETE FROM client_summary cs
+    WHERE cs.sdt = ANY(phones)
+    AND NOT EXISTS (
+        SELECT 1 FROM khach_hang kh
+        WHERE kh.sdt = cs.sdt AND COALESCE(kh.ten_khach, '') = cs.ten_khach
+    );
+
+    INSERT INTO client_summary (
+        sdt, ten_khach, sdt_norm, co_so, first_visit_date, last_visit_date,
+        nguoi_chot, closers, service_count, deposit_count, last_done_visit
+    )
+    SELECT * FROM client_summary_rows(phones)
+    ON CONFLICT (sdt, ten_khach) DO UPDATE SET
+        sdt_norm = EXCLUDED.sdt_norm,
+        co_so = EXCLUDED.co_so,
+        first_visit_date = EXCLUDED.first_visit_date,
+        last_visit_date = EXCLUDED.last_visit_date,
+        nguoi_chot = EXCLUDED.nguoi_chot,
+        closers = EXCLUDED.closers,
+        service_count = EXCLUDED.service_count,
+        deposit_count = EXCLUDED.deposit_count,
+        last_done_visit = EXCLUDED.last_done_visit,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Every phone a statement touches is recomputed in the writing transaction
+CREATE OR REPLACE FUNCTION sync_client_summary()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_client_summary(ARRAY(SELECT DISTINCT sdt::TEXT FROM new_rows WHERE sdt <> ''));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_client_summary(ARRAY(SELECT DISTINCT sdt::TEXT FROM old_rows WHERE sdt <> ''));
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Sync re-writes many rows unchanged; only summarized columns matter
+        PERFORM refresh_client_summary(ARRAY(
+            SELECT DISTINCT p FROM old_rows o
+            JOIN new_rows n ON n.id = o.id
+            CROSS JOIN LATERAL unnest(ARRAY[o.sdt::TEXT, n.sdt::TEXT]) AS p
+            WHERE p <> ''
+            AND (o.sdt, o.ten_khach, o.co_so, o.ngay_nhap_don, o.nguoi_chot, o.tien_coc, o.ngay_hen_lam, o.trang_thai)
+                IS DISTINCT FROM
+                (n.sdt, n.ten_khach, n.co_so, n.ngay_nhap_don, n.nguoi_chot, n.tien_coc, n.ngay_hen_lam, n.trang_thai)
+        ));
+    ELSE
+        DELETE FROM client_summary;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER khach_hang_client_summary_insert AFTER INSERT ON khach_hang
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary();
+
+CREATE TRIGGER khach_hang_client_summary_update AFTER UPDATE ON khach_hang
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary();
+
+CREATE TRIGGER khach_hang_client_summary_delete AFTER DELETE ON khach_hang
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary();
+
+CREATE TRIGGER khach_hang_client_summary_truncate AFTER TRUNCATE ON khach_hang
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_client_summary();
+
+-- ══════════════════════════════════════════════════════════════════════════════
+-- EXPORT DATA VERSIONS
+-- ══════════════════════════════════════════════════════════════════════════════
+
+-- Any write to a table an export reads invalidates the cached export files.
+-- nextval() takes no lock other writers wait for (no shared counter row).
+-- Transition tables allow one event per trigger, hence one trigger per event.
+CREATE SEQUENCE export_version_commissions;
+CREATE SEQUENCE export_version_ctv;
+CREATE SEQUENCE export_version_khach_hang;
+CREATE SEQUENCE export_version_activity_logs;
+
+CREATE OR REPLACE FUNCTION advance_export_data_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Statement triggers also fire for statements that touched no rows
+    IF TG_OP <> 'TRUNCATE' AND NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    PERFORM nextval(TG_ARGV[0]::regclass);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER commissions_export_version_insert AFTER INSERT ON commissions
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_commissions');
+
+CREATE TRIGGER commissions_export_version_update AFTER UPDATE ON commissions
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_commissions');
+
+CREATE TRIGGER commissions_export_version_delete AFTER DELETE ON commissions
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_commissions');
+
+CREATE TRIGGER commissions_export_version_truncate AFTER TRUNCATE ON commissions
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_commissions');
+
+CREATE TRIGGER ctv_export_version_insert AFTER INSERT ON ctv
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_ctv');
+
+CREATE TRIGGER ctv_export_version_update AFTER UPDATE ON ctv
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_ctv');
+
+CREATE TRIGGER ctv_export_version_delete AFTER DELETE ON ctv
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_ctv');
+
+CREATE TRIGGER ctv_export_version_truncate AFTER TRUNCATE ON ctv
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_ctv');
+
+CREATE TRIGGER khach_hang_export_version_insert AFTER INSERT ON khach_hang
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_khach_hang');
+
+CREATE TRIGGER khach_hang_export_version_update AFTER UPDATE ON khach_hang
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_khach_hang');
+
+CREATE TRIGGER khach_hang_export_version_delete AFTER DELETE ON khach_hang
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_khach_hang');
+
+CREATE TRIGGER khach_hang_export_version_truncate AFTER TRUNCATE ON khach_hang
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_khach_hang');
+
+-- Log inserts are covered by MAX(id) in the export version (admin/export.py);
+-- only in-place changes (IP masking, cleanup) need the sequence
+CREATE TRIGGER activity_logs_export_version_update AFTER UPDATE ON activity_logs
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_activity_logs');
+
+CREATE TRIGGER activity_logs_export_version_delete AFTER DELETE ON activity_logs
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_activity_logs');
+
+CREATE TRIGGER activity_logs_export_version_truncate AFTER TRUNCATE ON activity_logs
+    FOR EACH STATEMENT EXECUTE FUNCTION advance_export_data_version('export_version_activity_logs');
+
 -- ══════════════════════════════════════════════════════════════════════════════
 -- RECURSIVE CTE FUNCTION FOR MLM HIERARCHY
 -- ══════════════════════════════════════════════════════════════════════════════
@@ -9,6 +9,8 @@
 let allClients = [];
 let clientsCurrentPage = 1;
 let clientsTotalPages = 1;
+// Keyset cursor of each page reached so far (index = page - 1); other pages fall back to ?page=
+let clientsPageCursors = [''];
 let currentClientView = localStorage.getItem('clientView') || 'grid';
 
 /**
@@ -16,6 +18,7 @@ let currentClientView = localStorage.getItem('clientView') || 'grid';
  * @param {number} page - Page number
  */
 async function loadClientsWithServices(page = 1) {
+    if (page === 1) clientsPageCursors = [''];
     clientsCurrentPage = page;
     const search = document.getElementById('clientSearch')?.value || '';
     const status = document.getElementById('clientStatusFilter')?.value || '';
@@ -26,6 +29,7 @@ async function loadClientsWithServices(page = 1) {
     const params = new URLSearchParams();
     params.append('page', page);
     params.append('per_page', 50);
+    if (clientsPageCursors[page - 1]) params.append('cursor', clientsPageCursors[page - 1]);
     if (search) params.append('search', search);
     if (status) params.append('status', status);
     
@@ -35,10 +39,11 @@ async function loadClientsWithServices(page = 1) {
         if (result && result.status === 'success') {
             allClients = result.clients;
             clientsTotalPages = result.pagination.total_pages || 1;
+            if (result.pagination.next_cursor) clientsPageCursors[page] = result.pagination.next_cursor;
             
             // Update count display
             document.getElementById('clientsCount').textContent = 
-                `${t('showing')} ${result.clients.length} ${t('of')} ${result.pagination.total} ${t('clients')}`;
+                `${t('showing')} ${result.clients.length} ${t('of')} ${formatClientsTotal(result.pagination)} ${t('clients')}`;
             
             // Render based on current view
             if (currentClientView === 'table') {
@@ -77,6 +82,14 @@ async function loadClientsWithServices(page = 1) {
     }
 }
 
+/**
+ * Client total for display ("~" when the server estimated it)
+ * @param {object} pagination - Pagination object
+ */
+function formatClientsTotal(pagination) {
+    return `${pagination.total_is_estimate ? '~' : ''}${pagination.total}`;
+}
+
 /**
  * Update clients pagination controls
  * @param {object} pagination - Pagination object
@@ -87,7 +100,7 @@ function updateClientsPagination(pagination) {
     
     const start = (pagination.page - 1) * pagination.per_page + 1;
     const end = Math.min(pagination.page * pagination.per_page, pagination.total);
-    info.textContent = `${start}-${end} ${t('of')} ${pagination.total}`;
+    info.textContent = `${start}-${end} ${t('of')} ${formatClientsTotal(pagination)}`;
     
     let html = '';
     const totalPages = pagination.total_pages || 1;
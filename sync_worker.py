@@ -15,7 +15,11 @@ import logging
 from datetime import datetime
 from pathlib import Path
 from modules.google_sync import GoogleSheetSync
-from modules.mlm_core import calculate_new_commissions_fast
+from modules.sync_leader import SyncLeader
+from modules.mlm_core import enqueue_commission_job, process_commission_jobs, refresh_ctv_daily_rollup
+from modules.dashboard_cache import check_ctv_tree_watermark
+from modules.sheets_outbox import dispatch_sheets_outbox
+from modules.sheets_client import get_spreadsheet
 
 # ══════════════════════════════════════════════════════════════════════════════
 # CONFIGURATION
@@ -37,6 +41,10 @@ USE_PHONE_MATCHING = os.getenv('SYNC_USE_PHONE_MATCHING', 'true').lower() == 'tr
 # If set, only rows with timestamp > last_sync will be processed
 TIMESTAMP_COLUMN = os.getenv('SYNC_TIMESTAMP_COLUMN', None)
 
+# Sync the three tabs in parallel (one batched sheet read, one DB connection per tab)
+# Set to 'false' to sync them one after another on a single connection
+CONCURRENT_SYNC = os.getenv('SYNC_CONCURRENT', 'true').lower() == 'true'
+
 # Custom Database Handler
 class DBLogHandler(logging.Handler):
     def __init__(self, syncer):
@@ -85,7 +93,7 @@ def _sync_single_tab(syncer, spreadsheet, conn, tab_type, use_phone_matching, ti
         return 0, 1
 
 
-def run_sync(syncer, use_phone_matching=True, timestamp_column=None):
+def run_sync(syncer, use_phone_matching=True, timestamp_column=None, concurrent=True):
     """Run the main data sync (tham_my, nha_khoa, gioi_thieu).
     Each tab syncs independently — one tab failing won't skip the others.
     """
@@ -97,8 +105,8 @@ def run_sync(syncer, use_phone_matching=True, timestamp_column=None):
     
     try:
         logger.info("Connecting to Google Sheets...")
-        client = syncer.get_google_client()
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+        client = syncer.get_shared_google_client()
+        spreadsheet = get_spreadsheet(GOOGLE_SHEET_ID, client)
         
         logger.info("Connecting to database...")
         conn = syncer.get_db_connection()
@@ -109,17 +117,42 @@ def run_sync(syncer, use_phone_matching=True, timestamp_column=None):
             if timestamp_column:
                 logger.info(f"Timestamp column: {timestamp_column}")
             
-            # Sync each tab independently (one failure doesn't block the others)
-            for tab_type in ['tham_my', 'nha_khoa', 'gioi_thieu']:
-                p, e = _sync_single_tab(syncer, spreadsheet, conn, tab_type, use_phone_matching, timestamp_column)
-                stats[tab_type] = {'processed': p, 'errors': e}
+            if use_phone_matching and concurrent:
+                # All tabs at once: cycle time is the slowest tab, not the sum
+                start_time = time.time()
+                stats = syncer.sync_tabs_concurrently(spreadsheet, timestamp_column=timestamp_column)
+                slowest = max(stats, key=lambda tab: stats[tab]['duration'])
+                logger.info(f"Tabs synced in {time.time() - start_time:.2f}s "
+                            f"(slowest: {slowest} {stats[slowest]['duration']:.2f}s)")
+            else:
+                # Sync each tab independently (one failure doesn't block the others)
+                for tab_type in ['tham_my', 'nha_khoa', 'gioi_thieu']:
+                    p, e = _sync_single_tab(syncer, spreadsheet, conn, tab_type, use_phone_matching, timestamp_column)
+                    stats[tab_type] = {'processed': p, 'errors': e}
             
             if sum(s['processed'] for s in stats.values()) > 0:
-                logger.info("\n--- Calculating Commissions ---")
-                start_time = time.time()
-                comm_stats = calculate_new_commissions_fast(connection=conn)
-                duration = time.time() - start_time
-                logger.info(f"Commission calculation: {comm_stats} (took {duration:.2f}s)")
+                enqueue_commission_job('incremental', requested_by='sync_worker', connection=conn)
+            
+            # Run queued commission jobs (ours and the ones requested by the admin pages)
+            for job in process_commission_jobs(connection=conn):
+                logger.info(f"Commission job #{job['id']} ({job['job_type']}): "
+                            f"{job['status']} {job['result']} (took {job['duration']:.2f}s)")
+            
+            # Fold every day touched since the last cycle (sync, admin edits,
+            # recalculations) into ctv_daily_rollup
+            start_time = time.time()
+            rollup_days = refresh_ctv_daily_rollup(connection=conn)
+            if rollup_days:
+                logger.info(f"Daily rollup: {rollup_days} day(s) refreshed (took {time.time() - start_time:.2f}s)")
+            
+            # Referral tree edits invalidate every cached CTV dashboard
+            if check_ctv_tree_watermark(conn):
+                logger.info("CTV tree changed: dashboard caches invalidated")
+            
+            # Booking rows still in the outbox (web dispatcher down or backing off)
+            outbox = dispatch_sheets_outbox(connection=conn)
+            if outbox['sent'] or outbox['retry'] or outbox['failed']:
+                logger.info(f"Sheets outbox: {outbox}")
             
             # Update heartbeat after successful sync with count of new records
             total_new = sum(s['processed'] for s in stats.values())
@@ -142,11 +175,11 @@ def run_sync(syncer, use_phone_matching=True, timestamp_column=None):
 
 def run_pricing_sync(syncer):
     """Run the pricing sheet sync independently.
-    Uses its own Google client call and has internal retry logic.
+    Reuses the shared Google client and has internal retry logic.
     """
     try:
         from modules.pricing_sync import sync_pricing_sheet
-        client = syncer.get_google_client()
+        client = syncer.get_shared_google_client()
         result = sync_pricing_sheet(client, PRICING_SHEET_ID)
         if result > 0:
             logger.info(f"  ✅ Pricing Data: Synced successfully ({result} categories)")
@@ -162,6 +195,7 @@ def main():
     logger.info(f"Sheet ID: {GOOGLE_SHEET_ID}")
     logger.info(f"Pricing Sheet ID: {PRICING_SHEET_ID}")
     logger.info(f"Phone Matching: {'enabled' if USE_PHONE_MATCHING else 'disabled (count-based)'}")
+    logger.info(f"Concurrent Tabs: {'enabled' if CONCURRENT_SYNC else 'disabled'}")
     if TIMESTAMP_COLUMN:
         logger.info(f"Timestamp Column: {TIMESTAMP_COLUMN}")
     logger.info("=" * 60)
@@ -191,19 +225,32 @@ def main():
     except Exception as e:
         logger.error(f"Failed to setup DB logging: {e}")
     
+    # Gunicorn workers run an embedded sync loop as well; only the lock holder syncs
+    leader = SyncLeader(syncer.get_db_connection, 'sync_worker')
+    was_leader = False
+    
     cycle = 0
     consecutive_failures = 0
     MAX_CONSECUTIVE_FAILURES = 10  # After 10 failures, wait longer
     
     while True:
-        cycle += 1
         try:
+            is_leader = leader.ensure()
+            if is_leader != was_leader:
+                logger.info(f"{leader.worker_id}: {'sync leader' if is_leader else 'standby (another process holds the sync lock)'}")
+                was_leader = is_leader
+            if not is_leader:
+                time.sleep(SYNC_INTERVAL)
+                continue
+            
+            cycle += 1
             logger.info(f"\n{'='*60}")
             logger.info(f"Sync Cycle #{cycle} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
             logger.info("=" * 60)
             
             # ── Step 1: Main data sync (tham_my, nha_khoa, gioi_thieu) ──
-            stats = run_sync(syncer, use_phone_matching=USE_PHONE_MATCHING, timestamp_column=TIMESTAMP_COLUMN)
+            stats = run_sync(syncer, use_phone_matching=USE_PHONE_MATCHING, timestamp_column=TIMESTAMP_COLUMN,
+                             concurrent=CONCURRENT_SYNC)
             
             total_processed = sum(s['processed'] for s in stats.values())
             total_errors = sum(s['errors'] for s in stats.values())
@@ -227,6 +274,7 @@ def main():
             logger.info("\n" + "=" * 60)
             logger.info("Worker stopped by user (Ctrl+C)")
             logger.info("=" * 60)
+            leader.release()
             break
             
         except Exception as e:
@@ -239,12 +287,13 @@ def main():
             import traceback
             traceback.print_exc()
             
-            # Even if the main loop crashes, still try pricing sync
-            try:
-                logger.info("Attempting pricing sync despite main cycle failure...")
-                run_pricing_sync(syncer)
-            except Exception as pe:
-                logger.error(f"Pricing sync also failed: {pe}")
+            # Even if the main loop crashes, still try pricing sync (leader only)
+            if leader.is_leader:
+                try:
+                    logger.info("Attempting pricing sync despite main cycle failure...")
+                    run_pricing_sync(syncer)
+                except Exception as pe:
+                    logger.error(f"Pricing sync also failed: {pe}")
             
             # Exponential backoff on failures
             if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
@@ -261,6 +310,7 @@ def main():
                 logger.info("Recreating GoogleSheetSync instance...")
                 try:
                     syncer = GoogleSheetSync()
+                    syncer.get_shared_google_client(refresh=True)
                     # Reconnect DB handler
                     if db_handler:
                         db_handler.syncer = syncer
@@ -0,0 +1,167 @@
+"""
+Unit tests for the bulk commission engine (modules/mlm/commissions.py)
+
+calculate_commissions_bulk() must write exactly the rows that the per-CTV
+calculate_commissions() / calculate_cskh_commissions() write for the same
+transactions. Both run against a fake connection that records the
+DELETE / INSERT statements, over the in-memory fixture forest of
+test_referral_graph.py.
+
+Run: python -m pytest -q test_commission_bulk.py
+"""
+
+import os
+import sys
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from modules.mlm import commissions, hierarchy
+from modules.mlm.graph import ReferralGraph
+from test_referral_graph import EDGES
+
+
+RATES = {0: 0.25, 1: 0.05, 2: 0.025, 3: 0.0125, 4: 0.00625}
+
+# (transaction_id, ctv_code, amount)
+DIRECT = [
+    (1, 'A1111', 1000000),     # chain longer than MAX_LEVEL
+    (2, 'a2', 500000),         # code in a different case
+    (3, 'ROOT', 250000),
+    (4, 'b1', 120000),
+    (5, 'ORPHAN', 90000),      # referrer has no ctv row
+    (6, 'X', 80000),           # referral cycle
+    (7, 'NOBODY', 70000),      # unknown CTV: no rows
+    (-8, 'A11', 60000),        # khach_hang transaction
+    (3, 'B', 300000),          # listed twice: the last entry wins
+]
+
+# (transaction_id, original_ctv_code, amount)
+CSKH = [
+    (-20, 'A1', 400000),
+    (-21, 'ROOT', 200000),     # no upline
+    (-22, 'ORPHAN', 100000),
+    (-23, 'NOBODY', 50000),
+]
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.statements.append((' '.join(query.split()), params))
+
+    def fetchone(self):
+        self.connection.next_id += 1
+        return {'id': self.connection.next_id}
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.next_id = 0
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    graph = ReferralGraph(EDGES)
+    monkeypatch.setattr(hierarchy, 'get_referral_graph', lambda connection: graph)
+    monkeypatch.setattr(commissions, 'refresh_referral_graph', lambda connection: graph)
+    monkeypatch.setattr(commissions, 'get_commission_rates', lambda connection=None: RATES)
+    return graph
+
+
+def per_ctv_rows():
+    """Final commission rows after calling the per-CTV functions one by one"""
+    connection = FakeConnection()
+    for transaction_id, ctv_code, amount in DIRECT:
+        commissions.calculate_commissions(transaction_id, ctv_code, amount, connection, commit=False)
+    for transaction_id, ctv_code, amount in CSKH:
+        commissions.calculate_cskh_commissions(transaction_id, ctv_code, amount, connection, commit=False)
+
+    table = []
+    for query, params in connection.statements:
+        if query.startswith('DELETE FROM commissions WHERE transaction_id = %s'):
+            table = [row for row in table if row[0] != params[0]]
+        elif query.startswith('INSERT INTO commissions'):
+            commission_type = 'cskh' if "'cskh'" in query else 'direct'
+            transaction_id, ctv_code, level, rate, amount, commission_amount = params
+            table.append((transaction_id, ctv_code, level, rate, amount, commission_amount, commission_type))
+    return table
+
+
+def bulk_rows(monkeypatch, batch_size):
+    """Final commission rows after one calculate_commissions_bulk() call"""
+    monkeypatch.setattr(commissions, 'BULK_BATCH_SIZE', batch_size)
+    monkeypatch.setattr(commissions, 'execute_values',
+                        lambda cursor, query, rows, page_size=None: cursor.execute(query, list(rows)))
+
+    connection = FakeConnection()
+    stats = commissions.calculate_commissions_bulk(DIRECT, CSKH, connection, commit=False)
+
+    table = []
+    for query, params in connection.statements:
+        if query.startswith('DELETE FROM commissions WHERE transaction_id = ANY'):
+            table = [row for row in table if row[0] not in params[0]]
+        elif query.startswith('INSERT INTO commissions'):
+            table.extend(params)
+    return stats, table
+
+
+def test_per_level_rows_match_per_ctv_calculation(monkeypatch, graph):
+    expected = per_ctv_rows()
+    stats, rows = bulk_rows(monkeypatch, batch_size=2000)
+
+    assert sorted(rows) == sorted(expected)
+    assert stats == {
+        'transactions': len({row[0] for row in DIRECT + CSKH}),
+        'commissions': len(expected),
+        'errors': 0,
+    }
+
+
+def test_per_level_amounts(monkeypatch, graph):
+    _, rows = bulk_rows(monkeypatch, batch_size=2000)
+    by_transaction = {}
+    for transaction_id, ctv_code, level, rate, amount, commission_amount, kind in rows:
+        by_transaction.setdefault(transaction_id, []).append((ctv_code, level, commission_amount, kind))
+
+    assert sorted(by_transaction[1]) == [
+        ('A', 4, 1000000 * 0.00625, 'direct'),
+        ('A1', 3, 1000000 * 0.0125, 'direct'),
+        ('A11', 2, 1000000 * 0.025, 'direct'),
+        ('A111', 1, 1000000 * 0.05, 'direct'),
+        ('A1111', 0, 1000000 * 0.25, 'direct'),
+    ]
+    assert sorted(by_transaction[3]) == [
+        ('B', 0, 300000 * 0.25, 'direct'),
+        ('ROOT', 1, 300000 * 0.05, 'direct'),
+    ]
+    assert 7 not in by_transaction
+    assert sorted(by_transaction[-20]) == [
+        ('A', 2, 400000 * 0.025, 'cskh'),
+        ('A1', 1, 400000 * 0.05, 'cskh'),
+    ]
+    assert by_transaction[-21] == [('ROOT', 1, 200000 * 0.05, 'cskh')]
+
+
+def test_batches_do_not_change_the_result(monkeypatch, graph):
+    expected = per_ctv_rows()
+    for batch_size in (1, 2, 3):
+        _, rows = bulk_rows(monkeypatch, batch_size)
+        assert sorted(rows) == sorted(expected), batch_size
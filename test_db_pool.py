@@ -0,0 +1,249 @@
+"""
+Unit tests for ManagedConnectionPool (modules/db_pool.py)
+
+Runs without a database: the pool opens FakeConnection objects instead of
+psycopg2 connections.
+
+Run: python -m pytest -q test_db_pool.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from psycopg2 import extensions, InterfaceError, OperationalError
+
+from modules import db_pool
+from modules.db_pool import ManagedConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.connection.dead:
+            raise OperationalError("server closed the connection unexpectedly")
+        self.connection.queries.append(query)
+
+
+class FakeInfo:
+    def __init__(self):
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.info = FakeInfo()
+        self.queries = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.dead:
+            raise InterfaceError("connection already closed")
+        self.rollbacks += 1
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+        if self.dead:
+            raise InterfaceError("connection already closed")
+
+
+class FakePool(ManagedConnectionPool):
+    """ManagedConnectionPool whose connection factory hands out FakeConnection objects"""
+
+    def __init__(self, minconn=0, maxconn=2, **kwargs):
+        self.opened = []
+        kwargs.setdefault('timeout', 0.2)
+        super().__init__(minconn, maxconn, **kwargs)
+
+    def _connect(self):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        self._stats['opened'] += 1
+        return conn
+
+
+def test_reuses_the_last_returned_connection():
+    pool = FakePool(minconn=1)
+    assert len(pool.opened) == 1
+
+    first = pool.getconn()
+    assert first is pool.opened[0]
+    pool.putconn(first)
+    assert pool.getconn() is first
+    assert first.queries == []   # recently used: no SELECT 1
+
+
+def test_exhausted_pool_times_out():
+    pool = FakePool(maxconn=2)
+    held = [pool.getconn(), pool.getconn()]
+
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn(timeout=0.1)
+    assert time.monotonic() - started >= 0.1
+
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 2
+    assert len(pool.opened) == 2   # never opens past maxconn
+    assert len(held) == 2
+
+
+def test_exhausted_pool_hands_over_returned_connection():
+    pool = FakePool(maxconn=1)
+    held = pool.getconn()
+    received = []
+
+    waiter = threading.Thread(target=lambda: received.append(pool.getconn(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    pool.putconn(held)
+    waiter.join(5)
+
+    assert received == [held]
+    assert pool.stats()['waits'] == 1
+
+
+def test_exhausted_pool_makes_get_db_connection_return_none(monkeypatch):
+    pool = FakePool(maxconn=1, timeout=0.05)
+    monkeypatch.setattr(db_pool, '_pool', pool)
+
+    held = db_pool._checkout_connection()
+    assert held is pool.opened[0]
+    assert db_pool._checkout_connection() is None
+
+    db_pool._release_connection(held)
+    assert db_pool._checkout_connection() is held
+
+
+def test_broken_connection_returned_with_close_is_discarded():
+    pool = FakePool(maxconn=1)
+    broken = pool.getconn()
+    broken.dead = True
+
+    pool.putconn(broken, close=True)
+
+    assert broken.closed
+    stats = pool.stats()
+    assert stats['idle'] == 0 and stats['in_use'] == 0
+
+    # The slot is free again and the next checkout opens a fresh connection
+    replacement = pool.getconn(timeout=0.05)
+    assert replacement is not broken
+    assert len(pool.opened) == 2
+
+
+def test_open_transaction_is_rolled_back_on_return():
+    pool = FakePool(maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+
+    pool.putconn(conn)
+
+    assert conn.rollbacks == 1
+    assert not conn.closed
+    assert pool.stats()['idle'] == 1
+    assert pool.getconn() is conn
+    assert conn.queries == []
+
+
+def test_failed_transaction_is_rolled_back_and_validated_on_next_checkout():
+    pool = FakePool(maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INERROR
+
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+
+    assert pool.getconn() is conn
+    assert conn.queries == ['SELECT 1']
+    assert pool.stats()['validations'] == 1
+
+
+def test_connection_that_cannot_roll_back_is_closed():
+    pool = FakePool(maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+    conn.dead = True
+
+    pool.putconn(conn)
+
+    assert conn.closed
+    assert pool.stats()['idle'] == 0
+    assert pool.getconn() is not conn
+
+
+def test_unknown_transaction_state_is_closed():
+    pool = FakePool(maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_UNKNOWN
+
+    pool.putconn(conn)
+
+    assert conn.closed
+    assert pool.stats()['idle'] == 0
+
+
+def test_dead_idle_connection_is_replaced_on_checkout():
+    pool = FakePool(maxconn=1, validate_idle=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.dead = True
+    time.sleep(0.01)
+
+    replacement = pool.getconn()
+
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats()['validation_failures'] == 1
+
+
+def test_old_connection_is_recycled_on_return():
+    pool = FakePool(maxconn=1, max_age=0)
+    conn = pool.getconn()
+    time.sleep(0.01)
+
+    pool.putconn(conn)
+
+    assert conn.closed
+    assert pool.stats()['recycled'] == 1
+
+
+def test_connection_closed_by_caller_frees_its_slot():
+    pool = FakePool(maxconn=1)
+    conn = pool.getconn()
+    conn.close()
+
+    replacement = pool.getconn(timeout=0.05)
+
+    assert replacement is not conn
+    assert pool.stats()['reclaimed'] == 1
+
+
+def test_foreign_connection_is_closed_not_pooled():
+    pool = FakePool(maxconn=1)
+    foreign = FakeConnection()
+
+    pool.putconn(foreign)
+
+    assert foreign.closed
+    assert pool.stats()['idle'] == 0
@@ -0,0 +1,161 @@
+"""
+Unit tests for the in-memory referral graph (modules/mlm/graph.py)
+
+Runs without a database: every test builds a small forest from edge lists.
+
+Fixture forest (child -> referrer):
+    ROOT
+    ├── A
+    │   ├── A1
+    │   │   └── A11
+    │   │       └── A111
+    │   │           └── A1111
+    │   └── A2
+    └── B
+          └── b1 (refers to "root" in lower case)
+    ORPHAN -> GHOST (referrer code with no ctv row)
+    X -> Y -> X (referral cycle)
+
+Run: python -m pytest -q test_referral_graph.py
+"""
+
+import os
+import sys
+
+# Add parent directory to path for module imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.mlm import hierarchy
+from modules.mlm.graph import ReferralGraph
+
+
+EDGES = [
+    ('ROOT', None),
+    ('A', 'ROOT'),
+    ('B', 'ROOT'),
+    ('A1', 'A'),
+    ('A2', 'A'),
+    ('A11', 'A1'),
+    ('A111', 'A11'),
+    ('A1111', 'A111'),
+    ('b1', 'root'),
+    ('ORPHAN', 'GHOST'),
+    ('X', 'Y'),
+    ('Y', 'X'),
+]
+
+
+def make_graph():
+    return ReferralGraph(EDGES)
+
+
+def test_membership_ignores_placeholders_and_case():
+    graph = make_graph()
+    assert len(graph) == len(EDGES)
+    assert 'a11' in graph
+    assert 'GHOST' not in graph
+    assert 'NOBODY' not in graph
+    assert graph.get_parent('b1') == 'ROOT'
+    assert graph.get_parent('ORPHAN') == 'GHOST'
+
+
+def test_ancestors_respect_max_levels():
+    graph = make_graph()
+    assert graph.ancestors('A1111', 4) == [
+        ('A1111', 0), ('A111', 1), ('A11', 2), ('A1', 3), ('A', 4)
+    ]
+    assert graph.ancestors('A1111', 2) == [('A1111', 0), ('A111', 1), ('A11', 2)]
+    assert graph.ancestors('a2', 4) == [('A2', 0), ('A', 1), ('ROOT', 2)]
+    # Traversal stops at a referrer that has no ctv row
+    assert graph.ancestors('ORPHAN', 4) == [('ORPHAN', 0)]
+
+
+def test_level_between():
+    graph = make_graph()
+    assert graph.level_between('A111', 'root', 4) == 4
+    assert graph.level_between('A1111', 'ROOT', 4) is None
+    assert graph.level_between('B', 'A', 4) is None
+
+
+def test_descendants_by_level_and_depth_limits():
+    graph = make_graph()
+    assert graph.descendants_by_level('ROOT') == {
+        0: ['ROOT'],
+        1: ['A', 'B', 'b1'],
+        2: ['A1', 'A2'],
+        3: ['A11'],
+        4: ['A111'],
+        5: ['A1111'],
+    }
+    assert graph.descendants_by_level('ROOT', max_depth=2) == {
+        0: ['ROOT'],
+        1: ['A', 'B', 'b1'],
+        2: ['A1', 'A2'],
+    }
+    assert graph.descendants('A', max_depth=1) == {'A', 'A1', 'A2'}
+    assert graph.subtree_size('ROOT') == 8
+    assert graph.subtree_size('ROOT', max_depth=2) == 5
+    assert graph.depth_below('ROOT') == 5
+    assert graph.depth_below('ROOT', max_depth=3) == 3
+    assert graph.depth_below('A2') == 0
+
+
+def test_unknown_root():
+    graph = make_graph()
+    for code in ('NOBODY', 'GHOST', '', None):
+        assert graph.get_parent(code) is None
+        assert graph.ancestors(code, 4) == []
+        assert graph.descendants_by_level(code) == {}
+        assert graph.descendants(code) == set()
+        assert graph.subtree_size(code) == 0
+        assert graph.depth_below(code) == 0
+
+
+def test_cycles_terminate():
+    graph = make_graph()
+    assert graph.ancestors('X', 4) == [('X', 0), ('Y', 1)]
+    assert graph.descendants_by_level('X') == {0: ['X'], 1: ['Y']}
+    assert graph.descendants('Y') == {'X', 'Y'}
+    assert graph.subtree_size('X') == 1
+    assert graph.depth_below('Y') == 1
+
+
+def test_subtree_sizes_match_single_walks():
+    graph = make_graph()
+    for max_depth in (None, 0, 1, 2, 4):
+        sizes = graph.subtree_sizes(max_depth)
+        codes = [code for code, _ in EDGES]
+        assert sorted(sizes) == sorted(codes)
+        for code in codes:
+            assert sizes[code] == graph.subtree_size(code, max_depth), (code, max_depth)
+
+
+def test_incremental_updates():
+    graph = make_graph()
+
+    graph.set_parent('A1', 'B')
+    assert graph.ancestors('A11', 4) == [('A11', 0), ('A1', 1), ('B', 2), ('ROOT', 3)]
+    assert graph.descendants('A', max_depth=1) == {'A', 'A2'}
+
+    graph.set_parent('NEW', 'A2')
+    assert graph.get_parent('NEW') == 'A2'
+    assert graph.subtree_size('A') == 2
+
+    # A hard delete leaves the direct referrals without a referrer
+    graph.remove('B')
+    assert 'B' not in graph
+    assert graph.get_parent('A1') is None
+    assert graph.descendants('ROOT') == {'ROOT', 'A', 'A2', 'NEW', 'b1'}
+
+    # A placeholder referrer becomes a real node once its ctv row exists
+    graph.set_parent('GHOST', 'ROOT')
+    assert graph.ancestors('ORPHAN', 4) == [('ORPHAN', 0), ('GHOST', 1), ('ROOT', 2)]
+
+
+def test_get_all_descendants_keeps_unknown_ctv(monkeypatch):
+    graph = make_graph()
+    monkeypatch.setattr(hierarchy, 'get_referral_graph', lambda connection: graph)
+    connection = object()
+
+    assert hierarchy.get_all_descendants('A1', connection) == {'A1', 'A11', 'A111', 'A1111'}
+    assert hierarchy.get_all_descendants('NOBODY', connection) == {'NOBODY'}